@@ -1,13 +1,19 @@
+import asyncio
+import functools
 import logging
 import json
 import time
 from typing import Dict
 from tools import tool_registry
-from gemini import generate_text
+import gemini
 from self_learning import SelfLearningCore
 from core.config import settings
 from core.structured_logging import structured_logger, LogContext, operation_context
 from core.circuit_breaker import circuit_breaker, CircuitBreakerConfig
+from core.prompt_builder import AgentPromptBuilder
+from core.history_compactor import HistoryCompactor
+from core.tool_executor import get_tool_executor
+from core.llm_dispatch import Priority, llm_priority
 
 core = SelfLearningCore()
 logging.basicConfig(level=logging.INFO)
@@ -44,133 +50,161 @@ Never use non-existent tools like 'ask_user'. Persist through errors and adapt a
         name='agent_execution'
     )
 )
-def run_agent_loop(goal: str, max_loops: int = 30) -> Dict:
-    """Enhanced agent loop with proper error handling, retry logic, and recovery mechanisms."""
+async def run_agent_loop_async(goal: str, max_loops: int = 30) -> Dict:
+    """Enhanced agent loop with proper error handling, retry logic, and recovery mechanisms.
+
+    LLM calls go through gemini.generate_text_async and blocking tool calls run on the shared
+    tool executor's pools, so many loops can share one event loop.
+    """
     history = []
     consecutive_failures = 0
     max_consecutive_failures = getattr(settings, 'MAX_CONSECUTIVE_FAILURES', 3)
     
+    prompt_builder = AgentPromptBuilder(AGENT_LOOP_PROMPT, tool_registry.get_tools_json())
+    compactor = HistoryCompactor(
+        prompt_builder, goal,
+        functools.partial(gemini.generate_text_async, model_candidates=gemini._SUMMARY_MODEL_CANDIDATES,
+                          priority=Priority.BACKGROUND)
+    )
+    
     context = LogContext(metadata={'goal': goal, 'max_loops': max_loops})
     
-    with operation_context('agent_loop', context):
-        for i in range(max_loops):
-            history_str = "\n".join([f"  - Step {h['step']}: I used '{h['action']['name']}' which resulted in: '{h['result']}'" for h in history]) if history else "  - No actions taken yet."
-            prompt = AGENT_LOOP_PROMPT.format(goal=goal, history=history_str, tools=json.dumps(tool_registry.get_all_tools_dict(), indent=2))
+    try:
+        with operation_context('agent_loop', context):
+            for i in range(max_loops):
+                compactor.collect()
+                prompt = prompt_builder.build(goal)
             
-            # Generate agent decision with retry logic
-            decision_data = None
-            for decision_attempt in range(3):  # Max 3 attempts to get valid decision
-                try:
-                    structured_logger.log_agent_action(
-                        f"Generating agent decision (attempt {decision_attempt + 1}/3)",
-                        context,
-                        {"step": i + 1, "attempt": decision_attempt + 1}
-                    )
-                    response_text = generate_text(prompt)
-                    # Use centralized tolerant JSON parsing
-                    from core.utils import parse_json_tolerant
+                # Generate agent decision with retry logic
+                decision_data = None
+                for decision_attempt in range(3):  # Max 3 attempts to get valid decision
                     try:
-                        decision_data = parse_json_tolerant(response_text)
-                    except Exception:
-                        # Final fallback: try raw JSON parse
-                        decision_data = json.loads(response_text)
-                    break
-                except Exception as e:
-                    structured_logger.log_error(
-                        f"Failed to parse agent decision (attempt {decision_attempt + 1}/3): {e}",
-                        context,
-                        {"error": str(e), "attempt": decision_attempt + 1}
-                    )
-                    if decision_attempt == 2:  # Last attempt
-                        return {"status": "error", "message": f"Failed to parse agent decision after 3 attempts: {e}", "history": history, "final_result": None}
-                    time.sleep(1)  # Brief pause before retry
+                        structured_logger.log_agent_action(
+                            f"Generating agent decision (attempt {decision_attempt + 1}/3)",
+                            context,
+                            {"step": i + 1, "attempt": decision_attempt + 1}
+                        )
+                        with llm_priority(Priority.AGENT):
+                            if decision_attempt == 0:
+                                response_text = await gemini.generate_text_async(prompt)
+                            else:
+                                # Bypass the response cache so a retry after an unparseable answer samples a new one
+                                response_text = await gemini.generate_text_async(prompt, use_cache=False)
+                        # Use centralized tolerant JSON parsing
+                        from core.utils import parse_json_tolerant
+                        try:
+                            decision_data = parse_json_tolerant(response_text)
+                        except Exception:
+                            # Final fallback: try raw JSON parse
+                            decision_data = json.loads(response_text)
+                        break
+                    except Exception as e:
+                        structured_logger.log_error(
+                            f"Failed to parse agent decision (attempt {decision_attempt + 1}/3): {e}",
+                            context,
+                            {"error": str(e), "attempt": decision_attempt + 1}
+                        )
+                        if decision_attempt == 2:  # Last attempt
+                            return {"status": "error", "message": f"Failed to parse agent decision after 3 attempts: {e}", "history": history, "final_result": None}
+                        await asyncio.sleep(1)  # Brief pause before retry
             
-            if not decision_data:
-                return {"status": "error", "message": "Failed to generate valid agent decision", "history": history, "final_result": None}
+                if not decision_data:
+                    return {"status": "error", "message": "Failed to generate valid agent decision", "history": history, "final_result": None}
             
-            thought = decision_data.get("thought", "No thought provided.")
-            action_data = decision_data.get("action", {})
-            action_name = action_data.get("name")
-            action_params = action_data.get("params", {})
+                thought = decision_data.get("thought", "No thought provided.")
+                action_data = decision_data.get("action", {})
+                action_name = action_data.get("name")
+                action_params = action_data.get("params", {})
             
-            if not action_name:
-                consecutive_failures += 1
-                structured_logger.log_error(
-                    f"Agent generated invalid action (consecutive failures: {consecutive_failures})",
-                    context,
-                    {"thought": thought, "consecutive_failures": consecutive_failures}
-                )
-                if consecutive_failures >= max_consecutive_failures:
-                    return {"status": "error", "message": f"Too many consecutive failures ({consecutive_failures}). Last thought: {thought}", "history": history, "final_result": None}
-                continue
+                if not action_name:
+                    consecutive_failures += 1
+                    structured_logger.log_error(
+                        f"Agent generated invalid action (consecutive failures: {consecutive_failures})",
+                        context,
+                        {"thought": thought, "consecutive_failures": consecutive_failures}
+                    )
+                    if consecutive_failures >= max_consecutive_failures:
+                        return {"status": "error", "message": f"Too many consecutive failures ({consecutive_failures}). Last thought: {thought}", "history": history, "final_result": None}
+                    continue
             
-            tool = tool_registry.get_tool(action_name)
-            if not tool:
-                result = f"Error: Tool '{action_name}' not found."
-                consecutive_failures += 1
-            else:
-                # Execute tool with enhanced error handling and retry logic
-                result = execute_tool_with_retry(tool, action_name, action_params, context)
-                
-                # Check if execution was successful
-                if isinstance(result, str) and result.startswith("Error"):
+                tool = tool_registry.get_tool(action_name)
+                if not tool:
+                    result = f"Error: Tool '{action_name}' not found."
                     consecutive_failures += 1
-                    
-                    # Learn from the error for future improvements
-                    try:
-                        core.learn_from_error(action_name, action_params, result)
-                    except Exception as learning_error:
-                        structured_logger.log_error(
-                            f"Failed to learn from error: {learning_error}",
-                            context,
-                            {"original_error": result, "learning_error": str(learning_error)}
-                        )
                 else:
-                    consecutive_failures = 0  # Reset on success
-            
-            # Log the step execution
-            structured_logger.log_agent_action(
-                f"Executed step {i + 1}: {action_name}",
-                context,
-                {
-                    "step": i + 1,
-                    "action_name": action_name,
-                    "success": not (isinstance(result, str) and result.startswith("Error")),
-                    "consecutive_failures": consecutive_failures
-                }
-            )
-            
-            history.append({
-                "step": i + 1,
-                "thought": thought,
-                "action": action_data,
-                "result": str(result)
-            })
+                    # Execute tool with enhanced error handling and retry logic
+                    result = await get_tool_executor().run_in_pool(
+                        getattr(tool, 'resource', 'network'), execute_tool_with_retry, tool, action_name, action_params, context
+                    )
+                
+                    # Check if execution was successful
+                    if isinstance(result, str) and result.startswith("Error"):
+                        consecutive_failures += 1
+                    
+                        # Learn from the error for future improvements
+                        try:
+                            core.learn_from_error(action_name, action_params, result)
+                        except Exception as learning_error:
+                            structured_logger.log_error(
+                                f"Failed to learn from error: {learning_error}",
+                                context,
+                                {"original_error": result, "learning_error": str(learning_error)}
+                            )
+                    else:
+                        consecutive_failures = 0  # Reset on success
             
-            # Check for task completion
-            if action_name == "finish_task":
+                # Log the step execution
                 structured_logger.log_agent_action(
-                    "Agent completed the goal successfully",
+                    f"Executed step {i + 1}: {action_name}",
                     context,
-                    {"total_steps": i + 1, "final_result": str(result)}
+                    {
+                        "step": i + 1,
+                        "action_name": action_name,
+                        "success": not (isinstance(result, str) and result.startswith("Error")),
+                        "consecutive_failures": consecutive_failures
+                    }
                 )
-                return {"status": "success", "message": "Agent completed the goal.", "history": history, "final_result": result}
             
-            # Check if we should abort due to too many consecutive failures
-            if consecutive_failures >= max_consecutive_failures:
-                structured_logger.log_error(
-                    f"Aborting due to {consecutive_failures} consecutive failures",
-                    context,
-                    {"max_consecutive_failures": max_consecutive_failures, "total_steps": i + 1}
-                )
-                return {"status": "error", "message": f"Agent aborted after {consecutive_failures} consecutive failures.", "history": history, "final_result": None}
+                history.append({
+                    "step": i + 1,
+                    "thought": thought,
+                    "action": action_data,
+                    "result": str(result)
+                })
+                prompt_builder.add_step(history[-1])
+                compactor.maybe_start()
+            
+                # Check for task completion
+                if action_name == "finish_task":
+                    structured_logger.log_agent_action(
+                        "Agent completed the goal successfully",
+                        context,
+                        {"total_steps": i + 1, "final_result": str(result)}
+                    )
+                    return {"status": "success", "message": "Agent completed the goal.", "history": history, "final_result": result}
+            
+                # Check if we should abort due to too many consecutive failures
+                if consecutive_failures >= max_consecutive_failures:
+                    structured_logger.log_error(
+                        f"Aborting due to {consecutive_failures} consecutive failures",
+                        context,
+                        {"max_consecutive_failures": max_consecutive_failures, "total_steps": i + 1}
+                    )
+                    return {"status": "error", "message": f"Agent aborted after {consecutive_failures} consecutive failures.", "history": history, "final_result": None}
         
-        structured_logger.log_error(
-            "Agent reached maximum loops without finishing",
-            context,
-            {"max_loops": max_loops, "total_steps": len(history)}
-        )
-        return {"status": "error", "message": "Agent reached maximum loops without finishing the goal.", "history": history, "final_result": None}
+            structured_logger.log_error(
+                "Agent reached maximum loops without finishing",
+                context,
+                {"max_loops": max_loops, "total_steps": len(history)}
+            )
+            return {"status": "error", "message": "Agent reached maximum loops without finishing the goal.", "history": history, "final_result": None}
+    finally:
+        await compactor.close()
+
+
+def run_agent_loop(goal: str, max_loops: int = 30) -> Dict:
+    """Synchronous entry point for callers outside an event loop (CLI, scripts, tests)."""
+    return asyncio.run(run_agent_loop_async(goal, max_loops=max_loops))
 
 
 def execute_tool_with_retry(tool, action_name: str, action_params: dict, context: LogContext) -> str:
@@ -0,0 +1,81 @@
+"""Recall-vs-latency benchmark for the agent memory vector indexes.
+
+Builds an exact and an IVF index over synthetic clustered embeddings and
+reports, for each IVF nprobe, recall@k against the exact answer and the
+per-query search latency. Use it to pick MEMORY_ANN_THRESHOLD and
+MEMORY_IVF_NPROBE for a deployment:
+
+    python benchmark_memory_index.py --size 50000 --dim 768 --nprobe 4 8 12 16 32
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from core.vector_index import ExactIndex, IVFIndex
+
+
+def clustered_embeddings(rng, n, dim, clusters):
+    """Unit vectors scattered around a number of topics, like embeddings of related documents."""
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    noise = rng.standard_normal((n, dim)).astype(np.float32)
+    noise /= np.linalg.norm(noise, axis=1, keepdims=True)
+    vectors = centers[rng.integers(0, clusters, n)] + 0.5 * noise
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def time_queries(index, queries, k):
+    """Search one query at a time, as Memory.search does; returns (ids per query, latencies in ms)."""
+    found, latencies = [], []
+    for query in queries:
+        started = time.perf_counter()
+        _, ids = index.search(query[None, :], k)[0]
+        latencies.append((time.perf_counter() - started) * 1000)
+        found.append(set(ids.tolist()))
+    return found, np.array(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=50000, help="documents in the index")
+    parser.add_argument("--dim", type=int, default=768, help="embedding dimension")
+    parser.add_argument("--clusters", type=int, default=200, help="topics in the synthetic corpus")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 12, 16, 32])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    vectors = clustered_embeddings(rng, args.size, args.dim, args.clusters)
+    queries = clustered_embeddings(rng, args.queries, args.dim, args.clusters)
+    ids = np.arange(args.size)
+
+    started = time.perf_counter()
+    exact = ExactIndex(args.dim)
+    exact.add(ids, vectors)
+    exact_build = time.perf_counter() - started
+    truth, exact_latency = time_queries(exact, queries, args.k)
+
+    started = time.perf_counter()
+    ivf = IVFIndex(args.dim)
+    ivf.add(ids, vectors)
+    ivf_build = time.perf_counter() - started
+
+    print(f"{args.size} documents, dim {args.dim}, {args.queries} queries, recall@{args.k}")
+    print(f"{'index':<16}{'build s':>10}{'recall':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    print(f"{'exact':<16}{exact_build:>10.2f}{1.0:>10.3f}"
+          f"{np.percentile(exact_latency, 50):>10.3f}{np.percentile(exact_latency, 95):>10.3f}")
+    for nprobe in args.nprobe:
+        ivf.nprobe = nprobe
+        found, latency = time_queries(ivf, queries, args.k)
+        recall = np.mean([len(f & t) / max(len(t), 1) for f, t in zip(found, truth)])
+        print(f"{f'ivf nprobe={nprobe}':<16}{ivf_build:>10.2f}{recall:>10.3f}"
+              f"{np.percentile(latency, 50):>10.3f}{np.percentile(latency, 95):>10.3f}")
+    print(f"ivf lists: {ivf.get_stats()['nlist']}, largest: {ivf.get_stats()['largest_list']}")
+
+
+if __name__ == "__main__":
+    main()
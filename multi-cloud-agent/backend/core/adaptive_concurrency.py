@@ -0,0 +1,155 @@
+"""Adaptive (AIMD) concurrency limit for LLM calls.
+
+Fixed limits do not follow what the upstream can take. The controller grows
+the number of concurrent Gemini calls by one per round of successful calls
+while latency stays under ``GEMINI_AIMD_LATENCY_TARGET_SECONDS`` and the
+error rate is low, and cuts it by ``GEMINI_AIMD_DECREASE_FACTOR`` on a 429 or
+a timeout (at most once per cooldown, so one burst of concurrent failures
+counts once). The limit is applied to the priority dispatcher's slot pool, so
+the priority classes keep working at whatever size the pool has.
+
+The controller also fronts a breaker from ``CircuitBreakerManager``. Overload
+signals only count as breaker failures once the limit is already at its
+minimum: the breaker opens when throttling down has not helped, rather than
+being the throttle itself.
+"""
+
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from core.circuit_breaker import CircuitBreaker, CircuitBreakerConfig, circuit_manager
+from core.config import settings
+from core.llm_dispatch import get_llm_dispatcher
+from core.logging import get_logger
+
+logger = get_logger(__name__)
+
+# Weight of the newest sample in the latency and error-rate moving averages
+_EWMA_ALPHA = 0.1
+# Error rate above which the limit stops growing
+_MAX_HEALTHY_ERROR_RATE = 0.1
+
+
+class AIMDConcurrencyController:
+    """Additive-increase / multiplicative-decrease limit on concurrent calls."""
+
+    def __init__(self, name: str = "gemini_generation", initial: Optional[int] = None,
+                 min_limit: Optional[int] = None, max_limit: Optional[int] = None,
+                 decrease_factor: Optional[float] = None, latency_target: Optional[float] = None,
+                 cooldown: Optional[float] = None, on_change: Optional[Callable[[int], None]] = None,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.name = name
+        self.min_limit = max(1, min_limit or settings.GEMINI_AIMD_MIN_CONCURRENCY)
+        self.max_limit = max(self.min_limit, max_limit or settings.GEMINI_AIMD_MAX_CONCURRENCY)
+        initial = initial or settings.GEMINI_DISPATCH_MAX_CONCURRENT
+        self.limit = min(self.max_limit, max(self.min_limit, initial))
+        self.decrease_factor = decrease_factor or settings.GEMINI_AIMD_DECREASE_FACTOR
+        self.latency_target = latency_target or settings.GEMINI_AIMD_LATENCY_TARGET_SECONDS
+        self.cooldown = cooldown if cooldown is not None else settings.GEMINI_AIMD_COOLDOWN_SECONDS
+        self.on_change = on_change
+        self.breaker = breaker or circuit_manager.get_breaker(name, CircuitBreakerConfig(
+            failure_threshold=settings.GEMINI_AIMD_BREAKER_FAILURE_THRESHOLD,
+            recovery_timeout=float(settings.CIRCUIT_BREAKER_RECOVERY_TIMEOUT),
+        ))
+        self._latency: Optional[float] = None
+        self._error_rate = 0.0
+        self._last_decrease = 0.0
+        self._window_successes = 0
+        self._lock = threading.Lock()
+        self._stats = {"increases": 0, "decreases": 0, "overloads": 0, "slow_successes": 0}
+
+    def _set_limit(self, limit: int) -> Optional[int]:
+        """Caller must hold the lock; returns the new limit if it changed."""
+        old = self.limit
+        self.limit = min(self.max_limit, max(self.min_limit, int(limit)))
+        return self.limit if self.limit != old else None
+
+    def _notify(self, changed: Optional[int]):
+        """Caller must hold the lock."""
+        if changed is not None and self.on_change is not None:
+            self.on_change(changed)
+
+    def allow_request(self):
+        """Raise CircuitBreakerOpenError when the breaker has given up on the upstream."""
+        self.breaker.allow_request()
+
+    def record_success(self, latency: float):
+        with self._lock:
+            self._latency = latency if self._latency is None else (
+                (1 - _EWMA_ALPHA) * self._latency + _EWMA_ALPHA * latency)
+            self._error_rate *= 1 - _EWMA_ALPHA
+            changed = None
+            if latency > self.latency_target:
+                self._stats["slow_successes"] += 1
+            elif self._error_rate <= _MAX_HEALTHY_ERROR_RATE:
+                # +1 once a whole window of calls at the current limit has succeeded
+                self._window_successes += 1
+                if self._window_successes >= self.limit:
+                    self._window_successes = 0
+                    changed = self._set_limit(self.limit + 1)
+                    if changed is not None:
+                        self._stats["increases"] += 1
+            # Applied under the lock so concurrent changes reach the pool in order
+            self._notify(changed)
+        self.breaker.record_success()
+
+    def record_overload(self):
+        """A 429 or timeout: back off multiplicatively."""
+        now = time.monotonic()
+        with self._lock:
+            self._error_rate = (1 - _EWMA_ALPHA) * self._error_rate + _EWMA_ALPHA
+            self._window_successes = 0
+            self._stats["overloads"] += 1
+            at_floor = self.limit <= self.min_limit
+            changed = None
+            if not at_floor and now - self._last_decrease >= self.cooldown:
+                self._last_decrease = now
+                changed = self._set_limit(int(self.limit * self.decrease_factor))
+                self._stats["decreases"] += 1
+            self._notify(changed)
+        if at_floor:
+            # Throttling is already at its floor; now the breaker gets a say
+            self.breaker.record_failure()
+        elif changed is not None:
+            logger.warning(f"Overload on {self.name}; concurrency limit cut to {changed}")
+
+    def record_error(self):
+        """Any other failure: counts against the error rate, which pauses growth."""
+        with self._lock:
+            self._error_rate = (1 - _EWMA_ALPHA) * self._error_rate + _EWMA_ALPHA
+
+    def get_status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "limit": self.limit,
+                "min_limit": self.min_limit,
+                "max_limit": self.max_limit,
+                "latency_ewma_seconds": round(self._latency, 3) if self._latency is not None else None,
+                "latency_target_seconds": self.latency_target,
+                "error_rate_ewma": round(self._error_rate, 3),
+                "breaker_state": self.breaker.state.value,
+                **self._stats,
+            }
+
+
+# Global controller for Gemini generations
+_concurrency_controller: Optional[AIMDConcurrencyController] = None
+_concurrency_controller_lock = threading.Lock()
+
+
+def get_concurrency_controller() -> AIMDConcurrencyController:
+    """Get the global Gemini concurrency controller; when enabled it sizes the LLM dispatcher's pool."""
+    global _concurrency_controller
+    if _concurrency_controller is None:
+        with _concurrency_controller_lock:
+            if _concurrency_controller is None:
+                dispatcher = get_llm_dispatcher()
+                if settings.GEMINI_AIMD_ENABLED:
+                    controller = AIMDConcurrencyController(on_change=dispatcher.set_max_concurrent)
+                    dispatcher.set_max_concurrent(controller.limit)
+                else:
+                    # Fixed pool; the controller still feeds the breaker and reports what it would do
+                    controller = AIMDConcurrencyController()
+                _concurrency_controller = controller
+    return _concurrency_controller
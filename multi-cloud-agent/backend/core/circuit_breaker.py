@@ -2,8 +2,14 @@
 
 Provides circuit breaker functionality to prevent cascading failures
 by temporarily disabling operations that are likely to fail.
+
+With a shared state backend (``SHARED_STATE_BACKEND``) breaker state is kept
+per name across worker processes, so a breaker tripped in one worker fails
+fast in all of them.
 """
 
+import asyncio
+import functools
 import time
 import threading
 from typing import Any, Callable, Dict, Optional, Type
@@ -11,6 +17,7 @@ from enum import Enum
 from dataclasses import dataclass
 from core.config import settings
 from core.logging import get_logger
+from core.shared_state import SharedStateBackend, get_shared_state
 
 logger = get_logger(__name__)
 
@@ -38,15 +45,45 @@ class CircuitBreaker:
     After recovery timeout, allows test calls to check if service has recovered.
     """
     
-    def __init__(self, config: CircuitBreakerConfig):
+    def __init__(self, config: CircuitBreakerConfig, backend: Optional[SharedStateBackend] = None):
         self.config = config
+        self.backend = backend
         self.state = CircuitState.CLOSED
         self.failure_count = 0
         self.last_failure_time = 0.0
         self.lock = threading.RLock()
+    
+    @property
+    def _shared_key(self) -> str:
+        return f"breaker:{self.config.name}"
+    
+    def _apply(self, shared: Dict[str, Any]):
+        self.state = CircuitState(shared["state"])
+        self.failure_count = shared["failure_count"]
+        self.last_failure_time = shared["last_failure_time"]
+    
+    def _sync(self):
+        """Adopt the state recorded by other workers. Caller must hold the lock."""
+        if self.backend is None:
+            return
+        shared = self.backend.get(self._shared_key)
+        # A local HALF_OPEN probe keeps its state until its outcome is recorded
+        if shared and not (self.state == CircuitState.HALF_OPEN and shared["state"] == CircuitState.OPEN.value):
+            self._apply(shared)
         
     def __call__(self, func: Callable) -> Callable:
-        """Decorator to wrap functions with circuit breaker."""
+        """Decorator to wrap functions with circuit breaker.
+        
+        Coroutine functions get an async wrapper so the breaker observes the
+        awaited result rather than the coroutine object.
+        """
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                return await self.call_async(func, *args, **kwargs)
+            return async_wrapper
+        
+        @functools.wraps(func)
         def wrapper(*args, **kwargs):
             return self.call(func, *args, **kwargs)
         return wrapper
@@ -54,6 +91,7 @@ class CircuitBreaker:
     def call(self, func: Callable, *args, **kwargs) -> Any:
         """Execute function with circuit breaker protection."""
         with self.lock:
+            self._sync()
             if self.state == CircuitState.OPEN:
                 if self._should_attempt_reset():
                     self.state = CircuitState.HALF_OPEN
@@ -71,24 +109,87 @@ class CircuitBreaker:
                 self._on_failure()
                 raise e
     
+    async def call_async(self, func: Callable, *args, **kwargs) -> Any:
+        """Await a coroutine function with circuit breaker protection.
+        
+        The lock is only held for state transitions, never across the await.
+        """
+        self._before_call()
+        try:
+            result = await func(*args, **kwargs)
+        except self.config.expected_exception as e:
+            with self.lock:
+                self._on_failure()
+            raise e
+        with self.lock:
+            self._on_success()
+        return result
+    
+    def _before_call(self):
+        """Fail fast if the circuit is open, or move to HALF_OPEN after the timeout."""
+        with self.lock:
+            self._sync()
+            if self.state == CircuitState.OPEN:
+                if self._should_attempt_reset():
+                    self.state = CircuitState.HALF_OPEN
+                    logger.info(f"Circuit breaker '{self.config.name}' transitioning to HALF_OPEN")
+                else:
+                    raise CircuitBreakerOpenError(
+                        f"Circuit breaker '{self.config.name}' is OPEN"
+                    )
+    
+    def allow_request(self):
+        """Raise CircuitBreakerOpenError if a call should fail fast now (for callers that report outcomes themselves)."""
+        self._before_call()
+    
+    def record_success(self):
+        with self.lock:
+            self._on_success()
+    
+    def record_failure(self):
+        with self.lock:
+            self._on_failure()
+    
     def _should_attempt_reset(self) -> bool:
         """Check if enough time has passed to attempt reset."""
         return time.time() - self.last_failure_time >= self.config.recovery_timeout
     
     def _on_success(self):
         """Handle successful call."""
-        if self.state == CircuitState.HALF_OPEN:
+        was_half_open = self.state == CircuitState.HALF_OPEN
+        if self.state == CircuitState.CLOSED and self.failure_count == 0:
+            # Nothing to clear (as of the last sync), so skip the shared-state write
+            return
+        if self.backend is not None:
+            self._apply(self.backend.update(self._shared_key, lambda shared: {
+                "state": CircuitState.CLOSED.value,
+                "failure_count": 0,
+                "last_failure_time": (shared or {}).get("last_failure_time", 0.0),
+            }))
+        else:
             self.state = CircuitState.CLOSED
+            self.failure_count = 0
+        if was_half_open:
             logger.info(f"Circuit breaker '{self.config.name}' reset to CLOSED")
-        self.failure_count = 0
     
     def _on_failure(self):
         """Handle failed call."""
-        self.failure_count += 1
-        self.last_failure_time = time.time()
+        was_open = self.state == CircuitState.OPEN
+        if self.backend is not None:
+            def fail(shared: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+                failure_count = (shared or {}).get("failure_count", 0) + 1
+                state = (shared or {}).get("state", CircuitState.CLOSED.value)
+                if failure_count >= self.config.failure_threshold:
+                    state = CircuitState.OPEN.value
+                return {"state": state, "failure_count": failure_count, "last_failure_time": time.time()}
+            self._apply(self.backend.update(self._shared_key, fail))
+        else:
+            self.failure_count += 1
+            self.last_failure_time = time.time()
+            if self.failure_count >= self.config.failure_threshold:
+                self.state = CircuitState.OPEN
         
-        if self.failure_count >= self.config.failure_threshold:
-            self.state = CircuitState.OPEN
+        if self.state == CircuitState.OPEN and not was_open:
             logger.warning(
                 f"Circuit breaker '{self.config.name}' opened after {self.failure_count} failures"
             )
@@ -99,6 +200,10 @@ class CircuitBreaker:
             self.state = CircuitState.CLOSED
             self.failure_count = 0
             self.last_failure_time = 0.0
+            if self.backend is not None:
+                self.backend.update(self._shared_key, lambda shared: {
+                    "state": CircuitState.CLOSED.value, "failure_count": 0, "last_failure_time": 0.0
+                })
             logger.info(f"Circuit breaker '{self.config.name}' manually reset")
     
     @property
@@ -120,7 +225,8 @@ class CircuitBreakerOpenError(Exception):
 class CircuitBreakerManager:
     """Manages multiple circuit breakers."""
     
-    def __init__(self):
+    def __init__(self, backend: Optional[SharedStateBackend] = None):
+        self.backend = backend
         self.breakers: Dict[str, CircuitBreaker] = {}
         self.lock = threading.RLock()
     
@@ -139,7 +245,7 @@ class CircuitBreakerManager:
                 else:
                     config.name = name
                 
-                self.breakers[name] = CircuitBreaker(config)
+                self.breakers[name] = CircuitBreaker(config, self.backend)
                 logger.info(f"Created circuit breaker '{name}'")
             
             return self.breakers[name]
@@ -153,6 +259,9 @@ class CircuitBreakerManager:
     def get_status(self) -> Dict[str, Dict[str, Any]]:
         """Get status of all circuit breakers."""
         with self.lock:
+            for breaker in self.breakers.values():
+                with breaker.lock:
+                    breaker._sync()
             return {
                 name: {
                     'state': breaker.state.value,
@@ -166,7 +275,7 @@ class CircuitBreakerManager:
 
 
 # Global circuit breaker manager
-circuit_manager = CircuitBreakerManager()
+circuit_manager = CircuitBreakerManager(get_shared_state())
 
 
 def circuit_breaker(name: str, config: Optional[CircuitBreakerConfig] = None):
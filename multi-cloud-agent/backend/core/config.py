@@ -53,6 +53,54 @@ class Settings(BaseSettings):
     GEMINI_API_KEYS_LIST: List[str] = [k.strip() for k in GEMINI_API_KEYS.split(",") if k.strip()]
     GEMINI_API_KEY: Optional[str] = os.environ.get("GEMINI_API_KEY", "")
     GEMINI_MODEL_NAME: str = os.environ.get("GEMINI_MODEL_NAME", "gemini-2.5-pro")
+    # Model availability registry: how long a NotFound/unsupported model is skipped, and
+    # how often the candidates are re-checked in the background
+    GEMINI_MODEL_NEGATIVE_TTL_SECONDS: int = int(os.environ.get("GEMINI_MODEL_NEGATIVE_TTL_SECONDS", 600))
+    GEMINI_MODEL_REFRESH_SECONDS: int = int(os.environ.get("GEMINI_MODEL_REFRESH_SECONDS", 900))
+    # Per-key quota used by the key scheduler (starting points; lowered when 429s say otherwise)
+    GEMINI_KEY_RPM: int = int(os.environ.get("GEMINI_KEY_RPM", 30))
+    GEMINI_KEY_TPM: int = int(os.environ.get("GEMINI_KEY_TPM", 1000000))
+    GEMINI_KEY_DAILY_REQUESTS: int = int(os.environ.get("GEMINI_KEY_DAILY_REQUESTS", 1500))
+    # Fail with 429 instead of queueing when no key has capacity within this many seconds
+    GEMINI_KEY_MAX_WAIT_SECONDS: float = float(os.environ.get("GEMINI_KEY_MAX_WAIT_SECONDS", 30))
+    # Priority dispatch of generations: total concurrent calls, the share background work may
+    # use, and when background calls are shed (queue full, waited too long, quota tight)
+    GEMINI_DISPATCH_MAX_CONCURRENT: int = int(os.environ.get("GEMINI_DISPATCH_MAX_CONCURRENT", 8))
+    GEMINI_DISPATCH_BACKGROUND_SHARE: float = float(os.environ.get("GEMINI_DISPATCH_BACKGROUND_SHARE", 0.5))
+    GEMINI_DISPATCH_BACKGROUND_MAX_QUEUE: int = int(os.environ.get("GEMINI_DISPATCH_BACKGROUND_MAX_QUEUE", 20))
+    GEMINI_DISPATCH_BACKGROUND_MAX_WAIT_SECONDS: float = float(os.environ.get("GEMINI_DISPATCH_BACKGROUND_MAX_WAIT_SECONDS", 30))
+    GEMINI_DISPATCH_BACKGROUND_QUOTA_WAIT_SECONDS: float = float(os.environ.get("GEMINI_DISPATCH_BACKGROUND_QUOTA_WAIT_SECONDS", 5))
+    # Adaptive (AIMD) concurrency for generations: grow while calls finish under the latency
+    # target, cut by the decrease factor on 429s/timeouts; the breaker only counts overloads
+    # that arrive while the limit is already at its minimum
+    GEMINI_AIMD_ENABLED: bool = os.environ.get("GEMINI_AIMD_ENABLED", "True").lower() == "true"
+    GEMINI_AIMD_MIN_CONCURRENCY: int = int(os.environ.get("GEMINI_AIMD_MIN_CONCURRENCY", 1))
+    GEMINI_AIMD_MAX_CONCURRENCY: int = int(os.environ.get("GEMINI_AIMD_MAX_CONCURRENCY", 32))
+    GEMINI_AIMD_DECREASE_FACTOR: float = float(os.environ.get("GEMINI_AIMD_DECREASE_FACTOR", 0.5))
+    GEMINI_AIMD_LATENCY_TARGET_SECONDS: float = float(os.environ.get("GEMINI_AIMD_LATENCY_TARGET_SECONDS", 20))
+    GEMINI_AIMD_COOLDOWN_SECONDS: float = float(os.environ.get("GEMINI_AIMD_COOLDOWN_SECONDS", 2))
+    GEMINI_AIMD_BREAKER_FAILURE_THRESHOLD: int = int(os.environ.get("GEMINI_AIMD_BREAKER_FAILURE_THRESHOLD", 5))
+    # Hedged generations (opt-in): resend a call still running at this latency percentile on a
+    # second key with spare capacity; the budget ratio caps hedges as a fraction of requests
+    GEMINI_HEDGE_ENABLED: bool = os.environ.get("GEMINI_HEDGE_ENABLED", "False").lower() == "true"
+    GEMINI_HEDGE_PERCENTILE: float = float(os.environ.get("GEMINI_HEDGE_PERCENTILE", 95))
+    GEMINI_HEDGE_DEFAULT_DELAY_SECONDS: float = float(os.environ.get("GEMINI_HEDGE_DEFAULT_DELAY_SECONDS", 10))
+    GEMINI_HEDGE_MIN_DELAY_SECONDS: float = float(os.environ.get("GEMINI_HEDGE_MIN_DELAY_SECONDS", 1))
+    GEMINI_HEDGE_BUDGET_RATIO: float = float(os.environ.get("GEMINI_HEDGE_BUDGET_RATIO", 0.1))
+    # Fraction of hedge wins whose first attempt is left to finish, to measure the unhedged latency
+    GEMINI_HEDGE_LOSER_SAMPLE_RATE: float = float(os.environ.get("GEMINI_HEDGE_LOSER_SAMPLE_RATE", 0.1))
+    
+    # Gemini response cache (memory tier + persistent sqlite tier)
+    GEMINI_CACHE_ENABLED: bool = os.environ.get("GEMINI_CACHE_ENABLED", "True").lower() == "true"
+    GEMINI_CACHE_TTL_SECONDS: int = int(os.environ.get("GEMINI_CACHE_TTL_SECONDS", 86400))
+    GEMINI_CACHE_MAX_ENTRIES: int = int(os.environ.get("GEMINI_CACHE_MAX_ENTRIES", 500))
+    GEMINI_CACHE_MAX_MEMORY_MB: int = int(os.environ.get("GEMINI_CACHE_MAX_MEMORY_MB", 10))
+    GEMINI_CACHE_DB_PATH: str = os.environ.get("GEMINI_CACHE_DB_PATH", f"{_project_root}/backend/gemini_cache.db")
+    
+    # Reuse of successful plans for semantically similar /prompt requests
+    PLAN_CACHE_ENABLED: bool = os.environ.get("PLAN_CACHE_ENABLED", "True").lower() == "true"
+    PLAN_CACHE_SIMILARITY_THRESHOLD: float = float(os.environ.get("PLAN_CACHE_SIMILARITY_THRESHOLD", 0.92))
+    PLAN_CACHE_MAX_ENTRIES_PER_USER: int = int(os.environ.get("PLAN_CACHE_MAX_ENTRIES_PER_USER", 200))
     
     # Auto content generation settings
     ENABLE_AUTO_CONTENT: bool = os.environ.get("ENABLE_AUTO_CONTENT", "True").lower() == "true"
@@ -62,6 +110,11 @@ class Settings(BaseSettings):
     
     # Rate limiting
     RATE_LIMIT_PER_MINUTE: int = int(os.environ.get("RATE_LIMIT_PER_MINUTE", 60))
+    # Where limiter, key quota and circuit breaker state lives: "memory" (per process),
+    # "sqlite" (one WAL file shared by the workers on a host) or "redis" (shared by all hosts)
+    SHARED_STATE_BACKEND: str = os.environ.get("SHARED_STATE_BACKEND", "memory")
+    SHARED_STATE_SQLITE_PATH: str = os.environ.get("SHARED_STATE_SQLITE_PATH", f"{_project_root}/backend/shared_state.db")
+    SHARED_STATE_REDIS_URL: str = os.environ.get("SHARED_STATE_REDIS_URL", "redis://localhost:6379/0")
     
     # Logging
     LOG_LEVEL: str = os.environ.get("LOG_LEVEL", "INFO")
@@ -84,6 +137,20 @@ class Settings(BaseSettings):
     ENABLE_LOCAL_EMBEDDINGS: bool = os.environ.get("ENABLE_LOCAL_EMBEDDINGS", "False").lower() == "true"
     LOCAL_EMBEDDING_MODEL: str = os.environ.get("LOCAL_EMBEDDING_MODEL", "sentence-transformers/paraphrase-MiniLM-L3-v2")
     HIGH_MEMORY_MODE: bool = os.environ.get("HIGH_MEMORY_MODE", "False").lower() == "true"
+    # Agent memory vector index: "auto" (exact until MEMORY_ANN_THRESHOLD documents, then IVF),
+    # "exact" or "ivf"; IVF searches the MEMORY_IVF_NPROBE clusters closest to the query
+    MEMORY_INDEX: str = os.environ.get("MEMORY_INDEX", "auto")
+    MEMORY_ANN_THRESHOLD: int = int(os.environ.get("MEMORY_ANN_THRESHOLD", 20000))
+    MEMORY_IVF_NPROBE: int = int(os.environ.get("MEMORY_IVF_NPROBE", 16))
+    # Single memory adds are grouped into batched embedding calls of up to MAX_SIZE texts,
+    # waiting at most MAX_LATENCY_MS for a batch to fill
+    MEMORY_EMBED_BATCH_MAX_SIZE: int = int(os.environ.get("MEMORY_EMBED_BATCH_MAX_SIZE", 32))
+    MEMORY_EMBED_BATCH_MAX_LATENCY_MS: float = float(os.environ.get("MEMORY_EMBED_BATCH_MAX_LATENCY_MS", 10))
+    MEMORY_EMBED_BATCH_CONCURRENCY: int = int(os.environ.get("MEMORY_EMBED_BATCH_CONCURRENCY", 4))
+    # Documents queued by enqueue_document are embedded in the background, INGEST_BATCH_SIZE at a time;
+    # past INGEST_MAX_PENDING queued documents, writers embed inline instead
+    MEMORY_INGEST_BATCH_SIZE: int = int(os.environ.get("MEMORY_INGEST_BATCH_SIZE", 64))
+    MEMORY_INGEST_MAX_PENDING: int = int(os.environ.get("MEMORY_INGEST_MAX_PENDING", 10000))
     
     # Self-learning settings
     ENABLE_SELF_LEARNING: bool = os.environ.get("ENABLE_SELF_LEARNING", "True").lower() == "true"
@@ -100,6 +167,33 @@ class Settings(BaseSettings):
     AGENT_DECISION_RETRY_ATTEMPTS: int = int(os.environ.get("AGENT_DECISION_RETRY_ATTEMPTS", 3))
     BROWSER_ERROR_EXTRA_DELAY: bool = os.environ.get("BROWSER_ERROR_EXTRA_DELAY", "True").lower() == "true"
     
+    # Background agent job queue
+    AGENT_JOB_WORKERS: int = int(os.environ.get("AGENT_JOB_WORKERS", 4))
+    AGENT_JOB_DB_PATH: str = os.environ.get("AGENT_JOB_DB_PATH", f"{_project_root}/backend/agent_jobs.db")
+    # Seconds a claimed job stays owned without a heartbeat before another worker may requeue it
+    AGENT_JOB_LEASE_SECONDS: float = float(os.environ.get("AGENT_JOB_LEASE_SECONDS", 60))
+    AGENT_RESUME_HISTORY_STEPS: int = int(os.environ.get("AGENT_RESUME_HISTORY_STEPS", 20))
+    
+    # Agent prompt budget (tokens are estimated at ~4 characters each)
+    AGENT_PROMPT_TOKEN_BUDGET: int = int(os.environ.get("AGENT_PROMPT_TOKEN_BUDGET", 12000))
+    AGENT_PROMPT_RECENT_STEPS: int = int(os.environ.get("AGENT_PROMPT_RECENT_STEPS", 5))
+    AGENT_PROMPT_RECENT_RESULT_CHARS: int = int(os.environ.get("AGENT_PROMPT_RECENT_RESULT_CHARS", 4000))
+    AGENT_PROMPT_OLD_RESULT_CHARS: int = int(os.environ.get("AGENT_PROMPT_OLD_RESULT_CHARS", 300))
+    AGENT_SUMMARY_TRIGGER_TOKENS: int = int(os.environ.get("AGENT_SUMMARY_TRIGGER_TOKENS", 6000))
+    AGENT_SUMMARY_MAX_CHARS: int = int(os.environ.get("AGENT_SUMMARY_MAX_CHARS", 2000))
+    
+    # Per-step self-critique: "off", "async" (every step, in the background) or
+    # "sampled" (in the background, only on failed steps and every N steps)
+    AGENT_CRITIQUE_MODE: str = os.environ.get("AGENT_CRITIQUE_MODE", "sampled").lower()
+    AGENT_CRITIQUE_EVERY_N_STEPS: int = int(os.environ.get("AGENT_CRITIQUE_EVERY_N_STEPS", 5))
+    AGENT_MAX_PARALLEL_ACTIONS: int = int(os.environ.get("AGENT_MAX_PARALLEL_ACTIONS", 5))
+    
+    # Tool execution pools (blocking tool calls run here, off the event loop)
+    TOOL_BROWSER_WORKERS: int = int(os.environ.get("TOOL_BROWSER_WORKERS", 4))
+    TOOL_NETWORK_WORKERS: int = int(os.environ.get("TOOL_NETWORK_WORKERS", 16))
+    TOOL_CPU_WORKERS: int = int(os.environ.get("TOOL_CPU_WORKERS", os.cpu_count() or 2))
+    TOOL_TIMEOUT_SECONDS: float = float(os.environ.get("TOOL_TIMEOUT_SECONDS", 120))
+    
     # Form automation resilience
     FORM_ELEMENT_WAIT_STRATEGIES: int = int(os.environ.get("FORM_ELEMENT_WAIT_STRATEGIES", 3))
     FORM_ALTERNATIVE_SELECTORS: bool = os.environ.get("FORM_ALTERNATIVE_SELECTORS", "True").lower() == "true"
@@ -1,10 +1,10 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.pool import QueuePool
 from urllib.parse import urlparse
 import logging
-from typing import Generator
+from typing import Dict, Generator
 
 from core.config import settings
 
@@ -74,11 +74,26 @@ def init_db() -> None:
     """
     try:
         # Import all models to ensure they're registered with the Base metadata
-        from models import User, CloudCredential, AuditLog, PlanHistory, ChatHistory, AgentSession  # noqa
+        from models import User, CloudCredential, AuditLog, PlanHistory, ChatHistory, AgentSession, AgentStep  # noqa
         
         # Create all tables
         Base.metadata.create_all(bind=engine)
         logger.info("Database initialized successfully")
     except Exception as e:
         logger.error(f"Error initializing database: {e}")
-        raise
\ No newline at end of file
+        raise
+
+def add_missing_columns(table_name: str, columns: Dict[str, str]) -> None:
+    """
+    Add columns introduced after a table was created, e.g. {"history_summary": "TEXT"}.
+    create_all() only creates missing tables, so existing databases need this for new fields.
+    """
+    inspector = inspect(engine)
+    if not inspector.has_table(table_name):
+        return
+    existing = {col["name"] for col in inspector.get_columns(table_name)}
+    with engine.begin() as connection:
+        for name, ddl in columns.items():
+            if name not in existing:
+                logger.info(f"Adding column {table_name}.{name}")
+                connection.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {name} {ddl}"))
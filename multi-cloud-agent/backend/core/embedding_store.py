@@ -0,0 +1,145 @@
+"""On-disk cache of document embeddings, so startup does not re-embed memory.
+
+Rows are float32 vectors appended to a raw sidecar file (``<prefix>.f32``)
+that is memory-mapped on load; ``<prefix>.keys`` holds one key per row, and
+``<prefix>.json`` records the dimension. A key is a hash of the document text
+and the embedding model, so a model change simply misses.
+
+The files are append-only. A crash between writing vectors and keys leaves at
+most a torn tail, which the loader cuts off. Rows of deleted documents stay in
+the files until ``compact`` rewrites them. The mapping is copy-on-write: the
+index may adopt the mapped rows as its own matrix without ever changing the
+file.
+"""
+
+import json
+import os
+import threading
+from typing import Any, Dict, List, Sequence
+
+import numpy as np
+
+from core.logging import get_logger
+
+logger = get_logger(__name__)
+
+
+class EmbeddingStore:
+    """Append-only, memory-mapped embedding rows keyed by content hash."""
+
+    def __init__(self, prefix: str, dim: int):
+        self.prefix = prefix
+        self.dim = dim
+        self._vectors_path = f"{prefix}.f32"
+        self._keys_path = f"{prefix}.keys"
+        self._meta_path = f"{prefix}.json"
+        self._rows: Dict[str, int] = {}
+        self._vectors = np.zeros((0, dim), dtype=np.float32)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "appended": 0, "compactions": 0}
+        self._load()
+
+    def _load(self):
+        """Map the files written by earlier runs; unusable files are dropped."""
+        try:
+            with open(self._meta_path) as f:
+                meta = json.load(f)
+            with open(self._keys_path) as f:
+                keys = f.read().split("\n")
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable embedding store {self.prefix}: {e}")
+            return
+        if meta.get("dim") != self.dim:
+            logger.info(f"Embedding store {self.prefix} has dimension {meta.get('dim')}, need {self.dim}; starting over")
+            self._reset()
+            return
+        vector_bytes = os.path.getsize(self._vectors_path) if os.path.exists(self._vectors_path) else 0
+        complete = [k for k in keys if k]
+        count = min(len(complete), vector_bytes // (4 * self.dim))
+        if len(complete) != count or vector_bytes != count * 4 * self.dim:
+            # Cut a torn tail (keys without rows or rows without keys) so later appends line up
+            with open(self._vectors_path, "ab") as f:
+                f.truncate(count * 4 * self.dim)
+            with open(self._keys_path, "w") as f:
+                f.write("".join(f"{key}\n" for key in complete[:count]))
+        if count:
+            self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="c", shape=(count, self.dim))
+        self._rows = {key: row for row, key in enumerate(complete[:count])}
+
+    def _reset(self):
+        for path in (self._vectors_path, self._keys_path, self._meta_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self._rows = {}
+        self._vectors = np.zeros((0, self.dim), dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._rows
+
+    def lookup(self, keys: Sequence[str]) -> np.ndarray:
+        """Row number of each key, or -1 where it is not stored."""
+        with self._lock:
+            rows = np.fromiter((self._rows.get(key, -1) for key in keys), dtype=np.int64, count=len(keys))
+        hits = int((rows >= 0).sum())
+        self._stats["hits"] += hits
+        self._stats["misses"] += len(keys) - hits
+        return rows
+
+    def vectors(self, rows: np.ndarray) -> np.ndarray:
+        """Vectors at rows; a consecutive run is returned as a view of the mapped file."""
+        with self._lock:
+            if len(rows) and rows.max() >= len(self._vectors):
+                # Rows appended since the file was mapped
+                self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="c",
+                                          shape=(len(self._rows), self.dim))
+        if len(rows) and rows[-1] - rows[0] == len(rows) - 1 and np.all(np.diff(rows) == 1):
+            return self._vectors[rows[0]:rows[-1] + 1]
+        return np.asarray(self._vectors[rows])
+
+    def append(self, keys: List[str], vectors: np.ndarray) -> int:
+        """Persist rows whose keys are not stored yet; returns how many were written."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            fresh = [i for i, key in enumerate(keys) if key not in self._rows]
+            if not fresh:
+                return 0
+            if not os.path.exists(self._meta_path):
+                self._write_meta()
+            fresh_keys = [keys[i] for i in fresh]
+            with open(self._vectors_path, "ab") as f:
+                f.write(np.ascontiguousarray(vectors[fresh]).tobytes())
+            with open(self._keys_path, "a") as f:
+                f.write("".join(f"{key}\n" for key in fresh_keys))
+            start = len(self._rows)
+            self._rows.update(zip(fresh_keys, range(start, start + len(fresh))))
+            self._stats["appended"] += len(fresh)
+            return len(fresh)
+
+    def compact(self, keys: List[str], vectors: np.ndarray):
+        """Replace the files with exactly these rows (e.g. after documents were deleted)."""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self._lock:
+            self._write_meta()
+            with open(f"{self._vectors_path}.tmp", "wb") as f:
+                f.write(vectors.tobytes())
+            with open(f"{self._keys_path}.tmp", "w") as f:
+                f.write("".join(f"{key}\n" for key in keys))
+            os.replace(f"{self._vectors_path}.tmp", self._vectors_path)
+            os.replace(f"{self._keys_path}.tmp", self._keys_path)
+            self._rows = {}
+            self._vectors = np.zeros((0, self.dim), dtype=np.float32)
+            self._load()
+            self._stats["compactions"] += 1
+
+    def _write_meta(self):
+        with open(self._meta_path, "w") as f:
+            json.dump({"dim": self.dim, "dtype": "float32"}, f)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"rows": len(self._rows), "mapped_rows": len(self._vectors), **self._stats}
@@ -0,0 +1,143 @@
+"""Per-API-key pool of Gemini clients and model objects.
+
+``genai.configure(api_key=...)`` swaps the SDK's process-wide default clients,
+so two threads using different keys can send a request with each other's key,
+and every call rebuilt its gRPC channel and ``GenerativeModel``. The pool keeps
+one sync client and one ``GenerativeModel`` per (key, model, settings), all
+bound to that key explicitly. Nothing touches the SDK's global configuration,
+and sync gRPC clients are safe to share across threads.
+
+Async clients are different: a grpc.aio channel belongs to the event loop it
+was created on and fails once that loop is closed (every ``asyncio.run`` and
+worker-thread loop has its own). They are therefore kept per running loop,
+along with the models that use them, and dropped when their loop closes.
+"""
+
+import asyncio
+import copy
+import json
+import threading
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import google.ai.generativelanguage as glm
+import google.generativeai as genai
+
+from core.logging import get_logger
+
+logger = get_logger(__name__)
+
+
+class GeminiClientPool:
+    """Long-lived, key-bound Gemini clients and models, created on first use."""
+
+    def __init__(self):
+        self._clients: Dict[str, Any] = {}
+        # Per event loop: async clients by key, and async-bound copies of the pooled models
+        self._async_clients: Dict[asyncio.AbstractEventLoop, Dict[str, Any]] = {}
+        self._async_models: Dict[asyncio.AbstractEventLoop, Dict[Tuple[str, str, str], genai.GenerativeModel]] = {}
+        self._model_clients: Dict[str, Any] = {}
+        self._models: Dict[Tuple[str, str, str], genai.GenerativeModel] = {}
+        self._lock = threading.Lock()
+        self._stats = {"clients_created": 0, "models_created": 0, "model_reuses": 0}
+
+    def get_client(self, key: str):
+        """Sync GenerativeServiceClient bound to key."""
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = glm.GenerativeServiceClient(client_options={"api_key": key})
+                self._clients[key] = client
+                self._stats["clients_created"] += 1
+            return client
+
+    def get_async_client(self, key: str):
+        """GenerativeServiceAsyncClient bound to key, for the running event loop."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._forget_closed_loops()
+            clients = self._async_clients.setdefault(loop, {})
+            client = clients.get(key)
+            if client is None:
+                client = glm.GenerativeServiceAsyncClient(client_options={"api_key": key})
+                clients[key] = client
+                self._stats["clients_created"] += 1
+            return client
+
+    def _forget_closed_loops(self):
+        for loop in [loop for loop in self._async_clients if loop.is_closed()]:
+            del self._async_clients[loop]
+            self._async_models.pop(loop, None)
+
+    def get_model_client(self, key: str):
+        """ModelServiceClient bound to key, for model metadata lookups."""
+        with self._lock:
+            client = self._model_clients.get(key)
+            if client is None:
+                client = glm.ModelServiceClient(client_options={"api_key": key})
+                self._model_clients[key] = client
+                self._stats["clients_created"] += 1
+            return client
+
+    def get_model(self, key: str, model_name: str, use_async: bool = False,
+                  **model_kwargs: Any) -> genai.GenerativeModel:
+        """GenerativeModel for model_name whose calls go out with key.
+
+        Pass use_async=True from coroutines to get a copy of the model that also
+        carries the running loop's async client; the shared model never does.
+        """
+        signature = json.dumps(model_kwargs, sort_keys=True, default=str)
+        pool_key = (key, model_name, signature)
+        with self._lock:
+            model = self._models.get(pool_key)
+            if model is not None:
+                self._stats["model_reuses"] += 1
+        if model is None:
+            model = genai.GenerativeModel(model_name=model_name, **model_kwargs)
+            model._client = self.get_client(key)
+            with self._lock:
+                # Another thread may have built the same model meanwhile; keep the first
+                if pool_key in self._models:
+                    model = self._models[pool_key]
+                else:
+                    self._models[pool_key] = model
+                    self._stats["models_created"] += 1
+        if not use_async:
+            return model
+        async_client = self.get_async_client(key)
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            models = self._async_models.setdefault(loop, {})
+            async_model = models.get(pool_key)
+            if async_model is None:
+                async_model = copy.copy(model)
+                async_model._async_client = async_client
+                models[pool_key] = async_model
+        return async_model
+
+    def embed_content(self, key: str, model: str, content: Union[str, List[str]],
+                      task_type: Optional[str] = None) -> Dict[str, Any]:
+        """genai.embed_content on key's client; a list of texts is embedded in one batch request."""
+        return genai.embed_content(model=model, content=content, task_type=task_type, client=self.get_client(key))
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            async_keys = {key for clients in self._async_clients.values() for key in clients}
+            stats.update({"keys": len(set(self._clients) | async_keys), "models": len(self._models),
+                          "event_loops": len(self._async_clients)})
+        return stats
+
+
+# Global client pool instance
+_client_pool: Optional[GeminiClientPool] = None
+_client_pool_lock = threading.Lock()
+
+
+def get_gemini_client_pool() -> GeminiClientPool:
+    """Get the global Gemini client pool."""
+    global _client_pool
+    if _client_pool is None:
+        with _client_pool_lock:
+            if _client_pool is None:
+                _client_pool = GeminiClientPool()
+    return _client_pool
@@ -0,0 +1,227 @@
+"""Hedged requests: re-issue a slow call elsewhere and take whichever answers first.
+
+A Gemini call sometimes stalls until its timeout on one key while other keys
+are healthy. With hedging on, a call that has not returned by the
+``GEMINI_HEDGE_PERCENTILE`` of recent latencies is sent again on a second key
+with spare capacity; the first response wins and the other call is cancelled.
+
+Hedges are paid for from a budget that every request tops up by
+``GEMINI_HEDGE_BUDGET_RATIO`` (0.1 lets at most ~10% extra requests through),
+so the quota overhead stays bounded even when the upstream is slow across the
+board. Stats report the hedge rate and the p99 latency callers saw next to the
+p99 they would have seen without hedging. That one is measured: when a hedge
+wins, a ``GEMINI_HEDGE_LOSER_SAMPLE_RATE`` fraction of first attempts is left
+to finish in the background (its request is already paid for) and its real
+latency is recorded, weighted by the inverse of the rate to stand for the
+hedge wins whose first attempt was cancelled.
+"""
+
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple, TypeVar
+
+from core.config import settings
+from core.logging import get_logger
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+# Latency samples kept for the hedge deadline and the reported percentiles
+_SAMPLES = 500
+# Samples needed before the percentile replaces the default deadline
+_MIN_SAMPLES = 20
+# Most hedges that can be saved up while traffic is calm
+_MAX_BUDGET = 10.0
+
+
+def _percentile(samples: List[float], percentile: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100.0))]
+
+
+def _weighted_percentile(samples: List[Tuple[float, float]], percentile: float) -> Optional[float]:
+    """Percentile of (value, weight) samples, a sample counting weight times."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    target = sum(weight for _, weight in ordered) * percentile / 100.0
+    seen = 0.0
+    for value, weight in ordered:
+        seen += weight
+        if seen > target:
+            return value
+    return ordered[-1][0]
+
+
+class Hedger:
+    """Runs awaitables with an optional, budgeted hedge after a latency-percentile deadline."""
+
+    def __init__(self, enabled: Optional[bool] = None, percentile: Optional[float] = None,
+                 default_delay: Optional[float] = None, min_delay: Optional[float] = None,
+                 budget_ratio: Optional[float] = None, loser_sample_rate: Optional[float] = None):
+        self.enabled = settings.GEMINI_HEDGE_ENABLED if enabled is None else enabled
+        self.percentile = percentile or settings.GEMINI_HEDGE_PERCENTILE
+        self.default_delay = default_delay or settings.GEMINI_HEDGE_DEFAULT_DELAY_SECONDS
+        self.min_delay = min_delay if min_delay is not None else settings.GEMINI_HEDGE_MIN_DELAY_SECONDS
+        self.budget_ratio = budget_ratio if budget_ratio is not None else settings.GEMINI_HEDGE_BUDGET_RATIO
+        self.loser_sample_rate = (loser_sample_rate if loser_sample_rate is not None
+                                  else settings.GEMINI_HEDGE_LOSER_SAMPLE_RATE)
+        self._budget = 1.0
+        # Latency of single attempts (sets the deadline), of what callers saw, and measured
+        # (latency, weight) of what they would have seen without hedging
+        self._attempt_latencies: Deque[float] = deque(maxlen=_SAMPLES)
+        self._latencies: Deque[float] = deque(maxlen=_SAMPLES)
+        self._unhedged_latencies: Deque[Tuple[float, float]] = deque(maxlen=_SAMPLES)
+        # Losing first attempts left running to be measured, referenced until they finish
+        self._measuring: Set[asyncio.Task] = set()
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "hedged": 0, "hedge_wins": 0, "budget_denied": 0, "no_hedge_target": 0,
+                       "losers_measured": 0}
+
+    def hedge_delay(self) -> float:
+        """Seconds to wait on the first attempt before hedging."""
+        with self._lock:
+            samples = list(self._attempt_latencies)
+        if len(samples) < _MIN_SAMPLES:
+            return self.default_delay
+        return max(self.min_delay, _percentile(samples, self.percentile))
+
+    def _take_budget(self) -> bool:
+        with self._lock:
+            if self._budget >= 1.0:
+                self._budget -= 1.0
+                return True
+            self._stats["budget_denied"] += 1
+            return False
+
+    def _refund_budget(self):
+        with self._lock:
+            self._budget = min(_MAX_BUDGET, self._budget + 1.0)
+
+    def _record(self, elapsed: float, hedged: bool, hedge_won: bool):
+        with self._lock:
+            self._latencies.append(elapsed)
+            if not hedge_won:
+                # The first attempt answered, so this is also the unhedged latency
+                self._unhedged_latencies.append((elapsed, 1.0))
+            if hedged:
+                self._stats["hedged"] += 1
+            if hedge_won:
+                self._stats["hedge_wins"] += 1
+
+    def _measure_loser(self, task: asyncio.Task, started: float):
+        """Let a losing first attempt finish and record how long the caller would have waited for it."""
+        self._measuring.add(task)
+        weight = 1.0 / self.loser_sample_rate
+
+        def finished(task: asyncio.Task):
+            self._measuring.discard(task)
+            if task.cancelled():
+                return
+            task.exception()  # retrieved so a failed attempt is not reported as unhandled
+            with self._lock:
+                self._unhedged_latencies.append((time.monotonic() - started, weight))
+                self._stats["losers_measured"] += 1
+
+        task.add_done_callback(finished)
+
+    def record_attempt(self, seconds: float):
+        """Latency of one successful upstream attempt."""
+        with self._lock:
+            self._attempt_latencies.append(seconds)
+
+    async def run(self, primary: Callable[[], Awaitable[T]],
+                  hedge: Callable[[], Optional[Awaitable[T]]], hedge_lookup_async: bool = False) -> T:
+        """Await primary(); if it is still running at the deadline, also start hedge() and return the first success.
+
+        hedge() returns None when there is nowhere to send a second request. With
+        hedge_lookup_async, hedge() is awaited to get that result, for lookups that do I/O.
+        If the first attempt fails before the deadline its error is raised without hedging.
+        """
+        started = time.monotonic()
+        with self._lock:
+            self._stats["requests"] += 1
+            self._budget = min(_MAX_BUDGET, self._budget + self.budget_ratio)
+        if not self.enabled:
+            result = await primary()
+            self._record(time.monotonic() - started, False, False)
+            return result
+
+        primary_task = asyncio.ensure_future(primary())
+        pending = {primary_task}
+        hedge_task = None
+        measured: Optional[asyncio.Task] = None
+        try:
+            done, _ = await asyncio.wait(pending, timeout=self.hedge_delay())
+            if not done and self._take_budget():
+                coro = await hedge() if hedge_lookup_async else hedge()
+                if coro is None:
+                    self._refund_budget()
+                    with self._lock:
+                        self._stats["no_hedge_target"] += 1
+                else:
+                    hedge_task = asyncio.ensure_future(coro)
+                    pending.add(hedge_task)
+                    logger.info(f"Hedging a request still running after {time.monotonic() - started:.1f}s")
+            first_error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        hedge_won = task is hedge_task
+                        self._record(time.monotonic() - started, hedge_task is not None, hedge_won)
+                        if hedge_won and not primary_task.done() and random.random() < self.loser_sample_rate:
+                            measured = primary_task
+                            self._measure_loser(primary_task, started)
+                        return task.result()
+                    if first_error is None or task is primary_task:
+                        first_error = task.exception()
+            raise first_error
+        finally:
+            leftovers = [t for t in (primary_task, hedge_task) if t is not None and t is not measured]
+            for task in leftovers:
+                if not task.done():
+                    task.cancel()
+            await asyncio.gather(*leftovers, return_exceptions=True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            latencies = list(self._latencies)
+            unhedged = list(self._unhedged_latencies)
+            budget = self._budget
+        p99 = _percentile(latencies, 99)
+        unhedged_p99 = _weighted_percentile(unhedged, 99)
+        requests = stats["requests"]
+        return {
+            "enabled": self.enabled,
+            **stats,
+            "hedge_rate": round(stats["hedged"] / requests, 4) if requests else 0.0,
+            "hedge_budget": round(budget, 2),
+            "hedge_delay_seconds": round(self.hedge_delay(), 3),
+            "p99_ms": round(p99 * 1000, 1) if p99 is not None else None,
+            "p99_unhedged_ms": round(unhedged_p99 * 1000, 1) if unhedged_p99 is not None else None,
+            "p99_improvement_ms": (round((unhedged_p99 - p99) * 1000, 1)
+                                   if p99 is not None and unhedged_p99 is not None else None),
+        }
+
+
+# Global hedger for Gemini generations
+_hedger: Optional[Hedger] = None
+_hedger_lock = threading.Lock()
+
+
+def get_hedger() -> Hedger:
+    """Get the global Gemini request hedger."""
+    global _hedger
+    if _hedger is None:
+        with _hedger_lock:
+            if _hedger is None:
+                _hedger = Hedger()
+    return _hedger
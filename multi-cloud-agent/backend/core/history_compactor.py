@@ -0,0 +1,94 @@
+"""Rolling LLM summarization of old agent history.
+
+Once an ``AgentPromptBuilder`` history grows past ``AGENT_SUMMARY_TRIGGER_TOKENS``,
+the compacted older steps are folded into a running summary. Summaries are
+generated in a background task (typically on a cheaper model) so the agent
+loop never waits for them; the loop polls ``collect()`` each step and applies
+the summary once it is ready.
+"""
+
+import asyncio
+import time
+from typing import Awaitable, Callable, Optional, Tuple
+
+from core.config import settings
+from core.logging import get_logger
+from core.prompt_builder import AgentPromptBuilder
+
+logger = get_logger(__name__)
+
+SUMMARY_PROMPT = """You maintain the working memory of an autonomous web agent.
+
+GOAL: {goal}
+
+PREVIOUS SUMMARY:
+{previous}
+
+NEW STEPS TO FOLD IN:
+{steps}
+
+Write an updated summary in plain text (no JSON, at most {max_chars} characters). Keep what the agent
+needs to continue: pages and browser IDs in use, data already found, forms or accounts already
+completed, and approaches that failed and should not be repeated.
+"""
+
+# Seconds to wait before retrying after a failed summarization
+RETRY_DELAY = 60.0
+
+
+class HistoryCompactor:
+    """Runs at most one background summarization at a time for a prompt builder."""
+
+    def __init__(self, builder: AgentPromptBuilder, goal: str, generate: Callable[[str], Awaitable[str]],
+                 trigger_tokens: Optional[int] = None):
+        self.builder = builder
+        self.goal = goal
+        self.generate = generate
+        self.trigger_tokens = trigger_tokens or settings.AGENT_SUMMARY_TRIGGER_TOKENS
+        self._task: Optional[asyncio.Task] = None
+        self._retry_at = 0.0
+
+    def maybe_start(self) -> bool:
+        """Start a summarization if the history is large enough and none is running."""
+        if self._task is not None or time.monotonic() < self._retry_at:
+            return False
+        if not self.builder.needs_summary(self.trigger_tokens):
+            return False
+        lines, through_step = self.builder.summary_batch()
+        prompt = SUMMARY_PROMPT.format(
+            goal=self.goal,
+            previous=self.builder.summary or "(none yet)",
+            steps="\n".join(lines),
+            max_chars=settings.AGENT_SUMMARY_MAX_CHARS
+        )
+        self._task = asyncio.create_task(self._summarize(prompt, through_step))
+        logger.info(f"Summarizing agent history through step {through_step} ({len(lines)} new steps)")
+        return True
+
+    async def _summarize(self, prompt: str, through_step: int) -> Tuple[str, int]:
+        return await self.generate(prompt), through_step
+
+    def collect(self) -> Optional[Tuple[str, int]]:
+        """Apply a finished summary to the builder. Returns (summary, through_step) when one was applied."""
+        task = self._task
+        if task is None or not task.done():
+            return None
+        self._task = None
+        if task.cancelled():
+            return None
+        if task.exception() is not None:
+            logger.warning(f"History summarization failed, keeping verbatim history: {task.exception()}")
+            self._retry_at = time.monotonic() + RETRY_DELAY
+            return None
+        summary, through_step = task.result()
+        self.builder.apply_summary(summary, through_step)
+        if self.builder.summary_through != through_step:
+            return None
+        return self.builder.summary, through_step
+
+    async def close(self):
+        """Cancel a summarization still in flight."""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
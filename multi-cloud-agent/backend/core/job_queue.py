@@ -0,0 +1,384 @@
+"""Persistent background job queue for agent runs.
+
+Jobs are stored in a local sqlite database so queued and interrupted runs
+survive restarts, and a configurable pool of asyncio worker tasks drains the
+queue. Agent runs are keyed by ``AgentSession.run_id``; at most one job per
+run is active at a time.
+
+Several processes may share the database. A claimed job records its owner and
+a lease that the owning process renews on a heartbeat; only jobs whose lease
+has lapsed (their owner died) are requeued. Cancellation is recorded in the
+database so a run executing in another process can notice it between steps
+via ``is_cancelled``.
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from core.config import settings
+from core.logging import get_logger
+
+logger = get_logger(__name__)
+
+# Job lifecycle states
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+
+ACTIVE_STATES = (JOB_QUEUED, JOB_RUNNING)
+
+JobHandler = Callable[[Dict[str, Any]], Awaitable[Optional[Dict[str, Any]]]]
+
+
+class JobQueue:
+    """sqlite-backed FIFO queue with an asyncio worker pool."""
+
+    def __init__(self, db_path: Optional[str] = None, num_workers: Optional[int] = None,
+                 poll_interval: float = 1.0, lease_seconds: Optional[float] = None):
+        self.db_path = db_path or settings.AGENT_JOB_DB_PATH
+        self.num_workers = max(1, num_workers or settings.AGENT_JOB_WORKERS)
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds or settings.AGENT_JOB_LEASE_SECONDS
+        # Identifies this process as the owner of the jobs it claims
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._lock = threading.Lock()
+        self._workers: List[asyncio.Task] = []
+        self._running_tasks: Dict[str, asyncio.Task] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._handler: Optional[JobHandler] = None
+        self.init_database()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def init_database(self):
+        """Create the jobs table if it doesn't exist."""
+        directory = os.path.dirname(os.path.abspath(self.db_path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS agent_jobs (
+                    id TEXT PRIMARY KEY,
+                    run_id TEXT NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    payload TEXT,
+                    status TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    created_at TEXT NOT NULL,
+                    started_at TEXT,
+                    finished_at TEXT,
+                    owner TEXT,
+                    lease_expires_at REAL
+                )
+            ''')
+            # Databases created before leases existed lack the ownership columns
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(agent_jobs)")}
+            for column, ddl in (("owner", "TEXT"), ("lease_expires_at", "REAL")):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE agent_jobs ADD COLUMN {column} {ddl}")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_agent_jobs_status ON agent_jobs (status, created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_agent_jobs_run_id ON agent_jobs (run_id, created_at)")
+            conn.commit()
+        finally:
+            conn.close()
+
+    # ------------------------------------------------------------------
+    # Queue operations
+    # ------------------------------------------------------------------
+
+    def enqueue(self, run_id: str, user_id: int, payload: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Queue a job for run_id, or return the job already queued/running for it."""
+        with self._lock:
+            conn = self._connect()
+            try:
+                # One transaction for the check and the insert, so another process cannot slip a job in between
+                conn.execute("BEGIN IMMEDIATE")
+                active = conn.execute(
+                    "SELECT * FROM agent_jobs WHERE run_id = ? AND status IN (?, ?) ORDER BY created_at LIMIT 1",
+                    (run_id, *ACTIVE_STATES)
+                ).fetchone()
+                if active:
+                    conn.commit()
+                    return self._row_to_dict(active)
+
+                job_id = str(uuid.uuid4())
+                conn.execute(
+                    "INSERT INTO agent_jobs (id, run_id, user_id, payload, status, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (job_id, run_id, user_id, json.dumps(payload or {}), JOB_QUEUED, datetime.now().isoformat())
+                )
+                conn.commit()
+            finally:
+                conn.close()
+
+        self._notify()
+        logger.info(f"Queued agent job {job_id} for run_id={run_id}")
+        return self.get_job(job_id)
+
+    def _claim_next(self) -> Optional[Dict[str, Any]]:
+        """Atomically move the oldest queued job to running and return it."""
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute(
+                    "SELECT * FROM agent_jobs WHERE status = ? ORDER BY created_at LIMIT 1", (JOB_QUEUED,)
+                ).fetchone()
+                if not row:
+                    conn.commit()
+                    return None
+                lease_expires_at = time.time() + self.lease_seconds
+                conn.execute(
+                    "UPDATE agent_jobs SET status = ?, started_at = ?, owner = ?, lease_expires_at = ? WHERE id = ?",
+                    (JOB_RUNNING, datetime.now().isoformat(), self.owner, lease_expires_at, row["id"])
+                )
+                conn.commit()
+                job = self._row_to_dict(row)
+                job.update(status=JOB_RUNNING, owner=self.owner, lease_expires_at=lease_expires_at)
+                return job
+            finally:
+                conn.close()
+
+    def _finish(self, job_id: str, status: str, result: Optional[Dict[str, Any]] = None, error: Optional[str] = None):
+        conn = self._connect()
+        try:
+            # Never overwrite a cancellation that raced with completion, or a job
+            # requeued and claimed elsewhere after this process lost its lease
+            conn.execute(
+                "UPDATE agent_jobs SET status = ?, result = ?, error = ?, finished_at = ?, lease_expires_at = NULL "
+                "WHERE id = ? AND status = ? AND owner = ?",
+                (status, json.dumps(result) if result is not None else None, error,
+                 datetime.now().isoformat(), job_id, JOB_RUNNING, self.owner)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def cancel(self, run_id: str) -> Optional[Dict[str, Any]]:
+        """Cancel the active job for run_id. Returns the cancelled job, or None if nothing was cancelled."""
+        job = self.get_active_job(run_id)
+        if not job:
+            return None
+
+        conn = self._connect()
+        try:
+            # A job that finished since get_active_job keeps its real terminal state
+            cursor = conn.execute(
+                f"UPDATE agent_jobs SET status = ?, finished_at = ?, lease_expires_at = NULL "
+                f"WHERE id = ? AND status IN ({', '.join('?' * len(ACTIVE_STATES))})",
+                (JOB_CANCELLED, datetime.now().isoformat(), job["id"], *ACTIVE_STATES)
+            )
+            conn.commit()
+            cancelled = cursor.rowcount > 0
+        finally:
+            conn.close()
+        if not cancelled:
+            return None
+
+        # A job running in this process stops now; one owned by another process
+        # stops at its next step, when the run polls is_cancelled
+        task = self._running_tasks.get(job["id"])
+        if task and not task.done() and self._loop:
+            self._loop.call_soon_threadsafe(task.cancel)
+        logger.info(f"Cancelled agent job {job['id']} for run_id={run_id}")
+        return self.get_job(job["id"])
+
+    def renew_leases(self) -> int:
+        """Extend the lease on every job this process is running."""
+        job_ids = list(self._running_tasks)
+        if not job_ids:
+            return 0
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                f"UPDATE agent_jobs SET lease_expires_at = ? WHERE status = ? AND owner = ? "
+                f"AND id IN ({', '.join('?' * len(job_ids))})",
+                (time.time() + self.lease_seconds, JOB_RUNNING, self.owner, *job_ids)
+            )
+            conn.commit()
+            return cursor.rowcount
+        finally:
+            conn.close()
+
+    def recover_interrupted(self) -> int:
+        """Requeue running jobs whose owner stopped renewing their lease so they resume."""
+        conn = self._connect()
+        try:
+            # Rows without a lease were claimed before leases existed
+            cursor = conn.execute(
+                "UPDATE agent_jobs SET status = ?, started_at = NULL, owner = NULL, lease_expires_at = NULL "
+                "WHERE status = ? AND (lease_expires_at IS NULL OR lease_expires_at < ?)",
+                (JOB_QUEUED, JOB_RUNNING, time.time())
+            )
+            conn.commit()
+            if cursor.rowcount:
+                logger.info(f"Requeued {cursor.rowcount} interrupted agent job(s)")
+            return cursor.rowcount
+        finally:
+            conn.close()
+
+    # ------------------------------------------------------------------
+    # Lookups
+    # ------------------------------------------------------------------
+
+    def _row_to_dict(self, row: sqlite3.Row) -> Dict[str, Any]:
+        job = dict(row)
+        for field in ("payload", "result"):
+            if job.get(field):
+                try:
+                    job[field] = json.loads(job[field])
+                except (json.JSONDecodeError, TypeError):
+                    pass
+        return job
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT * FROM agent_jobs WHERE id = ?", (job_id,)).fetchone()
+            return self._row_to_dict(row) if row else None
+        finally:
+            conn.close()
+
+    def get_active_job(self, run_id: str) -> Optional[Dict[str, Any]]:
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT * FROM agent_jobs WHERE run_id = ? AND status IN (?, ?) ORDER BY created_at LIMIT 1",
+                (run_id, *ACTIVE_STATES)
+            ).fetchone()
+            return self._row_to_dict(row) if row else None
+        finally:
+            conn.close()
+
+    def get_latest_job(self, run_id: str) -> Optional[Dict[str, Any]]:
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT * FROM agent_jobs WHERE run_id = ? ORDER BY created_at DESC LIMIT 1", (run_id,)
+            ).fetchone()
+            return self._row_to_dict(row) if row else None
+        finally:
+            conn.close()
+
+    def is_cancelled(self, job_id: str) -> bool:
+        """Whether job_id was cancelled, possibly by another process sharing the database."""
+        job = self.get_job(job_id)
+        return bool(job and job["status"] == JOB_CANCELLED)
+
+    def get_stats(self) -> Dict[str, Any]:
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT status, COUNT(*) AS n FROM agent_jobs GROUP BY status").fetchall()
+            counts = {row["status"]: row["n"] for row in rows}
+        finally:
+            conn.close()
+        return {
+            "workers": self.num_workers,
+            "workers_alive": sum(1 for w in self._workers if not w.done()),
+            "in_flight": len(self._running_tasks),
+            "lease_seconds": self.lease_seconds,
+            "jobs": counts
+        }
+
+    # ------------------------------------------------------------------
+    # Worker pool
+    # ------------------------------------------------------------------
+
+    def _notify(self):
+        if self._loop and self._wakeup:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def start(self, handler: JobHandler):
+        """Start the worker pool on the running event loop."""
+        if self._workers:
+            return
+        self._handler = handler
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        await asyncio.to_thread(self.recover_interrupted)
+        self._workers = [
+            asyncio.create_task(self._worker(i), name=f"agent-job-worker-{i}")
+            for i in range(self.num_workers)
+        ]
+        self._heartbeat = asyncio.create_task(self._heartbeat_loop(), name="agent-job-heartbeat")
+        logger.info(f"Started {self.num_workers} agent job worker(s)")
+
+    async def stop(self):
+        """Stop the workers. Running jobs are left in 'running' and requeued once their lease lapses."""
+        tasks = self._workers + ([self._heartbeat] if self._heartbeat else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._heartbeat = None
+
+    async def _heartbeat_loop(self):
+        """Renew this process's leases and requeue jobs whose owner has died."""
+        interval = self.lease_seconds / 3
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.renew_leases)
+                if await asyncio.to_thread(self.recover_interrupted):
+                    self._notify()
+            except Exception as e:
+                logger.error(f"Agent job heartbeat failed: {e}", exc_info=True)
+
+    async def _worker(self, worker_id: int):
+        while True:
+            job = await asyncio.to_thread(self._claim_next)
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            task = asyncio.create_task(self._handler(job))
+            self._running_tasks[job["id"]] = task
+            try:
+                # Shielded so cancelling the worker is distinguishable from cancelling the job
+                result = await asyncio.shield(task)
+                await asyncio.to_thread(self._finish, job["id"], JOB_COMPLETED, result)
+            except asyncio.CancelledError:
+                if not task.cancelled():
+                    # The worker itself is shutting down; leave the job to be recovered.
+                    # Let the handler's cleanup finish before teardown continues.
+                    task.cancel()
+                    await asyncio.gather(task, return_exceptions=True)
+                    raise
+                logger.info(f"Agent job {job['id']} cancelled")
+            except Exception as e:
+                logger.error(f"Agent job {job['id']} failed: {e}", exc_info=True)
+                await asyncio.to_thread(self._finish, job["id"], JOB_FAILED, None, str(e))
+            finally:
+                self._running_tasks.pop(job["id"], None)
+
+
+# Global job queue instance
+_job_queue: Optional[JobQueue] = None
+
+
+def get_job_queue() -> JobQueue:
+    """Get the global agent job queue."""
+    global _job_queue
+    if _job_queue is None:
+        _job_queue = JobQueue()
+    return _job_queue
@@ -0,0 +1,311 @@
+"""Quota-aware scheduling of requests across Gemini API keys.
+
+Every key has token buckets for requests per minute and tokens per minute, plus
+a daily request budget. ``acquire`` assigns a request to the key that has
+capacity soonest and reserves that capacity (buckets may go negative, so
+reservations queue up fairly behind each other). The caller gets a wait,
+usually zero, instead of being blocked on one saturated key while others idle.
+
+Limits start at the configured ``GEMINI_KEY_*`` values and are learned from
+429s. A per-minute 429 lowers the key's RPM and parks the key for its
+``retry-after``; successes raise the RPM back towards the configured ceiling.
+A per-day 429 parks the key until the next UTC midnight.
+
+With a shared state backend (``core.shared_state``) every key's buckets live in
+a shared record of their own, so worker processes split the keys' budgets
+instead of each spending all of them. Read-only probes (``reserve=False``,
+``get_status``) only read those records. A reservation picks the key from a
+read of all of them and then updates just that key's record atomically,
+re-checking its wait there; reservations on different keys never contend.
+Keys are stored under a hash, never in the clear.
+"""
+
+import copy
+import hashlib
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, TypeVar
+
+from core.config import settings
+from core.logging import get_logger
+from core.shared_state import SharedStateBackend
+
+logger = get_logger(__name__)
+
+_RETRY_IN = re.compile(r"retry in ([\d.]+)\s*s", re.IGNORECASE)
+_RETRY_DELAY = re.compile(r"retry_delay\s*\{\s*seconds:\s*(\d+)", re.IGNORECASE)
+_PER_DAY = re.compile(r"per\s*day|daily", re.IGNORECASE)
+
+# Successful requests needed before a lowered RPM limit is raised by one
+_RECOVERY_SUCCESSES = 10
+
+# Shared state record of one key's buckets, followed by the key's hash
+_SHARED_KEY_PREFIX = "key_quota:"
+
+# Fresh picks tried when the chosen key was taken by another worker meanwhile
+_RESERVE_ATTEMPTS = 3
+
+T = TypeVar("T")
+
+
+def parse_retry_after(error: Any) -> Optional[float]:
+    """Seconds to wait from a 429: a Retry-After header or the delay quoted in the error."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    value = headers.get("retry-after") or headers.get("Retry-After")
+    if value:
+        try:
+            return float(value)
+        except ValueError:
+            pass
+    text = str(error)
+    match = _RETRY_IN.search(text) or _RETRY_DELAY.search(text)
+    return float(match.group(1)) if match else None
+
+
+def is_daily_quota_error(error: Any) -> bool:
+    """True if a 429 is about the daily quota rather than a per-minute limit."""
+    return bool(_PER_DAY.search(str(error)))
+
+
+def _key_prefix(key: str) -> str:
+    return key[:10] if len(key) >= 10 else key[:6]
+
+
+def _key_id(key: str) -> str:
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+def _utc_day() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+
+def _seconds_to_utc_midnight() -> float:
+    now = datetime.now(timezone.utc)
+    midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return (midnight - now).total_seconds()
+
+
+@dataclass
+class _KeyState:
+    rpm_ceiling: float
+    rpm_limit: float
+    tpm_limit: float
+    daily_limit: int
+    rpm_tokens: float
+    tpm_tokens: float
+    updated_at: float = field(default_factory=time.time)
+    day: str = field(default_factory=_utc_day)
+    daily_used: int = 0
+    blocked_until: float = 0.0
+    consecutive_429s: int = 0
+    successes_since_429: int = 0
+    requests: int = 0
+    rate_limited: int = 0
+
+
+class KeyScheduler:
+    """Per-key RPM/TPM token buckets and daily budgets; picks the key with the earliest capacity."""
+
+    def __init__(self, keys: Iterable[str] = (), rpm: Optional[int] = None, tpm: Optional[int] = None,
+                 daily_requests: Optional[int] = None, max_wait: Optional[float] = None,
+                 backend: Optional[SharedStateBackend] = None):
+        self.rpm = rpm or settings.GEMINI_KEY_RPM
+        self.tpm = tpm or settings.GEMINI_KEY_TPM
+        self.daily_requests = daily_requests or settings.GEMINI_KEY_DAILY_REQUESTS
+        self.max_wait = max_wait if max_wait is not None else settings.GEMINI_KEY_MAX_WAIT_SECONDS
+        self.backend = backend
+        # Every key seen, in order; without a backend these are also the live states
+        self._states: Dict[str, _KeyState] = {}
+        self._lock = threading.Lock()
+        self._register(keys)
+
+    def _new_state(self) -> _KeyState:
+        return _KeyState(
+            rpm_ceiling=self.rpm, rpm_limit=self.rpm, tpm_limit=self.tpm,
+            daily_limit=self.daily_requests, rpm_tokens=self.rpm, tpm_tokens=self.tpm
+        )
+
+    def _register(self, keys: Iterable[str]):
+        with self._lock:
+            for key in keys:
+                if key not in self._states:
+                    self._states[key] = self._new_state()
+
+    def _load(self, raw: Optional[Dict[str, Any]]) -> _KeyState:
+        return _KeyState(**raw) if raw else self._new_state()
+
+    def _snapshot(self, keys: List[str]) -> Dict[str, _KeyState]:
+        """Copies of the states of keys, for decisions that change nothing; shared records are only read."""
+        if self.backend is None:
+            with self._lock:
+                return {key: copy.copy(self._states[key]) for key in keys}
+        return {key: self._load(self.backend.get(_SHARED_KEY_PREFIX + _key_id(key))) for key in keys}
+
+    def _update(self, key: str, fn: Callable[[_KeyState], T]) -> T:
+        """Run fn on key's state atomically: under the lock, or in a transaction on key's shared record."""
+        self._register([key])
+        if self.backend is None:
+            with self._lock:
+                return fn(self._states[key])
+        result = []
+
+        def update(raw: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+            state = self._load(raw)
+            result[:] = [fn(state)]
+            return vars(state)
+
+        self.backend.update(_SHARED_KEY_PREFIX + _key_id(key), update)
+        return result[0]
+
+    def _refill(self, state: _KeyState, now: float):
+        elapsed = now - state.updated_at
+        state.updated_at = now
+        state.rpm_tokens = min(state.rpm_limit, state.rpm_tokens + elapsed * state.rpm_limit / 60.0)
+        state.tpm_tokens = min(state.tpm_limit, state.tpm_tokens + elapsed * state.tpm_limit / 60.0)
+        day = _utc_day()
+        if day != state.day:
+            state.day, state.daily_used, state.daily_limit = day, 0, self.daily_requests
+
+    def _wait_for(self, state: _KeyState, tokens: float, now: float) -> float:
+        waits = [state.blocked_until - now]
+        if state.rpm_tokens < 1:
+            waits.append((1 - state.rpm_tokens) * 60.0 / state.rpm_limit)
+        if state.tpm_tokens < tokens:
+            waits.append((tokens - state.tpm_tokens) * 60.0 / state.tpm_limit)
+        if state.daily_used >= state.daily_limit:
+            waits.append(_seconds_to_utc_midnight())
+        return max(0.0, *waits)
+
+    def _pick(self, states: Dict[str, _KeyState], keys: List[str], estimated_tokens: int,
+              max_wait: float) -> Tuple[Optional[str], float]:
+        """The key with the earliest capacity and its wait; (None, wait) if that is beyond max_wait."""
+        now = time.time()
+        best: Optional[Tuple[float, float, str]] = None
+        for key in keys:
+            state = states[key]
+            self._refill(state, now)
+            tokens = min(float(estimated_tokens), state.tpm_limit)
+            # Earliest capacity first; among keys free now, the one with most headroom
+            candidate = (self._wait_for(state, tokens, now), -state.rpm_tokens, key)
+            if best is None or candidate[:2] < best[:2]:
+                best = candidate
+        if best is None:
+            return None, 0.0
+        wait, _, key = best
+        if wait > max_wait:
+            return None, wait
+        return key, wait
+
+    def _reserve(self, state: _KeyState, estimated_tokens: int):
+        state.rpm_tokens -= 1
+        state.tpm_tokens -= min(float(estimated_tokens), state.tpm_limit)
+        state.daily_used += 1
+        state.requests += 1
+
+    def acquire(self, keys: Iterable[str], estimated_tokens: int = 0, reserve: bool = True,
+                max_wait: Optional[float] = None) -> Tuple[Optional[str], float]:
+        """Pick the key with the earliest capacity among keys and reserve one request on it.
+
+        Returns (key, seconds the caller must wait before sending). Returns (None, wait)
+        without reserving anything when even the best key is more than max_wait away
+        (the scheduler's own max_wait unless one is given; 0 asks for a key free right now).
+        With reserve=False nothing is written, so probing is cheap even on a shared backend.
+        """
+        keys = list(keys)
+        max_wait = self.max_wait if max_wait is None else max_wait
+        self._register(keys)
+        if not reserve:
+            return self._pick(self._snapshot(keys), keys, estimated_tokens, max_wait)
+        if self.backend is None:
+            with self._lock:
+                key, wait = self._pick(self._states, keys, estimated_tokens, max_wait)
+                if key is not None:
+                    self._reserve(self._states[key], estimated_tokens)
+                return key, wait
+
+        def reserve_if_ready(state: _KeyState) -> Optional[float]:
+            now = time.time()
+            self._refill(state, now)
+            wait = self._wait_for(state, min(float(estimated_tokens), state.tpm_limit), now)
+            if wait > max_wait:
+                return None
+            self._reserve(state, estimated_tokens)
+            return wait
+
+        wait = 0.0
+        for _ in range(_RESERVE_ATTEMPTS):
+            key, wait = self._pick(self._snapshot(keys), keys, estimated_tokens, max_wait)
+            if key is None:
+                return None, wait
+            # Other workers may have used the key since it was read; its own record decides
+            reserved_wait = self._update(key, reserve_if_ready)
+            if reserved_wait is not None:
+                return key, reserved_wait
+        return None, wait
+
+    def record_success(self, key: str, reserved_tokens: int = 0, used_tokens: Optional[int] = None):
+        """Settle a request: refund or charge the difference between reserved and used tokens."""
+        def settle(state: _KeyState):
+            if used_tokens is not None:
+                state.tpm_tokens += reserved_tokens - used_tokens
+            state.consecutive_429s = 0
+            state.successes_since_429 += 1
+            if state.rpm_limit < state.rpm_ceiling and state.successes_since_429 >= _RECOVERY_SUCCESSES:
+                state.rpm_limit = min(state.rpm_ceiling, state.rpm_limit + 1)
+                state.successes_since_429 = 0
+
+        self._update(key, settle)
+
+    def record_rate_limited(self, key: str, error: Any = None, retry_after: Optional[float] = None):
+        """Learn from a 429 on key: lower its limits and park it until it can be used again."""
+        if retry_after is None and error is not None:
+            retry_after = parse_retry_after(error)
+        daily = error is not None and is_daily_quota_error(error)
+
+        def park(state: _KeyState) -> Tuple[float, int, float]:
+            now = time.time()
+            self._refill(state, now)
+            state.rate_limited += 1
+            state.consecutive_429s += 1
+            state.successes_since_429 = 0
+            if daily:
+                # The quota ran out at this many requests today
+                state.daily_limit = max(1, state.daily_used)
+                state.blocked_until = now + (retry_after or _seconds_to_utc_midnight())
+                return state.rpm_limit, state.daily_used, 0.0
+            state.rpm_limit = max(1.0, state.rpm_limit * 0.75)
+            state.rpm_tokens = min(state.rpm_tokens, 0.0)
+            backoff = retry_after if retry_after is not None else min(60.0, 5.0 * 2 ** (state.consecutive_429s - 1))
+            state.blocked_until = max(state.blocked_until, now + backoff)
+            return state.rpm_limit, state.daily_used, backoff
+
+        rpm_limit, daily_used, backoff = self._update(key, park)
+        if daily:
+            logger.warning(f"Daily quota exhausted for key ({_key_prefix(key)}...) after {daily_used} requests")
+        else:
+            logger.warning(f"Key ({_key_prefix(key)}...) rate limited; RPM limit now {rpm_limit:.1f}, parked for {backoff:.1f}s")
+
+    def get_status(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            keys = list(self._states)
+        states = self._snapshot(keys)
+        now = time.time()
+        status = {}
+        for key, state in states.items():
+            self._refill(state, now)
+            status[_key_prefix(key)] = {
+                "rpm_limit": round(state.rpm_limit, 2),
+                "rpm_available": round(max(0.0, state.rpm_tokens), 2),
+                "tpm_limit": int(state.tpm_limit),
+                "tpm_available": int(max(0.0, state.tpm_tokens)),
+                "daily_used": state.daily_used,
+                "daily_limit": state.daily_limit,
+                "blocked_for_seconds": round(max(0.0, state.blocked_until - now), 1),
+                "requests": state.requests,
+                "rate_limited": state.rate_limited,
+            }
+        return status
@@ -0,0 +1,308 @@
+"""Priority dispatch of LLM calls.
+
+Interactive planning, agent decisions and background work (self-critique,
+history summaries) used to compete equally for the same rate-limited Gemini
+keys, so a burst of background calls could push a user's ``/prompt`` behind
+them. Every upstream generation now takes a slot from a ``PriorityDispatcher``
+first:
+
+* ``interactive`` -- user-facing requests; the default for unlabeled calls.
+* ``agent`` -- decisions inside agent runs.
+* ``background`` -- work nobody is waiting on.
+
+Free slots go to the highest class waiting, first come first served within a
+class. Background calls may only use a share of the slots, are deferred while
+higher classes wait, and are shed (``LLMRequestShed``) when their queue is
+full, when they have waited too long, or when the key scheduler reports that
+quota is tight.
+
+The class travels in a context variable, so a caller labels everything below
+it with ``with llm_priority(Priority.BACKGROUND): ...`` and no signature in
+between has to change.
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Any, Callable, Deque, Dict, Iterator, Optional, Union
+
+from core.config import settings
+from core.logging import get_logger
+
+logger = get_logger(__name__)
+
+# Recent waits kept per class for the wait-time percentiles
+_WAIT_SAMPLES = 200
+
+
+class Priority(str, Enum):
+    """LLM call classes, highest first."""
+    INTERACTIVE = "interactive"
+    AGENT = "agent"
+    BACKGROUND = "background"
+
+
+_RANK = {Priority.INTERACTIVE: 0, Priority.AGENT: 1, Priority.BACKGROUND: 2}
+
+_current_priority: contextvars.ContextVar[Priority] = contextvars.ContextVar(
+    "llm_priority", default=Priority.INTERACTIVE
+)
+
+
+def current_priority() -> Priority:
+    """Class of LLM calls made from the current context."""
+    return _current_priority.get()
+
+
+@contextlib.contextmanager
+def llm_priority(priority: Union[Priority, str]) -> Iterator[Priority]:
+    """Label LLM calls made inside the block (including awaited coroutines and to_thread calls)."""
+    token = _current_priority.set(Priority(priority))
+    try:
+        yield _current_priority.get()
+    finally:
+        _current_priority.reset(token)
+
+
+class LLMRequestShed(Exception):
+    """A background LLM call was dropped to keep capacity for higher classes."""
+    pass
+
+
+@dataclass
+class _Waiter:
+    priority: Priority
+    enqueued_at: float
+    event: Optional[threading.Event] = None
+    loop: Optional[asyncio.AbstractEventLoop] = None
+    future: Optional[asyncio.Future] = None
+    granted: bool = False
+
+
+@dataclass
+class _ClassStats:
+    in_flight: int = 0
+    admitted: int = 0
+    shed: int = 0
+    waits: Deque[float] = field(default_factory=lambda: deque(maxlen=_WAIT_SAMPLES))
+
+
+class PriorityDispatcher:
+    """Bounded pool of LLM call slots handed out by priority class."""
+
+    def __init__(self, max_concurrent: Optional[int] = None, background_share: Optional[float] = None,
+                 background_max_wait: Optional[float] = None, background_max_queue: Optional[int] = None,
+                 background_quota_wait: Optional[float] = None,
+                 quota_wait: Optional[Callable[[], float]] = None):
+        self.background_share = (background_share if background_share is not None
+                                 else settings.GEMINI_DISPATCH_BACKGROUND_SHARE)
+        self.max_concurrent = max(1, max_concurrent or settings.GEMINI_DISPATCH_MAX_CONCURRENT)
+        self.background_slots = self._background_slots_for(self.max_concurrent)
+        self.background_max_wait = (background_max_wait if background_max_wait is not None
+                                    else settings.GEMINI_DISPATCH_BACKGROUND_MAX_WAIT_SECONDS)
+        self.background_max_queue = (background_max_queue if background_max_queue is not None
+                                     else settings.GEMINI_DISPATCH_BACKGROUND_MAX_QUEUE)
+        self.background_quota_wait = (background_quota_wait if background_quota_wait is not None
+                                      else settings.GEMINI_DISPATCH_BACKGROUND_QUOTA_WAIT_SECONDS)
+        # Seconds until some key has capacity; set by the Gemini client once keys are loaded
+        self.quota_wait = quota_wait
+        self._queues: Dict[Priority, Deque[_Waiter]] = {p: deque() for p in Priority}
+        self._stats: Dict[Priority, _ClassStats] = {p: _ClassStats() for p in Priority}
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def _background_slots_for(self, limit: int) -> int:
+        """Background's cap for a pool of limit slots: its share, but always leaving one slot for higher classes.
+
+        At a single slot (e.g. after the AIMD controller cut the pool to its floor) background
+        may still use it, but only while no higher-class call is waiting (see _can_start).
+        """
+        slots = max(1, int(limit * self.background_share))
+        return min(slots, limit - 1) if limit > 1 else 1
+
+    def _can_start(self, priority: Priority) -> bool:
+        """Whether a call of priority may take a slot now. Caller must hold the lock."""
+        if self._in_flight >= self.max_concurrent:
+            return False
+        if priority == Priority.BACKGROUND and self._stats[priority].in_flight >= self.background_slots:
+            return False
+        # Strict priority: nothing starts ahead of a waiting higher class
+        return not any(self._queues[p] for p in Priority if _RANK[p] < _RANK[priority])
+
+    def _start(self, priority: Priority, waited: float):
+        """Take a slot. Caller must hold the lock."""
+        stats = self._stats[priority]
+        self._in_flight += 1
+        stats.in_flight += 1
+        stats.admitted += 1
+        stats.waits.append(waited)
+
+    def _shed(self, priority: Priority, reason: str) -> LLMRequestShed:
+        """Count a shed call. Caller must hold the lock."""
+        self._stats[priority].shed += 1
+        logger.info(f"Shedding {priority.value} LLM call: {reason}")
+        return LLMRequestShed(f"{priority.value} LLM call shed: {reason}")
+
+    def _checks_quota(self, priority: Priority) -> bool:
+        return priority == Priority.BACKGROUND and self.quota_wait is not None
+
+    def _quota_wait_for(self, priority: Priority) -> float:
+        """Seconds until a key has capacity, for calls the quota check applies to. Call without the lock."""
+        if not self._checks_quota(priority):
+            return 0.0
+        return self.quota_wait()
+
+    def _admit_or_enqueue(self, waiter: _Waiter, quota_wait: float = 0.0) -> bool:
+        """Start waiter now (True) or queue it (False); raises when it is shed. Caller must hold the lock."""
+        priority = waiter.priority
+        if priority == Priority.BACKGROUND:
+            if len(self._queues[priority]) >= self.background_max_queue:
+                raise self._shed(priority, "background queue is full")
+            if quota_wait > self.background_quota_wait:
+                raise self._shed(priority, f"quota is tight (next key capacity in {quota_wait:.0f}s)")
+        if not self._queues[priority] and self._can_start(priority):
+            self._start(priority, 0.0)
+            return True
+        self._queues[priority].append(waiter)
+        return False
+
+    def _grant_waiting(self):
+        """Hand free slots to waiters, highest class first. Caller must hold the lock."""
+        for priority in Priority:
+            queue = self._queues[priority]
+            while queue and self._can_start(priority):
+                waiter = queue.popleft()
+                waiter.granted = True
+                self._start(priority, time.monotonic() - waiter.enqueued_at)
+                if waiter.event is not None:
+                    waiter.event.set()
+                else:
+                    waiter.loop.call_soon_threadsafe(_resolve, waiter.future)
+
+    def _max_wait(self, priority: Priority) -> Optional[float]:
+        return self.background_max_wait if priority == Priority.BACKGROUND else None
+
+    def _abandon(self, waiter: _Waiter) -> bool:
+        """Withdraw a waiter that timed out or was cancelled; False if it was granted meanwhile."""
+        with self._lock:
+            if waiter.granted:
+                return False
+            self._queues[waiter.priority].remove(waiter)
+            # Lower classes held back by this waiter may start now
+            self._grant_waiting()
+            return True
+
+    def acquire(self, priority: Union[Priority, str, None] = None):
+        """Block the calling thread until a slot for priority is free."""
+        priority = Priority(priority or current_priority())
+        waiter = _Waiter(priority, time.monotonic(), event=threading.Event())
+        # The quota probe may read shared state, so it runs before taking the dispatcher lock
+        quota_wait = self._quota_wait_for(priority)
+        with self._lock:
+            if self._admit_or_enqueue(waiter, quota_wait):
+                return
+        if not waiter.event.wait(self._max_wait(priority)) and self._abandon(waiter):
+            with self._lock:
+                raise self._shed(priority, f"waited more than {self.background_max_wait:.0f}s for a slot")
+
+    async def acquire_async(self, priority: Union[Priority, str, None] = None):
+        """Wait on the event loop until a slot for priority is free."""
+        priority = Priority(priority or current_priority())
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(priority, time.monotonic(), loop=loop, future=loop.create_future())
+        # The quota probe may read shared state (SHARED_STATE_BACKEND); keep it off the loop
+        quota_wait = await asyncio.to_thread(self._quota_wait_for, priority) if self._checks_quota(priority) else 0.0
+        with self._lock:
+            if self._admit_or_enqueue(waiter, quota_wait):
+                return
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self._max_wait(priority))
+        except asyncio.TimeoutError:
+            if self._abandon(waiter):
+                with self._lock:
+                    raise self._shed(priority, f"waited more than {self.background_max_wait:.0f}s for a slot")
+        except asyncio.CancelledError:
+            if not self._abandon(waiter):
+                # The slot was granted as the caller went away; give it back
+                self.release(priority)
+            raise
+
+    def set_max_concurrent(self, max_concurrent: int):
+        """Resize the slot pool; calls already running finish even if the pool shrinks below them."""
+        with self._lock:
+            self.max_concurrent = max(1, int(max_concurrent))
+            self.background_slots = self._background_slots_for(self.max_concurrent)
+            self._grant_waiting()
+
+    def release(self, priority: Union[Priority, str, None] = None):
+        priority = Priority(priority or current_priority())
+        with self._lock:
+            self._in_flight -= 1
+            self._stats[priority].in_flight -= 1
+            self._grant_waiting()
+
+    @contextlib.contextmanager
+    def slot(self, priority: Union[Priority, str, None] = None) -> Iterator[Priority]:
+        priority = Priority(priority or current_priority())
+        self.acquire(priority)
+        try:
+            yield priority
+        finally:
+            self.release(priority)
+
+    @contextlib.asynccontextmanager
+    async def slot_async(self, priority: Union[Priority, str, None] = None):
+        priority = Priority(priority or current_priority())
+        await self.acquire_async(priority)
+        try:
+            yield priority
+        finally:
+            self.release(priority)
+
+    def get_stats(self) -> Dict[str, Any]:
+        classes = {}
+        with self._lock:
+            for priority in Priority:
+                stats = self._stats[priority]
+                waits = sorted(stats.waits)
+                classes[priority.value] = {
+                    "queue_depth": len(self._queues[priority]),
+                    "in_flight": stats.in_flight,
+                    "admitted": stats.admitted,
+                    "shed": stats.shed,
+                    "avg_wait_ms": round(1000 * sum(waits) / len(waits), 1) if waits else 0.0,
+                    "p95_wait_ms": round(1000 * waits[int(0.95 * (len(waits) - 1))], 1) if waits else 0.0,
+                    "max_wait_ms": round(1000 * waits[-1], 1) if waits else 0.0,
+                }
+            in_flight = self._in_flight
+        return {
+            "max_concurrent": self.max_concurrent,
+            "background_slots": self.background_slots,
+            "in_flight": in_flight,
+            "classes": classes,
+        }
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+# Global dispatcher instance
+_llm_dispatcher: Optional[PriorityDispatcher] = None
+_llm_dispatcher_lock = threading.Lock()
+
+
+def get_llm_dispatcher() -> PriorityDispatcher:
+    """Get the global LLM priority dispatcher."""
+    global _llm_dispatcher
+    if _llm_dispatcher is None:
+        with _llm_dispatcher_lock:
+            if _llm_dispatcher is None:
+                _llm_dispatcher = PriorityDispatcher()
+    return _llm_dispatcher
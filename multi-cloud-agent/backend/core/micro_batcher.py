@@ -0,0 +1,99 @@
+"""Micro-batching of single calls into batched ones.
+
+Callers submit one item at a time; a worker thread groups what arrives
+within ``max_latency`` seconds of the first item (or until ``max_size``
+items are waiting) into one call of the batch function, and hands each
+caller its own result. Used to turn concurrent ``Memory.add_document``
+calls into batched embedding requests: the upstream accepts a whole batch
+for about the cost of one text.
+
+Batches run on a small thread pool, so a slow batch does not hold back the
+next one.
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Generic, List, Optional, Tuple, TypeVar
+
+from core.logging import get_logger
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class MicroBatcher(Generic[T, R]):
+    """Groups submitted items into calls of fn(items) -> results (same length and order)."""
+
+    def __init__(self, fn: Callable[[List[T]], List[R]], max_size: int, max_latency: float,
+                 max_concurrency: int = 4, name: str = "batcher"):
+        self.fn = fn
+        self.max_size = max(1, max_size)
+        self.max_latency = max(0.0, max_latency)
+        self.name = name
+        self._pending: Deque[Tuple[T, Future, float]] = deque()
+        self._cond = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_concurrency), thread_name_prefix=name)
+        self._worker: Optional[threading.Thread] = None
+        self._stats = {"batches": 0, "items": 0, "largest_batch": 0, "failed_batches": 0}
+
+    def submit(self, item: T) -> "Future[R]":
+        future: Future = Future()
+        with self._cond:
+            self._pending.append((item, future, time.monotonic()))
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name=f"{self.name}-collector", daemon=True)
+                self._worker.start()
+            self._cond.notify()
+        return future
+
+    def call(self, item: T) -> R:
+        """Submit item and wait for its result."""
+        return self.submit(item).result()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                # Hold the batch open until it is full or its oldest item has waited max_latency
+                deadline = self._pending[0][2] + self.max_latency
+                while len(self._pending) < self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = [self._pending.popleft() for _ in range(min(self.max_size, len(self._pending)))]
+            self._executor.submit(self._execute, batch)
+
+    def _execute(self, batch: List[Tuple[T, Future, float]]):
+        items = [item for item, _, _ in batch]
+        try:
+            results = self.fn(items)
+            if len(results) != len(items):
+                raise RuntimeError(f"{self.name} returned {len(results)} results for {len(items)} items")
+        except Exception as e:
+            with self._cond:
+                self._stats["failed_batches"] += 1
+            logger.warning(f"{self.name} batch of {len(items)} failed: {e}")
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        with self._cond:
+            self._stats["batches"] += 1
+            self._stats["items"] += len(items)
+            self._stats["largest_batch"] = max(self._stats["largest_batch"], len(items))
+        for (_, future, _), result in zip(batch, results):
+            future.set_result(result)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            stats = dict(self._stats)
+            stats["queue_depth"] = len(self._pending)
+        stats["avg_batch_size"] = round(stats["items"] / stats["batches"], 2) if stats["batches"] else 0.0
+        stats["max_size"] = self.max_size
+        stats["max_latency_ms"] = round(self.max_latency * 1000, 1)
+        return stats
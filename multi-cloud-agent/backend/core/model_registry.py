@@ -0,0 +1,172 @@
+"""Per-key registry of which Gemini models are usable.
+
+Generation used to try every entry of the model candidate list on every
+attempt, paying a failed round trip for each unavailable model before
+reaching one that works. The registry remembers outcomes per (key, model):
+models that returned ``NotFound`` or "unsupported" are skipped until their
+negative result expires (``GEMINI_MODEL_NEGATIVE_TTL_SECONDS``), and the rest
+keep their configured preference order, so a model that merely answered once
+is never promoted over a preferred one that has not been tried yet. A background task re-checks the candidates against the
+models API (a metadata call that spends no generation quota) every
+``GEMINI_MODEL_REFRESH_SECONDS``.
+"""
+
+import asyncio
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from core.config import settings
+from core.logging import get_logger
+
+logger = get_logger(__name__)
+
+# Generation method a candidate must support to be usable
+_GENERATE_METHOD = "generateContent"
+
+
+@dataclass
+class _ModelStatus:
+    available: bool
+    checked_at: float
+    error: Optional[str] = None
+    source: str = "call"  # "call" (seen on a real request) or "probe" (background refresh)
+
+
+def _key_prefix(key: str) -> str:
+    return key[:10] if len(key) >= 10 else key[:6]
+
+
+def probe_model(key: str, model_name: str) -> bool:
+    """Ask the models API whether model_name exists for key and supports generateContent."""
+    import google.generativeai as genai
+    from core.gemini_clients import get_gemini_client_pool
+
+    name = model_name if model_name.startswith("models/") else f"models/{model_name}"
+    model = genai.get_model(name, client=get_gemini_client_pool().get_model_client(key))
+    methods = getattr(model, "supported_generation_methods", None) or []
+    return not methods or _GENERATE_METHOD in methods
+
+
+class ModelAvailabilityRegistry:
+    """Remembers, per API key, which model candidates work and which do not."""
+
+    def __init__(self, negative_ttl: Optional[float] = None, refresh_interval: Optional[float] = None,
+                 probe: Callable[[str, str], bool] = probe_model):
+        self.negative_ttl = negative_ttl if negative_ttl is not None else settings.GEMINI_MODEL_NEGATIVE_TTL_SECONDS
+        self.refresh_interval = refresh_interval or settings.GEMINI_MODEL_REFRESH_SECONDS
+        self.probe = probe
+        self._status: Dict[Tuple[str, str], _ModelStatus] = {}
+        self._lock = threading.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._last_refresh: Optional[float] = None
+        self._stats = {"skipped_unavailable": 0, "refreshes": 0, "probe_errors": 0}
+
+    def record_success(self, key: str, model_name: str, source: str = "call"):
+        with self._lock:
+            self._status[(key, model_name)] = _ModelStatus(True, time.time(), source=source)
+
+    def record_unavailable(self, key: str, model_name: str, error: Any = None, source: str = "call"):
+        with self._lock:
+            self._status[(key, model_name)] = _ModelStatus(
+                False, time.time(), error=str(error)[:200] if error else None, source=source
+            )
+
+    def _is_unavailable(self, status: Optional[_ModelStatus], now: float) -> bool:
+        return status is not None and not status.available and now - status.checked_at < self.negative_ttl
+
+    def candidates_for(self, key: str, candidates: Iterable[str]) -> List[str]:
+        """Candidates to try for key in configured order, skipping ones recently found unavailable."""
+        now = time.time()
+        usable = []
+        with self._lock:
+            for model_name in candidates:
+                if self._is_unavailable(self._status.get((key, model_name)), now):
+                    self._stats["skipped_unavailable"] += 1
+                else:
+                    usable.append(model_name)
+        return usable
+
+    def refresh(self, keys: Iterable[str], candidates: Iterable[str]):
+        """Probe every (key, candidate) pair now. Blocking; run it off the event loop."""
+        from google.api_core.exceptions import InvalidArgument, NotFound
+
+        candidates = list(candidates)
+        for key in keys:
+            for model_name in candidates:
+                try:
+                    if self.probe(key, model_name):
+                        self.record_success(key, model_name, source="probe")
+                    else:
+                        self.record_unavailable(key, model_name, "generateContent not supported", source="probe")
+                except (NotFound, InvalidArgument) as e:
+                    self.record_unavailable(key, model_name, e, source="probe")
+                except Exception as e:
+                    # Auth, quota or network trouble says nothing about the model; keep what we knew
+                    with self._lock:
+                        self._stats["probe_errors"] += 1
+                    logger.warning(f"Model probe for {model_name} with key ({_key_prefix(key)}...) failed: {e}")
+        with self._lock:
+            self._last_refresh = time.time()
+            self._stats["refreshes"] += 1
+
+    async def _refresh_loop(self, keys: List[str], candidates: List[str]):
+        while True:
+            await asyncio.to_thread(self.refresh, keys, candidates)
+            await asyncio.sleep(self.refresh_interval)
+
+    def start_refresh(self, keys: Iterable[str], candidates: Iterable[str]):
+        """Refresh now and then every refresh_interval seconds on the running event loop."""
+        keys = list(keys)
+        if self._refresh_task is not None or not keys:
+            return
+        self._refresh_task = asyncio.create_task(self._refresh_loop(keys, list(candidates)), name="gemini-model-refresh")
+
+    async def stop_refresh(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            await asyncio.gather(self._refresh_task, return_exceptions=True)
+            self._refresh_task = None
+
+    def get_status(self) -> Dict[str, Any]:
+        now = time.time()
+        models: Dict[str, Dict[str, Any]] = {}
+        with self._lock:
+            for (key, model_name), status in self._status.items():
+                if status.available:
+                    state = "available"
+                elif self._is_unavailable(status, now):
+                    state = "unavailable"
+                else:
+                    state = "expired"
+                models.setdefault(_key_prefix(key), {})[model_name] = {
+                    "state": state,
+                    "checked_at": status.checked_at,
+                    "source": status.source,
+                    "error": status.error,
+                }
+            stats = dict(self._stats)
+            last_refresh = self._last_refresh
+        return {
+            "models": models,
+            "negative_ttl_seconds": self.negative_ttl,
+            "refresh_interval_seconds": self.refresh_interval,
+            "last_refresh": last_refresh,
+            **stats,
+        }
+
+
+# Global model registry instance
+_model_registry: Optional[ModelAvailabilityRegistry] = None
+_model_registry_lock = threading.Lock()
+
+
+def get_model_registry() -> ModelAvailabilityRegistry:
+    """Get the global model availability registry."""
+    global _model_registry
+    if _model_registry is None:
+        with _model_registry_lock:
+            if _model_registry is None:
+                _model_registry = ModelAvailabilityRegistry()
+    return _model_registry
@@ -0,0 +1,366 @@
+"""Semantic reuse of plans that users marked successful.
+
+``/prompt`` consults this cache before asking the LLM for a plan. Prompts of
+``PlanHistory`` rows with ``feedback == 'success'`` are embedded with the
+agent's ``Memory`` embeddings; an incoming prompt whose cosine similarity to
+one of the same user's successful prompts clears
+``PLAN_CACHE_SIMILARITY_THRESHOLD`` gets that plan back, adapted to the new
+prompt, without an LLM call.
+
+Adaptation is literal: URLs, e-mail addresses, quoted strings and numbers of
+the cached prompt are paired with the ones in the new prompt, and a step param
+is rewritten only when its whole value (string or number) is a value that
+changed. Every changed value must be found that way, and must map to a single
+new value; otherwise the plan cannot be adapted safely (the value may be part
+of an instance type or region, or not appear in the plan at all) and the
+lookup is a miss. Substrings are never replaced.
+
+Embeddings place opposite requests close together ("create a VM on gcp" and
+"delete a VM on gcp" differ in one word), so similarity alone never selects a
+plan: the two prompts must also have the same intent, meaning the same action
+verbs and the same cloud providers and resource kinds (see
+``intent_signature``). Synonyms such as "launch" and "create" count as one.
+"""
+
+import copy
+import re
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from core.config import settings
+from core.logging import get_logger
+from core.response_cache import normalize_prompt
+
+logger = get_logger(__name__)
+
+# Values in a prompt that a reused plan must be rewritten for
+_ENTITY = re.compile(
+    r"https?://[^\s\"'<>]+"
+    r"|[\w.+-]+@[\w-]+(?:\.[\w-]+)+"
+    r"|\"[^\"]+\""
+    r"|'[^']+'"
+    r"|(?<![\w.])\d+(?:\.\d+)?(?![\w.])"
+)
+
+
+# Action verbs, grouped by what they do to a resource; a prompt's verbs must match a cached prompt's
+_VERB_GROUPS = {
+    "create": ("create", "make", "launch", "provision", "spin", "add", "build"),
+    "delete": ("delete", "remove", "destroy", "terminate", "drop", "erase", "purge", "teardown"),
+    "read": ("list", "show", "get", "describe", "display", "fetch", "view", "check", "find"),
+    "start": ("start", "boot", "resume", "run"),
+    "stop": ("stop", "shutdown", "halt", "pause", "suspend"),
+    "restart": ("restart", "reboot"),
+    "update": ("update", "modify", "change", "edit", "resize", "scale", "rename", "configure"),
+    "deploy": ("deploy", "publish", "release"),
+    "upload": ("upload", "push"),
+    "download": ("download", "pull", "export"),
+    "copy": ("copy", "clone", "duplicate"),
+    "move": ("move", "migrate", "transfer"),
+    "attach": ("attach", "mount", "connect"),
+    "detach": ("detach", "unmount", "disconnect"),
+    "enable": ("enable", "allow", "grant", "open"),
+    "disable": ("disable", "deny", "revoke", "block", "close"),
+    "backup": ("backup", "snapshot"),
+    "restore": ("restore", "recover"),
+    "send": ("send", "post", "reply"),
+    "search": ("search", "scrape", "crawl", "browse"),
+    "fill": ("fill", "submit", "signup", "register"),
+    "login": ("login", "signin", "authenticate"),
+    "install": ("install",),
+    "uninstall": ("uninstall",),
+}
+
+# Providers and resource kinds a plan is specific to
+_NOUN_GROUPS = {
+    "aws": ("aws", "amazon", "ec2", "s3", "rds", "lambda", "eks"),
+    "gcp": ("gcp", "gce", "gcs", "gke", "bigquery"),
+    "azure": ("azure", "aks"),
+    "vm": ("vm", "vms", "instance", "instances", "server", "servers", "ec2", "gce", "machine", "machines"),
+    "storage": ("bucket", "buckets", "storage", "s3", "gcs", "blob", "blobs", "disk", "disks", "volume", "volumes"),
+    "database": ("database", "databases", "db", "rds", "sql", "bigquery", "table", "tables"),
+    "function": ("function", "functions", "lambda", "serverless"),
+    "cluster": ("cluster", "clusters", "kubernetes", "k8s", "eks", "gke", "aks", "pod", "pods"),
+    "network": ("network", "networks", "vpc", "subnet", "subnets", "firewall", "dns", "ip"),
+    "identity": ("user", "users", "iam", "role", "roles", "policy", "policies", "permission", "permissions"),
+}
+
+
+def _index(groups: Dict[str, Tuple[str, ...]]) -> Dict[str, Set[str]]:
+    index: Dict[str, Set[str]] = {}
+    for group, words in groups.items():
+        for word in words:
+            index.setdefault(word, set()).add(group)
+    return index
+
+
+_VERBS = _index(_VERB_GROUPS)
+_NOUNS = _index(_NOUN_GROUPS)
+
+# Multi-word spellings folded into one token before matching
+_PHRASES = (
+    (re.compile(r"\bgoogle cloud\b"), "gcp"),
+    (re.compile(r"\bspin up\b"), "spin"),
+    (re.compile(r"\btear down\b"), "teardown"),
+    (re.compile(r"\bshut down\b"), "shutdown"),
+    (re.compile(r"\bsign up\b"), "signup"),
+    (re.compile(r"\b(?:log|sign) in(?:to)?\b"), "signin"),
+    (re.compile(r"\bvirtual machines?\b"), "vm"),
+)
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def intent_signature(prompt: str) -> Tuple[FrozenSet[str], FrozenSet[str]]:
+    """The action verb groups and the provider/resource groups a prompt mentions.
+
+    Literal values (see ``extract_entities``) are left out: they are what
+    adaptation rewrites, and a URL like google.com must not read as a provider.
+    """
+    text = _ENTITY.sub(" ", prompt.lower())
+    for phrase, token in _PHRASES:
+        text = phrase.sub(token, text)
+    verbs: Set[str] = set()
+    nouns: Set[str] = set()
+    for word in _WORD.findall(text):
+        verbs.update(_VERBS.get(word, ()))
+        nouns.update(_NOUNS.get(word, ()))
+    return frozenset(verbs), frozenset(nouns)
+
+
+def extract_entities(prompt: str) -> List[str]:
+    """Literal values (URLs, e-mails, quoted strings, numbers) in order of appearance."""
+    entities = []
+    for match in _ENTITY.finditer(prompt):
+        value = match.group(0)
+        if value[0] in "\"'":
+            value = value[1:-1]
+        entities.append(value.rstrip(".,;:!?)") if value.startswith("http") else value)
+    return entities
+
+
+def _as_number(text: str) -> Any:
+    return float(text) if "." in text else int(text)
+
+
+def _substitute(value: Any, mapping: Dict[str, str], used: Set[str]) -> Any:
+    """Replace leaves whose whole value is a key of mapping, keeping numbers numeric; records the keys used."""
+    if isinstance(value, dict):
+        return {key: _substitute(item, mapping, used) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_substitute(item, mapping, used) for item in value]
+    if isinstance(value, str) and value in mapping:
+        used.add(value)
+        return mapping[value]
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        old = str(value)
+        if old in mapping:
+            try:
+                replacement = _as_number(mapping[old])
+            except ValueError:
+                return value
+            used.add(old)
+            return replacement
+    return value
+
+
+def adapt_plan(plan: List[Dict[str, Any]], cached_prompt: str, prompt: str) -> Optional[List[Dict[str, Any]]]:
+    """Rewrite a cached plan's params for a new prompt. Returns None if the prompts' values don't line up."""
+    old_entities = extract_entities(cached_prompt)
+    new_entities = extract_entities(prompt)
+    if len(old_entities) != len(new_entities):
+        return None
+    mapping: Dict[str, str] = {}
+    for old, new in zip(old_entities, new_entities):
+        if old != new and mapping.setdefault(old, new) != new:
+            # The same value became two different ones; which param gets which is unknown
+            return None
+    used: Set[str] = set()
+    adapted = []
+    for number, step in enumerate(copy.deepcopy(plan), start=1):
+        if isinstance(step, dict):
+            step["step"] = number
+            if mapping and "params" in step:
+                step["params"] = _substitute(step["params"], mapping, used)
+        adapted.append(step)
+    if used != set(mapping):
+        # A changed value that is not a whole param value (e.g. part of "t2.micro") or not in the plan at all
+        return None
+    return adapted
+
+
+@dataclass
+class _PlanEntry:
+    plan_id: int
+    prompt: str
+    normalized: str
+    plan: List[Dict[str, Any]]
+    vector: Optional[np.ndarray]  # unit length, None if the prompt could not be embedded
+    intent: Tuple[FrozenSet[str], FrozenSet[str]]
+
+
+@dataclass
+class PlanMatch:
+    plan_id: int
+    plan: List[Dict[str, Any]]
+    similarity: float
+    cached_prompt: str
+
+
+class PlanCache:
+    """Per-user index of successful plans, searched by prompt embedding similarity."""
+
+    def __init__(self, embed: Optional[Callable[[str], np.ndarray]] = None, threshold: Optional[float] = None,
+                 max_entries_per_user: Optional[int] = None, enabled: Optional[bool] = None):
+        self._embed = embed
+        self.threshold = threshold if threshold is not None else settings.PLAN_CACHE_SIMILARITY_THRESHOLD
+        self.max_entries_per_user = max_entries_per_user or settings.PLAN_CACHE_MAX_ENTRIES_PER_USER
+        self.enabled = settings.PLAN_CACHE_ENABLED if enabled is None else enabled
+        self._entries: Dict[int, List[_PlanEntry]] = {}
+        self._loaded: Set[int] = set()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "exact_hits": 0, "misses": 0, "unadaptable": 0, "intent_mismatches": 0,
+                       "embedding_failures": 0}
+
+    def _embedding(self, text: str) -> Optional[np.ndarray]:
+        if self._embed is None:
+            import memory
+            self._embed = memory.get_memory_instance()._get_embedding
+        try:
+            vector = np.asarray(self._embed(text), dtype=np.float32)
+        except Exception as e:
+            logger.warning(f"Plan cache embedding failed: {e}")
+            return None
+        norm = float(np.linalg.norm(vector))
+        # The embedding fallback returns a zero vector when no model is reachable
+        if norm == 0.0:
+            return None
+        return vector / norm
+
+    def _count(self, stat: str):
+        with self._lock:
+            self._stats[stat] += 1
+
+    def is_loaded(self, user_id: int) -> bool:
+        with self._lock:
+            return user_id in self._loaded
+
+    def load(self, user_id: int, rows: Iterable[Tuple[int, str, List[Dict[str, Any]]]]):
+        """Index a user's successful (plan_id, prompt, plan) rows, newest first."""
+        entries = []
+        for plan_id, prompt, plan in rows:
+            if len(entries) >= self.max_entries_per_user:
+                break
+            entry = self._make_entry(plan_id, prompt, plan)
+            if entry is not None:
+                entries.append(entry)
+        with self._lock:
+            self._entries[user_id] = entries
+            self._loaded.add(user_id)
+        logger.info(f"Plan cache loaded {len(entries)} successful plans for user {user_id}")
+
+    def _make_entry(self, plan_id: int, prompt: str, plan: Any) -> Optional[_PlanEntry]:
+        if not prompt or not isinstance(plan, list) or not plan:
+            return None
+        vector = self._embedding(prompt)
+        if vector is None:
+            # Still servable for exact repeats of the prompt
+            self._count("embedding_failures")
+        return _PlanEntry(plan_id, prompt, normalize_prompt(prompt).lower(), plan, vector, intent_signature(prompt))
+
+    def add(self, user_id: int, plan_id: int, prompt: str, plan: Any):
+        """Index a plan that was just marked successful. Users not loaded yet pick it up on load."""
+        if not self.enabled or not self.is_loaded(user_id):
+            return
+        entry = self._make_entry(plan_id, prompt, plan)
+        if entry is None:
+            return
+        with self._lock:
+            entries = [e for e in self._entries.get(user_id, []) if e.plan_id != plan_id]
+            entries.insert(0, entry)
+            self._entries[user_id] = entries[:self.max_entries_per_user]
+
+    def remove(self, user_id: int, plan_id: int):
+        """Forget a plan, e.g. after it was re-rated as a failure."""
+        with self._lock:
+            if user_id in self._entries:
+                self._entries[user_id] = [e for e in self._entries[user_id] if e.plan_id != plan_id]
+
+    def lookup(self, user_id: int, prompt: str) -> Optional[PlanMatch]:
+        """Best adaptable successful plan for prompt at or above the threshold, or None."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entries = list(self._entries.get(user_id, []))
+        if not entries:
+            self._count("misses")
+            return None
+
+        normalized = normalize_prompt(prompt).lower()
+        for entry in entries:
+            if entry.normalized == normalized:
+                # The prompts differ at most in case and spacing, so the plan stands as is if no value maps
+                plan = adapt_plan(entry.plan, entry.prompt, prompt) or copy.deepcopy(entry.plan)
+                self._count("exact_hits")
+                return PlanMatch(entry.plan_id, plan, 1.0, entry.prompt)
+
+        entries = [entry for entry in entries if entry.vector is not None]
+        query = self._embedding(prompt) if entries else None
+        if query is None:
+            self._count("misses")
+            return None
+        similarities = np.stack([entry.vector for entry in entries]) @ query
+        intent = intent_signature(prompt)
+        unadaptable = intent_mismatch = False
+        for index in np.argsort(-similarities):
+            similarity = float(similarities[index])
+            if similarity < self.threshold:
+                break
+            entry = entries[index]
+            if entry.intent != intent:
+                # Similar wording, different action or target, e.g. "delete" where the plan "create"s
+                intent_mismatch = True
+                continue
+            plan = adapt_plan(entry.plan, entry.prompt, prompt)
+            if plan is None:
+                unadaptable = True
+                continue
+            self._count("hits")
+            return PlanMatch(entry.plan_id, plan, round(similarity, 4), entry.prompt)
+        self._count("unadaptable" if unadaptable else "intent_mismatches" if intent_mismatch else "misses")
+        return None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._loaded.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["users"] = len(self._loaded)
+            stats["plans"] = sum(len(entries) for entries in self._entries.values())
+        lookups = stats["hits"] + stats["exact_hits"] + stats["misses"] + stats["unadaptable"] + stats["intent_mismatches"]
+        stats.update({
+            "enabled": self.enabled,
+            "threshold": self.threshold,
+            "hit_rate_percent": round((stats["hits"] + stats["exact_hits"]) / lookups * 100, 2) if lookups else 0,
+        })
+        return stats
+
+
+# Global plan cache instance
+_plan_cache: Optional[PlanCache] = None
+_plan_cache_lock = threading.Lock()
+
+
+def get_plan_cache() -> PlanCache:
+    """Get the global plan cache."""
+    global _plan_cache
+    if _plan_cache is None:
+        with _plan_cache_lock:
+            if _plan_cache is None:
+                _plan_cache = PlanCache()
+    return _plan_cache
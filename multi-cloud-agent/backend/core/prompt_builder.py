@@ -0,0 +1,202 @@
+"""Incremental, token-budgeted prompt construction for the agent loop.
+
+The agent loop used to rebuild its whole history string and re-serialize the
+tool registry on every step, so prompt size and CPU time grew quadratically
+with run length. ``AgentPromptBuilder`` renders each step once when it is
+recorded, compacts results once they fall out of the recent window and drops
+the oldest steps into a one-line summary when the history exceeds its token
+budget, keeping per-step prompt size bounded. Older steps can also be folded
+into a rolling LLM-written summary (see ``core.history_compactor``).
+"""
+
+import re
+from collections import Counter, deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
+
+from core.config import settings
+from core.utils import truncate_string
+
+NO_HISTORY = "  - No actions taken yet."
+
+# Upper bound on compacted lines kept for the next summary if summarization keeps failing
+MAX_PENDING_SUMMARY_STEPS = 200
+
+_HTML_HINT = re.compile(r"<(html|body|div|head|script|!doctype)\b", re.IGNORECASE)
+_HTML_DROP = re.compile(r"<(script|style|noscript|svg)\b.*?</\1>", re.IGNORECASE | re.DOTALL)
+_HTML_TAG = re.compile(r"<[^>]+>")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token) used for prompt budgeting."""
+    return len(text) // 4 + 1
+
+
+def condense_result(result: Any, max_chars: int) -> str:
+    """Render a tool result for the prompt, reducing raw HTML to its visible text."""
+    text = str(result)
+    if _HTML_HINT.search(text[:2000]):
+        original_len = len(text)
+        text = _HTML_DROP.sub(" ", text)
+        text = _HTML_TAG.sub(" ", text)
+        text = _WHITESPACE.sub(" ", text).strip()
+        text = f"[page text, {original_len} chars of HTML] {text}"
+    return truncate_string(text, max_length=max_chars, suffix=" ...[truncated]")
+
+
+@dataclass
+class _RenderedStep:
+    step: int
+    action: str
+    line: str
+    tokens: int
+    compact: bool = False
+    # Raw entry, kept only until the step is compacted so it can be re-rendered
+    entry: Optional[Dict[str, Any]] = None
+
+
+class AgentPromptBuilder:
+    """Builds agent-loop prompts from a template, a cached tools block and a bounded history."""
+
+    def __init__(self, template: str, tools_block: str, token_budget: Optional[int] = None,
+                 recent_steps: Optional[int] = None, recent_result_chars: Optional[int] = None,
+                 old_result_chars: Optional[int] = None):
+        self.template = template
+        self.tools_block = tools_block
+        self.token_budget = token_budget or settings.AGENT_PROMPT_TOKEN_BUDGET
+        self.recent_steps = max(1, recent_steps or settings.AGENT_PROMPT_RECENT_STEPS)
+        self.recent_result_chars = recent_result_chars or settings.AGENT_PROMPT_RECENT_RESULT_CHARS
+        self.old_result_chars = old_result_chars or settings.AGENT_PROMPT_OLD_RESULT_CHARS
+
+        self._steps: Deque[_RenderedStep] = deque()
+        self._compacted = 0  # number of leading entries in self._steps already compacted
+        self._history_tokens = 0
+        self._omitted_first: Optional[int] = None
+        self._omitted_last: Optional[int] = None
+        self._omitted_actions: Counter = Counter()
+        self._history_cache: Optional[str] = None
+        # Rolling summary of steps 1..summary_through and the compacted lines not yet folded into it
+        self.summary: Optional[str] = None
+        self.summary_through = 0
+        self._summary_tokens = 0
+        self._unsummarized: Deque[Tuple[int, str]] = deque(maxlen=MAX_PENDING_SUMMARY_STEPS)
+        # Template and tools are fixed for the lifetime of the builder
+        self._fixed_tokens = estimate_tokens(template) + estimate_tokens(tools_block)
+
+    def _render(self, entry: Dict[str, Any], max_chars: int) -> str:
+        action = entry.get("action") or {}
+        name = action.get("name") if isinstance(action, dict) else action
+        result = condense_result(entry.get("result", ""), max_chars)
+        return f"  - Step {entry.get('step')}: I used '{name}' which resulted in: '{result}'"
+
+    def add_step(self, entry: Dict[str, Any]):
+        """Record one history entry ({"step", "action": {"name", ...}, "result"})."""
+        if (entry.get("step") or 0) <= self.summary_through:
+            return
+        action = entry.get("action") or {}
+        name = str(action.get("name") if isinstance(action, dict) else action)
+        line = self._render(entry, self.recent_result_chars)
+        rendered = _RenderedStep(step=entry.get("step"), action=name, line=line,
+                                 tokens=estimate_tokens(line), entry=entry)
+        self._steps.append(rendered)
+        self._history_tokens += rendered.tokens
+
+        # The step that just left the recent window is compacted exactly once
+        while len(self._steps) - self._compacted > self.recent_steps:
+            old = self._steps[self._compacted]
+            old_line = self._render(old.entry, self.old_result_chars)
+            old.entry = None
+            self._history_tokens += estimate_tokens(old_line) - old.tokens
+            old.line, old.tokens, old.compact = old_line, estimate_tokens(old_line), True
+            self._unsummarized.append((old.step, old_line))
+            self._compacted += 1
+
+        self._enforce_budget()
+        self._history_cache = None
+
+    def extend(self, entries: Iterable[Dict[str, Any]]):
+        for entry in entries:
+            self.add_step(entry)
+
+    def _enforce_budget(self):
+        history_budget = max(0, self.token_budget - self._fixed_tokens - self._summary_tokens)
+        while self._history_tokens > history_budget and len(self._steps) > 1:
+            dropped = self._steps.popleft()
+            if dropped.compact:
+                self._compacted -= 1
+            else:
+                self._unsummarized.append((dropped.step, self._render(dropped.entry, self.old_result_chars)))
+            self._history_tokens -= dropped.tokens
+            if self._omitted_first is None:
+                self._omitted_first = dropped.step
+            self._omitted_last = dropped.step
+            self._omitted_actions[dropped.action] += 1
+
+    def needs_summary(self, trigger_tokens: Optional[int] = None) -> bool:
+        """True once compacted steps are waiting and the history has grown past the trigger size."""
+        trigger_tokens = trigger_tokens or settings.AGENT_SUMMARY_TRIGGER_TOKENS
+        if not self._unsummarized:
+            return False
+        return self._history_tokens >= trigger_tokens or self._omitted_first is not None
+
+    def summary_batch(self) -> Tuple[List[str], int]:
+        """Snapshot of the compacted lines to fold into the summary, and the last step they cover."""
+        return [line for _, line in self._unsummarized], self._unsummarized[-1][0]
+
+    def apply_summary(self, summary: Optional[str], through_step: int):
+        """Replace steps 1..through_step in the prompt with the rolling summary."""
+        if not summary or through_step < self.summary_through:
+            return
+        self.summary = truncate_string(summary.strip(), max_length=settings.AGENT_SUMMARY_MAX_CHARS,
+                                       suffix=" ...[truncated]")
+        self.summary_through = through_step
+        self._summary_tokens = estimate_tokens(self.summary)
+
+        while self._steps and self._steps[0].step <= through_step:
+            dropped = self._steps.popleft()
+            if dropped.compact:
+                self._compacted -= 1
+            self._history_tokens -= dropped.tokens
+        while self._unsummarized and self._unsummarized[0][0] <= through_step:
+            self._unsummarized.popleft()
+        if self._omitted_last is not None and self._omitted_last <= through_step:
+            self._omitted_first = self._omitted_last = None
+            self._omitted_actions.clear()
+        elif self._omitted_first is not None:
+            self._omitted_first = through_step + 1
+
+        self._enforce_budget()
+        self._history_cache = None
+
+    def _omitted_summary(self) -> Optional[str]:
+        if self._omitted_first is None:
+            return None
+        actions = ", ".join(f"{name} x{count}" for name, count in self._omitted_actions.most_common(8))
+        return f"  - Steps {self._omitted_first}-{self._omitted_last}: earlier steps omitted to fit the prompt budget (actions used: {actions})"
+
+    def render_history(self) -> str:
+        """The history block, re-joined only after a new step is added."""
+        if self._history_cache is None:
+            lines = []
+            if self.summary:
+                lines.append(f"  - Summary of steps 1-{self.summary_through}: {self.summary}")
+            omitted = self._omitted_summary()
+            if omitted:
+                lines.append(omitted)
+            lines.extend(step.line for step in self._steps)
+            self._history_cache = "\n".join(lines) if lines else NO_HISTORY
+        return self._history_cache
+
+    def build(self, goal: str) -> str:
+        return self.template.format(goal=goal, history=self.render_history(), tools=self.tools_block)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "steps_in_prompt": len(self._steps),
+            "steps_compacted": self._compacted,
+            "steps_omitted": sum(self._omitted_actions.values()),
+            "summary_through_step": self.summary_through,
+            "history_tokens": self._history_tokens,
+            "token_budget": self.token_budget,
+        }
@@ -0,0 +1,189 @@
+"""Prompt-hash response cache for Gemini generations.
+
+Identical prompts (repeated intent extraction, planning retries, summaries of
+the same page) are answered from cache instead of spending quota. Keys hash
+the model candidates, the generation config and the normalized prompt. Lookups
+go through an in-memory ``MemoryEfficientLRUCache`` first and then a sqlite
+table that survives restarts; both tiers expire entries after a TTL.
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional
+
+from core.config import settings
+from core.logging import get_logger
+from core.memory_efficient_cache import MemoryEfficientLRUCache
+
+logger = get_logger(__name__)
+
+_TRAILING_SPACE = re.compile(r"[ \t]+\n")
+_BLANK_LINES = re.compile(r"\n{3,}")
+
+# Prune expired sqlite rows every this many writes
+_PRUNE_EVERY = 200
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Normalize whitespace that does not change a prompt's meaning."""
+    text = prompt.replace("\r\n", "\n").strip()
+    text = _TRAILING_SPACE.sub("\n", text)
+    return _BLANK_LINES.sub("\n\n", text)
+
+
+def make_cache_key(prompt: str, models: Iterable[str], config: Dict[str, Any]) -> str:
+    """Cache key for a generation: model candidates + generation config + normalized prompt."""
+    payload = json.dumps(
+        {"models": list(models), "config": config, "prompt": normalize_prompt(prompt)},
+        sort_keys=True, default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Two-tier (memory + sqlite) TTL cache of generated text."""
+
+    def __init__(self, db_path: Optional[str] = None, ttl_seconds: Optional[int] = None,
+                 max_entries: Optional[int] = None, enabled: Optional[bool] = None):
+        self.db_path = db_path or settings.GEMINI_CACHE_DB_PATH
+        self.ttl_seconds = ttl_seconds or settings.GEMINI_CACHE_TTL_SECONDS
+        self.enabled = settings.GEMINI_CACHE_ENABLED if enabled is None else enabled
+        self.memory = MemoryEfficientLRUCache(
+            max_size=max_entries or settings.GEMINI_CACHE_MAX_ENTRIES,
+            max_memory_mb=settings.GEMINI_CACHE_MAX_MEMORY_MB,
+            ttl_seconds=self.ttl_seconds
+        )
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "bypassed": 0, "disk_errors": 0}
+        if self.enabled:
+            self.init_database()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=5)
+
+    def init_database(self):
+        """Create the cache table if it doesn't exist."""
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS gemini_response_cache (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_gemini_response_cache_created ON gemini_response_cache (created_at)")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _count(self, stat: str):
+        with self._lock:
+            self._stats[stat] += 1
+
+    def record_bypass(self):
+        """Count a generation that opted out of the cache."""
+        self._count("bypassed")
+
+    def get(self, key: str) -> Optional[str]:
+        """Look up a cached response in memory, then on disk."""
+        if not self.enabled:
+            return None
+        value = self.memory.get(key)
+        if value is not None:
+            self._count("memory_hits")
+            return value
+
+        try:
+            conn = self._connect()
+            try:
+                row = conn.execute(
+                    "SELECT response FROM gemini_response_cache WHERE key = ? AND created_at > ?",
+                    (key, time.time() - self.ttl_seconds)
+                ).fetchone()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.warning(f"Response cache read failed: {e}")
+            self._count("disk_errors")
+            row = None
+
+        if row is None:
+            self._count("misses")
+            return None
+        self._count("disk_hits")
+        self.memory.put(key, row[0])
+        return row[0]
+
+    def put(self, key: str, response: str):
+        """Store a response in both tiers."""
+        if not self.enabled or not response:
+            return
+        self.memory.put(key, response)
+        try:
+            conn = self._connect()
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO gemini_response_cache (key, response, created_at) VALUES (?, ?, ?)",
+                    (key, response, time.time())
+                )
+                with self._lock:
+                    self._writes += 1
+                    prune = self._writes % _PRUNE_EVERY == 0
+                if prune:
+                    conn.execute("DELETE FROM gemini_response_cache WHERE created_at <= ?", (time.time() - self.ttl_seconds,))
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.warning(f"Response cache write failed: {e}")
+            self._count("disk_errors")
+            return
+        self._count("stores")
+
+    def clear(self):
+        self.memory.clear()
+        if not self.enabled:
+            return
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM gemini_response_cache")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        hits = stats["memory_hits"] + stats["disk_hits"]
+        stats.update({
+            "enabled": self.enabled,
+            "ttl_seconds": self.ttl_seconds,
+            "hit_rate_percent": round(hits / lookups * 100, 2) if lookups else 0,
+            "memory": self.memory.get_stats(),
+        })
+        return stats
+
+
+# Global response cache instance
+_response_cache: Optional[ResponseCache] = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """Get the global Gemini response cache."""
+    global _response_cache
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                _response_cache = ResponseCache()
+    return _response_cache
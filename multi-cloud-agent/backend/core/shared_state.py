@@ -0,0 +1,171 @@
+"""Cross-process state for rate limits, key budgets and circuit breakers.
+
+Under several uvicorn workers every process used to keep its own limiter and
+breaker state, so together they spent the Gemini quota several times over.
+Components that must agree across workers keep their state in a
+``SharedStateBackend``, a small JSON key-value store with an atomic
+read-modify-write ``update``:
+
+* ``sqlite`` -- a WAL-mode database file shared by all workers on one host.
+* ``redis`` -- any server speaking the Redis protocol (Redis, Valkey, KeyDB, a
+  local stand-in); only GET, SET and WATCH/MULTI/EXEC are used.
+* ``memory`` (default) -- no backend; each component keeps in-process state.
+
+``SHARED_STATE_BACKEND`` selects the backend.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from core.config import settings
+from core.logging import get_logger
+
+logger = get_logger(__name__)
+
+State = Dict[str, Any]
+# fn may run more than once (optimistic retries), so it must not have side effects
+Updater = Callable[[Optional[State]], State]
+
+
+class SharedStateBackend:
+    """JSON key-value store shared between worker processes."""
+
+    name = "base"
+
+    def get(self, key: str) -> Optional[State]:
+        raise NotImplementedError
+
+    def update(self, key: str, fn: Updater) -> State:
+        """Atomically replace key's value with fn(current value) and return the new value."""
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+
+class SqliteStateBackend(SharedStateBackend):
+    """Shared state in a WAL-mode sqlite file; BEGIN IMMEDIATE serializes writers across processes."""
+
+    name = "sqlite"
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or settings.SHARED_STATE_SQLITE_PATH
+        self._local = threading.local()
+        self.init_database()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def init_database(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        self._connection().execute('''
+            CREATE TABLE IF NOT EXISTS shared_state (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        ''')
+
+    def get(self, key: str) -> Optional[State]:
+        row = self._connection().execute("SELECT value FROM shared_state WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update(self, key: str, fn: Updater) -> State:
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT value FROM shared_state WHERE key = ?", (key,)).fetchone()
+            value = fn(json.loads(row[0]) if row else None)
+            conn.execute(
+                "INSERT OR REPLACE INTO shared_state (key, value, updated_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time())
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return value
+
+    def delete(self, key: str):
+        self._connection().execute("DELETE FROM shared_state WHERE key = ?", (key,))
+
+
+class RedisStateBackend(SharedStateBackend):
+    """Shared state on a Redis-protocol server, updated with WATCH/MULTI/EXEC."""
+
+    name = "redis"
+
+    def __init__(self, client: Any, prefix: str = "mca:", max_retries: int = 50):
+        self.client = client
+        self.prefix = prefix
+        self.max_retries = max_retries
+
+    def get(self, key: str) -> Optional[State]:
+        raw = self.client.get(self.prefix + key)
+        return json.loads(raw) if raw else None
+
+    def update(self, key: str, fn: Updater) -> State:
+        key = self.prefix + key
+        for _ in range(self.max_retries):
+            with self.client.pipeline() as pipe:
+                try:
+                    pipe.watch(key)
+                    raw = pipe.get(key)
+                    value = fn(json.loads(raw) if raw else None)
+                    pipe.multi()
+                    pipe.set(key, json.dumps(value))
+                    pipe.execute()
+                    return value
+                except Exception as e:
+                    # redis.exceptions.WatchError: another worker wrote the key first
+                    if type(e).__name__ == "WatchError":
+                        continue
+                    raise
+        raise RuntimeError(f"Shared state update for {key} kept conflicting after {self.max_retries} attempts")
+
+    def delete(self, key: str):
+        self.client.delete(self.prefix + key)
+
+
+def create_shared_state(kind: Optional[str] = None) -> Optional[SharedStateBackend]:
+    """Build the backend named by kind (default SHARED_STATE_BACKEND); None means in-process state."""
+    kind = (kind or settings.SHARED_STATE_BACKEND).lower()
+    if kind == "sqlite":
+        return SqliteStateBackend()
+    if kind == "redis":
+        try:
+            import redis
+        except ImportError:
+            logger.error("SHARED_STATE_BACKEND=redis but the redis package is not installed; limits stay per-process")
+            return None
+        return RedisStateBackend(redis.Redis.from_url(settings.SHARED_STATE_REDIS_URL))
+    if kind != "memory":
+        logger.warning(f"Unknown SHARED_STATE_BACKEND '{kind}'; limits stay per-process")
+    return None
+
+
+# Global shared state backend
+_shared_state: Optional[SharedStateBackend] = None
+_shared_state_loaded = False
+_shared_state_lock = threading.Lock()
+
+
+def get_shared_state() -> Optional[SharedStateBackend]:
+    """Get the configured shared state backend, or None when state is per-process."""
+    global _shared_state, _shared_state_loaded
+    if not _shared_state_loaded:
+        with _shared_state_lock:
+            if not _shared_state_loaded:
+                _shared_state = create_shared_state()
+                _shared_state_loaded = True
+    return _shared_state
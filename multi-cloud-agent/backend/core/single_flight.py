@@ -0,0 +1,148 @@
+"""Single-flight coalescing of identical in-flight calls.
+
+When several threads or coroutines ask for the same thing at once (the same
+prompt, the same embedding text), only the first caller -- the leader --
+performs the upstream call; the others wait on its outcome. Every waiter gets
+the leader's result or re-raises the leader's exception. Flights are keyed by
+a content hash and forgotten as soon as they finish, so this only merges calls
+that actually overlap; anything later goes through the response cache instead.
+
+Synchronous callers only join flights led by another thread. Joining a flight
+led by a coroutine could block the very event loop that has to finish it.
+"""
+
+import asyncio
+import concurrent.futures
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from core.logging import get_logger
+
+logger = get_logger(__name__)
+
+
+@dataclass
+class _Flight:
+    is_async: bool
+    future: concurrent.futures.Future = field(default_factory=concurrent.futures.Future)
+    waiters: int = 1
+    task: Optional[asyncio.Task] = None
+
+
+class SingleFlight:
+    """Merges concurrent calls that share a key into one upstream call."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "coalesced": 0, "errors": 0}
+
+    def _join(self, key: str, is_async: bool) -> Tuple[Optional[_Flight], bool]:
+        """Return (flight, is_leader). A sync caller gets (None, True) when it must not wait on the flight."""
+        with self._lock:
+            self._stats["calls"] += 1
+            flight = self._flights.get(key)
+            if flight is not None and (is_async or not flight.is_async):
+                flight.waiters += 1
+                self._stats["coalesced"] += 1
+                return flight, False
+            if flight is not None:
+                return None, True
+            flight = _Flight(is_async=is_async)
+            self._flights[key] = flight
+            return flight, True
+
+    def _finish(self, key: str, flight: _Flight, result: Any = None, error: Optional[BaseException] = None):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            if error is not None:
+                self._stats["errors"] += 1
+        if error is not None:
+            flight.future.set_exception(error)
+        else:
+            flight.future.set_result(result)
+
+    def do(self, key: str, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Call fn, or wait for an identical call already running in another thread."""
+        flight, leader = self._join(key, is_async=False)
+        if flight is None:
+            return fn(*args, **kwargs)
+        if not leader:
+            return flight.future.result()
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            self._finish(key, flight, error=e)
+            raise
+        self._finish(key, flight, result=result)
+        return result
+
+    async def do_async(self, key: str, fn: Callable[..., Awaitable[Any]], *args: Any, **kwargs: Any) -> Any:
+        """Await fn(), or wait for an identical call already in flight.
+
+        The upstream call runs as its own task, so a cancelled waiter does not
+        cancel it for the others; it is cancelled once every waiter has gone.
+        """
+        flight, leader = self._join(key, is_async=True)
+        if leader:
+            flight.task = asyncio.ensure_future(self._lead(key, flight, fn, *args, **kwargs))
+        try:
+            return await asyncio.shield(asyncio.wrap_future(flight.future))
+        except asyncio.CancelledError:
+            with self._lock:
+                flight.waiters -= 1
+                abandoned = flight.waiters == 0
+                # Retire the flight before cancelling it, so no new caller joins a call about to be cancelled
+                if abandoned and self._flights.get(key) is flight:
+                    del self._flights[key]
+            if abandoned and flight.task is not None:
+                flight.task.cancel()
+            raise
+
+    async def _lead(self, key: str, flight: _Flight, fn: Callable[..., Awaitable[Any]], *args: Any, **kwargs: Any):
+        try:
+            result = await fn(*args, **kwargs)
+        except asyncio.CancelledError:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            flight.future.cancel()
+            raise
+        except BaseException as e:
+            self._finish(key, flight, error=e)
+            return
+        self._finish(key, flight, result=result)
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._flights)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._flights)
+        stats["coalesced_percent"] = round(stats["coalesced"] / stats["calls"] * 100, 2) if stats["calls"] else 0
+        return stats
+
+
+# Named single-flight groups, shared across modules
+_groups: Dict[str, SingleFlight] = {}
+_groups_lock = threading.Lock()
+
+
+def get_single_flight(name: str) -> SingleFlight:
+    """Get (or create) the process-wide single-flight group for name."""
+    with _groups_lock:
+        group = _groups.get(name)
+        if group is None:
+            group = _groups[name] = SingleFlight(name)
+        return group
+
+
+def get_single_flight_stats() -> Dict[str, Dict[str, Any]]:
+    with _groups_lock:
+        groups = dict(_groups)
+    return {name: group.get_stats() for name, group in groups.items()}
@@ -0,0 +1,99 @@
+"""Helpers for consuming streamed LLM output.
+
+Agent decisions are a JSON object, often followed by closing prose or a
+markdown fence. With a streamed generation the decision is usable as soon as
+its closing brace arrives; ``JsonObjectScanner`` finds that point without
+re-scanning the text on every chunk, and ``read_json_object`` stops the
+stream there instead of waiting for the rest of the answer.
+"""
+
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from core.utils import parse_json_tolerant
+
+
+class JsonObjectScanner:
+    """Incrementally finds top-level ``{...}`` objects in text that arrives in pieces.
+
+    Braces inside JSON strings (including escaped quotes) are ignored. Text
+    outside objects is not interpreted, so quotes in surrounding prose do not
+    confuse the scan.
+    """
+
+    def __init__(self):
+        self._parts: List[str] = []
+        self._length = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._start: Optional[int] = None
+
+    @property
+    def text(self) -> str:
+        """Everything fed so far."""
+        if len(self._parts) > 1:
+            self._parts = ["".join(self._parts)]
+        return self._parts[0] if self._parts else ""
+
+    def feed(self, chunk: str) -> List[str]:
+        """Add chunk; returns the text of every top-level object that closed within it."""
+        offset = self._length
+        self._parts.append(chunk)
+        self._length += len(chunk)
+        completed: List[Tuple[int, int]] = []
+        for i, ch in enumerate(chunk):
+            if self._depth == 0:
+                if ch == "{":
+                    self._depth = 1
+                    self._start = offset + i
+                continue
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == "{":
+                self._depth += 1
+            elif ch == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    completed.append((self._start, offset + i + 1))
+                    self._start = None
+        if not completed:
+            return []
+        text = self.text
+        return [text[start:end] for start, end in completed]
+
+
+async def read_json_object(chunks: AsyncIterator[str],
+                           on_chunk: Optional[Callable[[str], Awaitable[None]]] = None
+                           ) -> Tuple[Dict[str, Any], str]:
+    """Consume a text stream until a JSON object in it parses; returns (object, text read).
+
+    on_chunk is awaited with each chunk as it arrives. Each completed object goes
+    through parse_json_tolerant, and the stream is closed as soon as one parses, so
+    trailing text is never waited for. Otherwise the whole text is parsed at the end
+    (ValueError when there is nothing to extract).
+    """
+    scanner = JsonObjectScanner()
+    try:
+        async for chunk in chunks:
+            if on_chunk is not None:
+                await on_chunk(chunk)
+            for candidate in scanner.feed(chunk):
+                try:
+                    decision = parse_json_tolerant(candidate)
+                except ValueError:
+                    # Braces in leading prose; keep reading
+                    continue
+                if isinstance(decision, dict):
+                    return decision, scanner.text
+    finally:
+        aclose = getattr(chunks, "aclose", None)
+        if aclose is not None:
+            await aclose()
+    return parse_json_tolerant(scanner.text), scanner.text
@@ -0,0 +1,237 @@
+"""Process-wide executor for blocking tool calls.
+
+Tools from ``tool_registry`` are synchronous (Selenium, HTTP clients, file and
+code analysis). They run on bounded thread pools, one per resource class, so a
+burst of browser work cannot starve network tools and no caller ever blocks the
+event loop. Submission is awaitable and timeouts free the caller immediately.
+A call's timeout starts when a worker picks it up; waiting in the queue is
+bounded separately and reported as ``ToolQueueTimeoutError``. A browser tool
+whose call times out has its session marked for recycling, and the driver is
+quit in the background, which also unblocks the stuck Selenium call.
+"""
+
+import asyncio
+import concurrent.futures
+import functools
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from core.config import settings
+from core.logging import get_logger
+
+logger = get_logger(__name__)
+
+# Resource classes
+RESOURCE_BROWSER = "browser"
+RESOURCE_NETWORK = "network"
+RESOURCE_CPU = "cpu"
+RESOURCE_CLASSES = (RESOURCE_BROWSER, RESOURCE_NETWORK, RESOURCE_CPU)
+
+# How many recycled browser IDs get_stats reports
+RECENT_RECYCLED_BROWSERS = 50
+
+
+class ToolTimeoutError(Exception):
+    """Raised when a tool call exceeds its timeout. The worker thread may still be running."""
+
+
+class ToolQueueTimeoutError(ToolTimeoutError):
+    """Raised when a tool call is still queued behind others at its timeout. It never ran and has been dropped."""
+
+
+@dataclass
+class _PoolStats:
+    queued: int = 0
+    active: int = 0
+    completed: int = 0
+    failed: int = 0
+    timed_out: int = 0
+    queue_timed_out: int = 0
+
+
+class ToolExecutor:
+    """Bounded per-resource-class thread pools with awaitable, time-limited submission."""
+
+    def __init__(self, caps: Optional[Dict[str, int]] = None):
+        caps = caps or {
+            RESOURCE_BROWSER: settings.TOOL_BROWSER_WORKERS,
+            RESOURCE_NETWORK: settings.TOOL_NETWORK_WORKERS,
+            RESOURCE_CPU: settings.TOOL_CPU_WORKERS,
+        }
+        self.caps = {resource: max(1, int(caps.get(resource, 1))) for resource in RESOURCE_CLASSES}
+        self._pools = {
+            resource: concurrent.futures.ThreadPoolExecutor(max_workers=cap, thread_name_prefix=f"tool-{resource}")
+            for resource, cap in self.caps.items()
+        }
+        self._stats = {resource: _PoolStats() for resource in RESOURCE_CLASSES}
+        self._lock = threading.Lock()
+        self.browsers_recycled = 0
+        self.recycled_browsers: Deque[str] = deque(maxlen=RECENT_RECYCLED_BROWSERS)
+
+    def _pool(self, resource: str) -> concurrent.futures.ThreadPoolExecutor:
+        return self._pools.get(resource) or self._pools[RESOURCE_NETWORK]
+
+    def submit(self, resource: str, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> concurrent.futures.Future:
+        """Queue fn on the pool for resource and return a concurrent future."""
+        return self._submit(resource, fn, args, kwargs)
+
+    def _submit(self, resource: str, fn: Callable[..., Any], args: tuple, kwargs: Dict[str, Any],
+                on_start: Optional[Callable[[], None]] = None) -> concurrent.futures.Future:
+        resource = resource if resource in self._pools else RESOURCE_NETWORK
+        stats = self._stats[resource]
+
+        def run():
+            with self._lock:
+                stats.queued -= 1
+                stats.active += 1
+            if on_start:
+                on_start()
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException:
+                with self._lock:
+                    stats.failed += 1
+                raise
+            else:
+                with self._lock:
+                    stats.completed += 1
+                return result
+            finally:
+                with self._lock:
+                    stats.active -= 1
+
+        def on_done(future: concurrent.futures.Future):
+            # A future cancelled while still queued never reaches run()
+            if future.cancelled():
+                with self._lock:
+                    stats.queued -= 1
+
+        with self._lock:
+            stats.queued += 1
+        future = self._pool(resource).submit(run)
+        future.add_done_callback(on_done)
+        return future
+
+    async def run_in_pool(self, resource: str, fn: Callable[..., Any], *args: Any,
+                          timeout: Optional[float] = None, **kwargs: Any) -> Any:
+        """Await fn on the pool for resource.
+
+        timeout bounds the call from when a worker starts it, raising ToolTimeoutError.
+        A call still queued after timeout is dropped with ToolQueueTimeoutError instead.
+        """
+        resource = resource if resource in self._pools else RESOURCE_NETWORK
+        loop = asyncio.get_running_loop()
+        started = asyncio.Event()
+        started_at: List[float] = []
+
+        def on_start():
+            started_at.append(time.monotonic())
+            try:
+                loop.call_soon_threadsafe(started.set)
+            except RuntimeError:
+                pass  # The caller's loop has closed; nobody is waiting
+
+        future = self._submit(resource, fn, args, kwargs, on_start)
+        # Cancelling the awaitable cancels a still-queued call; a running one finishes on its own
+        result = asyncio.wrap_future(future)
+        call_timeout = timeout
+        if timeout is not None:
+            start_wait = asyncio.ensure_future(started.wait())
+            try:
+                await asyncio.wait({result, start_wait}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            except asyncio.CancelledError:
+                result.cancel()
+                raise
+            finally:
+                start_wait.cancel()
+            # cancel() fails if a worker picked the call up just now
+            if not started_at and future.cancel():
+                with self._lock:
+                    self._stats[resource].queue_timed_out += 1
+                raise ToolQueueTimeoutError(f"still queued after {timeout} seconds")
+            if started_at:
+                call_timeout = max(0.0, started_at[0] + timeout - time.monotonic())
+        try:
+            return await asyncio.wait_for(result, timeout=call_timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self._stats[resource].timed_out += 1
+            raise ToolTimeoutError(f"timed out after {timeout} seconds")
+
+    async def run_tool(self, tool, params: Dict[str, Any], timeout: Optional[float] = None) -> Any:
+        """Run a registered tool on the pool for its resource class."""
+        resource = getattr(tool, "resource", RESOURCE_NETWORK)
+        if timeout is None:
+            timeout = settings.TOOL_TIMEOUT_SECONDS
+        try:
+            # Bind params first: a tool's own ``timeout`` argument must not collide with ours
+            call = functools.partial(tool.func, **params)
+            return await self.run_in_pool(resource, call, timeout=timeout)
+        except ToolQueueTimeoutError:
+            # The call never started, so its browser is not wedged
+            raise
+        except ToolTimeoutError:
+            browser_id = params.get("browser_id")
+            if resource == RESOURCE_BROWSER and browser_id:
+                self.recycle_browser(browser_id)
+            raise
+
+    def recycle_browser(self, browser_id: str):
+        """Drop a wedged browser session and quit its driver off-pool so it cannot be reused."""
+        from browsing import browsers
+
+        driver = browsers.pop(browser_id, None)
+        with self._lock:
+            self.browsers_recycled += 1
+            self.recycled_browsers.append(browser_id)
+        if driver is None:
+            return
+        logger.warning(f"Recycling browser session {browser_id} after a tool timeout")
+
+        def quit_driver():
+            try:
+                driver.quit()
+            except Exception as e:
+                logger.warning(f"Failed to quit recycled browser {browser_id}: {e}")
+
+        # A dedicated thread: the browser pool may be saturated by the stuck call itself
+        threading.Thread(target=quit_driver, name=f"recycle-{browser_id}", daemon=True).start()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            pools = {
+                resource: {
+                    "workers": self.caps[resource],
+                    "active": stats.active,
+                    "queued": stats.queued,
+                    "completed": stats.completed,
+                    "failed": stats.failed,
+                    "timed_out": stats.timed_out,
+                    "queue_timed_out": stats.queue_timed_out,
+                }
+                for resource, stats in self._stats.items()
+            }
+            recycled = {"browsers_recycled": self.browsers_recycled, "recycled_browsers": list(self.recycled_browsers)}
+        return {"pools": pools, **recycled}
+
+    def shutdown(self):
+        for pool in self._pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+# Global tool executor instance
+_tool_executor: Optional[ToolExecutor] = None
+_tool_executor_lock = threading.Lock()
+
+
+def get_tool_executor() -> ToolExecutor:
+    """Get the global tool executor."""
+    global _tool_executor
+    if _tool_executor is None:
+        with _tool_executor_lock:
+            if _tool_executor is None:
+                _tool_executor = ToolExecutor()
+    return _tool_executor
@@ -4,7 +4,7 @@ import re
 import time
 import hashlib
 from datetime import datetime, timezone
-from typing import Any, Dict, List, Optional, Union, Callable
+from typing import Any, Dict, List, Optional, Tuple, Union, Callable
 import logging
 
 # Configure logger
@@ -123,6 +123,47 @@ def parse_json_tolerant(response_text: str) -> Dict[str, Any]:
         raise ValueError(f"Invalid JSON after cleaning: {e}")
 
 
+# Agent actions that end or pause a run; they are never executed as part of a batch
+AGENT_CONTROL_ACTIONS = {"finish_task", "request_credentials", "ask_user"}
+
+def normalize_agent_actions(decision: Dict[str, Any], max_actions: int = 5) -> Tuple[List[Tuple[str, Dict[str, Any]]], bool]:
+    """
+    Extract the actions from an agent decision.
+    
+    Accepts the single-action form {"action": {...}} and the batch form
+    {"independent": true, "actions": [{...}, ...]}. Control actions inside a batch
+    are dropped so the model sends them alone once the batch results are in.
+    
+    Args:
+        decision: Parsed agent decision
+        max_actions: Maximum number of batched actions to keep
+        
+    Returns:
+        ([(name, params), ...], independent); the list is empty if no valid action was found
+    """
+    raw_actions = decision.get("actions")
+    if not isinstance(raw_actions, list) or not raw_actions:
+        raw_actions = [decision.get("action") or {}]
+    
+    actions = []
+    for raw in raw_actions:
+        if not isinstance(raw, dict):
+            continue
+        name = raw.get("name")
+        params = raw.get("params", {})
+        if not name or not isinstance(params, dict):
+            continue
+        actions.append((name, params))
+    
+    if len(actions) > 1:
+        actions = [a for a in actions if a[0] not in AGENT_CONTROL_ACTIONS] or actions[:1]
+        if len(actions) > max_actions:
+            logger.warning(f"Agent batched {len(actions)} actions; running the first {max_actions}")
+            actions = actions[:max_actions]
+    
+    independent = len(actions) > 1 and bool(decision.get("independent", False))
+    return actions, independent
+
 def _clean_json_string(json_string: str) -> str:
     """
     Clean a JSON string by removing problematic patterns.
@@ -0,0 +1,378 @@
+"""Vector indexes for agent memory.
+
+``Memory`` hands normalized float32 rows to an index and asks for the k rows
+with the highest inner product (cosine similarity) to a batch of queries.
+Every index supports incremental inserts and deletes by integer id:
+
+* ``ExactIndex`` -- one contiguous matrix scored with a single matrix
+  product. Exact, and the fastest option for small corpora.
+* ``IVFIndex`` -- an inverted file in plain numpy. Rows are clustered with
+  spherical k-means into about sqrt(n) lists, and a query only scores the
+  ``MEMORY_IVF_NPROBE`` lists whose centroids are closest to it. Recall
+  trades against latency through nprobe; ``benchmark_memory_index.py``
+  measures both against the exact answer.
+* ``AutoIndex`` -- starts exact and moves its rows into an IVF index once it
+  holds ``MEMORY_ANN_THRESHOLD`` of them (and back below half of that).
+
+Indexes keep their own lock, so searches never see a half-applied insert or
+delete.
+"""
+
+import threading
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+from core.config import settings
+from core.logging import get_logger
+
+logger = get_logger(__name__)
+
+# Rows allocated when a matrix is first used; it doubles when full
+_INITIAL_CAPACITY = 256
+# Lloyd iterations when (re)training IVF centroids
+_KMEANS_ITERATIONS = 10
+# Training rows sampled per centroid
+_TRAINING_ROWS_PER_LIST = 64
+# Rows scored at once while assigning rows to centroids
+_ASSIGN_CHUNK = 8192
+# IVF retrains once it has grown (or shrunk) by this factor since the last training
+_RETRAIN_GROWTH = 4.0
+
+
+class _RowStore:
+    """Growable contiguous matrix of rows with their ids; deletes move the last row into the gap."""
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.vectors = np.zeros((0, dim), dtype=np.float32)
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.size = 0
+
+    def append(self, ids: np.ndarray, vectors: np.ndarray, copy: bool = True) -> int:
+        """Append rows; returns the position of the first one.
+
+        With copy=False the first rows of an empty store are adopted as its matrix
+        (e.g. a copy-on-write mapping of the embedding store); the matrix is copied
+        only once it has to grow.
+        """
+        if not copy and not len(self.ids) and vectors.dtype == np.float32 and vectors.flags.c_contiguous:
+            self.vectors, self.ids, self.size = vectors, np.array(ids, dtype=np.int64), len(ids)
+            return 0
+        start, needed = self.size, self.size + len(ids)
+        if needed > len(self.ids):
+            capacity = max(_INITIAL_CAPACITY, len(self.ids))
+            while capacity < needed:
+                capacity *= 2
+            grown_vectors = np.zeros((capacity, self.dim), dtype=np.float32)
+            grown_vectors[:start] = self.vectors[:start]
+            grown_ids = np.zeros(capacity, dtype=np.int64)
+            grown_ids[:start] = self.ids[:start]
+            self.vectors, self.ids = grown_vectors, grown_ids
+        self.vectors[start:needed] = vectors
+        self.ids[start:needed] = ids
+        self.size = needed
+        return start
+
+    def remove_at(self, position: int) -> Optional[int]:
+        """Remove the row at position; returns the id of the row moved into its place, if any."""
+        last = self.size - 1
+        moved = None
+        if position != last:
+            self.vectors[position] = self.vectors[last]
+            self.ids[position] = self.ids[last]
+            moved = int(self.ids[position])
+        self.size = last
+        return moved
+
+    def scores(self, queries: np.ndarray) -> np.ndarray:
+        return queries @ self.vectors[:self.size].T
+
+
+def _top_k(scores: np.ndarray, ids: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Best k (score, id) pairs of one query's scores, best first, via a partial sort."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+    top = top[np.argsort(-scores[top], kind="stable")]
+    return scores[top], ids[top]
+
+
+class VectorIndex:
+    """Inner-product index over normalized rows, keyed by integer id."""
+
+    kind = "base"
+
+    def add(self, ids: Iterable[int], vectors: np.ndarray, copy: bool = True):
+        """Insert rows; copy=False lets an index keep vectors as they are instead of copying them."""
+        raise NotImplementedError
+
+    def remove(self, ids: Iterable[int]) -> int:
+        """Remove ids that are present; returns how many were."""
+        raise NotImplementedError
+
+    def search(self, queries: np.ndarray, k: int) -> list:
+        """For each query row, a (scores, ids) pair of up to k matches, best first."""
+        raise NotImplementedError
+
+    def export(self) -> Tuple[np.ndarray, np.ndarray]:
+        """All (ids, vectors) currently held."""
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"kind": self.kind, "size": len(self)}
+
+
+class ExactIndex(VectorIndex):
+    """Brute-force search over one contiguous matrix."""
+
+    kind = "exact"
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self._rows = _RowStore(dim)
+        self._positions: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def add(self, ids: Iterable[int], vectors: np.ndarray, copy: bool = True):
+        ids = np.asarray(list(ids), dtype=np.int64)
+        with self._lock:
+            start = self._rows.append(ids, vectors, copy)
+            self._positions.update(zip(ids.tolist(), range(start, start + len(ids))))
+
+    def remove(self, ids: Iterable[int]) -> int:
+        removed = 0
+        with self._lock:
+            for doc_id in ids:
+                position = self._positions.pop(int(doc_id), None)
+                if position is None:
+                    continue
+                moved = self._rows.remove_at(position)
+                if moved is not None:
+                    self._positions[moved] = position
+                removed += 1
+        return removed
+
+    def search(self, queries: np.ndarray, k: int) -> list:
+        with self._lock:
+            scores = self._rows.scores(queries)
+            ids = self._rows.ids[:self._rows.size].copy()
+        return [_top_k(row, ids, k) for row in scores]
+
+    def export(self) -> Tuple[np.ndarray, np.ndarray]:
+        with self._lock:
+            size = self._rows.size
+            return self._rows.ids[:size].copy(), self._rows.vectors[:size].copy()
+
+    def __len__(self) -> int:
+        return self._rows.size
+
+
+class IVFIndex(VectorIndex):
+    """Inverted-file index: k-means lists, searched nprobe at a time."""
+
+    kind = "ivf"
+
+    def __init__(self, dim: int, nprobe: Optional[int] = None, nlist: Optional[int] = None, seed: int = 0):
+        self.dim = dim
+        self.nprobe = nprobe or settings.MEMORY_IVF_NPROBE
+        # Fixed list count, or None to use about sqrt(n) at each training
+        self.fixed_nlist = nlist
+        self._rng = np.random.default_rng(seed)
+        self._centroids = np.zeros((0, dim), dtype=np.float32)
+        self._lists: list = []
+        self._locations: Dict[int, Tuple[int, int]] = {}
+        self._trained_size = 0
+        self._lock = threading.Lock()
+        self._stats = {"trainings": 0}
+
+    def _nlist_for(self, n: int) -> int:
+        if self.fixed_nlist:
+            return max(1, min(self.fixed_nlist, n))
+        return max(1, min(4096, int(np.sqrt(n))))
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        """Nearest centroid of each row, scored in chunks to bound the temporary matrix."""
+        assignment = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), _ASSIGN_CHUNK):
+            chunk = vectors[start:start + _ASSIGN_CHUNK]
+            assignment[start:start + len(chunk)] = np.argmax(chunk @ self._centroids.T, axis=1)
+        return assignment
+
+    def _train(self, vectors: np.ndarray):
+        """Spherical k-means on a sample of vectors. Caller must hold the lock."""
+        nlist = self._nlist_for(len(vectors))
+        sample_size = min(len(vectors), nlist * _TRAINING_ROWS_PER_LIST)
+        sample = vectors[self._rng.choice(len(vectors), sample_size, replace=False)]
+        self._centroids = sample[self._rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(_KMEANS_ITERATIONS):
+            assignment = self._assign(sample)
+            order = np.argsort(assignment, kind="stable")
+            grouped = assignment[order]
+            starts = np.flatnonzero(np.r_[True, grouped[1:] != grouped[:-1]])
+            sums = np.add.reduceat(sample[order], starts, axis=0)
+            # Clusters that lost all their rows keep their previous centroid
+            self._centroids[grouped[starts]] = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-8)
+        self._stats["trainings"] += 1
+
+    def _rebuild(self, ids: np.ndarray, vectors: np.ndarray):
+        """Retrain on all rows and redistribute them into fresh lists. Caller must hold the lock."""
+        self._lists = []
+        self._locations = {}
+        self._trained_size = len(ids)
+        if not len(ids):
+            self._centroids = np.zeros((0, self.dim), dtype=np.float32)
+            return
+        self._train(vectors)
+        self._lists = [_RowStore(self.dim) for _ in range(len(self._centroids))]
+        self._insert(ids, vectors)
+
+    def _insert(self, ids: np.ndarray, vectors: np.ndarray):
+        """Append rows to their nearest lists. Caller must hold the lock."""
+        assignment = self._assign(vectors)
+        order = np.argsort(assignment, kind="stable")
+        boundaries = np.flatnonzero(np.diff(assignment[order])) + 1
+        for group in np.split(order, boundaries):
+            list_no = int(assignment[group[0]])
+            start = self._lists[list_no].append(ids[group], vectors[group])
+            for offset, doc_id in enumerate(ids[group].tolist()):
+                self._locations[doc_id] = (list_no, start + offset)
+
+    def _export_locked(self) -> Tuple[np.ndarray, np.ndarray]:
+        if not self._lists:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, self.dim), dtype=np.float32)
+        return (np.concatenate([lst.ids[:lst.size] for lst in self._lists]),
+                np.concatenate([lst.vectors[:lst.size] for lst in self._lists]))
+
+    def add(self, ids: Iterable[int], vectors: np.ndarray, copy: bool = True):
+        ids = np.asarray(list(ids), dtype=np.int64)
+        if not len(ids):
+            return
+        with self._lock:
+            size = len(self._locations) + len(ids)
+            if not self._lists or size >= self._trained_size * _RETRAIN_GROWTH:
+                # Centroids trained on far fewer rows no longer split the data evenly
+                existing_ids, existing = self._export_locked()
+                self._rebuild(np.concatenate([existing_ids, ids]),
+                              np.concatenate([existing, np.asarray(vectors, dtype=np.float32)]))
+            else:
+                self._insert(ids, np.asarray(vectors, dtype=np.float32))
+
+    def remove(self, ids: Iterable[int]) -> int:
+        removed = 0
+        with self._lock:
+            for doc_id in ids:
+                location = self._locations.pop(int(doc_id), None)
+                if location is None:
+                    continue
+                list_no, position = location
+                moved = self._lists[list_no].remove_at(position)
+                if moved is not None:
+                    self._locations[moved] = (list_no, position)
+                removed += 1
+            if self._trained_size and len(self._locations) * _RETRAIN_GROWTH < self._trained_size:
+                self._rebuild(*self._export_locked())
+        return removed
+
+    def search(self, queries: np.ndarray, k: int) -> list:
+        with self._lock:
+            if not self._locations:
+                return [_top_k(np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64), k) for _ in queries]
+            nprobe = min(self.nprobe, len(self._centroids))
+            centroid_scores = queries @ self._centroids.T
+            probes = np.argpartition(-centroid_scores, nprobe - 1, axis=1)[:, :nprobe]
+            results = []
+            for query, probe in zip(queries, probes):
+                lists = [self._lists[i] for i in probe.tolist() if self._lists[i].size]
+                if not lists:
+                    results.append(_top_k(np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64), k))
+                    continue
+                scores = np.concatenate([lst.vectors[:lst.size] @ query for lst in lists])
+                ids = np.concatenate([lst.ids[:lst.size] for lst in lists])
+                results.append(_top_k(scores, ids, k))
+            return results
+
+    def export(self) -> Tuple[np.ndarray, np.ndarray]:
+        with self._lock:
+            return self._export_locked()
+
+    def __len__(self) -> int:
+        return len(self._locations)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            sizes = [lst.size for lst in self._lists]
+            return {
+                "kind": self.kind,
+                "size": len(self._locations),
+                "nlist": len(self._lists),
+                "nprobe": self.nprobe,
+                "largest_list": max(sizes) if sizes else 0,
+                **self._stats,
+            }
+
+
+class AutoIndex(VectorIndex):
+    """Exact search for small corpora; switches to IVF at threshold rows and back below half of it."""
+
+    def __init__(self, dim: int, threshold: Optional[int] = None, nprobe: Optional[int] = None):
+        self.dim = dim
+        self.threshold = threshold or settings.MEMORY_ANN_THRESHOLD
+        self.nprobe = nprobe
+        self._index: VectorIndex = ExactIndex(dim)
+        # Serializes switches against writes; searches go straight to the current index
+        self._lock = threading.Lock()
+        self._switches = 0
+
+    @property
+    def kind(self) -> str:
+        return self._index.kind
+
+    def _switch(self, index: VectorIndex):
+        """Move every row into index. Caller must hold the lock."""
+        ids, vectors = self._index.export()
+        index.add(ids, vectors)
+        logger.info(f"Memory index switched from {self._index.kind} to {index.kind} at {len(ids)} documents")
+        self._index = index
+        self._switches += 1
+
+    def add(self, ids: Iterable[int], vectors: np.ndarray, copy: bool = True):
+        with self._lock:
+            self._index.add(ids, vectors, copy)
+            if isinstance(self._index, ExactIndex) and len(self._index) >= self.threshold:
+                self._switch(IVFIndex(self.dim, nprobe=self.nprobe))
+
+    def remove(self, ids: Iterable[int]) -> int:
+        with self._lock:
+            removed = self._index.remove(ids)
+            if isinstance(self._index, IVFIndex) and len(self._index) < self.threshold // 2:
+                self._switch(ExactIndex(self.dim))
+            return removed
+
+    def search(self, queries: np.ndarray, k: int) -> list:
+        return self._index.search(queries, k)
+
+    def export(self) -> Tuple[np.ndarray, np.ndarray]:
+        return self._index.export()
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self._index.get_stats(), "mode": "auto", "threshold": self.threshold, "switches": self._switches}
+
+
+def create_vector_index(dim: int, kind: Optional[str] = None) -> VectorIndex:
+    """Build the index named by kind (default MEMORY_INDEX)."""
+    kind = (kind or settings.MEMORY_INDEX).lower()
+    if kind == "exact":
+        return ExactIndex(dim)
+    if kind == "ivf":
+        return IVFIndex(dim)
+    if kind != "auto":
+        logger.warning(f"Unknown MEMORY_INDEX '{kind}'; using auto")
+    return AutoIndex(dim)
@@ -0,0 +1,108 @@
+"""Write-behind queue: accept writes now, apply them in batches on a worker thread.
+
+Writers call ``put`` and return immediately; a daemon thread drains what has
+queued up in batches of at most ``max_batch`` items and hands each batch to
+``flush_fn``. Used for agent memory ingestion, where adding a document means
+an embedding request that request handlers should not wait on.
+
+The queue tracks how far behind it is: ``lag_ms`` is the age of the oldest
+item not yet flushed (queued or in a running batch), so a growing value means
+the flush function cannot keep up with writers. ``max_pending`` bounds the
+backlog; ``put`` returns False instead of queueing beyond it, leaving the
+writer to apply the item itself.
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Generic, List, Optional, Tuple, TypeVar
+
+from core.logging import get_logger
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+
+class WriteBehindQueue(Generic[T]):
+    """Queues items for flush_fn(items), called with batches in order on one worker thread."""
+
+    def __init__(self, flush_fn: Callable[[List[T]], Any], max_batch: int = 64,
+                 max_pending: int = 10000, name: str = "write-behind"):
+        self.flush_fn = flush_fn
+        self.max_batch = max(1, max_batch)
+        self.max_pending = max(1, max_pending)
+        self.name = name
+        self._queue: Deque[Tuple[T, float]] = deque()
+        # Enqueue time of the oldest item in the batch being flushed
+        self._in_flight_since: Optional[float] = None
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        self._worker: Optional[threading.Thread] = None
+        self._stats = {"enqueued": 0, "flushed": 0, "rejected": 0, "batches": 0,
+                       "failed_batches": 0, "failed_items": 0, "last_lag_ms": 0.0, "max_lag_ms": 0.0}
+
+    def put(self, item: T) -> bool:
+        """Queue item; False if max_pending items are already waiting."""
+        with self._cond:
+            if len(self._queue) >= self.max_pending:
+                self._stats["rejected"] += 1
+                return False
+            self._queue.append((item, time.monotonic()))
+            self._stats["enqueued"] += 1
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name=f"{self.name}-worker", daemon=True)
+                self._worker.start()
+            self._cond.notify_all()
+        return True
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """Wait until everything queued so far is flushed; False on timeout."""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._queue and not self._in_flight, timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                batch = [self._queue.popleft() for _ in range(min(self.max_batch, len(self._queue)))]
+                self._in_flight = len(batch)
+                self._in_flight_since = batch[0][1]
+            try:
+                self.flush_fn([item for item, _ in batch])
+                failed = False
+            except Exception as e:
+                failed = True
+                logger.error(f"{self.name} failed to flush {len(batch)} items: {e}", exc_info=True)
+            lag_ms = (time.monotonic() - batch[0][1]) * 1000
+            with self._cond:
+                if failed:
+                    self._stats["failed_batches"] += 1
+                    self._stats["failed_items"] += len(batch)
+                else:
+                    self._stats["batches"] += 1
+                    self._stats["flushed"] += len(batch)
+                self._stats["last_lag_ms"] = round(lag_ms, 1)
+                self._stats["max_lag_ms"] = round(max(self._stats["max_lag_ms"], lag_ms), 1)
+                self._in_flight = 0
+                self._in_flight_since = None
+                self._cond.notify_all()
+
+    def __len__(self) -> int:
+        """Items not flushed yet, including a batch being flushed."""
+        with self._cond:
+            return len(self._queue) + self._in_flight
+
+    def get_stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._cond:
+            stats = dict(self._stats)
+            oldest = self._in_flight_since if self._in_flight_since is not None else (
+                self._queue[0][1] if self._queue else None)
+            stats["depth"] = len(self._queue)
+            stats["in_flight"] = self._in_flight
+        stats["lag_ms"] = round((now - oldest) * 1000, 1) if oldest is not None else 0.0
+        stats["max_batch"] = self.max_batch
+        stats["max_pending"] = self.max_pending
+        return stats
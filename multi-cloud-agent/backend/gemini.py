@@ -1,4 +1,3 @@
-import google.generativeai as genai
 from core.config import settings
 import logging
 from fastapi import HTTPException
@@ -9,11 +8,22 @@ try:
 except ImportError:  # Older versions may not have TooManyRequests
     from google.api_core.exceptions import ResourceExhausted, ServiceUnavailable, NotFound, InvalidArgument  # type: ignore
     QUOTA_EXCEPTIONS = (ResourceExhausted,)
-from typing import List, Optional
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 from rate_limiter import rate_limiter
+from core.response_cache import get_response_cache, make_cache_key
+from core.single_flight import get_single_flight, get_single_flight_stats
+from core.gemini_clients import get_gemini_client_pool
+from core.model_registry import get_model_registry
+from core.key_scheduler import KeyScheduler
+from core.shared_state import get_shared_state
+from core.prompt_builder import estimate_tokens
+from core.llm_dispatch import current_priority, get_llm_dispatcher, llm_priority
+from core.hedging import get_hedger
+from core.adaptive_concurrency import get_concurrency_controller
+from core.circuit_breaker import CircuitBreakerOpenError
+import asyncio
 import itertools
 import time
-import random
 
 # Preferred model candidates (first is configured). Will fallback if model not found/unsupported.
 _MODEL_CANDIDATES = []
@@ -24,6 +34,9 @@ for m in ["gemini-1.5-flash", "gemini-1.5-pro", "gemini-2.0-flash", "gemini-2.0-
     if m not in _MODEL_CANDIDATES:
         _MODEL_CANDIDATES.append(m)
 
+# Cheaper candidates first, for background work such as history summarization
+_SUMMARY_MODEL_CANDIDATES = [m for m in _MODEL_CANDIDATES if "flash" in m] + [m for m in _MODEL_CANDIDATES if "flash" not in m]
+
 
 # Generation Config - Optimized for better performance
 generation_config = {
@@ -50,6 +63,7 @@ class APIKeyManager:
         self.key_failures = {}
         self.last_rotation = time.time()
         self._load_api_keys()
+        self.scheduler = KeyScheduler(self.api_keys, backend=get_shared_state())
     
     def _load_api_keys(self):
         """Load and validate API keys."""
@@ -68,12 +82,8 @@ class APIKeyManager:
             self.key_usage[key] = 0
             self.key_failures[key] = 0
     
-    def get_best_key(self) -> Optional[str]:
-        """Get the best available API key based on usage and failure history."""
-        if not self.api_keys:
-            return None
-        
-        # Filter out keys with too many recent failures
+    def _healthy_keys(self) -> List[str]:
+        """Keys without too many recent (non-quota) failures."""
         current_time = time.time()
         available_keys = []
         
@@ -93,14 +103,24 @@ class APIKeyManager:
                 self.key_failures[key] = 0
             available_keys = self.api_keys
         
-        # Sort by usage (prefer less used keys)
-        available_keys.sort(key=lambda k: self.key_usage.get(k, 0))
-        
-        # Add some randomness to prevent all requests going to the same key
-        if len(available_keys) > 1 and random.random() < 0.2:
-            available_keys = available_keys[1:] + available_keys[:1]
+        return available_keys
+    
+    def acquire_key(self, estimated_tokens: int = 0) -> Tuple[Optional[str], float]:
+        """Reserve quota for one request on the healthy key with the earliest capacity.
         
-        return available_keys[0] if available_keys else None
+        Returns (key, seconds to wait before sending), or (None, wait) when every key
+        is further than GEMINI_KEY_MAX_WAIT_SECONDS from having capacity.
+        """
+        if not self.api_keys:
+            return None, 0.0
+        return self.scheduler.acquire(self._healthy_keys(), estimated_tokens)
+    
+    def get_best_key(self) -> Optional[str]:
+        """Get the healthy API key with the earliest free quota, without reserving it."""
+        if not self.api_keys:
+            return None
+        key, _ = self.scheduler.acquire(self._healthy_keys(), reserve=False)
+        return key or self.api_keys[0]
     
     def mark_key_usage(self, key: str):
         """Mark a key as used."""
@@ -114,10 +134,94 @@ class APIKeyManager:
 # Global API key manager
 api_key_manager = APIKeyManager()
 
-def generate_text(prompt: str) -> str:
+# Rough prompt-token cost of one image input
+_IMAGE_TOKENS = 258
+
+def _estimate_request_tokens(prompt: str) -> int:
+    """Tokens to reserve for a request: the prompt plus the maximum output."""
+    return estimate_tokens(prompt) + generation_config["max_output_tokens"]
+
+def _used_tokens(response) -> Optional[int]:
+    """Actual token count of a response, when the SDK reports it."""
+    usage = getattr(response, "usage_metadata", None)
+    total = getattr(usage, "total_token_count", None)
+    return int(total) if total else None
+
+def _raise_if_out_of_quota(wait: float):
+    """Fail fast when no key will have capacity within GEMINI_KEY_MAX_WAIT_SECONDS."""
+    if wait > 0:
+        raise HTTPException(status_code=429, detail=f"All Gemini API keys are out of quota; capacity frees up in {wait:.0f}s.")
+
+def start_model_refresh():
+    """Start re-checking model availability for every configured key in the background."""
+    get_model_registry().start_refresh(api_key_manager.api_keys, _MODEL_CANDIDATES)
+
+def _quota_wait() -> float:
+    """Seconds until some healthy key has capacity; the dispatcher sheds background calls when this grows."""
+    if not api_key_manager.api_keys:
+        return 0.0
+    _, wait = api_key_manager.scheduler.acquire(api_key_manager._healthy_keys(), reserve=False)
+    return wait
+
+get_llm_dispatcher().quota_wait = _quota_wait
+
+def _allow_generation():
+    """Fail fast while the generation breaker is open (the concurrency limit could not shed enough load)."""
+    try:
+        get_concurrency_controller().allow_request()
+    except CircuitBreakerOpenError as e:
+        raise HTTPException(status_code=503, detail=f"Gemini is overloaded; not accepting generations for now ({e}).")
+
+def _is_overload(e: Exception) -> bool:
+    """429s and timeouts: signals that there are more calls in flight than the upstream takes."""
+    return isinstance(e, QUOTA_EXCEPTIONS + (asyncio.TimeoutError,)) or type(e).__name__ == "DeadlineExceeded"
+
+def _dispatched(fn, *args):
+    """Run an upstream call once the dispatcher grants a slot to the caller's priority class."""
+    _allow_generation()
+    with get_llm_dispatcher().slot():
+        return fn(*args)
+
+async def _off_loop(fn, *args):
+    """Call fn on a worker thread when it does shared-state I/O (SHARED_STATE_BACKEND set), inline otherwise."""
+    if get_shared_state() is None:
+        return fn(*args)
+    return await asyncio.to_thread(fn, *args)
+
+async def _dispatched_async(fn, *args):
+    await _off_loop(_allow_generation)
+    async with get_llm_dispatcher().slot_async():
+        return await fn(*args)
+
+# Concurrent generations of the same prompt (keyed like the response cache) share one call
+_generation_flights = get_single_flight("gemini_generation")
+
+def _flight_key(cache_key: str) -> str:
+    """Flights are per priority class, so a caller never waits behind another class's slot limits or sheds."""
+    return f"{current_priority().value}:{cache_key}"
+
+def generate_text(prompt: str, use_cache: bool = True, priority: Optional[str] = None) -> str:
     """
     Generates text using the Gemini Pro model with enhanced failover and rate limiting.
+    Identical prompts are answered from the response cache unless use_cache is False, and
+    identical prompts already in flight at the same priority share that one upstream call. Upstream calls are
+    dispatched by priority class (the caller's llm_priority unless priority is given);
+    background calls raise LLMRequestShed when capacity is needed elsewhere.
     """
+    with llm_priority(priority or current_priority()):
+        response_cache = get_response_cache()
+        cache_key = make_cache_key(prompt, _MODEL_CANDIDATES, generation_config)
+        if use_cache:
+            cached = response_cache.get(cache_key)
+            if cached is not None:
+                return cached
+            return _generation_flights.do(_flight_key(cache_key), _dispatched, _generate_text_uncached, prompt, cache_key, use_cache)
+        response_cache.record_bypass()
+        # Opting out of the cache asks for a fresh sample, so don't share another caller's either
+        return _dispatched(_generate_text_uncached, prompt, cache_key, use_cache)
+
+def _generate_text_uncached(prompt: str, cache_key: str, use_cache: bool) -> str:
+    response_cache = get_response_cache()
     if not api_key_manager.api_keys:
         raise HTTPException(status_code=500, detail="No Gemini API keys configured.")
 
@@ -127,39 +231,37 @@ def generate_text(prompt: str) -> str:
     quota_exhausted_count = 0
     attempts = 0
     max_attempts = len(api_key_manager.api_keys) * 2  # Reduced from 3 to prevent excessive retries
+    estimated_tokens = _estimate_request_tokens(prompt)
 
     while attempts < max_attempts:
         attempts += 1
         
-        # Get the best available key
-        key = api_key_manager.get_best_key()
+        # Assign the request to the key with the earliest free quota
+        key, wait = api_key_manager.acquire_key(estimated_tokens)
         if not key:
+            _raise_if_out_of_quota(wait)
             break
         
         key_prefix = key[:10] if len(key) >= 10 else key[:6]
         
         try:
-            # Apply enhanced rate limiting per API key
             key_id = f"gemini_{key_prefix}"
-            remaining = rate_limiter.get_remaining_requests(key_id, max_requests=30, window_seconds=60)  # Reduced from 50
-            
-            if remaining <= 0:
-                logging.warning(f"Rate limit reached for Gemini key ({key_prefix}...), skipping to next")
-                api_key_manager.mark_key_failure(key)
-                continue
-                
-            # Wait if needed to avoid hitting rate limits
-            rate_limiter.wait_if_needed(key_id, max_requests=30, window_seconds=60)
+            if wait > 0:
+                logging.info(f"Waiting {wait:.1f}s for quota on Gemini key ({key_prefix}...)")
+                time.sleep(wait)
             
-            logging.info(f"Attempt {attempts}: Trying Gemini generation with key ({key_prefix}...) - {remaining} requests remaining")
+            logging.info(f"Attempt {attempts}: Trying Gemini generation with key ({key_prefix}...)")
+            attempt_started = time.monotonic()
             
-            genai.configure(api_key=key)
-
+            # Known-good models first; models that recently failed for this key are skipped
+            candidates = get_model_registry().candidates_for(key, _MODEL_CANDIDATES)
+            if not candidates:
+                raise NotFound(f"No model candidate is currently available for key ({key_prefix}...)")
             last_model_exc = None
-            for model_name in _MODEL_CANDIDATES:
+            for model_name in candidates:
                 try:
-                    model = genai.GenerativeModel(
-                        model_name=model_name,
+                    model = get_gemini_client_pool().get_model(
+                        key, model_name,
                         generation_config=generation_config,
                         safety_settings=safety_settings
                     )
@@ -172,13 +274,20 @@ def generate_text(prompt: str) -> str:
                     # Mark successful usage
                     api_key_manager.mark_key_usage(key)
                     rate_limiter.handle_success(key_id)
+                    get_model_registry().record_success(key, model_name)
 
-                    logging.info(f"✅ Successfully generated text on attempt {attempts} with key ({key_prefix}...) using model {model_name} - {remaining-1} requests remaining")
+                    api_key_manager.scheduler.record_success(key, estimated_tokens, _used_tokens(response))
+                    get_concurrency_controller().record_success(time.monotonic() - attempt_started)
+
+                    logging.info(f"✅ Successfully generated text on attempt {attempts} with key ({key_prefix}...) using model {model_name}")
+                    if use_cache:
+                        response_cache.put(cache_key, response.text)
                     return response.text
                 except (NotFound, InvalidArgument) as me:
                     # Only fallback on true model issues; do not swallow key/auth errors
                     msg = str(me).lower()
                     if isinstance(me, NotFound) or "not found" in msg or "not supported" in msg or "unsupported" in msg:
+                        get_model_registry().record_unavailable(key, model_name, me)
                         last_model_exc = me
                         logging.warning(f"Model {model_name} not available/supported. Trying next candidate. Error: {me}")
                         continue
@@ -189,19 +298,17 @@ def generate_text(prompt: str) -> str:
             
         except QUOTA_EXCEPTIONS as e:
             quota_exhausted_count += 1
-            api_key_manager.mark_key_failure(key)
+            # The scheduler parks this key; the next attempt goes to the key with capacity soonest
+            api_key_manager.scheduler.record_rate_limited(key, e)
+            get_concurrency_controller().record_overload()
             rate_limiter.handle_429_error(f"gemini_{key_prefix}")
             logging.warning(f"❌ Gemini quota exceeded for key ({key_prefix}...): {e}")
             last_exception = e
-            
-            # Wait before retrying with exponential backoff
-            wait_time = min(2 ** attempts, 30)  # Cap at 30 seconds
-            logging.info(f"Waiting {wait_time}s before retry...")
-            time.sleep(wait_time)
             continue
             
         except ServiceUnavailable as e:
             api_key_manager.mark_key_failure(key)
+            get_concurrency_controller().record_error()
             logging.warning(f"❌ Gemini service unavailable for key ({key_prefix}...): {e}")
             last_exception = e
             time.sleep(5)  # Short wait for service issues
@@ -209,6 +316,10 @@ def generate_text(prompt: str) -> str:
             
         except Exception as e:
             api_key_manager.mark_key_failure(key)
+            if _is_overload(e):
+                get_concurrency_controller().record_overload()
+            else:
+                get_concurrency_controller().record_error()
             logging.warning(f"❌ Gemini error with key ({key_prefix}...): {e}")
             last_exception = e
             time.sleep(2)  # Short wait for other errors
@@ -222,6 +333,310 @@ def generate_text(prompt: str) -> str:
     
     raise HTTPException(status_code=500, detail=f"Gemini text generation failed after {attempts} attempts: {last_exception}")
 
+async def generate_text_async(prompt: str, timeout: float = 30, model_candidates: Optional[List[str]] = None,
+                              use_cache: bool = True, priority: Optional[str] = None) -> str:
+    """
+    Asyncio-native counterpart of generate_text.
+
+    Uses the SDK's async transport with pooled per-key channels, awaits backoff instead of
+    sleeping, and propagates asyncio cancellation so callers can abandon a generation.
+    model_candidates overrides the model preference order (e.g. _SUMMARY_MODEL_CANDIDATES).
+    Identical prompts are answered from the response cache unless use_cache is False, and
+    identical prompts already in flight at the same priority share that one upstream call. Priority works as in
+    generate_text.
+    """
+    with llm_priority(priority or current_priority()):
+        response_cache = get_response_cache()
+        cache_key = make_cache_key(prompt, model_candidates or _MODEL_CANDIDATES, generation_config)
+        if use_cache:
+            cached = await asyncio.to_thread(response_cache.get, cache_key)
+            if cached is not None:
+                return cached
+            return await _generation_flights.do_async(
+                _flight_key(cache_key), _dispatched_async, _generate_text_async_uncached,
+                prompt, cache_key, timeout, model_candidates, use_cache
+            )
+        response_cache.record_bypass()
+        return await _dispatched_async(_generate_text_async_uncached, prompt, cache_key, timeout, model_candidates, use_cache)
+
+def _record_attempt_success(key: str, model_name: str, started: float, estimated_tokens: int,
+                            used_tokens: Optional[int]):
+    """Book a successful upstream attempt against key, its model and the concurrency limit."""
+    key_prefix = key[:10] if len(key) >= 10 else key[:6]
+    api_key_manager.mark_key_usage(key)
+    rate_limiter.handle_success(f"gemini_{key_prefix}")
+    get_model_registry().record_success(key, model_name)
+    api_key_manager.scheduler.record_success(key, estimated_tokens, used_tokens)
+    get_concurrency_controller().record_success(time.monotonic() - started)
+
+def _record_attempt_failure(key: str, e: Exception, timeout: float):
+    """Book a failed upstream attempt: a 429 parks the key, anything else counts as a key failure."""
+    key_prefix = key[:10] if len(key) >= 10 else key[:6]
+    if isinstance(e, QUOTA_EXCEPTIONS):
+        api_key_manager.scheduler.record_rate_limited(key, e)
+        rate_limiter.handle_429_error(f"gemini_{key_prefix}")
+        get_concurrency_controller().record_overload()
+        logging.warning(f"❌ Gemini quota exceeded for key ({key_prefix}...): {e}")
+        return
+    api_key_manager.mark_key_failure(key)
+    if isinstance(e, ServiceUnavailable):
+        get_concurrency_controller().record_error()
+        logging.warning(f"❌ Gemini service unavailable for key ({key_prefix}...): {e}")
+    elif isinstance(e, asyncio.TimeoutError):
+        get_concurrency_controller().record_overload()
+        logging.warning(f"❌ Gemini request timed out after {timeout}s for key ({key_prefix}...)")
+    else:
+        if _is_overload(e):
+            get_concurrency_controller().record_overload()
+        else:
+            get_concurrency_controller().record_error()
+        logging.warning(f"❌ Gemini error with key ({key_prefix}...): {e}")
+
+def _is_model_unavailable(e: Exception) -> bool:
+    """NotFound/InvalidArgument errors that mean the model, not the key or the request, is the problem."""
+    msg = str(e).lower()
+    return isinstance(e, NotFound) or "not found" in msg or "not supported" in msg or "unsupported" in msg
+
+async def _generate_on_key_async(key: str, prompt: str, timeout: float,
+                                 model_candidates: Optional[List[str]], estimated_tokens: int) -> str:
+    """One generation attempt on key, trying its available models; records the outcome against the key."""
+    key_prefix = key[:10] if len(key) >= 10 else key[:6]
+    started = time.monotonic()
+    try:
+        # Known-good models first; models that recently failed for this key are skipped
+        candidates = get_model_registry().candidates_for(key, model_candidates or _MODEL_CANDIDATES)
+        if not candidates:
+            raise NotFound(f"No model candidate is currently available for key ({key_prefix}...)")
+        last_model_exc = None
+        for model_name in candidates:
+            try:
+                model = get_gemini_client_pool().get_model(
+                    key, model_name, use_async=True,
+                    generation_config=generation_config,
+                    safety_settings=safety_settings
+                )
+                response = await asyncio.wait_for(
+                    model.generate_content_async(prompt, request_options={"timeout": timeout}),
+                    timeout=timeout + 5
+                )
+
+                await _off_loop(_record_attempt_success, key, model_name, started, estimated_tokens, _used_tokens(response))
+                get_hedger().record_attempt(time.monotonic() - started)
+
+                logging.info(f"✅ Successfully generated text (async) with key ({key_prefix}...) using model {model_name}")
+                return response.text
+            except (NotFound, InvalidArgument) as me:
+                if _is_model_unavailable(me):
+                    get_model_registry().record_unavailable(key, model_name, me)
+                    last_model_exc = me
+                    logging.warning(f"Model {model_name} not available/supported. Trying next candidate. Error: {me}")
+                    continue
+                raise
+        raise last_model_exc
+
+    except Exception as e:
+        await _off_loop(_record_attempt_failure, key, e, timeout)
+        raise
+
+def _acquire_spare_key(primary_key: str, estimated_tokens: int) -> Optional[str]:
+    others = [k for k in api_key_manager._healthy_keys() if k != primary_key]
+    key, _ = api_key_manager.scheduler.acquire(others, estimated_tokens, max_wait=0)
+    return key
+
+async def _hedge_on_spare_key(primary_key: str, prompt: str, timeout: float,
+                              model_candidates: Optional[List[str]], estimated_tokens: int):
+    """The same generation on another healthy key that has capacity right now, or None."""
+    key = await _off_loop(_acquire_spare_key, primary_key, estimated_tokens)
+    if key is None:
+        return None
+    return _generate_on_key_async(key, prompt, timeout, model_candidates, estimated_tokens)
+
+async def _generate_text_async_uncached(prompt: str, cache_key: str, timeout: float,
+                                        model_candidates: Optional[List[str]], use_cache: bool) -> str:
+    response_cache = get_response_cache()
+    if not api_key_manager.api_keys:
+        raise HTTPException(status_code=500, detail="No Gemini API keys configured.")
+
+    logging.info(f"Starting async Gemini generation with {len(api_key_manager.api_keys)} available API keys")
+
+    last_exception = None
+    quota_exhausted_count = 0
+    attempts = 0
+    max_attempts = len(api_key_manager.api_keys) * 2
+    estimated_tokens = _estimate_request_tokens(prompt)
+
+    while attempts < max_attempts:
+        attempts += 1
+
+        key, wait = await _off_loop(api_key_manager.acquire_key, estimated_tokens)
+        if not key:
+            _raise_if_out_of_quota(wait)
+            break
+
+        key_prefix = key[:10] if len(key) >= 10 else key[:6]
+
+        try:
+            if wait > 0:
+                logging.info(f"Waiting {wait:.1f}s for quota on Gemini key ({key_prefix}...)")
+                await asyncio.sleep(wait)
+
+            logging.info(f"Attempt {attempts}: Trying async Gemini generation with key ({key_prefix}...)")
+
+            # A call still running at the hedge deadline is also sent on a spare key (when enabled)
+            text = await get_hedger().run(
+                lambda: _generate_on_key_async(key, prompt, timeout, model_candidates, estimated_tokens),
+                lambda: _hedge_on_spare_key(key, prompt, timeout, model_candidates, estimated_tokens),
+                hedge_lookup_async=True
+            )
+            if use_cache:
+                await asyncio.to_thread(response_cache.put, cache_key, text)
+            return text
+
+        except QUOTA_EXCEPTIONS as e:
+            quota_exhausted_count += 1
+            last_exception = e
+            continue
+
+        except ServiceUnavailable as e:
+            last_exception = e
+            await asyncio.sleep(5)
+            continue
+
+        except asyncio.TimeoutError as e:
+            last_exception = e
+            continue
+
+        except Exception as e:
+            last_exception = e
+            await asyncio.sleep(2)
+            continue
+
+    logging.error(f"All {attempts} async Gemini API key attempts failed. Quota exhausted: {quota_exhausted_count}, Other errors: {attempts - quota_exhausted_count}")
+
+    if quota_exhausted_count >= attempts / 2:
+        raise HTTPException(status_code=429, detail=f"Multiple Gemini API keys have exceeded quota after {attempts} attempts. Please try again later.")
+
+    raise HTTPException(status_code=500, detail=f"Gemini text generation failed after {attempts} attempts: {last_exception}")
+
+async def _open_stream_on_key(key: str, prompt: str, timeout: float,
+                             model_candidates: Optional[List[str]]) -> Tuple[str, Any]:
+    """Start a streamed generation on key, trying its available models; returns (model name, response)."""
+    key_prefix = key[:10] if len(key) >= 10 else key[:6]
+    candidates = get_model_registry().candidates_for(key, model_candidates or _MODEL_CANDIDATES)
+    if not candidates:
+        raise NotFound(f"No model candidate is currently available for key ({key_prefix}...)")
+    last_model_exc = None
+    for model_name in candidates:
+        try:
+            model = get_gemini_client_pool().get_model(
+                key, model_name, use_async=True,
+                generation_config=generation_config,
+                safety_settings=safety_settings
+            )
+            response = await asyncio.wait_for(
+                model.generate_content_async(prompt, stream=True, request_options={"timeout": timeout}),
+                timeout=timeout + 5
+            )
+            return model_name, response
+        except (NotFound, InvalidArgument) as me:
+            if _is_model_unavailable(me):
+                get_model_registry().record_unavailable(key, model_name, me)
+                last_model_exc = me
+                logging.warning(f"Model {model_name} not available/supported. Trying next candidate. Error: {me}")
+                continue
+            raise
+    raise last_model_exc
+
+def _chunk_text(chunk) -> str:
+    """Text of one streamed chunk; chunks carrying only finish metadata have none."""
+    try:
+        return chunk.text
+    except (ValueError, AttributeError):
+        return ""
+
+async def generate_text_stream_async(prompt: str, timeout: float = 30, model_candidates: Optional[List[str]] = None,
+                                     priority: Optional[str] = None) -> AsyncIterator[str]:
+    """
+    Stream a generation, yielding text chunks as Gemini produces them.
+
+    Runs in one dispatcher slot (priority works as in generate_text) with the same key
+    scheduling and bookkeeping as generate_text_async. Another key is only tried while
+    nothing has been yielded; once text has gone out an error is raised to the caller.
+    timeout bounds the wait for each chunk. Streams are not cached or coalesced. A caller
+    that has what it needs may stop early (aclose() or break out of an async for); that
+    counts as a successful call and frees the slot right away.
+    """
+    priority = priority or current_priority()
+    if not api_key_manager.api_keys:
+        raise HTTPException(status_code=500, detail="No Gemini API keys configured.")
+    await _off_loop(_allow_generation)
+
+    last_exception = None
+    quota_exhausted_count = 0
+    attempts = 0
+    max_attempts = len(api_key_manager.api_keys) * 2
+    estimated_tokens = _estimate_request_tokens(prompt)
+
+    async with get_llm_dispatcher().slot_async(priority):
+        while attempts < max_attempts:
+            attempts += 1
+
+            key, wait = await _off_loop(api_key_manager.acquire_key, estimated_tokens)
+            if not key:
+                _raise_if_out_of_quota(wait)
+                break
+
+            key_prefix = key[:10] if len(key) >= 10 else key[:6]
+            streamed = False
+            try:
+                if wait > 0:
+                    logging.info(f"Waiting {wait:.1f}s for quota on Gemini key ({key_prefix}...)")
+                    await asyncio.sleep(wait)
+
+                logging.info(f"Attempt {attempts}: Trying streamed Gemini generation with key ({key_prefix}...)")
+                started = time.monotonic()
+                model_name, response = await _open_stream_on_key(key, prompt, timeout, model_candidates)
+                chunks = response.__aiter__()
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), timeout=timeout)
+                    except StopAsyncIteration:
+                        break
+                    text = _chunk_text(chunk)
+                    if text:
+                        streamed = True
+                        try:
+                            yield text
+                        except GeneratorExit:
+                            # The caller stopped reading; the upstream call itself went fine
+                            await _off_loop(_record_attempt_success, key, model_name, started, estimated_tokens, None)
+                            raise
+
+                await _off_loop(_record_attempt_success, key, model_name, started, estimated_tokens, _used_tokens(response))
+                logging.info(f"✅ Successfully streamed text with key ({key_prefix}...) using model {model_name}")
+                return
+
+            except Exception as e:
+                await _off_loop(_record_attempt_failure, key, e, timeout)
+                if streamed:
+                    # Part of the answer is already out; a retry would send it again
+                    raise
+                last_exception = e
+                if isinstance(e, QUOTA_EXCEPTIONS):
+                    quota_exhausted_count += 1
+                elif isinstance(e, ServiceUnavailable):
+                    await asyncio.sleep(5)
+                elif not isinstance(e, asyncio.TimeoutError):
+                    await asyncio.sleep(2)
+                continue
+
+    logging.error(f"All {attempts} streamed Gemini API key attempts failed. Quota exhausted: {quota_exhausted_count}, Other errors: {attempts - quota_exhausted_count}")
+
+    if quota_exhausted_count >= attempts / 2:
+        raise HTTPException(status_code=429, detail=f"Multiple Gemini API keys have exceeded quota after {attempts} attempts. Please try again later.")
+
+    raise HTTPException(status_code=500, detail=f"Gemini streamed generation failed after {attempts} attempts: {last_exception}")
+
 def generate_text_with_image(prompt: str, image_path: str) -> str:
     """
     Generates text using the Gemini Pro Vision model with an image and enhanced failover.
@@ -237,38 +652,36 @@ def generate_text_with_image(prompt: str, image_path: str) -> str:
     quota_exhausted_count = 0
     attempts = 0
     max_attempts = len(api_key_manager.api_keys) * 2
+    estimated_tokens = _estimate_request_tokens(prompt) + _IMAGE_TOKENS
 
     while attempts < max_attempts:
         attempts += 1
         
-        key = api_key_manager.get_best_key()
+        key, wait = api_key_manager.acquire_key(estimated_tokens)
         if not key:
+            _raise_if_out_of_quota(wait)
             break
         
         key_prefix = key[:10] if len(key) >= 10 else key[:6]
         
         try:
-            # Apply enhanced rate limiting per API key
             key_id = f"gemini_vision_{key_prefix}"
-            remaining = rate_limiter.get_remaining_requests(key_id, max_requests=20, window_seconds=60)  # Lower limit for vision
-            
-            if remaining <= 0:
-                logging.warning(f"Rate limit reached for Gemini vision key ({key_prefix}...), skipping to next")
-                api_key_manager.mark_key_failure(key)
-                continue
-                
-            # Wait if needed to avoid hitting rate limits
-            rate_limiter.wait_if_needed(key_id, max_requests=20, window_seconds=60)
+            if wait > 0:
+                logging.info(f"Waiting {wait:.1f}s for quota on Gemini key ({key_prefix}...)")
+                time.sleep(wait)
             
-            logging.info(f"Attempt {attempts}: Trying Gemini vision generation with key ({key_prefix}...) - {remaining} requests remaining")
+            logging.info(f"Attempt {attempts}: Trying Gemini vision generation with key ({key_prefix}...)")
             
-            genai.configure(api_key=key)
             img = PIL.Image.open(image_path)
 
+            # Known-good models first; models that recently failed for this key are skipped
+            candidates = get_model_registry().candidates_for(key, _MODEL_CANDIDATES)
+            if not candidates:
+                raise NotFound(f"No model candidate is currently available for key ({key_prefix}...)")
             last_model_exc = None
-            for model_name in _MODEL_CANDIDATES:
+            for model_name in candidates:
                 try:
-                    vision_model = genai.GenerativeModel(model_name)
+                    vision_model = get_gemini_client_pool().get_model(key, model_name)
                     try:
                         response = vision_model.generate_content([prompt, img], timeout=30)
                     except TypeError:
@@ -277,12 +690,16 @@ def generate_text_with_image(prompt: str, image_path: str) -> str:
                     # Mark successful usage
                     api_key_manager.mark_key_usage(key)
                     rate_limiter.handle_success(key_id)
+                    get_model_registry().record_success(key, model_name)
+
+                    api_key_manager.scheduler.record_success(key, estimated_tokens, _used_tokens(response))
 
-                    logging.info(f"✅ Successfully generated vision text on attempt {attempts} with key ({key_prefix}...) using model {model_name} - {remaining-1} requests remaining")
+                    logging.info(f"✅ Successfully generated vision text on attempt {attempts} with key ({key_prefix}...) using model {model_name}")
                     return response.text
                 except (NotFound, InvalidArgument) as me:
                     msg = str(me).lower()
                     if isinstance(me, NotFound) or "not found" in msg or "not supported" in msg or "unsupported" in msg:
+                        get_model_registry().record_unavailable(key, model_name, me)
                         last_model_exc = me
                         logging.warning(f"Vision model {model_name} not available/supported. Trying next candidate. Error: {me}")
                         continue
@@ -292,15 +709,10 @@ def generate_text_with_image(prompt: str, image_path: str) -> str:
             
         except QUOTA_EXCEPTIONS as e:
             quota_exhausted_count += 1
-            api_key_manager.mark_key_failure(key)
+            api_key_manager.scheduler.record_rate_limited(key, e)
             rate_limiter.handle_429_error(f"gemini_vision_{key_prefix}")
             logging.warning(f"❌ Gemini vision quota exceeded for key ({key_prefix}...): {e}")
             last_exception = e
-            
-            # Wait before retrying with exponential backoff
-            wait_time = min(2 ** attempts, 30)
-            logging.info(f"Waiting {wait_time}s before retry...")
-            time.sleep(wait_time)
             continue
             
         except ServiceUnavailable as e:
@@ -345,12 +757,15 @@ def start_chat_session():
         key_prefix = key[:10] if len(key) >= 10 else key[:6]
         
         try:
-            genai.configure(api_key=key)
+            # Known-good models first; models that recently failed for this key are skipped
+            candidates = get_model_registry().candidates_for(key, _MODEL_CANDIDATES)
+            if not candidates:
+                raise NotFound(f"No model candidate is currently available for key ({key_prefix}...)")
             last_model_exc = None
-            for model_name in _MODEL_CANDIDATES:
+            for model_name in candidates:
                 try:
-                    model = genai.GenerativeModel(
-                        model_name=model_name,
+                    model = get_gemini_client_pool().get_model(
+                        key, model_name,
                         generation_config=generation_config,
                         safety_settings=safety_settings
                     )
@@ -362,6 +777,7 @@ def start_chat_session():
                 except (NotFound, InvalidArgument) as me:
                     msg = str(me).lower()
                     if isinstance(me, NotFound) or "not found" in msg or "not supported" in msg or "unsupported" in msg:
+                        get_model_registry().record_unavailable(key, model_name, me)
                         last_model_exc = me
                         logging.warning(f"Chat model {model_name} not available/supported. Trying next candidate. Error: {me}")
                         continue
@@ -402,7 +818,15 @@ def get_api_status() -> dict:
     status = {
         "total_keys": len(api_key_manager.api_keys),
         "available_keys": len([k for k in api_key_manager.api_keys if api_key_manager.key_failures.get(k, 0) < 3]),
-        "key_status": {}
+        "key_status": {},
+        "response_cache": get_response_cache().get_stats(),
+        "coalescing": get_single_flight_stats(),
+        "client_pool": get_gemini_client_pool().get_stats(),
+        "model_availability": get_model_registry().get_status(),
+        "key_quota": api_key_manager.scheduler.get_status(),
+        "dispatch": get_llm_dispatcher().get_stats(),
+        "hedging": get_hedger().get_stats(),
+        "adaptive_concurrency": get_concurrency_controller().get_status()
     }
     
     for key in api_key_manager.api_keys:
@@ -37,7 +37,7 @@ from core.db import Base, engine
 logger.info("Importing models...")
 try:
     # Import models from models.py
-    from models import User, CloudCredential, AuditLog, PlanHistory
+    from models import User, CloudCredential, AuditLog, PlanHistory, ChatHistory, AgentSession, AgentStep
     logger.info("Models imported successfully")
     
     # Create all tables
@@ -12,8 +12,17 @@ apply_memory_optimizations()
 
 from core.config import settings
 from core.structured_logging import structured_logger, LogContext, operation_context
-from core.circuit_breaker import circuit_breaker, CircuitBreakerConfig, CircuitBreakerManager
+from core.circuit_breaker import circuit_breaker, CircuitBreakerConfig, circuit_manager
 from core.lazy_imports import lazy_import_decorator, get_lazy_import
+from core.job_queue import get_job_queue
+from core.prompt_builder import AgentPromptBuilder
+from core.history_compactor import HistoryCompactor
+from core.tool_executor import get_tool_executor, ToolQueueTimeoutError, ToolTimeoutError
+from core.plan_cache import get_plan_cache
+from core.model_registry import get_model_registry
+from core.llm_dispatch import Priority, get_llm_dispatcher, llm_priority
+from core.streaming import read_json_object
+from core.embedding_store import EmbeddingStore
 
 from fastapi import FastAPI, Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordRequestForm
@@ -22,17 +31,17 @@ from sqlalchemy.orm import Session
 from authlib.integrations.starlette_client import OAuth
 from jose import jwt, JWTError
 from datetime import datetime, timedelta
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Set, Tuple
 from starlette.middleware.sessions import SessionMiddleware
 from starlette.responses import RedirectResponse
 from passlib.context import CryptContext
 
 import time
-from core.db import SessionLocal, Base
-from core.db import init_db
-from models import User, CloudCredential, PlanHistory, ChatHistory, AgentSession
+from core.db import SessionLocal, Base, engine
+from core.db import init_db, add_missing_columns
+from models import User, CloudCredential, PlanHistory, ChatHistory, AgentSession, AgentStep
+from repositories.agent_step import AgentStepRepository
 from security import encrypt_text as encrypt, decrypt_text as decrypt
-from openai import OpenAI
 
 from audit import log_audit
 from tools import tool_registry, browsers
@@ -66,9 +75,26 @@ from response_formatter import ResponseFormatter
 import json
 import re
 import asyncio
+import uuid
 import contextlib
+import functools
+import threading
 
 MEMORY_FILE = "./agent_memory.json"
+# Saves run on worker threads (one per job worker); serialize them so writes cannot interleave
+_memory_save_lock = threading.Lock()
+# Embeddings of the documents in MEMORY_FILE, so a restart does not re-embed them
+EMBEDDINGS_FILE = "./agent_memory.embeddings"
+embedding_store = EmbeddingStore(EMBEDDINGS_FILE, memory.memory_instance.embedding_dim)
+
+def _decode_stored_document(doc):
+    """Older saves stored each document as its JSON text, which was encoded again on every restart; unwrap it."""
+    while isinstance(doc, str):
+        try:
+            doc = json.loads(doc)
+        except json.JSONDecodeError:
+            break
+    return doc
 
 def load_agent_memory():
     if os.path.exists(MEMORY_FILE):
@@ -76,9 +102,9 @@ def load_agent_memory():
             try:
                 data = json.load(f)
                 # Assuming 'knowledge' is the key where documents are stored
-                for doc in data.get('knowledge', []):
-                    memory.memory_instance.add_document(doc)
-                print("Agent memory loaded successfully.")
+                docs = [_decode_stored_document(doc) for doc in data.get('knowledge', [])]
+                counts = memory.memory_instance.load_documents(docs, embedding_store)
+                print(f"Agent memory loaded successfully ({counts['reused']} stored embeddings reused, {counts['embedded']} computed).")
             except json.JSONDecodeError as e:
                 print(f"Error decoding agent memory JSON: {e}")
             except Exception as e:
@@ -89,9 +115,13 @@ def load_agent_memory():
 def save_agent_memory():
     # Only save agent memory if NO_MEMORY is not set to true
     if not os.getenv('NO_MEMORY', 'false').lower() == 'true':
-        with open(MEMORY_FILE, 'w') as f:
-            # Assuming documents are stored as a list of dictionaries
-            json.dump({"knowledge": memory.memory_instance.documents}, f, indent=2)
+        with _memory_save_lock:
+            # Write a temp file and swap it in so a crash mid-write never leaves a truncated file
+            tmp_path = f"{MEMORY_FILE}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({"knowledge": memory.memory_instance.document_data()}, f, indent=2)
+            os.replace(tmp_path, MEMORY_FILE)
+            memory.memory_instance.persist_embeddings(embedding_store)
         print("Agent memory saved successfully.")
     else:
         print("Agent memory saving disabled via NO_MEMORY environment variable")
@@ -109,7 +139,8 @@ from fastapi.exceptions import RequestValidationError as FastAPIRequestValidatio
 from fastapi import WebSocket, WebSocketDisconnect
 
 core = SelfLearningCore()
-circuit_breaker_manager = CircuitBreakerManager()
+# The process-wide manager, so breakers shared across workers show up in /healthz
+circuit_breaker_manager = circuit_manager
 
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -135,11 +166,27 @@ async def lifespan(app: FastAPI):
         start_memory_monitoring()
         logging.info("Memory monitoring started for 512MB limit")
         
+        # The step log table postdates init_db_script.py; create it on existing databases
+        Base.metadata.create_all(bind=engine, tables=[AgentStep.__table__])
+        add_missing_columns("agent_sessions", {"history_summary": "TEXT", "summary_through_step": "INTEGER DEFAULT 0"})
+        add_missing_columns("agent_steps", {"critique": "TEXT", "parallel_group": "INTEGER"})
+        
+        # Start background workers for queued agent runs
+        await get_job_queue().start(run_agent_job)
+        logging.info("Agent job queue started")
+        
+        gemini.start_model_refresh()
+        
         app.state.running = True
     except Exception as e:
         logging.error(f"Fatal error during database initialization: {e}", exc_info=True)
         raise
     yield
+    await get_job_queue().stop()
+    await get_model_registry().stop_refresh()
+    get_tool_executor().shutdown()
+    for task in list(_critique_tasks):
+        task.cancel()
     app.state.running = False
 
 app = FastAPI(lifespan=lifespan)
@@ -344,7 +391,11 @@ async def save_credentials(cred_data: schemas.CloudCredentialCreate, user: schem
     log_audit(db, user.id, f'update_{cred_data.provider}_credentials', 'Credentials updated')
     return cred
 
-limiter = Limiter(key_func=get_remote_address)
+# With a Redis shared state backend the per-client request limits are counted across workers too
+limiter = Limiter(
+    key_func=get_remote_address,
+    storage_uri=settings.SHARED_STATE_REDIS_URL if settings.SHARED_STATE_BACKEND.lower() == "redis" else None
+)
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
@@ -357,6 +408,23 @@ async def scrape_website(scrape_req: ScrapeRequest, user: schemas.User = Depends
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def _lookup_cached_plan(db: Session, user_id: int, prompt_text: str):
+    """Find a successful past plan for a near-identical prompt. Embedding runs off the event loop."""
+    plan_cache = get_plan_cache()
+    if not plan_cache.enabled:
+        return None
+    try:
+        if not plan_cache.is_loaded(user_id):
+            rows = db.query(PlanHistory).filter(
+                PlanHistory.user_id == user_id, PlanHistory.feedback == "success"
+            ).order_by(PlanHistory.id.desc()).limit(plan_cache.max_entries_per_user).all()
+            successful = [(row.id, row.prompt, json.loads(row.plan)) for row in rows]
+            await asyncio.to_thread(plan_cache.load, user_id, successful)
+        return await asyncio.to_thread(plan_cache.lookup, user_id, prompt_text)
+    except Exception as e:
+        logging.error(f"Plan cache lookup failed: {e}", exc_info=True)
+        return None
+
 @app.post('/prompt')
 @circuit_breaker(
     'prompt_generation',
@@ -385,9 +453,21 @@ async def prompt(request: Request, prompt_req: schemas.PromptRequest, user: sche
             {"prompt": prompt_text}
         )
     
+    if prompt_req.use_plan_cache:
+        cached = await _lookup_cached_plan(db, user.id, prompt_text)
+        if cached is not None:
+            logging.info(f"Reusing successful plan {cached.plan_id} (similarity {cached.similarity}) for prompt")
+            return {
+                "plan": cached.plan,
+                "prompt": prompt_text,
+                "cached": True,
+                "cached_plan_id": cached.plan_id,
+                "similarity": cached.similarity
+            }
+
     try:
         memory_instance = memory.get_memory_instance()
-        retrieved_docs_tuples = memory_instance.search(prompt_text, k=3)
+        retrieved_docs_tuples = await asyncio.to_thread(memory_instance.search, prompt_text, k=3)
         context_parts = []
         for _, doc in retrieved_docs_tuples:
             context_parts.append(
@@ -404,7 +484,7 @@ async def prompt(request: Request, prompt_req: schemas.PromptRequest, user: sche
         logging.error(f"Error searching memory: {e}", exc_info=True)
         context = "No past interactions found."
 
-    tool_descriptions = json.dumps(tool_registry.get_all_tools_dict(), indent=2)
+    tool_descriptions = tool_registry.get_tools_json()
     gemini_prompt = f"""
 You are a world-class autonomous AI agent IDE. Your primary goal is to create a multi-step execution plan based on a user's request, available tools, past experiences, with autonomy, security, and multilingual support.
 
@@ -465,7 +545,7 @@ YOUR PLAN:
     logging.info("Generating plan with LLM...")
     
     try:
-        response_text = generate_text(gemini_prompt)
+        response_text = await generate_text_async(gemini_prompt)
         logging.info(f"LLM raw response: {response_text}")
         
         json_match = re.search(r"```(?:json)?\s*(\{.*?\})\s*```", response_text, re.DOTALL)
@@ -490,7 +570,7 @@ YOUR PLAN:
         logging.error(f"An unexpected error occurred during plan generation: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="An unexpected error occurred during plan generation.")
 
-    return {"plan": plan, "prompt": prompt_text}
+    return {"plan": plan, "prompt": prompt_text, "cached": False}
 
 @app.post('/execute_plan')
 @circuit_breaker(
@@ -556,7 +636,7 @@ async def execute_plan(request: Request, exec_req: schemas.PlanExecutionRequest,
                 logging.info(f"Executing step {step_num}: action='{action}', params={params}")
                 if action == "cloud_operation":
                     params["user_creds"] = user_creds
-                result = tool.func(**params)
+                result = await get_tool_executor().run_tool(tool, params)
                 execution_steps.append({"step": step_num, "action": action, "status": "done", "details": result})
             except Exception as e:
                 logging.error(f"Error executing step {step_num} ('{action}'): {e}", exc_info=True)
@@ -603,6 +683,16 @@ async def feedback(feedback_req: schemas.FeedbackRequest, user: schemas.User = D
     plan_history.status = feedback_req.feedback
     db.commit()
 
+    plan_cache = get_plan_cache()
+    try:
+        if plan_history.feedback == "success":
+            # add() embeds the prompt synchronously; keep it off the event loop
+            await asyncio.to_thread(plan_cache.add, user.id, plan_history.id, plan_history.prompt, json.loads(plan_history.plan))
+        else:
+            plan_cache.remove(user.id, plan_history.id)
+    except Exception as e:
+        logging.error(f"Error updating plan cache for plan {feedback_req.plan_id}: {e}", exc_info=True)
+
     try:
         memory_instance = memory.get_memory_instance()
         interaction_data = {
@@ -612,8 +702,8 @@ async def feedback(feedback_req: schemas.FeedbackRequest, user: schemas.User = D
             "feedback": plan_history.feedback,
             "correction": plan_history.correction
         }
-        memory_instance.add_document(interaction_data)
-        logging.info(f"Added feedback and full interaction for plan {feedback_req.plan_id} to agent's memory.")
+        await memory_instance.enqueue_document_async(interaction_data)
+        logging.info(f"Queued feedback and full interaction for plan {feedback_req.plan_id} for agent's memory.")
     except Exception as e:
         logging.error(f"Error adding feedback to memory for plan {feedback_req.plan_id}: {e}", exc_info=True)
         return {"status": "success", "message": "Feedback recorded, but failed to update my long-term memory."}
@@ -625,7 +715,7 @@ def healthz():
     try:
         # Get circuit breaker statuses
         circuit_breaker_status = {
-            name: str(cb.state) for name, cb in circuit_breaker_manager.circuit_breakers.items()
+            name: status['state'] for name, status in circuit_breaker_manager.get_status().items()
         }
         
         # Get memory statistics
@@ -635,6 +725,9 @@ def healthz():
             "status": "ok",
             "timestamp": datetime.now().isoformat(),
             "circuit_breakers": circuit_breaker_status,
+            "tool_executor": get_tool_executor().get_stats(),
+            "plan_cache": get_plan_cache().get_stats(),
+            "llm_dispatch": get_llm_dispatcher().get_stats(),
             "performance_monitoring": getattr(settings, 'ENABLE_PERFORMANCE_MONITORING', False),
             "memory": memory_stats
         }
@@ -658,7 +751,9 @@ async def get_memory_statistics():
             "timestamp": datetime.now().isoformat(),
             "data": {
                 "memory": memory_stats,
-                "caches": cache_stats
+                "caches": cache_stats,
+                # Documents, vector index and the embedding ingestion queue (depth, lag_ms)
+                "agent_memory": memory.memory_instance.get_stats()
             }
         }
     except Exception as e:
@@ -766,7 +861,7 @@ async def call_tool(tool_req: schemas.ToolCallRequest, user: schemas.User = Depe
     try:
         if tool_name in ['open_browser', 'get_page_content', 'fill_form', 'fill_multiple_fields', 'click_button', 'close_browser', 'search_web',
                         'select_dropdown_option', 'upload_file', 'wait_for_element', 'check_checkbox']:
-            result = tool.func(**params)
+            result = await get_tool_executor().run_tool(tool, params)
         else:
             creds = db.query(CloudCredential).filter_by(user_id=user.id).all()
             user_creds = {}
@@ -775,7 +870,7 @@ async def call_tool(tool_req: schemas.ToolCallRequest, user: schemas.User = Depe
                     user_creds['aws'] = {'access_key': decrypt(c.access_key), 'secret_key': decrypt(c.secret_key)}
                 # Add other providers similarly
             params['credentials'] = user_creds.get(tool_name.split('_')[-1], {})
-            result = tool.func(**params)
+            result = await get_tool_executor().run_tool(tool, params)
         return {'result': result}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error executing tool: {str(e)}")
@@ -835,6 +930,11 @@ def _get_api_recommendations(gemini_status: dict, rate_limiter_status: dict) ->
         if backoff > 3.0:
             recommendations.append(f"📈 {key_prefix} has high backoff multiplier ({backoff:.1f}x). Consider reducing request frequency.")
     
+    # Check whether the configured model is being skipped
+    for key_prefix, models in gemini_status.get("model_availability", {}).get("models", {}).items():
+        if models.get(settings.GEMINI_MODEL_NAME, {}).get("state") == "unavailable":
+            recommendations.append(f"🔀 {settings.GEMINI_MODEL_NAME} is unavailable for {key_prefix}; requests are routed to fallback models.")
+    
     if not recommendations:
         recommendations.append("✅ API status is healthy. All systems operating normally.")
     
@@ -873,7 +973,7 @@ async def reset_gemini_circuit_breakers(user: schemas.User = Depends(get_current
             "error": str(e)
         }
 
-def generate_text(prompt: str) -> str:
+def generate_text(prompt: str, use_cache: bool = True) -> str:
     """
     Generate text using enhanced Gemini API with intelligent fallback mechanisms.
     """
@@ -881,7 +981,7 @@ def generate_text(prompt: str) -> str:
     
     try:
         # Try Gemini API first
-        return gemini.generate_text(prompt)
+        return gemini.generate_text(prompt, use_cache=use_cache)
     except HTTPException as e:
         error_detail = getattr(e, 'detail', str(e))
         logging.error(f"Gemini generation failed: {error_detail}")
@@ -913,64 +1013,313 @@ def generate_text(prompt: str) -> str:
             logging.error(f"Fallback response generation failed: {fallback_error}")
             return f"I'm experiencing technical difficulties but I'm here to help with: {prompt[:100]}...\n\nPlease try again in a moment for full AI-powered assistance."
 
+async def generate_text_async(prompt: str, use_cache: bool = True) -> str:
+    """
+    Async variant of generate_text for request handlers; never blocks the event loop on Gemini.
+    """
+    from fallback_responses import generate_fallback_response
+    
+    try:
+        return await gemini.generate_text_async(prompt, use_cache=use_cache)
+    except HTTPException as e:
+        error_detail = getattr(e, 'detail', str(e))
+        logging.error(f"Gemini generation failed: {error_detail}")
+        
+        if e.status_code == 429 or "quota" in error_detail.lower() or "429" in error_detail:
+            logging.warning("Gemini API quota exceeded, using intelligent fallback response")
+            try:
+                return generate_fallback_response(prompt)
+            except Exception as fallback_error:
+                logging.error(f"Fallback response generation failed: {fallback_error}")
+                return f"I understand you need help with: {prompt[:100]}...\n\nI'm currently experiencing high API usage limits, but I'm ready to assist you with this task. Please try again in a few minutes for full AI-powered responses, or let me know if you'd like to proceed with basic assistance."
+        
+        raise e
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logging.error(f"An unexpected error occurred with Gemini: {e}")
+        try:
+            logging.info("Attempting fallback response due to unexpected error")
+            return generate_fallback_response(prompt)
+        except Exception as fallback_error:
+            logging.error(f"Fallback response generation failed: {fallback_error}")
+            return f"I'm experiencing technical difficulties but I'm here to help with: {prompt[:100]}...\n\nPlease try again in a moment for full AI-powered assistance."
+
+async def stream_decision_async(prompt: str, on_chunk) -> Tuple[Dict[str, Any], str]:
+    """
+    Stream an agent decision, awaiting on_chunk with each piece of text, and return
+    (decision, text) as soon as the decision's JSON object is complete.
+    When the stream fails before any text arrived, falls back to generate_text_async.
+    """
+    from core.utils import parse_json_tolerant
+
+    received = []
+
+    async def forward(chunk: str):
+        received.append(chunk)
+        await on_chunk(chunk)
+
+    try:
+        return await read_json_object(gemini.generate_text_stream_async(prompt), forward)
+    except ValueError:
+        raise
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        if received:
+            raise
+        logging.warning(f"Streamed generation failed before any output ({e}); generating without streaming")
+        response_text = await generate_text_async(prompt, use_cache=False)
+        return parse_json_tolerant(response_text), response_text
+
+async def send_stream_chunk(user_id: int, topic: str, chunk: str, **fields):
+    """Send one piece of streamed LLM output on topic to the user's current WebSocket, if connected."""
+    websocket = active_connections.get(user_id)
+    if websocket:
+        try:
+            await websocket.send_json({"topic": topic, "payload": {"stream": chunk, **fields}})
+        except RuntimeError as e:
+            logging.warning(f"Could not stream to WebSocket for user {user_id}: {e}")
+
+async def send_agent_status(user_id: int, status: str, data: dict):
+    """Send a structured status change on the 'agent_updates' topic to the user's current WebSocket, if connected."""
+    websocket = active_connections.get(user_id)
+    if websocket:
+        try:
+            await websocket.send_json({"topic": "agent_updates", "payload": {"status": status, "data": data}})
+        except RuntimeError as e:
+            logging.warning(f"Could not send status to WebSocket for user {user_id}: {e}")
+
+async def send_agent_update(user_id: int, message: str):
+    """Send a log line on the 'agent_updates' topic to the user's current WebSocket, if connected."""
+    websocket = active_connections.get(user_id)
+    if websocket:
+        try:
+            await websocket.send_json({"topic": "agent_updates", "payload": {"log": message}})
+        except RuntimeError as e:
+            logging.warning(f"Could not send log to WebSocket for user {user_id}: {e}")
+    else:
+        logging.warning(f"No active WebSocket connection for user {user_id} to send log: {message}")
+
 @app.post('/agent/run', response_model=schemas.AgentRunResponse, tags=["Agent"])
 @limiter.limit("5/minute")
 async def agent_run(request: Request, agent_req: schemas.AgentStateRequest, user: schemas.User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Queue an agent run; progress streams over the /ws 'agent_updates' topic."""
     core.log_action('agent_run', {'user_input': agent_req.user_input})
-    user_id = user.id
-    websocket = active_connections.get(user_id)
-    
+    run_id = agent_req.run_id
+    if not run_id:
+        return schemas.AgentRunResponse(status="error", message="run_id is required to start or resume an agent run.", history=[], final_result=None)
+
+    session_obj = db.query(AgentSession).filter(AgentSession.run_id == run_id, AgentSession.user_id == user.id).first()
+    if not session_obj and not agent_req.user_input:
+        return schemas.AgentRunResponse(status="error", message="No existing session for run_id and no user_input provided to start a new session.", history=[], final_result=None)
+
+    return _enqueue_agent_run(user.id, run_id, agent_req.user_input)
+
+def _enqueue_agent_run(user_id: int, run_id: str, user_input: str | None) -> schemas.AgentRunResponse:
+    job = get_job_queue().enqueue(run_id, user_id, {"user_input": user_input})
+    return schemas.AgentRunResponse(
+        status="queued",
+        message=f"Agent run {run_id} is {job['status']} (job {job['id']}). Progress is streamed on the 'agent_updates' topic.",
+        history=[],
+        final_result=None,
+        run_id=run_id,
+        job_id=job['id']
+    )
+
+@app.get('/agent/run/{run_id}', tags=["Agent"])
+async def agent_run_status(run_id: str, user: schemas.User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Get the session and background job status of an agent run."""
+    session_obj = db.query(AgentSession).filter(AgentSession.run_id == run_id, AgentSession.user_id == user.id).first()
+    if not session_obj:
+        raise HTTPException(status_code=404, detail="Agent run not found.")
+    job = get_job_queue().get_latest_job(run_id)
+    return {
+        "run_id": run_id,
+        "goal": session_obj.goal,
+        "status": session_obj.status,
+        "current_step": session_obj.current_step,
+        "awaiting_assistance": session_obj.awaiting_assistance,
+        "assistance_request": session_obj.assistance_request,
+        "job": {
+            "id": job["id"],
+            "status": job["status"],
+            "created_at": job["created_at"],
+            "started_at": job["started_at"],
+            "finished_at": job["finished_at"],
+            "result": job["result"],
+            "error": job["error"]
+        } if job else None
+    }
+
+@app.post('/agent/run/{run_id}/cancel', tags=["Agent"])
+async def agent_run_cancel(run_id: str, user: schemas.User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Cancel the queued or running job for an agent run. The session stays resumable."""
+    session_obj = db.query(AgentSession).filter(AgentSession.run_id == run_id, AgentSession.user_id == user.id).first()
+    if not session_obj:
+        raise HTTPException(status_code=404, detail="Agent run not found.")
+    job = await asyncio.to_thread(get_job_queue().cancel, run_id)
+    if not job:
+        return {"status": "not_running", "run_id": run_id, "message": "No queued or running job for this run."}
+    session_obj.status = 'cancelled'
+    db.commit()
+    await send_agent_status(user.id, "cancelled", {"run_id": run_id, "job_id": job["id"]})
+    return {"status": "cancelled", "run_id": run_id, "job_id": job["id"]}
+
+@app.post('/agent/run/{run_id}/resume', response_model=schemas.AgentRunResponse, tags=["Agent"])
+@limiter.limit("5/minute")
+async def agent_run_resume(request: Request, run_id: str, payload: Dict[str, Any] | None = None, user: schemas.User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Re-queue a paused, cancelled or input-awaiting agent run, optionally with new user input."""
+    session_obj = db.query(AgentSession).filter(AgentSession.run_id == run_id, AgentSession.user_id == user.id).first()
+    if not session_obj:
+        raise HTTPException(status_code=404, detail="Agent run not found.")
+    if session_obj.status == 'completed':
+        return schemas.AgentRunResponse(status="error", message="Agent run already completed.", history=[], final_result=None, run_id=run_id)
+    user_input = (payload or {}).get("user_input")
+    return _enqueue_agent_run(user.id, run_id, user_input)
+
+def _browser_timeout_result(action_name: str, action_params: Dict[str, Any], timeout_duration: float,
+                            error: ToolTimeoutError) -> str:
+    """Result text for a browser tool that timed out; its session has been recycled by the executor unless it never started."""
+    browser_id = action_params.get('browser_id')
+    if isinstance(error, ToolQueueTimeoutError):
+        return (f"Error: Browser operation '{action_name}' did not start within {timeout_duration} seconds because "
+                f"the browser pool is busy. Browser session '{browser_id}' is unchanged; try again.")
+    return (f"Error: Browser operation '{action_name}' timed out after {timeout_duration} seconds. "
+            f"Browser session '{browser_id}' was closed; use open_browser to start a new one.")
+
+async def _run_independent_actions(actions: List[Tuple[str, Dict[str, Any]]], execute_action) -> List[Tuple[str, Dict[str, Any]]]:
+    """Run a batch of independent actions concurrently, serializing those that drive the same browser."""
+    browser_locks: Dict[str, asyncio.Lock] = {}
+
+    async def run_one(action_name: str, action_params: Dict[str, Any]):
+        tool = tool_registry.get_tool(action_name)
+        if tool is not None and tool.resource == "browser" and action_name != "open_browser":
+            # Selenium drivers are not thread-safe; actions without a browser_id share the inferred one
+            lock = browser_locks.setdefault(str(action_params.get("browser_id")), asyncio.Lock())
+            async with lock:
+                return await execute_action(action_name, action_params)
+        return await execute_action(action_name, action_params)
+
+    return list(await asyncio.gather(*(run_one(name, params) for name, params in actions)))
+
+# In-flight background critiques, referenced so they are not garbage collected before finishing
+_critique_tasks: Set[asyncio.Task] = set()
+
+def _should_critique(step_number: int, result: str) -> bool:
+    """Apply AGENT_CRITIQUE_MODE to decide whether a step gets a self-critique."""
+    mode = settings.AGENT_CRITIQUE_MODE
+    if mode == "async":
+        return True
+    if mode == "sampled":
+        failed = result.startswith(("Error", "GPU/WebGL Error"))
+        return failed or step_number % max(1, settings.AGENT_CRITIQUE_EVERY_N_STEPS) == 0
+    return False
+
+def _store_step_critique(run_id: str, step_number: int, critique: str):
+    db = SessionLocal()
+    try:
+        AgentStepRepository(db).set_critique(run_id, step_number, critique)
+    finally:
+        db.close()
+
+async def _critique_step(user_id: int, run_id: str, step_number: int, goal: str, result: str):
+    critique_prompt = f"Goal: {goal}\nLast Action Result: {result}\nCritique and suggest improvement."
+    try:
+        critique = await gemini.generate_text_async(critique_prompt, priority=Priority.BACKGROUND)
+        await asyncio.to_thread(_store_step_critique, run_id, step_number, critique)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logging.warning(f"Self-critique for run {run_id} step {step_number} failed: {e}")
+        return
+    await send_agent_update(user_id, f"Self-Critique (step {step_number}): {critique[:200]}...")
+
+def _schedule_step_critique(user_id: int, run_id: str, step_number: int, goal: str, result: str):
+    task = asyncio.create_task(_critique_step(user_id, run_id, step_number, goal, result))
+    _critique_tasks.add(task)
+    task.add_done_callback(_critique_tasks.discard)
+
+def _schedule_critiques(user_id: int, run_id: str, first_step: int, goal: str, results: List[str]):
+    """Start background critiques for the steps, numbered from first_step, that AGENT_CRITIQUE_MODE selects."""
+    for offset, result in enumerate(results):
+        if _should_critique(first_step + offset, result):
+            _schedule_step_critique(user_id, run_id, first_step + offset, goal, result)
+
+async def run_agent_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Job queue handler: execute one queued agent run with its own DB session."""
+    user_id = job["user_id"]
+    run_id = job["run_id"]
+    user_input = (job.get("payload") or {}).get("user_input")
+    db = SessionLocal()
+    try:
+        response = await _execute_agent_run(db, user_id, run_id, user_input, job_id=job["id"])
+        return {
+            "status": response.status,
+            "message": response.message,
+            "final_result": response.final_result,
+            "steps": len(response.history)
+        }
+    except asyncio.CancelledError:
+        # A shutdown also cancels the handler, but then the job stays running and resumes after its lease lapses
+        if await asyncio.to_thread(get_job_queue().is_cancelled, job["id"]):
+            session_obj = db.query(AgentSession).filter(AgentSession.run_id == run_id).first()
+            if session_obj:
+                session_obj.status = 'cancelled'
+                db.commit()
+            await send_agent_update(user_id, f"Agent run {run_id} cancelled.")
+        raise
+    finally:
+        db.close()
+
+async def _execute_agent_run(db: Session, user_id: int, run_id: str, user_input: str | None, job_id: str | None = None) -> schemas.AgentRunResponse:
     # Add current goal to memory only if provided (avoid adding None during resume)
-    if agent_req.user_input:
-        memory.memory_instance.add_document({"type": "user_goal", "content": agent_req.user_input, "timestamp": datetime.now().isoformat()})
-        save_agent_memory()
+    if user_input:
+        await memory.memory_instance.enqueue_document_async({"type": "user_goal", "content": user_input, "timestamp": datetime.now().isoformat()})
+        await asyncio.to_thread(save_agent_memory)
     
     # Retrieve relevant context from memory if input provided
-    if agent_req.user_input:
-        relevant_context = memory.memory_instance.search(agent_req.user_input, k=5) # Get top 5 relevant documents
+    if user_input:
+        # Top 5 relevant documents; include_pending also finds ones still being embedded
+        relevant_context = await asyncio.to_thread(memory.memory_instance.search, user_input, k=5, include_pending=True)
         context_str = "\n".join([json.dumps(doc) for _, doc in relevant_context])
         if context_str:
             print(f"Retrieved context from memory: {context_str}")
 
     async def send_log(message: str):
-        if websocket:
-            try:
-                await websocket.send_json({"topic": "agent_updates", "payload": {"log": message}})
-            except RuntimeError as e:
-                logging.warning(f"Could not send log to WebSocket for user {user_id}: {e}")
-        else:
-            logging.warning(f"No active WebSocket connection for user {user_id} to send log: {message}")
+        await send_agent_update(user_id, message)
 
+    compactor = None
     try:
-        # Ensure we have a run_id to persist and resume the session
-        run_id = agent_req.run_id
-        if not run_id:
-            return schemas.AgentRunResponse(status="error", message="run_id is required to start or resume an agent run.", history=[], final_result=None)
-
         # Load or create AgentSession
         session_obj = db.query(AgentSession).filter(AgentSession.run_id == run_id, AgentSession.user_id == user_id).first()
         if not session_obj:
-            if not agent_req.user_input:
+            if not user_input:
                 return schemas.AgentRunResponse(status="error", message="No existing session for run_id and no user_input provided to start a new session.", history=[], final_result=None)
             session_obj = AgentSession(
                 user_id=user_id,
                 run_id=run_id,
-                goal=agent_req.user_input,
+                goal=user_input,
                 status='running',
-                current_step=0,
-                history=json.dumps([])
+                current_step=0
             )
             db.add(session_obj)
             db.commit()
             db.refresh(session_obj)
 
         # Establish goal and prior history from session
-        goal = agent_req.user_input or session_obj.goal
+        goal = user_input or session_obj.goal
         max_loops = 50  # Increased to allow more attempts
-        try:
-            history = json.loads(session_obj.history) if session_obj.history else []
-        except Exception:
-            history = []
+        step_repo = AgentStepRepository(db)
+        # Resume from the step log, reading only the most recent steps not covered by the summary
+        summary_through = int(session_obj.summary_through_step or 0)
+        history = step_repo.get_history(run_id, limit=settings.AGENT_RESUME_HISTORY_STEPS, after_step=summary_through)
+        if not history and session_obj.history:
+            # Sessions recorded before the step log existed keep their history in the legacy blob
+            try:
+                history = json.loads(session_obj.history)[-settings.AGENT_RESUME_HISTORY_STEPS:]
+            except Exception:
+                history = []
 
         await send_log(f"Agent run started for goal: {goal} (run_id={run_id}, resumed_steps={session_obj.current_step})")
 
@@ -1025,56 +1374,35 @@ async def agent_run(request: Request, agent_req: schemas.AgentStateRequest, user
             }}
         }}
         
+        When several actions do not depend on each other's results (e.g. multiple searches or scraping several URLs), you may instead return them in one batch, which runs concurrently:
+        {{
+            "thought": "Your reasoning",
+            "independent": true,
+            "actions": [
+                {{"name": "tool_name", "params": {{}}}},
+                {{"name": "tool_name", "params": {{}}}}
+            ]
+        }}
+        Never batch "finish_task" or "request_credentials"; send them as a single action.
+        
         For completion, use "finish_task" with {{"final_answer": "result"}}.
         Use "request_credentials" only when authentication credentials are absolutely required to continue. Persist through errors and adapt autonomously for all other scenarios.
         """
     
-        # Continue from previous step count
-        step_offset = int(session_obj.current_step or 0)
-        for i in range(max_loops):
-            await send_log(f"--- Agent Loop {step_offset + i + 1} for goal: '{goal}' ---")
-            
-            # 1. THINK and CHOOSE NEXT ACTION
-            history_str = "\n".join([f"  - Step {h['step']}: I used '{h['action']['name']}' which resulted in: '{h['result']}'" for h in history]) if history else "  - No actions taken yet."
-            # Build the prompt for the next action
-            prompt = AGENT_LOOP_PROMPT.format(
-                goal=goal,
-                history=history_str,
-                tools=json.dumps(tool_registry.get_all_tools_dict(), indent=2)
-            )
-            # Ensure we have a safe default thought in case parsing fails
-            thought = "No thought recorded due to an error."
-            try:
-                await send_log(f"Generating next action with LLM...")
-                response_text = generate_text(prompt)
-                await send_log(f"LLM Response: {response_text[:200]}...") # Log first 200 chars
-                # Extract JSON from the response with tolerant parsing
-                from core.utils import parse_json_tolerant
-                logging.info(f"Attempting to parse agent decision from response: {response_text[:200]}...")
-                decision_data = parse_json_tolerant(response_text)
-
-                thought = decision_data.get("thought", "No thought provided.")
-                action_data = decision_data.get("action", {})
-                action_name = action_data.get("name")
-                action_params = action_data.get("params", {})
-            except (json.JSONDecodeError, AttributeError, ValueError) as e:
-                logging.error(f"Failed to parse agent decision from response: '{response_text}'. Error: {e}", exc_info=True)
-                # Mark session as failed for this attempt, but keep history
-                session_obj.status = 'failed'
-                session_obj.history = json.dumps(history)
-                db.commit()
-                return schemas.AgentRunResponse(status="error", message=f"Agent failed to parse LLM response: '{response_text}'. Last thought was: {thought}", history=history, final_result=None)
-
-            if not action_name or not isinstance(action_params, dict):
-                session_obj.status = 'failed'
-                session_obj.history = json.dumps(history)
-                db.commit()
-                return schemas.AgentRunResponse(status="error", message=f"Agent generated an invalid action. Last thought: {thought}", history=history, final_result=None)
-
-            # 2. EXECUTE THE CHOSEN ACTION
-            await send_log(f"Agent Thought: {thought}")
-            await send_log(f"Agent Action: {action_name} with params {action_params}")
+        # History is rendered incrementally and kept within the prompt token budget
+        prompt_builder = AgentPromptBuilder(AGENT_LOOP_PROMPT, tool_registry.get_tools_json())
+        prompt_builder.apply_summary(session_obj.history_summary, summary_through)
+        prompt_builder.extend(history)
+        # Older steps are folded into a rolling summary in the background on a cheaper model
+        compactor = HistoryCompactor(
+            prompt_builder, goal,
+            functools.partial(gemini.generate_text_async, model_candidates=gemini._SUMMARY_MODEL_CANDIDATES,
+                              priority=Priority.BACKGROUND)
+        )
 
+        async def execute_action(action_name: str, action_params: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+            """Run one tool call with browser_id inference, param filtering and one retry; never raises."""
+            tool_executor = get_tool_executor()
             tool = tool_registry.get_tool(action_name)
             if not tool:
                 result = f"Error: Tool '{action_name}' not found."
@@ -1112,26 +1440,17 @@ async def agent_run(request: Request, agent_req: schemas.AgentStateRequest, user
                             await send_log(f"Removed invalid parameters for {action_name}: {removed_params}")
                             action_params = valid_params
                     
-                    # Add timeout for browser operations to prevent hanging
-                    import asyncio
-                    import concurrent.futures
-                    
+                    # Blocking tools run on the shared executor's bounded pools, off the event loop
                     if action_name in browser_required_tools:
                         # Execute browser operations with extended timeout for form operations
                         timeout_duration = 60 if action_name in ['fill_multiple_fields', 'fill_form'] else 30
-                        with concurrent.futures.ThreadPoolExecutor() as executor:
-                            future = executor.submit(tool.func, **action_params)
-                            try:
-                                result = future.result(timeout=timeout_duration)
-                            except concurrent.futures.TimeoutError:
-                                await send_log(f"Browser operation '{action_name}' timed out after {timeout_duration} seconds")
-                                # Try to continue with a partial success message instead of complete failure
-                                if action_name in ['fill_multiple_fields', 'fill_form']:
-                                    result = f"Form filling operation timed out but may have partially completed. Continuing to next step."
-                                else:
-                                    result = f"Error: Browser operation '{action_name}' timed out. This may be due to GPU/WebGL issues."
+                        try:
+                            result = await tool_executor.run_tool(tool, action_params, timeout=timeout_duration)
+                        except ToolTimeoutError as e:
+                            await send_log(f"Browser operation '{action_name}' {e}")
+                            result = _browser_timeout_result(action_name, action_params, timeout_duration, e)
                     else:
-                        result = tool.func(**action_params)
+                        result = await tool_executor.run_tool(tool, action_params)
                     
                     await send_log(f"Action Result: {str(result)[:200]}...") # Log first 200 chars
                 except Exception as e:
@@ -1158,17 +1477,12 @@ async def agent_run(request: Request, agent_req: schemas.AgentStateRequest, user
                                     # Retry with timeout for browser operations
                                     if action_name in browser_required_tools:
                                         timeout_duration = 60 if action_name in ['fill_multiple_fields', 'fill_form'] else 30
-                                        with concurrent.futures.ThreadPoolExecutor() as executor:
-                                            future = executor.submit(tool.func, **action_params)
-                                            try:
-                                                result = future.result(timeout=timeout_duration)
-                                            except concurrent.futures.TimeoutError:
-                                                if action_name in ['fill_multiple_fields', 'fill_form']:
-                                                    result = f"Form filling retry timed out but may have partially completed. Continuing to next step."
-                                                else:
-                                                    result = f"Error: Retry of '{action_name}' timed out after {timeout_duration} seconds"
+                                        try:
+                                            result = await tool_executor.run_tool(tool, action_params, timeout=timeout_duration)
+                                        except ToolTimeoutError as e:
+                                            result = _browser_timeout_result(action_name, action_params, timeout_duration, e)
                                     else:
-                                        result = tool.func(**action_params)
+                                        result = await tool_executor.run_tool(tool, action_params)
                                     
                                     await send_log(f"Action Result (after retry): {str(result)[:200]}...")
                                 else:
@@ -1181,25 +1495,108 @@ async def agent_run(request: Request, agent_req: schemas.AgentStateRequest, user
                             core.log_error(str(e), {'goal': goal, 'action': action_name, 'params': action_params})
                             result = f"Error executing tool '{action_name}': {e}"
                             await send_log(result)
+            return str(result), action_params
+
+        # Continue from previous step count
+        step_number = int(session_obj.current_step or 0)
+        for i in range(max_loops):
+            # The job may have been cancelled from another process sharing the job queue
+            if job_id and await asyncio.to_thread(get_job_queue().is_cancelled, job_id):
+                raise asyncio.CancelledError()
+            await send_log(f"--- Agent Loop {i + 1} (step {step_number + 1}) for goal: '{goal}' ---")
+            
+            # 1. THINK and CHOOSE NEXT ACTION
+            compacted = compactor.collect()
+            if compacted:
+                session_obj.history_summary, session_obj.summary_through_step = compacted
+                db.commit()
+                await send_log(f"Compacted agent history through step {compacted[1]}")
+            prompt = prompt_builder.build(goal)
+            # Ensure we have a safe default thought in case parsing fails
+            thought = "No thought recorded due to an error."
+            step_started_at = datetime.utcnow()
+            llm_started = time.perf_counter()
+            streamed_parts = []
+
+            async def forward_chunk(chunk: str):
+                streamed_parts.append(chunk)
+                await send_stream_chunk(user_id, "agent_updates", chunk, run_id=run_id, step=step_number + 1)
+
+            try:
+                await send_log(f"Generating next action with LLM...")
+                # Agent decisions are never cached (a retry must be able to sample a new answer). The
+                # decision is streamed to the client and parsed as soon as its JSON object closes.
+                with llm_priority(Priority.AGENT):
+                    decision_data, response_text = await stream_decision_async(prompt, forward_chunk)
+                llm_duration_ms = (time.perf_counter() - llm_started) * 1000
+                await send_log(f"LLM Response: {response_text[:200]}...") # Log first 200 chars
+                from core.utils import normalize_agent_actions
+
+                thought = decision_data.get("thought", "No thought provided.")
+                # A single "action", or an "actions" batch the model declared independent
+                actions, independent = normalize_agent_actions(decision_data, settings.AGENT_MAX_PARALLEL_ACTIONS)
+            except (json.JSONDecodeError, AttributeError, ValueError) as e:
+                response_text = "".join(streamed_parts)
+                logging.error(f"Failed to parse agent decision from response: '{response_text}'. Error: {e}", exc_info=True)
+                # Mark session as failed for this attempt, but keep history
+                session_obj.status = 'failed'
+                db.commit()
+                return schemas.AgentRunResponse(status="error", message=f"Agent failed to parse LLM response: '{response_text}'. Last thought was: {thought}", history=history, final_result=None)
+
+            if not actions:
+                session_obj.status = 'failed'
+                db.commit()
+                return schemas.AgentRunResponse(status="error", message=f"Agent generated an invalid action. Last thought: {thought}", history=history, final_result=None)
+
+            # 2. EXECUTE THE CHOSEN ACTION(S)
+            await send_log(f"Agent Thought: {thought}")
+            for action_name, action_params in actions:
+                await send_log(f"Agent Action: {action_name} with params {action_params}")
+
+            tool_started = time.perf_counter()
+            if len(actions) == 1:
+                results = [await execute_action(*actions[0])]
+            elif independent:
+                await send_log(f"Running {len(actions)} independent actions concurrently")
+                results = await _run_independent_actions(actions, execute_action)
+            else:
+                results = [await execute_action(name, params) for name, params in actions]
+            
+            tool_duration_ms = (time.perf_counter() - tool_started) * 1000
             
             # 3. RECORD AND OBSERVE
-            step_number = step_offset + i + 1
-            history.append({
-                "step": step_number,
-                "thought": thought,
-                "action": action_data,
-                "result": str(result) # Ensure result is a string
-            })
-            # Persist session progress after each step
+            # Each action is its own step; actions from one batch are siblings sharing parallel_group
+            first_step = step_number + 1
+            for (action_name, _), (result, action_params) in zip(actions, results):
+                step_number += 1
+                history.append({
+                    "step": step_number,
+                    "thought": thought,
+                    "action": {"name": action_name, "params": action_params},
+                    "result": result
+                })
+                prompt_builder.add_step(history[-1])
+                # Persist session progress after each step: one appended row, never a history rewrite
+                step_repo.append(
+                    run_id,
+                    step_number,
+                    commit=False,
+                    thought=thought,
+                    action=action_name,
+                    params=json.dumps(action_params, default=str),
+                    result=result,
+                    started_at=step_started_at,
+                    llm_duration_ms=llm_duration_ms,
+                    tool_duration_ms=tool_duration_ms,
+                    parallel_group=first_step if len(actions) > 1 else None
+                )
             session_obj.current_step = step_number
-            session_obj.history = json.dumps(history)
             session_obj.status = 'running'
             db.commit()
+            compactor.maybe_start()
 
-            # Self-Critique
-            critique_prompt = f"Goal: {goal}\nLast Action Result: {result}\nCritique and suggest improvement."
-            critique = generate_text(critique_prompt)
-            await send_log(f"Self-Critique: {critique[:200]}...") # Log first 200 chars
+            # Self-Critique runs off the critical path and is attached to the step record when done
+            _schedule_critiques(user_id, run_id, first_step, goal, [result for result, _ in results])
 
             # 4. CHECK FOR COMPLETION OR USER INPUT NEEDED
             if action_name == "request_credentials" or action_name == "ask_user":
@@ -1209,22 +1606,15 @@ async def agent_run(request: Request, agent_req: schemas.AgentStateRequest, user
                         "Please provide the required credentials or information to continue."))
                 
                 await send_log(f"Agent requires user input: {assistance_message}")
-                await send_log(json.dumps({
-                    "topic": "agent_updates", 
-                    "payload": {
-                        "status": "requires_input", 
-                        "data": {
-                            "message": assistance_message,
-                            "request_type": action_name,
-                            "run_id": session_obj.run_id
-                        }
-                    }
-                }))
+                await send_agent_status(user_id, "requires_input", {
+                    "message": assistance_message,
+                    "request_type": action_name,
+                    "run_id": session_obj.run_id
+                })
                 
                 session_obj.status = 'requires_input'
                 session_obj.awaiting_assistance = True
                 session_obj.assistance_request = assistance_message
-                session_obj.history = json.dumps(history)
                 db.commit()
                 
                 # Format structured response
@@ -1264,20 +1654,13 @@ async def agent_run(request: Request, agent_req: schemas.AgentStateRequest, user
                     history=history
                 )
                 
-                await send_log(json.dumps({
-                    "topic": "agent_updates", 
-                    "payload": {
-                        "status": "complete", 
-                        "data": {
-                            "final_result": result,
-                            "formatted_response": formatted_response,
-                            "notification": completion_notification
-                        }
-                    }
-                }))
+                await send_agent_status(user_id, "complete", {
+                    "final_result": result,
+                    "formatted_response": formatted_response,
+                    "notification": completion_notification
+                })
                 
                 session_obj.status = 'completed'
-                session_obj.history = json.dumps(history)
                 db.commit()
                 
                 return schemas.AgentRunResponse(
@@ -1303,21 +1686,14 @@ async def agent_run(request: Request, agent_req: schemas.AgentStateRequest, user
         
         # Keep session resumable
         session_obj.status = 'paused'
-        session_obj.history = json.dumps(history)
         db.commit()
         
-        await send_log(json.dumps({
-            "topic": "agent_updates", 
-            "payload": {
-                "status": "paused", 
-                "data": {
-                    "message": "Agent reached maximum loops without finishing the goal. Call /agent/run again with the same run_id to resume.",
-                    "formatted_response": formatted_response,
-                    "resumable": True,
-                    "run_id": session_obj.run_id
-                }
-            }
-        }))
+        await send_agent_status(user_id, "paused", {
+            "message": "Agent reached maximum loops without finishing the goal. Call /agent/run again with the same run_id to resume.",
+            "formatted_response": formatted_response,
+            "resumable": True,
+            "run_id": session_obj.run_id
+        })
         
         return schemas.AgentRunResponse(
             status="paused", 
@@ -1328,18 +1704,20 @@ async def agent_run(request: Request, agent_req: schemas.AgentStateRequest, user
     except Exception as e:
         error_message = f"An unexpected error occurred during agent run: {e}"
         logging.error(error_message, exc_info=True)
-        core.log_error(str(e), {'goal': agent_req.user_input})
+        core.log_error(str(e), {'goal': user_input})
         # Try to update session status if possible
         try:
             if 'session_obj' in locals() and session_obj:
                 session_obj.status = 'failed'
-                session_obj.history = json.dumps(history if 'history' in locals() else [])
                 db.commit()
         except Exception:
             pass
         await send_log(error_message)
-        await send_log(json.dumps({"topic": "agent_updates", "payload": {"status": "error", "data": {"message": error_message}}}))
+        await send_agent_status(user_id, "error", {"message": error_message})
         raise
+    finally:
+        if compactor:
+            await compactor.close()
 
 @app.get('/')
 def root():
@@ -1450,7 +1828,7 @@ async def websocket_chat_endpoint(websocket: WebSocket, user: schemas.User = Dep
             db.commit()
             # Add message to memory if available
             try:
-                memory.memory_instance.add_document({"type": "chat", "sender": "user", "message": message, "agent_run_id": agent_run_id, "timestamp": datetime.now().isoformat()})
+                await memory.memory_instance.enqueue_document_async({"type": "chat", "sender": "user", "message": message, "agent_run_id": agent_run_id, "timestamp": datetime.now().isoformat()})
             except Exception:
                 pass
             # Echo back to client and notify agent listeners
@@ -1506,23 +1884,20 @@ Text Content Summary:
         
 Please answer the user's question about this content."""
         
-        # Use OpenAI to generate response
-        client = OpenAI(api_key=settings.OPENAI_API_KEY)
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_message}
-            ],
-            max_tokens=1000,
-            temperature=0.7
-        )
+        # Stream the answer to the user's WebSocket as it is generated
+        stream_id = f"task-chat-{task_id}-{uuid.uuid4().hex[:8]}"
+        parts = []
+        async for chunk in gemini.generate_text_stream_async(f"{system_prompt}\n\nUser question: {user_message}"):
+            parts.append(chunk)
+            await send_stream_chunk(user.id, "chat", chunk, sender="assistant", stream_id=stream_id, task_id=task_id)
+        await send_stream_chunk(user.id, "chat", "", sender="assistant", stream_id=stream_id, task_id=task_id, done=True)
         
-        ai_response = response.choices[0].message.content
+        ai_response = "".join(parts)
         
         return {
             "success": True,
             "response": ai_response,
+            "stream_id": stream_id,
             "context": {
                 "url": context_data['url'],
                 "title": context_data['title'],
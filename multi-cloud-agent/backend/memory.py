@@ -1,9 +1,13 @@
+import asyncio
 import os
 import numpy as np
-from typing import List, Tuple, Dict, Any, Optional
-# from annoy import AnnoyIndex
-import google.generativeai as genai
+from typing import List, Tuple, Dict, Any, Optional, Union
+import hashlib
+import heapq
+import itertools
 import json
+import re
+import threading
 import time
 from datetime import datetime
 from core.config import settings
@@ -11,28 +15,80 @@ import logging
 from core.circuit_breaker import get_circuit_breaker, CircuitBreakerConfig, CircuitBreakerOpenError
 from core.local_embeddings import local_embedding_fallback, LocalEmbeddingError
 from core.structured_logging import structured_logger, LogContext, operation_context
+from core.single_flight import get_single_flight
+from core.gemini_clients import get_gemini_client_pool
+from core.vector_index import VectorIndex, create_vector_index
+from core.embedding_store import EmbeddingStore
+from core.micro_batcher import MicroBatcher
+from core.write_behind import WriteBehindQueue
 
-# No global configuration - embeddings will be generated with key rotation
-# Key configuration is handled per request in _generate_external_embedding method
+# No global configuration - embeddings are generated with key rotation on
+# per-key clients from the shared Gemini client pool
+
+# Concurrent embeddings of the same text share one call
+_embedding_flights = get_single_flight("gemini_embedding")
+
+# Gemini rejects texts over ~36KB; longer ones are truncated to this many characters
+_MAX_EMBED_CHARS = 30000
+# Most texts the Gemini embedding API takes in one batch request
+_EMBED_REQUEST_LIMIT = 100
+# Words compared by the lexical match over documents still waiting to be embedded
+_WORD = re.compile(r"\w+")
 
 class Memory:
-    def __init__(self, embedding_dim: int = 768):
+    def __init__(self, embedding_dim: int = 768, index: Optional[VectorIndex] = None):
         """
         Initializes the Memory class.
         Args:
             embedding_dim: The dimension of the embeddings. Google's model uses 768.
+            index: Vector index for the embeddings; defaults to the one named by MEMORY_INDEX.
+
+        Embeddings are normalized on insert, so the index ranks by inner product.
         """
         self.embedding_dim = embedding_dim
-        # self.index = AnnoyIndex(embedding_dim, 'angular')
-        self.documents: List[str] = []
-        self.embeddings: List[np.ndarray] = []  # Store embeddings for cosine similarity
+        self.index = index or create_vector_index(embedding_dim)
+        # Documents by id, in insertion order: (JSON text, parsed copy returned by search)
+        self._docs: Dict[int, Tuple[str, Any]] = {}
+        self._next_id = itertools.count()
+        # Rows not yet written to an EmbeddingStore, by document id
+        self._unpersisted: Dict[int, np.ndarray] = {}
+        # Groups concurrent single adds into batched embedding requests
+        self._embed_batcher = MicroBatcher(
+            lambda texts: self._get_embeddings(texts),
+            max_size=settings.MEMORY_EMBED_BATCH_MAX_SIZE,
+            max_latency=settings.MEMORY_EMBED_BATCH_MAX_LATENCY_MS / 1000.0,
+            max_concurrency=settings.MEMORY_EMBED_BATCH_CONCURRENCY,
+            name="memory-embed",
+        )
+        # Documents from enqueue_document that are not embedded yet, by id: (JSON text, parsed copy)
+        self._pending: Dict[int, Tuple[str, Any]] = {}
+        self._ingest_queue = WriteBehindQueue(
+            self._ingest,
+            max_batch=settings.MEMORY_INGEST_BATCH_SIZE,
+            max_pending=settings.MEMORY_INGEST_MAX_PENDING,
+            name="memory-ingest",
+        )
+        self._lock = threading.Lock()
         self.item_counter = 0
+        # Embeddings that came back with another dimension (e.g. the local fallback model)
+        self.dimension_mismatches = 0
         # The model for embedding
         self.embedding_model = 'models/embedding-001'
         # Circuit breaker state
         self._embed_failures = 0
         self._embed_open_until = 0.0
 
+    @property
+    def documents(self) -> List[str]:
+        """JSON text of every document, oldest first; queued ones come last."""
+        with self._lock:
+            return [text for text, _ in itertools.chain(self._docs.values(), self._pending.values())]
+
+    def document_data(self) -> List[Any]:
+        """Every document as it was added, oldest first, including those not embedded yet."""
+        with self._lock:
+            return [json.loads(text) for text, _ in itertools.chain(self._docs.values(), self._pending.values())]
+
     def _get_embedding(self, text: str) -> np.ndarray:
         """
         Generates an embedding for the given text using Google's service.
@@ -42,21 +98,13 @@ class Memory:
             return np.zeros(self.embedding_dim, dtype=np.float32)
         
         # Truncate text if it exceeds Gemini's 36KB limit (approximately 30,000 characters)
-        max_chars = 30000
+        max_chars = _MAX_EMBED_CHARS
         if len(text) > max_chars:
             text = text[:max_chars]
             logging.warning(f"Text truncated from {len(text)} to {max_chars} characters for embedding generation")
         
         # Get circuit breaker for embeddings
-        circuit_breaker = get_circuit_breaker(
-            'embedding_generation',
-            CircuitBreakerConfig(
-                failure_threshold=getattr(settings, 'CIRCUIT_BREAKER_FAILURE_THRESHOLD', 5),
-                recovery_timeout=float(getattr(settings, 'CIRCUIT_BREAKER_RECOVERY_TIMEOUT', 60.0)),
-                expected_exception=Exception,
-                name='embedding_generation'
-            )
-        )
+        circuit_breaker = self._embedding_breaker()
         
         context = LogContext(metadata={'text_length': len(text)})
         
@@ -76,8 +124,66 @@ class Memory:
             structured_logger.log_retry_attempt('embedding_generation', 0, str(e), context)
             return self._generate_fallback_embedding(text, context)
 
+    def _embedding_breaker(self):
+        return get_circuit_breaker(
+            'embedding_generation',
+            CircuitBreakerConfig(
+                failure_threshold=getattr(settings, 'CIRCUIT_BREAKER_FAILURE_THRESHOLD', 5),
+                recovery_timeout=float(getattr(settings, 'CIRCUIT_BREAKER_RECOVERY_TIMEOUT', 60.0)),
+                expected_exception=Exception,
+                name='embedding_generation'
+            )
+        )
+
+    def _get_embeddings(self, texts: List[str]) -> List[np.ndarray]:
+        """
+        Batched counterpart of _get_embedding: one upstream request per chunk of up to
+        _EMBED_REQUEST_LIMIT texts, behind the same circuit breaker, with the local model
+        (or zero vectors) as fallback for a chunk that fails.
+        """
+        embeddings = [np.zeros(self.embedding_dim, dtype=np.float32) for _ in texts]
+        todo = [i for i, text in enumerate(texts) if text.strip()]
+        circuit_breaker = self._embedding_breaker()
+        for start in range(0, len(todo), _EMBED_REQUEST_LIMIT):
+            chunk = todo[start:start + _EMBED_REQUEST_LIMIT]
+            # Same truncation as _get_embedding, for Gemini's request size limit
+            chunk_texts = [texts[i][:_MAX_EMBED_CHARS] for i in chunk]
+            context = LogContext(metadata={'batch_size': len(chunk_texts)})
+            try:
+                with operation_context('generate_embeddings_batch', context):
+                    vectors = circuit_breaker.call(self._embed_with_failover, chunk_texts)
+            except CircuitBreakerOpenError:
+                structured_logger.log_circuit_breaker_event('embedding_generation', 'open', context)
+                vectors = self._generate_fallback_embeddings(chunk_texts, context)
+            except Exception as e:
+                structured_logger.log_retry_attempt('embedding_generation', 0, str(e), context)
+                vectors = self._generate_fallback_embeddings(chunk_texts, context)
+            for i, vector in zip(chunk, vectors):
+                embeddings[i] = np.asarray(vector, dtype=np.float32)
+        return embeddings
+
+    def _generate_fallback_embeddings(self, texts: List[str], context: Optional[LogContext] = None) -> List[np.ndarray]:
+        """Local-model embeddings for a batch, or zero vectors when the local model is unavailable."""
+        if local_embedding_fallback.available:
+            try:
+                return [np.array(v, dtype=np.float32) for v in local_embedding_fallback.embed_texts(texts)]
+            except LocalEmbeddingError as e:
+                structured_logger.log_self_learning_event(f"Local embedding fallback failed: {e}", context)
+        return [np.zeros(self.embedding_dim, dtype=np.float32) for _ in texts]
+
     def _generate_external_embedding(self, text: str) -> List[float]:
-        """Generate embedding using external service (Gemini) with API key failover."""
+        """Generate embedding using external service (Gemini) with API key failover.
+
+        Concurrent requests for the same text and model share one upstream call.
+        """
+        return _embedding_flights.do(self.content_key(text), self._embed_with_failover, text)
+
+    def content_key(self, text: str) -> str:
+        """Identifies the embedding of text under the current embedding model."""
+        return hashlib.sha256(f"{self.embedding_model}\n{text}".encode("utf-8")).hexdigest()
+
+    def _embed_with_failover(self, text: Union[str, List[str]]) -> List[Any]:
+        """Embed text, or a list of texts in one batch request, trying each configured key."""
         # Build the list of API keys to try
         api_keys = []
         
@@ -108,11 +214,8 @@ class Memory:
                 try:
                     logging.info(f"Attempting Gemini embedding with key #{i+1} ({key_prefix}...), attempt {attempt+1}")
                     
-                    genai.configure(api_key=key)
-                    result = genai.embed_content(
-                        model=self.embedding_model,
-                        content=text,
-                        task_type="retrieval_document"
+                    result = get_gemini_client_pool().embed_content(
+                        key, self.embedding_model, text, task_type="retrieval_document"
                     )
                     logging.info(f"✅ Successfully generated embedding using key #{i+1} ({key_prefix}...)")
                     return result['embedding']
@@ -186,70 +289,228 @@ class Memory:
             # Return zero vector as last resort
             return np.zeros(self.embedding_dim, dtype=np.float32)
 
-    def _cosine_similarity(self, a: np.ndarray, b: np.ndarray) -> float:
-        """Compute cosine similarity between two vectors using numpy."""
-        a_norm = np.linalg.norm(a) + 1e-8
-        b_norm = np.linalg.norm(b) + 1e-8
-        return float(np.dot(a, b) / (a_norm * b_norm))
+    def _normalize_rows(self, vectors: np.ndarray) -> np.ndarray:
+        """Scale rows to unit length; zero rows stay zero."""
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-8)
+
+    def _as_row(self, embedding: np.ndarray) -> np.ndarray:
+        """Embedding as a matrix row; one of another dimension cannot be compared and becomes zeros."""
+        embedding = np.asarray(embedding, dtype=np.float32).ravel()
+        if embedding.shape[0] != self.embedding_dim:
+            self.dimension_mismatches += 1
+            logging.warning(f"Embedding has dimension {embedding.shape[0]}, expected {self.embedding_dim}; it will not match searches")
+            return np.zeros(self.embedding_dim, dtype=np.float32)
+        return embedding
+
+    def _insert(self, texts: List[str], rows: np.ndarray) -> List[int]:
+        """Store documents with their normalized rows; returns their ids."""
+        with self._lock:
+            ids = [next(self._next_id) for _ in texts]
+            for doc_id, text in zip(ids, texts):
+                self._docs[doc_id] = (text, json.loads(text))
+            self.index.add(ids, rows)
+            self._unpersisted.update(zip(ids, rows))
+            self.item_counter += len(texts)
+        return ids
+
+    def _rows_for(self, embeddings: List[np.ndarray]) -> np.ndarray:
+        return self._normalize_rows(np.stack([self._as_row(e) for e in embeddings]))
 
-    def add_document(self, data: Dict[str, Any]):
+    def add_document(self, data: Dict[str, Any]) -> int:
         """
         Adds a structured document to the memory. The embedding is computed and stored.
+        Concurrent adds share batched embedding requests (see MEMORY_EMBED_BATCH_*).
+        Returns the document id, which delete_document accepts.
         """
         text_representation = json.dumps(data)
-        embedding = self._get_embedding(text_representation)
-        
-        # Store both document and embedding
-        self.documents.append(text_representation)
-        self.embeddings.append(embedding)
-        self.item_counter += 1
+        embedding = self._embed_batcher.call(text_representation)
+        return self._insert([text_representation], self._rows_for([embedding]))[0]
+
+    def add_documents(self, docs: List[Any]) -> List[int]:
+        """Adds many documents with batched embedding requests; returns their ids in order."""
+        if not docs:
+            return []
+        texts = [json.dumps(doc) for doc in docs]
+        return self._insert(texts, self._rows_for(self._get_embeddings(texts)))
+
+    def enqueue_document(self, data: Dict[str, Any]) -> int:
+        """
+        Queues a document to be embedded in the background and returns its id at once.
+        It is part of document_data() immediately and searchable by embedding once its
+        batch has been embedded; search(include_pending=True) also matches it lexically
+        before then. With MEMORY_INGEST_MAX_PENDING documents already queued, it is
+        embedded inline instead; coroutines use enqueue_document_async.
+        """
+        doc_id, queued = self._enqueue(data)
+        if not queued:
+            logging.warning("Memory ingestion queue is full; embedding the document inline")
+            self._ingest([doc_id])
+        return doc_id
+
+    async def enqueue_document_async(self, data: Dict[str, Any]) -> int:
+        """enqueue_document for coroutines: a full queue is relieved on a worker thread, never on the event loop."""
+        doc_id, queued = self._enqueue(data)
+        if not queued:
+            logging.warning("Memory ingestion queue is full; embedding the document on a worker thread")
+            await asyncio.to_thread(self._ingest, [doc_id])
+        return doc_id
+
+    def _enqueue(self, data: Dict[str, Any]) -> Tuple[int, bool]:
+        """Registers a pending document; returns its id and whether the ingestion queue took it."""
+        text = json.dumps(data)
+        with self._lock:
+            doc_id = next(self._next_id)
+            self._pending[doc_id] = (text, json.loads(text))
+        return doc_id, self._ingest_queue.put(doc_id)
+
+    def _ingest(self, ids: List[int]):
+        """Embeds queued documents and moves them into the index; deleted ones are skipped."""
+        with self._lock:
+            queued = [(doc_id, self._pending[doc_id][0]) for doc_id in ids if doc_id in self._pending]
+        if not queued:
+            return
+        rows = self._rows_for(self._get_embeddings([text for _, text in queued]))
+        with self._lock:
+            live = [i for i, (doc_id, _) in enumerate(queued) if doc_id in self._pending]
+            live_ids = [queued[i][0] for i in live]
+            for doc_id in live_ids:
+                self._docs[doc_id] = self._pending.pop(doc_id)
+            if live_ids:
+                self.index.add(live_ids, rows[live])
+                self._unpersisted.update(zip(live_ids, rows[live]))
+            self.item_counter += len(live_ids)
+
+    def wait_for_ingestion(self, timeout: Optional[float] = None) -> bool:
+        """Blocks until every queued document is embedded; False if timeout passed first."""
+        return self._ingest_queue.drain(timeout)
+
+    def load_documents(self, docs: List[Any], store: EmbeddingStore) -> Dict[str, int]:
+        """
+        Adds documents saved by an earlier run, reusing their embeddings from store.
+        Stored rows are handed to the index without copying; the documents the store
+        does not know are embedded in batches. Returns how many embeddings were reused
+        and computed.
+        """
+        texts = [json.dumps(doc) for doc in docs]
+        rows = store.lookup([self.content_key(text) for text in texts])
+        hits = np.flatnonzero(rows >= 0)
+        misses = np.flatnonzero(rows < 0)
+        embedded = self._rows_for(self._get_embeddings([texts[i] for i in misses])) if len(misses) else None
+
+        with self._lock:
+            ids = [next(self._next_id) for _ in texts]
+            for doc_id, text in zip(ids, texts):
+                self._docs[doc_id] = (text, json.loads(text))
+            if len(hits):
+                self.index.add([ids[i] for i in hits], store.vectors(rows[hits]), copy=False)
+            if embedded is not None:
+                miss_ids = [ids[i] for i in misses]
+                self.index.add(miss_ids, embedded)
+                self._unpersisted.update(zip(miss_ids, embedded))
+            self.item_counter += len(texts)
+        return {"reused": len(hits), "embedded": len(misses)}
+
+    def persist_embeddings(self, store: EmbeddingStore):
+        """
+        Writes embeddings added since the last call to store. Rows of deleted documents are
+        dropped by a compaction once they make up half of the store.
+        """
+        with self._lock:
+            pending = [(self.content_key(self._docs[doc_id][0]), row)
+                       for doc_id, row in self._unpersisted.items()
+                       if doc_id in self._docs and row.any()]
+            self._unpersisted.clear()
+            live = len(self._docs)
+        if pending:
+            store.append([key for key, _ in pending], np.stack([row for _, row in pending]))
+        if len(store) > 2 * live + 100:
+            with self._lock:
+                ids, vectors = self.index.export()
+                keep = [i for i, doc_id in enumerate(ids.tolist()) if doc_id in self._docs and vectors[i].any()]
+                keys = [self.content_key(self._docs[int(ids[i])][0]) for i in keep]
+            store.compact(keys, vectors[keep])
+
+    def delete_document(self, doc_id: int) -> bool:
+        """Removes a document from the memory and its index; False if there was no such document."""
+        with self._lock:
+            if self._pending.pop(doc_id, None) is not None:
+                return True
+            if self._docs.pop(doc_id, None) is None:
+                return False
+            self._unpersisted.pop(doc_id, None)
+            self.index.remove([doc_id])
+            return True
 
-    def search(self, query: str, k: int = 5) -> List[Tuple[float, Dict[str, Any]]]:
+    def search(self, query: str, k: int = 5, include_pending: bool = False) -> List[Tuple[float, Dict[str, Any]]]:
         """
         Searches the memory for similar documents using cosine similarity.
+        Returns (distance, document) pairs, nearest first; distance is 1 - similarity.
+        With include_pending, documents still queued for embedding are matched by shared
+        words instead, with the fraction of query words they lack as distance.
         """
-        if not self.documents:
+        return self.search_batch([query], k, include_pending)[0]
+
+    def search_batch(self, queries: List[str], k: int = 5,
+                     include_pending: bool = False) -> List[List[Tuple[float, Dict[str, Any]]]]:
+        """
+        Searches for several queries at once with one pass over the index.
+        Returned documents are shared with the memory and must not be modified.
+        """
+        results = self._search_index(queries, k)
+        if include_pending:
+            with self._lock:
+                pending = list(self._pending.values())
+            if pending:
+                results = [heapq.nsmallest(k, found + self._lexical_matches(query, pending, k), key=lambda m: m[0])
+                           for query, found in zip(queries, results)]
+        return results
+
+    def _lexical_matches(self, query: str, pending: List[Tuple[str, Any]], k: int) -> List[Tuple[float, Any]]:
+        """The k pending documents sharing the most words with query, as (distance, document)."""
+        words = set(_WORD.findall(query.lower()))
+        if not words:
             return []
+        matches = []
+        for text, parsed in pending:
+            shared = len(words.intersection(_WORD.findall(text.lower())))
+            if shared:
+                matches.append((1.0 - shared / len(words), parsed))
+        return heapq.nsmallest(k, matches, key=lambda m: m[0])
+
+    def _search_index(self, queries: List[str], k: int) -> List[List[Tuple[float, Dict[str, Any]]]]:
+        if not self._docs:
+            return [[] for _ in queries]
 
         try:
-            # Get query embedding
-            query_embedding = self._get_embedding(query)
-            
-            # Compute cosine similarities with all stored embeddings
-            similarities = []
-            for i, doc_embedding in enumerate(self.embeddings):
-                similarity = self._cosine_similarity(query_embedding, doc_embedding)
-                similarities.append((similarity, i))
-            
-            # Sort by similarity (descending) and get top k
-            similarities.sort(key=lambda x: x[0], reverse=True)
-            
+            embeddings = [self._get_embedding(queries[0])] if len(queries) == 1 else self._get_embeddings(queries)
+            query_rows = np.stack(embeddings).astype(np.float32, copy=False)
+            if query_rows.shape[1] != self.embedding_dim:
+                raise ValueError(f"query embedding has dimension {query_rows.shape[1]}, expected {self.embedding_dim}")
+            matches = self.index.search(self._normalize_rows(query_rows), k)
+            docs = self._docs
             results = []
-            for similarity, doc_index in similarities[:k]:
-                try:
-                    # Convert similarity to distance (lower is better)
-                    distance = 1.0 - similarity
-                    doc_data = json.loads(self.documents[doc_index])
-                    results.append((distance, doc_data))
-                except json.JSONDecodeError:
-                    continue  # Skip malformed entries
-            
+            for scores, ids in matches:
+                # A document deleted since the index answered is skipped
+                found = [(1.0 - score, docs.get(doc_id)) for score, doc_id in zip(scores.tolist(), ids.tolist())]
+                results.append([(distance, doc[1]) for distance, doc in found if doc is not None])
             return results
-            
+
         except Exception as e:
             print(f"Warning: Cosine similarity search failed: {e}")
-            # Fall back to recent documents
-            num_docs_to_return = min(k, len(self.documents))
-            
-            results = []
-            for doc_str in reversed(self.documents[-num_docs_to_return:]):
-                try:
-                    # The "distance" is a placeholder value.
-                    results.append((0.0, json.loads(doc_str)))
-                except json.JSONDecodeError:
-                    continue  # Skip malformed entries
-            
-            return results
+            # Fall back to recent documents; the "distance" is a placeholder value
+            with self._lock:
+                recent = [(0.0, parsed) for _, parsed in reversed(self._docs.values())][:max(k, 0)]
+            return [list(recent) for _ in queries]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "documents": len(self._docs),
+            "dimension_mismatches": self.dimension_mismatches,
+            "index": self.index.get_stats(),
+            "embedding_batches": self._embed_batcher.get_stats(),
+            "ingestion": self._ingest_queue.get_stats(),
+        }
 
 # Global instance of the Memory class
 memory_instance = Memory()
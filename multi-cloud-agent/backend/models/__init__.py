@@ -7,4 +7,5 @@ from models.cloud_credential import CloudCredential
 from models.audit_log import AuditLog
 from models.plan_history import PlanHistory
 from models.chat_history import ChatHistory
-from models.agent_session import AgentSession
\ No newline at end of file
+from models.agent_session import AgentSession
+from models.agent_step import AgentStep
\ No newline at end of file
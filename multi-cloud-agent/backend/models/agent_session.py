@@ -18,9 +18,17 @@ class AgentSession(BaseModel):
     current_step = Column(Integer, default=0)
 
     # Execution history and assistance
-    history = Column(Text, nullable=True)  # JSON of execution history
+    history = Column(Text, nullable=True)  # Legacy JSON of execution history; new runs use agent_steps
     awaiting_assistance = Column(Boolean, default=False)
     assistance_request = Column(Text, nullable=True)
 
+    # Rolling summary of steps folded out of the agent prompt (steps 1..summary_through_step)
+    history_summary = Column(Text, nullable=True)
+    summary_through_step = Column(Integer, default=0)
+
+    # Append-only step log
+    steps = relationship("AgentStep", back_populates="session", cascade="all, delete-orphan",
+                         lazy="dynamic", order_by="AgentStep.step")
+
     def __repr__(self) -> str:
         return f"<AgentSession(id={self.id}, run_id='{self.run_id}', status='{self.status}')>"
\ No newline at end of file
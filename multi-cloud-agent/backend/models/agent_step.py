@@ -0,0 +1,52 @@
+import json
+from typing import Any, Dict
+
+from sqlalchemy import Column, String, Integer, ForeignKey, Text, DateTime, Float, Index
+from sqlalchemy.orm import relationship
+
+from models.base import BaseModel
+
+class AgentStep(BaseModel):
+    """
+    Model representing one step of an agent run. Steps are append-only:
+    each loop iteration inserts a row instead of rewriting the session history.
+    """
+    __table_args__ = (
+        Index("ix_agent_steps_run_id_step", "run_id", "step"),
+    )
+
+    # Relationship to the owning session
+    run_id = Column(String, ForeignKey("agent_sessions.run_id", ondelete="CASCADE"), nullable=False)
+    session = relationship("AgentSession", back_populates="steps")
+
+    # Step content
+    step = Column(Integer, nullable=False)
+    thought = Column(Text, nullable=True)
+    action = Column(String, nullable=True)
+    params = Column(Text, nullable=True)  # JSON of the action params
+    result = Column(Text, nullable=True)
+    critique = Column(Text, nullable=True)  # Filled in later by the background self-critique, if any
+    parallel_group = Column(Integer, nullable=True)  # First step of the concurrent batch this step ran in
+
+    # Timings
+    started_at = Column(DateTime, nullable=True)
+    llm_duration_ms = Column(Float, nullable=True)
+    tool_duration_ms = Column(Float, nullable=True)
+
+    def to_history_entry(self) -> Dict[str, Any]:
+        """
+        Convert the row to the history entry shape used by the agent loop.
+        """
+        try:
+            params = json.loads(self.params) if self.params else {}
+        except (json.JSONDecodeError, TypeError):
+            params = {}
+        return {
+            "step": self.step,
+            "thought": self.thought,
+            "action": {"name": self.action, "params": params},
+            "result": self.result
+        }
+
+    def __repr__(self) -> str:
+        return f"<AgentStep(run_id='{self.run_id}', step={self.step}, action='{self.action}')>"
@@ -1,25 +1,52 @@
 import time
 import threading
-import random
-from collections import defaultdict, deque
-from typing import Dict, Optional, Tuple
+from dataclasses import dataclass, field, fields
+from typing import Any, Callable, Dict, Optional
 import logging
-from datetime import datetime, timedelta
+
+from core.shared_state import SharedStateBackend, get_shared_state
 
 class CircuitBreaker:
     """
     Circuit breaker pattern to prevent cascading failures.
+    
+    With a shared state backend the failure count and state live under the breaker's
+    name, so a trip in one worker opens the breaker in all of them.
     """
-    def __init__(self, failure_threshold: int = 5, recovery_timeout: int = 60):
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: int = 60,
+                 name: str = "", backend: Optional[SharedStateBackend] = None):
         self.failure_threshold = failure_threshold
         self.recovery_timeout = recovery_timeout
+        self.name = name
+        self.backend = backend
         self.failure_count = 0
         self.last_failure_time = None
         self.state = "CLOSED"  # CLOSED, OPEN, HALF_OPEN
         self.lock = threading.Lock()
     
+    @property
+    def _shared_key(self) -> str:
+        return f"rate_breaker:{self.name}"
+    
+    def _apply(self, shared: Dict[str, Any]):
+        self.failure_count = shared["failure_count"]
+        self.last_failure_time = shared["last_failure_time"]
+        self.state = shared["state"]
+    
+    def sync(self):
+        """Load the state other workers have recorded (no-op without a shared backend)."""
+        if self.backend is None:
+            return
+        shared = self.backend.get(self._shared_key)
+        if shared:
+            with self.lock:
+                # A local HALF_OPEN probe stays in flight until its outcome is recorded
+                if not (self.state == "HALF_OPEN" and shared["state"] == "OPEN"):
+                    self._apply(shared)
+    
     def call(self, func, *args, **kwargs):
         """Execute function with circuit breaker protection."""
+        self.sync()
         if self.state == "OPEN":
             if time.time() - self.last_failure_time > self.recovery_timeout:
                 self.state = "HALF_OPEN"
@@ -37,33 +64,146 @@ class CircuitBreaker:
     
     def _on_success(self):
         with self.lock:
+            if self.backend is not None:
+                self._apply(self.backend.update(self._shared_key, lambda shared: {
+                    "failure_count": 0,
+                    "last_failure_time": (shared or {}).get("last_failure_time"),
+                    "state": "CLOSED",
+                }))
+                return
             self.failure_count = 0
             self.state = "CLOSED"
     
     def _on_failure(self):
         with self.lock:
+            if self.backend is not None:
+                def fail(shared):
+                    failure_count = (shared or {}).get("failure_count", 0) + 1
+                    state = "OPEN" if failure_count >= self.failure_threshold else (shared or {}).get("state", "CLOSED")
+                    return {"failure_count": failure_count, "last_failure_time": time.time(), "state": state}
+                was_open = self.state == "OPEN"
+                self._apply(self.backend.update(self._shared_key, fail))
+                if self.state == "OPEN" and not was_open:
+                    logging.warning(f"Circuit breaker opened after {self.failure_count} failures")
+                return
             self.failure_count += 1
             self.last_failure_time = time.time()
             if self.failure_count >= self.failure_threshold:
                 self.state = "OPEN"
                 logging.warning(f"Circuit breaker opened after {self.failure_count} failures")
 
+@dataclass
+class _KeyLimit:
+    """GCRA state for one key: O(1) memory regardless of the request rate."""
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+    tat: float = 0.0  # theoretical arrival time of the next conforming request
+    interval: float = 1.0  # seconds per request at the configured rate
+    tolerance: float = 59.0  # burst allowance: window_seconds - interval
+    backoff_multiplier: float = 1.0
+    last_429_time: float = 0.0
+    
+    def to_shared(self) -> Dict[str, float]:
+        return {f.name: getattr(self, f.name) for f in fields(self) if f.name != "lock"}
+
+class _BreakerRegistry(dict):
+    """Creates each key's circuit breaker on first access, bound to the limiter's backend."""
+    def __init__(self, backend: Optional[SharedStateBackend]):
+        super().__init__()
+        self.backend = backend
+    
+    def __missing__(self, key: str) -> CircuitBreaker:
+        breaker = self[key] = CircuitBreaker(name=key, backend=self.backend)
+        return breaker
+
 class RateLimiter:
     """
-    Enhanced rate limiter with exponential backoff and circuit breaker.
-    Implements a sliding window rate limiter with intelligent retry logic.
+    Per-key rate limiter using the generic cell rate algorithm (GCRA), with 429 backoff
+    and a circuit breaker per key.
+    
+    Each key keeps a single theoretical arrival time under its own lock, so keys never
+    contend with each other and nothing sleeps while holding a lock. ``acquire`` reserves
+    a slot and returns how long the caller must wait before using it; ``wait_if_needed``
+    sleeps outside the limiter.
+    
+    Gemini keys are throttled by ``core.key_scheduler.KeyScheduler``; gemini.py only
+    reports outcomes here (``handle_success`` / ``handle_429_error``) to drive the
+    per-key backoff and breakers shown by the status endpoints.
+    
+    With a shared state backend each key's state is read and written in one backend
+    transaction instead of under the local lock, so every worker draws on the same
+    budget. Shared state runs on wall-clock time, which is comparable across processes.
     """
     
-    def __init__(self):
-        self.requests: Dict[str, deque] = defaultdict(deque)
-        self.circuit_breakers: Dict[str, CircuitBreaker] = defaultdict(lambda: CircuitBreaker())
-        self.lock = threading.Lock()
-        self.backoff_multipliers: Dict[str, float] = defaultdict(lambda: 1.0)
-        self.last_429_time: Dict[str, float] = defaultdict(lambda: 0)
+    def __init__(self, backend: Optional[SharedStateBackend] = None):
+        self.backend = backend
+        self._clock = time.monotonic if backend is None else time.time
+        self._limits: Dict[str, _KeyLimit] = {}
+        self.circuit_breakers: Dict[str, CircuitBreaker] = _BreakerRegistry(backend)
+        self.lock = threading.Lock()  # guards creation of per-key state only
+    
+    def _limit(self, key: str) -> _KeyLimit:
+        limit = self._limits.get(key)
+        if limit is None:
+            with self.lock:
+                limit = self._limits.setdefault(key, _KeyLimit())
+        return limit
+    
+    def _mutate(self, key: str, fn: Callable[[_KeyLimit], Any]) -> Any:
+        """Run fn on key's state atomically: under the key's lock, or in one backend transaction."""
+        if self.backend is None:
+            limit = self._limit(key)
+            with limit.lock:
+                return fn(limit)
+        result = []
         
+        def update(shared: Optional[Dict[str, float]]) -> Dict[str, float]:
+            limit = _KeyLimit(**shared) if shared else _KeyLimit()
+            result[:] = [fn(limit)]
+            return limit.to_shared()
+        
+        self.backend.update(f"limit:{key}", update)
+        return result[0]
+    
+    def _snapshot(self, key: str) -> _KeyLimit:
+        """Current state of key, for reporting."""
+        if self.backend is None:
+            return self._limit(key)
+        shared = self.backend.get(f"limit:{key}")
+        return _KeyLimit(**shared) if shared else _KeyLimit()
+    
+    @staticmethod
+    def _configure(limit: _KeyLimit, max_requests: int, window_seconds: int):
+        """Apply the caller's rate to the key's state. Call through _mutate."""
+        limit.interval = window_seconds / max(1, max_requests)
+        limit.tolerance = max(0.0, window_seconds - limit.interval)
+    
+    def _wait(self, limit: _KeyLimit, now: float) -> float:
+        """Seconds until the next request on limit conforms. Call through _mutate."""
+        return max(0.0, max(limit.tat, now) - limit.tolerance - now)
+    
+    def _reserve(self, limit: _KeyLimit, now: float):
+        """Consume one slot. Call through _mutate."""
+        limit.tat = max(limit.tat, now) + limit.interval * limit.backoff_multiplier
+    
+    def acquire(self, key: str, max_requests: int = 60, window_seconds: int = 60) -> float:
+        """
+        Reserve a request slot for key without sleeping.
+        
+        Returns:
+            Seconds the caller must wait before sending (0.0 if it may send now)
+        """
+        def reserve(limit: _KeyLimit) -> float:
+            now = self._clock()
+            self._configure(limit, max_requests, window_seconds)
+            wait = self._wait(limit, now)
+            self._reserve(limit, now)
+            return wait
+        
+        return self._mutate(key, reserve)
+    
     def is_allowed(self, key: str, max_requests: int = 60, window_seconds: int = 60) -> bool:
         """
-        Check if a request is allowed based on rate limits.
+        Check if a request is allowed based on rate limits, consuming a slot if it is.
         
         Args:
             key: Identifier for the rate limit (e.g., 'gemini', 'groq')
@@ -73,112 +213,110 @@ class RateLimiter:
         Returns:
             True if request is allowed, False otherwise
         """
-        current_time = time.time()
+        def try_reserve(limit: _KeyLimit) -> bool:
+            now = self._clock()
+            self._configure(limit, max_requests, window_seconds)
+            if self._wait(limit, now) > 0:
+                return False
+            self._reserve(limit, now)
+            return True
         
-        with self.lock:
-            # Clean old requests outside the window
-            while (self.requests[key] and 
-                   current_time - self.requests[key][0] > window_seconds):
-                self.requests[key].popleft()
-            
-            # Check if we're under the limit
-            if len(self.requests[key]) < max_requests:
-                self.requests[key].append(current_time)
-                return True
-            
-            return False
+        return self._mutate(key, try_reserve)
     
     def wait_if_needed(self, key: str, max_requests: int = 60, window_seconds: int = 60) -> Optional[float]:
         """
-        Wait if rate limit would be exceeded with exponential backoff.
+        Reserve a slot and sleep until it is usable. Only the calling thread sleeps.
         
         Returns:
             None if no wait needed, otherwise the wait time in seconds
         """
-        if not self.is_allowed(key, max_requests, window_seconds):
-            # Calculate wait time until oldest request expires
-            with self.lock:
-                if self.requests[key]:
-                    oldest_request = self.requests[key][0]
-                    base_wait_time = window_seconds - (time.time() - oldest_request) + 1
-                    
-                    # Apply exponential backoff for 429 errors
-                    backoff_multiplier = self.backoff_multipliers[key]
-                    wait_time = base_wait_time * backoff_multiplier
-                    
-                    # Add jitter to prevent thundering herd
-                    jitter = random.uniform(0.8, 1.2)
-                    wait_time *= jitter
-                    
-                    if wait_time > 0:
-                        logging.info(f"Rate limit hit for {key}. Waiting {wait_time:.1f} seconds (backoff: {backoff_multiplier:.2f}x)")
-                        time.sleep(wait_time)
-                        return wait_time
+        wait_time = self.acquire(key, max_requests, window_seconds)
+        if wait_time > 0:
+            logging.info(f"Rate limit hit for {key}. Waiting {wait_time:.1f} seconds (backoff: {self._snapshot(key).backoff_multiplier:.2f}x)")
+            time.sleep(wait_time)
+            return wait_time
         return None
     
     def handle_429_error(self, key: str, retry_after: Optional[int] = None):
         """
         Handle 429 error by updating backoff multiplier and circuit breaker.
+        A retry_after pushes the key's next conforming request at least that far out.
         """
-        current_time = time.time()
-        self.last_429_time[key] = current_time
+        def back_off(limit: _KeyLimit) -> float:
+            limit.last_429_time = time.time()
+            # Increase backoff multiplier: each request now costs more of the window
+            limit.backoff_multiplier = min(limit.backoff_multiplier * 1.5, 10.0)
+            if retry_after:
+                limit.tat = max(limit.tat, self._clock() + retry_after + limit.tolerance)
+            return limit.backoff_multiplier
         
-        # Increase backoff multiplier
-        self.backoff_multipliers[key] = min(self.backoff_multipliers[key] * 1.5, 10.0)
+        backoff = self._mutate(key, back_off)
         
         # Update circuit breaker
         self.circuit_breakers[key]._on_failure()
         
         if retry_after:
-            logging.warning(f"429 error for {key}, retry after {retry_after}s, backoff: {self.backoff_multipliers[key]:.2f}x")
+            logging.warning(f"429 error for {key}, retry after {retry_after}s, backoff: {backoff:.2f}x")
         else:
-            logging.warning(f"429 error for {key}, backoff: {self.backoff_multipliers[key]:.2f}x")
+            logging.warning(f"429 error for {key}, backoff: {backoff:.2f}x")
     
     def handle_success(self, key: str):
         """
         Handle successful request by resetting backoff multiplier.
         """
-        self.backoff_multipliers[key] = max(self.backoff_multipliers[key] * 0.8, 1.0)
+        def recover(limit: _KeyLimit):
+            limit.backoff_multiplier = max(limit.backoff_multiplier * 0.8, 1.0)
+        
+        self._mutate(key, recover)
         self.circuit_breakers[key]._on_success()
     
     def get_remaining_requests(self, key: str, max_requests: int = 60, window_seconds: int = 60) -> int:
         """
-        Get the number of remaining requests in the current window.
+        Get the number of requests that could be sent right now.
         """
-        current_time = time.time()
+        def headroom(limit: _KeyLimit) -> int:
+            now = self._clock()
+            self._configure(limit, max_requests, window_seconds)
+            headroom = limit.tolerance - (max(limit.tat, now) - now)
+            if headroom < 0:
+                return 0
+            step = limit.interval * limit.backoff_multiplier
+            return min(max_requests, int(headroom // step) + 1)
         
-        with self.lock:
-            # Clean old requests
-            while (self.requests[key] and 
-                   current_time - self.requests[key][0] > window_seconds):
-                self.requests[key].popleft()
-            
-            return max_requests - len(self.requests[key])
+        return self._mutate(key, headroom)
     
     def get_circuit_breaker_status(self, key: str) -> Dict[str, any]:
         """
         Get circuit breaker status for monitoring.
         """
         cb = self.circuit_breakers[key]
+        cb.sync()
+        limit = self._snapshot(key)
         return {
             "state": cb.state,
             "failure_count": cb.failure_count,
             "last_failure_time": cb.last_failure_time,
-            "backoff_multiplier": self.backoff_multipliers[key],
-            "last_429_time": self.last_429_time[key]
+            "backoff_multiplier": limit.backoff_multiplier,
+            "last_429_time": limit.last_429_time
         }
     
     def reset_circuit_breaker(self, key: str):
         """
         Reset circuit breaker for a specific key.
         """
-        self.circuit_breakers[key] = CircuitBreaker()
-        self.backoff_multipliers[key] = 1.0
-        self.last_429_time[key] = 0
+        self.circuit_breakers[key] = CircuitBreaker(name=key, backend=self.backend)
+        with self.lock:
+            self._limits[key] = _KeyLimit()
+        if self.backend is not None:
+            self.backend.delete(f"limit:{key}")
+            # Written rather than deleted, so other workers adopt the reset on their next sync
+            self.backend.update(f"rate_breaker:{key}", lambda shared: {
+                "failure_count": 0, "last_failure_time": None, "state": "CLOSED"
+            })
         logging.info(f"Reset circuit breaker for {key}")
 
 # Global rate limiter instance
-rate_limiter = RateLimiter()
+rate_limiter = RateLimiter(get_shared_state())
 
 def with_rate_limit(provider: str, max_requests: int = 50, window_seconds: int = 60):
     """
@@ -188,6 +326,7 @@ def with_rate_limit(provider: str, max_requests: int = 50, window_seconds: int =
         def wrapper(*args, **kwargs):
             # Check circuit breaker first
             cb = rate_limiter.circuit_breakers[provider]
+            cb.sync()
             if cb.state == "OPEN":
                 if time.time() - cb.last_failure_time > cb.recovery_timeout:
                     cb.state = "HALF_OPEN"
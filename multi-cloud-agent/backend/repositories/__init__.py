@@ -5,4 +5,5 @@ from repositories.base import BaseRepository
 from repositories.user import UserRepository
 from repositories.cloud_credential import CloudCredentialRepository
 from repositories.audit_log import AuditLogRepository
-from repositories.plan_history import PlanHistoryRepository
\ No newline at end of file
+from repositories.plan_history import PlanHistoryRepository
+from repositories.agent_step import AgentStepRepository
\ No newline at end of file
@@ -0,0 +1,80 @@
+from typing import Any, Dict, List, Optional
+from sqlalchemy.orm import Session
+from sqlalchemy import func
+
+from repositories.base import BaseRepository
+from models.agent_step import AgentStep
+
+class AgentStepRepository(BaseRepository[AgentStep, Any, Any]):
+    """
+    Repository for the append-only agent step log.
+    """
+    def __init__(self, db: Session):
+        super().__init__(db, AgentStep)
+    
+    def append(self, run_id: str, step: int, commit: bool = True, **fields: Any) -> AgentStep:
+        """
+        Insert a single step row. Pass commit=False to batch with other changes in one transaction.
+        """
+        db_obj = AgentStep(run_id=run_id, step=step, **fields)
+        self.db.add(db_obj)
+        if commit:
+            self.db.commit()
+        return db_obj
+    
+    def set_critique(self, run_id: str, step: int, critique: str) -> bool:
+        """
+        Attach a self-critique to an already recorded step.
+        """
+        updated = self.db.query(AgentStep).filter(
+            AgentStep.run_id == run_id, AgentStep.step == step
+        ).update({AgentStep.critique: critique}, synchronize_session=False)
+        self.db.commit()
+        return bool(updated)
+    
+    def get_recent(self, run_id: str, limit: Optional[int] = None, after_step: int = 0) -> List[AgentStep]:
+        """
+        Get the most recent steps of a run (numbered above `after_step`) in ascending step order,
+        reading at most `limit` rows.
+        """
+        query = self.db.query(AgentStep).filter(AgentStep.run_id == run_id)
+        if after_step:
+            query = query.filter(AgentStep.step > after_step)
+        query = query.order_by(AgentStep.step.desc(), AgentStep.id.desc())
+        if limit is not None:
+            query = query.limit(limit)
+        return list(reversed(query.all()))
+    
+    def get_history(self, run_id: str, limit: Optional[int] = None, after_step: int = 0) -> List[Dict[str, Any]]:
+        """
+        Get recent steps of a run as agent loop history entries.
+        """
+        return [s.to_history_entry() for s in self.get_recent(run_id, limit, after_step)]
+    
+    def count_by_run_id(self, run_id: str) -> int:
+        """
+        Count the steps recorded for a run.
+        """
+        return self.db.query(func.count(AgentStep.id)).filter(AgentStep.run_id == run_id).scalar()
+    
+    def get_summaries(self, run_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Get step count and last result for several runs in one indexed query.
+        """
+        if not run_ids:
+            return {}
+        latest = self.db.query(
+            AgentStep.run_id.label("run_id"),
+            func.count(AgentStep.id).label("step_count"),
+            func.max(AgentStep.step).label("last_step")
+        ).filter(AgentStep.run_id.in_(run_ids)).group_by(AgentStep.run_id).subquery()
+        
+        rows = self.db.query(latest.c.run_id, latest.c.step_count, AgentStep.result).join(
+            AgentStep,
+            (AgentStep.run_id == latest.c.run_id) & (AgentStep.step == latest.c.last_step)
+        ).all()
+        
+        return {
+            run_id: {"step_count": step_count, "last_result": result}
+            for run_id, step_count, result in rows
+        }
@@ -8,6 +8,7 @@ import os
 from core.db import get_db
 from auth import get_current_user
 from models import User, AgentSession
+from repositories.agent_step import AgentStepRepository
 import schemas
 
 router = APIRouter(prefix="/api/tasks", tags=["tasks"])
@@ -37,9 +38,14 @@ async def get_task_results(
         total_count = query.count()
         sessions = query.offset(offset).limit(limit).all()
         
+        # Step counts and last results come from the indexed step log, not the history blob
+        step_summaries = AgentStepRepository(db).get_summaries([s.run_id for s in sessions])
+        
         # Convert sessions to task results format
         results = []
         for session in sessions:
+            summary = step_summaries.get(session.run_id)
+            steps_completed = summary["step_count"] if summary else (session.current_step or 0)
             task_result = {
                 "id": session.id,
                 "goal": session.goal,
@@ -47,18 +53,18 @@ async def get_task_results(
                 "status": session.status,
                 "created_at": session.created_at.isoformat() if session.created_at else None,
                 "updated_at": session.updated_at.isoformat() if session.updated_at else None,
-                "result": session.result if hasattr(session, 'result') else None,
-                "steps_completed": len(session.history) if session.history else 0,
-                "total_steps": len(session.history) if session.history else 0,
+                "result": summary["last_result"] if summary else None,
+                "steps_completed": steps_completed,
+                "total_steps": steps_completed,
                 "user_id": session.user_id
             }
             
-            # Try to extract more detailed information from history
-            if session.history:
+            # Sessions recorded before the step log keep their history in the legacy blob
+            if not summary and session.history:
                 try:
                     history = json.loads(session.history) if isinstance(session.history, str) else session.history
                     if isinstance(history, list) and history:
-                        # Get the last step for result information
+                        task_result["steps_completed"] = task_result["total_steps"] = len(history)
                         last_step = history[-1]
                         if isinstance(last_step, dict):
                             task_result["result"] = last_step.get("result", last_step.get("observation", "Task completed"))
@@ -150,6 +156,14 @@ async def download_task_result(
         if not session:
             raise HTTPException(status_code=404, detail="Task not found")
         
+        history = AgentStepRepository(db).get_history(session.run_id)
+        if not history and session.history:
+            # Sessions recorded before the step log keep their history in the legacy blob
+            try:
+                history = json.loads(session.history) if isinstance(session.history, str) else session.history
+            except json.JSONDecodeError:
+                history = []
+        
         # Prepare task data
         task_data = {
             "id": session.id,
@@ -157,7 +171,7 @@ async def download_task_result(
             "status": session.status,
             "created_at": session.created_at.isoformat() if session.created_at else None,
             "updated_at": session.updated_at.isoformat() if session.updated_at else None,
-            "history": session.history,
+            "history": history if isinstance(history, list) else [],
             "user_id": session.user_id
         }
         
@@ -8,11 +8,13 @@ class PromptRequest(BaseSchema):
     Schema for prompt request.
     """
     prompt: str = Field(..., min_length=1, max_length=2000)
+    use_plan_cache: bool = True
     
     class Config:
         json_schema_extra = {
             "example": {
-                "prompt": "Create a VM in AWS and install nginx"
+                "prompt": "Create a VM in AWS and install nginx",
+                "use_plan_cache": True
             }
         }
 
@@ -105,6 +107,8 @@ class AgentRunResponse(BaseResponseSchema):
     message: str
     final_result: Optional[str] = None
     history: List[Dict[str, Any]]
+    run_id: Optional[str] = None
+    job_id: Optional[str] = None
     
     class Config:
         json_schema_extra = {
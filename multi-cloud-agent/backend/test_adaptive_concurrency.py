@@ -0,0 +1,73 @@
+import asyncio
+import unittest
+
+from core.adaptive_concurrency import AIMDConcurrencyController
+from core.circuit_breaker import CircuitBreaker, CircuitBreakerConfig, CircuitBreakerOpenError
+from core.llm_dispatch import Priority, PriorityDispatcher
+
+
+def make_controller(**overrides):
+    options = dict(initial=4, min_limit=1, max_limit=8, decrease_factor=0.5, latency_target=1.0, cooldown=0,
+                   breaker=CircuitBreaker(CircuitBreakerConfig(failure_threshold=2, recovery_timeout=60, name="test")))
+    options.update(overrides)
+    return AIMDConcurrencyController(**options)
+
+
+class TestAIMDConcurrencyController(unittest.TestCase):
+    def test_grows_by_one_per_window_of_healthy_calls(self):
+        controller = make_controller()
+        for _ in range(4):
+            controller.record_success(0.2)
+        self.assertEqual(controller.get_status()["limit"], 5)
+        # Slow answers do not earn more concurrency
+        for _ in range(20):
+            controller.record_success(5.0)
+        self.assertEqual(controller.get_status()["limit"], 5)
+
+    def test_overload_halves_the_limit_once_per_cooldown(self):
+        controller = make_controller(initial=8, cooldown=60)
+        for _ in range(3):
+            controller.record_overload()
+        status = controller.get_status()
+        self.assertEqual((status["limit"], status["decreases"], status["overloads"]), (4, 1, 3))
+
+    def test_errors_pause_growth(self):
+        controller = make_controller()
+        for _ in range(3):
+            controller.record_error()
+        for _ in range(4):
+            controller.record_success(0.2)
+        self.assertEqual(controller.get_status()["limit"], 4)
+
+    def test_breaker_only_counts_overloads_at_the_floor(self):
+        controller = make_controller(initial=2)
+        controller.record_overload()
+        self.assertEqual(controller.get_status()["limit"], 1)
+        controller.allow_request()
+        controller.record_overload()
+        controller.record_overload()
+        with self.assertRaises(CircuitBreakerOpenError):
+            controller.allow_request()
+        self.assertEqual(controller.get_status()["breaker_state"], "open")
+
+
+class TestDispatcherFollowsTheLimit(unittest.IsolatedAsyncioTestCase):
+    async def test_resized_pool_admits_waiting_calls(self):
+        dispatcher = PriorityDispatcher(max_concurrent=1, background_share=1.0, background_max_wait=5,
+                                        background_max_queue=10, background_quota_wait=5)
+        controller = make_controller(initial=1, on_change=dispatcher.set_max_concurrent)
+        await dispatcher.acquire_async(Priority.INTERACTIVE)
+        waiting = asyncio.create_task(dispatcher.acquire_async(Priority.INTERACTIVE))
+        await asyncio.sleep(0.01)
+        self.assertFalse(waiting.done())
+
+        controller.record_success(0.1)
+        await asyncio.wait_for(waiting, 1)
+        self.assertEqual(dispatcher.get_stats()["max_concurrent"], 2)
+
+        controller.record_overload()
+        self.assertEqual(dispatcher.get_stats()["max_concurrent"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,36 @@
+import unittest
+
+from core.utils import normalize_agent_actions
+
+
+class TestNormalizeAgentActions(unittest.TestCase):
+    def test_single_action(self):
+        actions, independent = normalize_agent_actions({"action": {"name": "search_web", "params": {"query": "a"}}})
+        self.assertEqual(actions, [("search_web", {"query": "a"})])
+        self.assertFalse(independent)
+
+    def test_independent_batch(self):
+        decision = {"independent": True, "actions": [
+            {"name": "search_web", "params": {"query": "a"}},
+            {"name": "search_web", "params": {"query": "b"}},
+        ]}
+        actions, independent = normalize_agent_actions(decision)
+        self.assertEqual(len(actions), 2)
+        self.assertTrue(independent)
+
+    def test_batch_drops_control_actions_and_caps_size(self):
+        decision = {"independent": True, "actions": [
+            {"name": "search_web", "params": {"query": str(n)}} for n in range(6)
+        ] + [{"name": "finish_task", "params": {"final_answer": "x"}}]}
+        actions, _ = normalize_agent_actions(decision, max_actions=3)
+        self.assertEqual([name for name, _ in actions], ["search_web"] * 3)
+
+    def test_invalid_actions_are_skipped(self):
+        self.assertEqual(normalize_agent_actions({"action": {"params": {}}}), ([], False))
+        actions, independent = normalize_agent_actions({"independent": True, "actions": ["bad", {"name": "read_file"}]})
+        self.assertEqual(actions, [("read_file", {})])
+        self.assertFalse(independent)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import asyncio
+import unittest
+from unittest.mock import AsyncMock, patch
+
+import main
+
+
+class TestShouldCritique(unittest.TestCase):
+    def test_off_never_critiques(self):
+        with patch.object(main.settings, "AGENT_CRITIQUE_MODE", "off"):
+            self.assertFalse(main._should_critique(5, "ok"))
+            self.assertFalse(main._should_critique(3, "Error: boom"))
+
+    def test_async_critiques_every_step(self):
+        with patch.object(main.settings, "AGENT_CRITIQUE_MODE", "async"):
+            self.assertTrue(all(main._should_critique(step, "ok") for step in range(1, 8)))
+
+    def test_sampled_critiques_every_nth_and_failed_steps(self):
+        with patch.object(main.settings, "AGENT_CRITIQUE_MODE", "sampled"), \
+                patch.object(main.settings, "AGENT_CRITIQUE_EVERY_N_STEPS", 3):
+            picked = [step for step in range(1, 10) if main._should_critique(step, "ok")]
+            self.assertEqual(picked, [3, 6, 9])
+            self.assertTrue(main._should_critique(4, "Error: element not found"))
+            self.assertTrue(main._should_critique(4, "GPU/WebGL Error: context lost"))
+
+    def test_sampled_with_non_positive_interval_checks_every_step(self):
+        with patch.object(main.settings, "AGENT_CRITIQUE_MODE", "sampled"), \
+                patch.object(main.settings, "AGENT_CRITIQUE_EVERY_N_STEPS", 0):
+            self.assertTrue(main._should_critique(7, "ok"))
+
+    def test_unknown_mode_is_off(self):
+        with patch.object(main.settings, "AGENT_CRITIQUE_MODE", "sometimes"):
+            self.assertFalse(main._should_critique(5, "Error: boom"))
+
+
+class TestScheduleCritiques(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.generate = AsyncMock(side_effect=lambda prompt, **kwargs: f"critique of {prompt.splitlines()[1]}")
+        self.stored = []
+        self.updates = AsyncMock()
+        self.patches = [
+            patch.object(main.gemini, "generate_text_async", self.generate),
+            patch.object(main, "_store_step_critique", lambda run_id, step, critique: self.stored.append((run_id, step, critique))),
+            patch.object(main, "send_agent_update", self.updates),
+        ]
+        for p in self.patches:
+            p.start()
+
+    async def asyncTearDown(self):
+        for p in self.patches:
+            p.stop()
+
+    async def schedule(self, mode, results, every_n=5, first_step=1):
+        with patch.object(main.settings, "AGENT_CRITIQUE_MODE", mode), \
+                patch.object(main.settings, "AGENT_CRITIQUE_EVERY_N_STEPS", every_n):
+            main._schedule_critiques(7, "run-1", first_step, "goal", results)
+        pending = list(main._critique_tasks)
+        await asyncio.gather(*pending)
+        return pending
+
+    async def test_off_schedules_nothing(self):
+        self.assertEqual(await self.schedule("off", ["ok", "Error: x"]), [])
+        self.generate.assert_not_called()
+
+    async def test_async_critiques_each_step_in_the_background(self):
+        tasks = await self.schedule("async", ["first", "second"], first_step=4)
+        self.assertEqual(len(tasks), 2)
+        self.assertEqual(sorted(step for _, step, _ in self.stored), [4, 5])
+        self.assertEqual(self.updates.await_count, 2)
+        # Critiques are background work for the dispatcher
+        self.assertEqual(self.generate.call_args.kwargs["priority"], main.Priority.BACKGROUND)
+        self.assertEqual(main._critique_tasks, set())
+
+    async def test_sampled_picks_interval_and_failed_steps(self):
+        await self.schedule("sampled", ["ok", "Error: timeout", "ok", "ok"], every_n=4, first_step=1)
+        self.assertEqual(sorted(step for _, step, _ in self.stored), [2, 4])
+
+    async def test_failed_critique_is_not_stored_or_sent(self):
+        self.generate.side_effect = RuntimeError("quota")
+        await self.schedule("async", ["ok"])
+        self.assertEqual(self.stored, [])
+        self.updates.assert_not_awaited()
+
+
+if __name__ == "__main__":
+    unittest.main()
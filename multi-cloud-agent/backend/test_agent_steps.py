@@ -0,0 +1,61 @@
+import json
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import models  # noqa: F401 - registers every table on Base
+from core.db import Base
+from repositories.agent_step import AgentStepRepository
+
+
+class TestAgentStepRepository(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine("sqlite://")
+        Base.metadata.create_all(self.engine)
+        self.db = sessionmaker(bind=self.engine)()
+        self.repo = AgentStepRepository(self.db)
+
+    def tearDown(self):
+        self.db.close()
+        self.engine.dispose()
+
+    def _record(self, run_id, steps):
+        for step in steps:
+            self.repo.append(run_id, step, commit=False, thought=f"t{step}", action="search",
+                             params=json.dumps({"q": step}), result=f"r{step}")
+        self.db.commit()
+
+    def test_history_is_in_step_order(self):
+        self._record("run-1", [2, 1, 3])
+        history = self.repo.get_history("run-1")
+        self.assertEqual([entry["step"] for entry in history], [1, 2, 3])
+        self.assertEqual(history[0]["action"], {"name": "search", "params": {"q": 1}})
+        self.assertEqual(history[0]["result"], "r1")
+
+    def test_get_recent_reads_the_last_steps_only(self):
+        self._record("run-1", range(1, 11))
+        self.assertEqual([s.step for s in self.repo.get_recent("run-1", limit=3)], [8, 9, 10])
+        self.assertEqual([s.step for s in self.repo.get_recent("run-1", limit=3, after_step=8)], [9, 10])
+        self.assertEqual(self.repo.count_by_run_id("run-1"), 10)
+
+    def test_summaries_are_grouped_per_run(self):
+        self._record("run-1", [1, 2, 3])
+        self._record("run-2", [1])
+        summaries = self.repo.get_summaries(["run-1", "run-2", "run-3"])
+        self.assertEqual(summaries, {
+            "run-1": {"step_count": 3, "last_result": "r3"},
+            "run-2": {"step_count": 1, "last_result": "r1"},
+        })
+        self.assertEqual(self.repo.get_summaries([]), {})
+
+    def test_critique_is_attached_to_a_recorded_step(self):
+        self._record("run-1", [1])
+        self.assertTrue(self.repo.set_critique("run-1", 1, "looks fine"))
+        self.assertFalse(self.repo.set_critique("run-1", 2, "no such step"))
+        self.db.expire_all()
+        self.assertEqual(self.repo.get_recent("run-1")[0].critique, "looks fine")
+
+
+if __name__ == "__main__":
+    unittest.main()
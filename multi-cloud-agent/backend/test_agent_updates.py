@@ -0,0 +1,48 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+import main
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_json(self, payload):
+        self.sent.append(payload)
+
+
+class TestAgentUpdatePayloads(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.websocket = FakeWebSocket()
+        self.connections = patch.dict(main.active_connections, {7: self.websocket})
+        self.connections.start()
+
+    async def asyncTearDown(self):
+        self.connections.stop()
+
+    async def test_status_is_sent_as_structured_payload(self):
+        await main.send_agent_status(7, "complete", {"final_result": "done"})
+        self.assertEqual(self.websocket.sent, [
+            {"topic": "agent_updates", "payload": {"status": "complete", "data": {"final_result": "done"}}}
+        ])
+
+    async def test_log_line_is_sent_under_log(self):
+        await main.send_agent_update(7, "step 1")
+        self.assertEqual(self.websocket.sent, [{"topic": "agent_updates", "payload": {"log": "step 1"}}])
+
+    async def test_failed_run_reports_error_status_not_a_log_line(self):
+        db = MagicMock()
+        db.query.side_effect = Exception("db down")
+        with patch.object(main.core, "log_error"), self.assertRaises(Exception):
+            await main._execute_agent_run(db, 7, "run-1", None)
+        statuses = [sent["payload"] for sent in self.websocket.sent if "status" in sent["payload"]]
+        self.assertEqual(len(statuses), 1)
+        self.assertEqual(statuses[0]["status"], "error")
+        self.assertIn("db down", statuses[0]["data"]["message"])
+        for sent in self.websocket.sent:
+            self.assertNotIn("agent_updates", str(sent["payload"].get("log", "")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from core.embedding_store import EmbeddingStore
+
+
+class TestEmbeddingStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.prefix = os.path.join(self.tmp.name, "memory.embeddings")
+        self.vectors = np.random.default_rng(0).standard_normal((5, 4)).astype(np.float32)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_rows_survive_a_restart_as_a_mapped_view(self):
+        store = EmbeddingStore(self.prefix, 4)
+        self.assertEqual(store.append(list("abcde"), self.vectors), 5)
+        self.assertEqual(store.append(["a", "f"], self.vectors[:2]), 1)
+
+        reopened = EmbeddingStore(self.prefix, 4)
+        rows = reopened.lookup(["b", "c", "d", "zz"])
+        self.assertEqual(rows.tolist(), [1, 2, 3, -1])
+        block = reopened.vectors(rows[:3])
+        self.assertIsInstance(block, np.memmap)
+        np.testing.assert_array_equal(block, self.vectors[1:4])
+        # Copy-on-write: changing the mapped rows never reaches the file
+        block[0] = 0
+        np.testing.assert_array_equal(EmbeddingStore(self.prefix, 4).vectors(np.array([1])), self.vectors[[1]])
+
+    def test_torn_tail_is_cut_so_appends_stay_aligned(self):
+        store = EmbeddingStore(self.prefix, 4)
+        store.append(list("abc"), self.vectors[:3])
+        # A crash after the vectors of "d" were written but before its key was
+        with open(self.prefix + ".f32", "ab") as f:
+            f.write(self.vectors[3].tobytes()[:10])
+
+        reopened = EmbeddingStore(self.prefix, 4)
+        self.assertEqual(len(reopened), 3)
+        reopened.append(["e"], self.vectors[[4]])
+        final = EmbeddingStore(self.prefix, 4)
+        np.testing.assert_array_equal(final.vectors(final.lookup(["e"])), self.vectors[[4]])
+
+    def test_dimension_change_starts_over(self):
+        EmbeddingStore(self.prefix, 4).append(["a"], self.vectors[:1])
+        store = EmbeddingStore(self.prefix, 8)
+        self.assertEqual(len(store), 0)
+        store.append(["a"], np.ones((1, 8), dtype=np.float32))
+        self.assertEqual(len(EmbeddingStore(self.prefix, 8)), 1)
+
+    def test_compact_keeps_only_given_rows(self):
+        store = EmbeddingStore(self.prefix, 4)
+        store.append(list("abcde"), self.vectors)
+        store.compact(["e", "a"], self.vectors[[4, 0]])
+        self.assertEqual(store.lookup(list("abcde")).tolist(), [1, -1, -1, -1, 0])
+        np.testing.assert_array_equal(EmbeddingStore(self.prefix, 4).vectors(np.array([0, 1])), self.vectors[[4, 0]])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import asyncio
+import threading
+import unittest
+from unittest import mock
+
+import google.generativeai as genai
+
+from core.gemini_clients import GeminiClientPool
+
+
+class TestGeminiClientPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = GeminiClientPool()
+
+    def test_models_are_built_once_per_key_model_and_settings(self):
+        model = self.pool.get_model("key-a", "gemini-1.5-flash", generation_config={"temperature": 0.7})
+        self.assertIs(model, self.pool.get_model("key-a", "gemini-1.5-flash", generation_config={"temperature": 0.7}))
+        self.assertIsNot(model, self.pool.get_model("key-a", "gemini-1.5-flash", generation_config={"temperature": 0.2}))
+        self.assertIsNot(model, self.pool.get_model("key-b", "gemini-1.5-flash", generation_config={"temperature": 0.7}))
+        stats = self.pool.get_stats()
+        self.assertEqual((stats["models_created"], stats["model_reuses"], stats["keys"]), (3, 1, 2))
+
+    def test_models_are_bound_to_their_own_key_without_global_configure(self):
+        with mock.patch.object(genai, "configure") as configure:
+            model_a = self.pool.get_model("key-a", "gemini-1.5-flash")
+            model_b = self.pool.get_model("key-b", "gemini-1.5-flash")
+        configure.assert_not_called()
+        self.assertIs(model_a._client, self.pool.get_client("key-a"))
+        self.assertIsNot(model_a._client, model_b._client)
+        # Worker threads have no event loop, so the async client waits for an async caller
+        self.assertIsNone(model_a._async_client)
+
+    def test_async_callers_get_the_key_bound_async_client(self):
+        async def get_async_model():
+            model = self.pool.get_model("key-a", "gemini-1.5-flash", use_async=True)
+            self.assertIs(model, self.pool.get_model("key-a", "gemini-1.5-flash", use_async=True))
+            self.assertIs(model._async_client, self.pool.get_async_client("key-a"))
+            return model
+
+        model = asyncio.run(get_async_model())
+        shared = self.pool.get_model("key-a", "gemini-1.5-flash")
+        self.assertIs(model._client, shared._client)
+        # The shared model is never pinned to one event loop's channel
+        self.assertIsNone(shared._async_client)
+
+    def test_each_event_loop_gets_its_own_async_client(self):
+        async def get_async_model():
+            return self.pool.get_model("key-a", "gemini-1.5-flash", use_async=True)
+
+        first = asyncio.run(get_async_model())
+        second = asyncio.run(get_async_model())
+        self.assertIsNot(first, second)
+        self.assertIsNot(first._async_client, second._async_client)
+        # Clients of closed loops are dropped as new loops come along
+        self.assertEqual(self.pool.get_stats()["event_loops"], 1)
+
+    def test_concurrent_callers_share_one_model(self):
+        models = []
+        threads = [
+            threading.Thread(target=lambda: models.append(self.pool.get_model("key-a", "gemini-1.5-pro")))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(len({id(model) for model in models}), 1)
+
+    def test_embeddings_use_the_key_bound_client(self):
+        with mock.patch.object(genai, "embed_content", return_value={"embedding": [0.1]}) as embed:
+            self.pool.embed_content("key-a", "models/embedding-001", "text", task_type="retrieval_document")
+        self.assertIs(embed.call_args.kwargs["client"], self.pool.get_client("key-a"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,145 @@
+import asyncio
+import unittest
+
+from core.hedging import Hedger
+
+
+def make_hedger(**overrides):
+    options = dict(enabled=True, percentile=95, default_delay=0.05, min_delay=0.01, budget_ratio=0.5,
+                   loser_sample_rate=0.0)
+    options.update(overrides)
+    return Hedger(**options)
+
+
+class TestHedger(unittest.IsolatedAsyncioTestCase):
+    async def test_slow_call_is_hedged_and_the_loser_cancelled(self):
+        hedger = make_hedger()
+        cancelled = []
+
+        async def stalled():
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append("primary")
+                raise
+            return "primary"
+
+        async def fast():
+            return "hedge"
+
+        result = await asyncio.wait_for(hedger.run(stalled, fast), 1)
+        self.assertEqual((result, cancelled), ("hedge", ["primary"]))
+        stats = hedger.get_stats()
+        self.assertEqual((stats["hedged"], stats["hedge_wins"], stats["hedge_rate"]), (1, 1, 1.0))
+        # The cancelled attempt was never measured, so there is no unhedged latency to compare with
+        self.assertEqual((stats["p99_unhedged_ms"], stats["p99_improvement_ms"]), (None, None))
+
+    async def test_sampled_losers_finish_and_measure_the_unhedged_latency(self):
+        hedger = make_hedger(loser_sample_rate=1.0)
+
+        async def slow():
+            await asyncio.sleep(0.3)
+            return "primary"
+
+        async def fast():
+            return "hedge"
+
+        self.assertEqual(await asyncio.wait_for(hedger.run(slow, fast), 0.2), "hedge")
+        self.assertEqual(hedger.get_stats()["losers_measured"], 0)
+        await asyncio.sleep(0.35)
+        stats = hedger.get_stats()
+        self.assertEqual(stats["losers_measured"], 1)
+        # The first attempt's real latency, not its timeout
+        self.assertGreater(stats["p99_unhedged_ms"], 250)
+        self.assertLess(stats["p99_unhedged_ms"], 1000)
+        self.assertGreater(stats["p99_improvement_ms"], 150)
+
+    async def test_fast_calls_and_early_failures_are_not_hedged(self):
+        hedger = make_hedger()
+        hedges = []
+
+        async def ok():
+            return "ok"
+
+        async def broken():
+            raise ValueError("bad request")
+
+        def hedge():
+            hedges.append(1)
+            return None
+
+        self.assertEqual(await hedger.run(ok, hedge), "ok")
+        with self.assertRaises(ValueError):
+            await hedger.run(broken, hedge)
+        self.assertEqual(hedges, [])
+
+    async def test_hedges_are_bounded_by_the_budget(self):
+        # Each request earns a tenth of a hedge, on top of the one the hedger starts with
+        hedger = make_hedger(budget_ratio=0.1)
+        started = []
+
+        async def slow():
+            await asyncio.sleep(0.08)
+            return "primary"
+
+        def hedge():
+            started.append(1)
+
+            async def slower():
+                await asyncio.sleep(1)
+                return "hedge"
+            return slower()
+
+        for _ in range(10):
+            self.assertEqual(await hedger.run(slow, hedge), "primary")
+        stats = hedger.get_stats()
+        self.assertEqual((len(started), stats["hedged"]), (2, 2))
+        self.assertEqual(stats["budget_denied"], 8)
+
+    async def test_hedge_failure_falls_back_to_the_primary(self):
+        hedger = make_hedger()
+
+        async def slow():
+            await asyncio.sleep(0.1)
+            return "primary"
+
+        async def failing():
+            raise RuntimeError("quota")
+
+        self.assertEqual(await hedger.run(slow, failing), "primary")
+        self.assertEqual(hedger.get_stats()["hedge_wins"], 0)
+
+    async def test_async_hedge_lookup_is_awaited_before_hedging(self):
+        hedger = make_hedger()
+
+        async def slow():
+            await asyncio.sleep(0.1)
+            return "primary"
+
+        async def no_target():
+            return None
+
+        async def spare_key():
+            async def fast():
+                return "hedge"
+            return fast()
+
+        self.assertEqual(await hedger.run(slow, no_target, hedge_lookup_async=True), "primary")
+        self.assertEqual(hedger.get_stats()["no_hedge_target"], 1)
+        self.assertEqual(await hedger.run(slow, spare_key, hedge_lookup_async=True), "hedge")
+
+    async def test_disabled_hedger_only_measures(self):
+        hedger = make_hedger(enabled=False)
+
+        async def slow():
+            await asyncio.sleep(0.08)
+            return "primary"
+
+        self.assertEqual(await hedger.run(slow, lambda: self.fail("hedged while disabled")), "primary")
+        stats = hedger.get_stats()
+        self.assertEqual((stats["requests"], stats["hedged"]), (1, 0))
+        self.assertIsNotNone(stats["p99_ms"])
+
+
+if __name__ == "__main__":
+    unittest.main()
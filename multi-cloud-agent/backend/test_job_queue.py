@@ -0,0 +1,167 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+from core.job_queue import JobQueue, JOB_CANCELLED, JOB_COMPLETED, JOB_FAILED, JOB_QUEUED, JOB_RUNNING
+
+
+class TestJobQueue(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.queue = JobQueue(db_path=os.path.join(self.tmpdir.name, "jobs.db"), num_workers=2, poll_interval=0.05)
+
+    async def asyncTearDown(self):
+        await self.queue.stop()
+        self.tmpdir.cleanup()
+
+    async def _wait_for_status(self, job_id, status, timeout=2.0):
+        deadline = asyncio.get_running_loop().time() + timeout
+        while asyncio.get_running_loop().time() < deadline:
+            if self.queue.get_job(job_id)["status"] == status:
+                return
+            await asyncio.sleep(0.02)
+        self.fail(f"job {job_id} never reached {status}")
+
+    async def test_enqueue_is_idempotent_per_run(self):
+        first = self.queue.enqueue("run-1", 1, {"user_input": "goal"})
+        second = self.queue.enqueue("run-1", 1, {"user_input": "other"})
+        self.assertEqual(first["id"], second["id"])
+        self.assertEqual(first["status"], JOB_QUEUED)
+
+    async def test_worker_completes_job(self):
+        async def handler(job):
+            return {"echo": job["payload"]["user_input"]}
+
+        await self.queue.start(handler)
+        job = self.queue.enqueue("run-1", 1, {"user_input": "goal"})
+        await self._wait_for_status(job["id"], JOB_COMPLETED)
+        self.assertEqual(self.queue.get_job(job["id"])["result"], {"echo": "goal"})
+
+    async def test_failed_job_records_error(self):
+        async def handler(job):
+            raise RuntimeError("boom")
+
+        await self.queue.start(handler)
+        job = self.queue.enqueue("run-1", 1)
+        await self._wait_for_status(job["id"], JOB_FAILED)
+        self.assertEqual(self.queue.get_job(job["id"])["error"], "boom")
+
+    async def test_cancel_running_job(self):
+        started = asyncio.Event()
+
+        async def handler(job):
+            started.set()
+            await asyncio.sleep(30)
+
+        await self.queue.start(handler)
+        job = self.queue.enqueue("run-1", 1)
+        await asyncio.wait_for(started.wait(), timeout=2)
+        self.queue.cancel("run-1")
+        await asyncio.sleep(0.1)
+        self.assertEqual(self.queue.get_job(job["id"])["status"], JOB_CANCELLED)
+        self.assertEqual(self.queue.get_stats()["in_flight"], 0)
+
+    async def test_cancel_does_not_relabel_a_job_that_just_finished(self):
+        job = self.queue.enqueue("run-1", 1)
+        self.queue._claim_next()
+        snapshot = self.queue.get_active_job("run-1")
+        self.queue._finish(job["id"], JOB_COMPLETED, {"done": True})
+        # The job finishes between the active-job lookup and the update
+        self.queue.get_active_job = lambda run_id: snapshot
+        self.assertIsNone(self.queue.cancel("run-1"))
+        self.assertEqual(self.queue.get_job(job["id"])["status"], JOB_COMPLETED)
+
+    async def test_processes_enqueueing_the_same_run_share_one_job(self):
+        queues = [self._sibling() for _ in range(4)]
+        jobs = await asyncio.gather(*(asyncio.to_thread(q.enqueue, "run-1", 1) for q in queues))
+        self.assertEqual(len({job["id"] for job in jobs}), 1)
+
+    async def test_stop_leaves_running_jobs_for_recovery(self):
+        started = asyncio.Event()
+        cleaned_up = []
+
+        async def handler(job):
+            started.set()
+            try:
+                await asyncio.sleep(30)
+            except asyncio.CancelledError:
+                cleaned_up.append(self.queue.is_cancelled(job["id"]))
+                raise
+
+        await self.queue.start(handler)
+        job = self.queue.enqueue("run-1", 1)
+        await asyncio.wait_for(started.wait(), timeout=2)
+        await self.queue.stop()
+        # The handler finished its cleanup before stop() returned, and saw a shutdown rather than a cancel
+        self.assertEqual(cleaned_up, [False])
+        self.assertEqual(self.queue.get_job(job["id"])["status"], JOB_RUNNING)
+
+    def _sibling(self, **kwargs):
+        """Another process's queue on the same database."""
+        return JobQueue(db_path=self.queue.db_path, num_workers=1, poll_interval=0.05, **kwargs)
+
+    async def test_interrupted_jobs_are_requeued_once_their_lease_lapses(self):
+        crashed = self._sibling(lease_seconds=0.05)
+        job = crashed.enqueue("run-1", 1)
+        crashed._claim_next()
+        await asyncio.sleep(0.1)
+        self.assertEqual(self.queue.recover_interrupted(), 1)
+        recovered = self.queue.get_job(job["id"])
+        self.assertEqual(recovered["status"], JOB_QUEUED)
+        self.assertIsNone(recovered["owner"])
+
+    async def test_jobs_with_a_live_lease_are_not_requeued(self):
+        job = self._sibling().enqueue("run-1", 1)
+        claimed = self._sibling()._claim_next()
+        self.assertEqual(claimed["id"], job["id"])
+        self.assertEqual(self.queue.recover_interrupted(), 0)
+        self.assertEqual(self.queue.get_job(job["id"])["status"], JOB_RUNNING)
+
+    async def test_heartbeat_keeps_running_job_owned(self):
+        self.queue.lease_seconds = 0.15
+        started = asyncio.Event()
+
+        async def handler(job):
+            started.set()
+            await asyncio.sleep(30)
+
+        await self.queue.start(handler)
+        job = self.queue.enqueue("run-1", 1)
+        await asyncio.wait_for(started.wait(), timeout=2)
+        await asyncio.sleep(0.4)
+        self.assertEqual(self._sibling().recover_interrupted(), 0)
+        running = self.queue.get_job(job["id"])
+        self.assertEqual(running["status"], JOB_RUNNING)
+        self.assertEqual(running["owner"], self.queue.owner)
+
+    async def test_cancel_from_another_process_is_visible_to_the_owner(self):
+        job = self.queue.enqueue("run-1", 1)
+        self.queue._claim_next()
+        self.assertFalse(self.queue.is_cancelled(job["id"]))
+        self._sibling().cancel("run-1")
+        self.assertTrue(self.queue.is_cancelled(job["id"]))
+        self.queue._finish(job["id"], JOB_COMPLETED, {"done": True})
+        self.assertEqual(self.queue.get_job(job["id"])["status"], JOB_CANCELLED)
+
+    async def test_handler_that_stops_on_cancellation_is_recorded_cancelled(self):
+        started = asyncio.Event()
+
+        async def handler(job):
+            started.set()
+            while not self.queue.is_cancelled(job["id"]):
+                await asyncio.sleep(0.02)
+            raise asyncio.CancelledError()
+
+        await self.queue.start(handler)
+        job = self.queue.enqueue("run-1", 1)
+        await asyncio.wait_for(started.wait(), timeout=2)
+        # Cancelled through the database only, as a sibling process would
+        self._sibling().cancel("run-1")
+        await asyncio.sleep(0.2)
+        self.assertEqual(self.queue.get_job(job["id"])["status"], JOB_CANCELLED)
+        self.assertEqual(self.queue.get_stats()["in_flight"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+
+from core.key_scheduler import KeyScheduler, is_daily_quota_error, parse_retry_after
+
+
+class QuotaError(Exception):
+    pass
+
+
+class TestKeyScheduler(unittest.TestCase):
+    def test_spreads_requests_to_the_key_with_most_headroom(self):
+        scheduler = KeyScheduler(["a", "b"], rpm=10, tpm=100000, daily_requests=100, max_wait=30)
+        picks = [scheduler.acquire(["a", "b"])[0] for _ in range(4)]
+        self.assertEqual(sorted(picks), ["a", "a", "b", "b"])
+
+    def test_saturated_key_is_skipped_while_another_is_idle(self):
+        scheduler = KeyScheduler(["a", "b"], rpm=2, tpm=100000, daily_requests=100, max_wait=30)
+        for _ in range(2):
+            self.assertEqual(scheduler.acquire(["a"]), ("a", 0.0))
+        self.assertEqual(scheduler.acquire(["a", "b"]), ("b", 0.0))
+
+    def test_reservations_queue_behind_each_other_and_fail_fast_past_max_wait(self):
+        scheduler = KeyScheduler(["a"], rpm=60, tpm=100000, daily_requests=100, max_wait=2.5)
+        for _ in range(60):
+            scheduler.acquire(["a"])
+        key, wait = scheduler.acquire(["a"])
+        self.assertEqual(key, "a")
+        self.assertAlmostEqual(wait, 1.0, delta=0.1)
+        self.assertAlmostEqual(scheduler.acquire(["a"])[1], 2.0, delta=0.1)
+        self.assertEqual(scheduler.acquire(["a"])[0], None)
+
+    def test_token_budget_limits_large_requests(self):
+        scheduler = KeyScheduler(["a", "b"], rpm=100, tpm=6000, daily_requests=100, max_wait=30)
+        self.assertEqual(scheduler.acquire(["a", "b"], estimated_tokens=5000)[0], "a")
+        # "a" has 1000 tokens left, "b" has all 6000
+        self.assertEqual(scheduler.acquire(["a", "b"], estimated_tokens=3000), ("b", 0.0))
+        # Settling with the real usage refunds the unused reservation
+        scheduler.record_success("a", reserved_tokens=5000, used_tokens=1000)
+        self.assertGreaterEqual(scheduler.get_status()["a"]["tpm_available"], 5000)
+
+    def test_429_parks_key_for_retry_after_and_lowers_rpm(self):
+        scheduler = KeyScheduler(["a", "b"], rpm=20, tpm=100000, daily_requests=100, max_wait=30)
+        scheduler.record_rate_limited("a", QuotaError("429 Resource exhausted. Please retry in 12.5s."))
+        status = scheduler.get_status()["a"]
+        self.assertEqual(status["rpm_limit"], 15)
+        self.assertAlmostEqual(status["blocked_for_seconds"], 12.5, delta=0.2)
+        self.assertEqual(scheduler.acquire(["a", "b"]), ("b", 0.0))
+        key, wait = scheduler.acquire(["a"])
+        self.assertAlmostEqual(wait, 12.5, delta=0.2)
+
+        for _ in range(10):
+            scheduler.record_success("a")
+        self.assertEqual(scheduler.get_status()["a"]["rpm_limit"], 16)
+
+    def test_daily_quota_error_learns_the_daily_limit(self):
+        scheduler = KeyScheduler(["a"], rpm=100, tpm=100000, daily_requests=1000, max_wait=30)
+        for _ in range(5):
+            scheduler.acquire(["a"])
+        scheduler.record_rate_limited("a", QuotaError("429 quota exceeded: GenerateRequestsPerDayPerProjectPerModel"))
+        self.assertEqual(scheduler.get_status()["a"]["daily_limit"], 5)
+        self.assertEqual(scheduler.acquire(["a"])[0], None)
+
+    def test_parses_retry_hints(self):
+        self.assertEqual(parse_retry_after(QuotaError("retry_delay { seconds: 27 }")), 27.0)
+        self.assertIsNone(parse_retry_after(QuotaError("quota exceeded")))
+        self.assertTrue(is_daily_quota_error("limit: requests per day"))
+        self.assertFalse(is_daily_quota_error("GenerateRequestsPerMinutePerProjectPerModel"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,140 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from core.llm_dispatch import LLMRequestShed, Priority, PriorityDispatcher, current_priority, llm_priority
+
+
+def make_dispatcher(**overrides):
+    options = dict(max_concurrent=1, background_share=1.0, background_max_wait=5,
+                   background_max_queue=10, background_quota_wait=5)
+    options.update(overrides)
+    return PriorityDispatcher(**options)
+
+
+class TestPriorityDispatcher(unittest.IsolatedAsyncioTestCase):
+    async def test_free_slot_goes_to_the_highest_waiting_class(self):
+        dispatcher = make_dispatcher()
+        order = []
+
+        async def call(priority, label):
+            async with dispatcher.slot_async(priority):
+                order.append(label)
+                await asyncio.sleep(0.01)
+
+        await dispatcher.acquire_async(Priority.AGENT)
+        tasks = [asyncio.create_task(call(Priority.BACKGROUND, "background")),
+                 asyncio.create_task(call(Priority.AGENT, "agent")),
+                 asyncio.create_task(call(Priority.INTERACTIVE, "interactive"))]
+        await asyncio.sleep(0.01)
+        depths = {name: c["queue_depth"] for name, c in dispatcher.get_stats()["classes"].items()}
+        self.assertEqual(depths, {"interactive": 1, "agent": 1, "background": 1})
+
+        dispatcher.release(Priority.AGENT)
+        await asyncio.gather(*tasks)
+        self.assertEqual(order, ["interactive", "agent", "background"])
+        stats = dispatcher.get_stats()
+        self.assertEqual(stats["in_flight"], 0)
+        self.assertGreater(stats["classes"]["background"]["max_wait_ms"], stats["classes"]["interactive"]["max_wait_ms"])
+
+    async def test_background_keeps_to_its_share_of_slots(self):
+        dispatcher = make_dispatcher(max_concurrent=2, background_share=0.5)
+        await dispatcher.acquire_async(Priority.BACKGROUND)
+        waiting = asyncio.create_task(dispatcher.acquire_async(Priority.BACKGROUND))
+        await asyncio.sleep(0.01)
+        self.assertFalse(waiting.done())
+        # The slot background may not use is still there for interactive calls
+        await asyncio.wait_for(dispatcher.acquire_async(Priority.INTERACTIVE), 1)
+        dispatcher.release(Priority.BACKGROUND)
+        await asyncio.wait_for(waiting, 1)
+
+    async def test_background_always_leaves_a_slot_for_higher_classes(self):
+        dispatcher = make_dispatcher(max_concurrent=3, background_share=1.0)
+        for _ in range(2):
+            await dispatcher.acquire_async(Priority.BACKGROUND)
+        waiting = asyncio.create_task(dispatcher.acquire_async(Priority.BACKGROUND))
+        await asyncio.sleep(0.01)
+        self.assertFalse(waiting.done())
+        await asyncio.wait_for(dispatcher.acquire_async(Priority.AGENT), 1)
+
+        # Shrinking the pool keeps that reserve; at the floor, strict priority does the job
+        dispatcher.set_max_concurrent(2)
+        self.assertEqual(dispatcher.background_slots, 1)
+        dispatcher.set_max_concurrent(1)
+        self.assertEqual(dispatcher.background_slots, 1)
+        for priority in (Priority.BACKGROUND, Priority.BACKGROUND, Priority.AGENT):
+            dispatcher.release(priority)
+        await asyncio.wait_for(waiting, 1)
+
+    async def test_background_is_shed_when_quota_is_tight_or_the_queue_is_full(self):
+        dispatcher = make_dispatcher(background_max_queue=1, quota_wait=lambda: 60.0)
+        with self.assertRaises(LLMRequestShed):
+            await dispatcher.acquire_async(Priority.BACKGROUND)
+        # Higher classes are never shed for quota; they wait on the key scheduler instead
+        await dispatcher.acquire_async(Priority.INTERACTIVE)
+
+        dispatcher.quota_wait = lambda: 0.0
+        queued = asyncio.create_task(dispatcher.acquire_async(Priority.BACKGROUND))
+        await asyncio.sleep(0.01)
+        with self.assertRaises(LLMRequestShed):
+            await dispatcher.acquire_async(Priority.BACKGROUND)
+        queued.cancel()
+        await asyncio.gather(queued, return_exceptions=True)
+        self.assertEqual(dispatcher.get_stats()["classes"]["background"]["shed"], 2)
+
+    async def test_quota_is_probed_outside_the_dispatcher_lock(self):
+        dispatcher = make_dispatcher()
+        held = []
+        dispatcher.quota_wait = lambda: held.append(dispatcher._lock.locked()) or 0.0
+        await dispatcher.acquire_async(Priority.BACKGROUND)
+        dispatcher.release(Priority.BACKGROUND)
+        # Only background calls are checked against the quota
+        await dispatcher.acquire_async(Priority.INTERACTIVE)
+        self.assertEqual(held, [False])
+
+    async def test_background_waiting_too_long_is_shed_and_cancelled_waiters_leave_the_queue(self):
+        dispatcher = make_dispatcher(background_max_wait=0.05)
+        await dispatcher.acquire_async(Priority.INTERACTIVE)
+        with self.assertRaises(LLMRequestShed):
+            await dispatcher.acquire_async(Priority.BACKGROUND)
+        waiting = asyncio.create_task(dispatcher.acquire_async(Priority.AGENT))
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        dispatcher.release(Priority.INTERACTIVE)
+        stats = dispatcher.get_stats()
+        self.assertEqual((stats["in_flight"], stats["classes"]["agent"]["queue_depth"]), (0, 0))
+
+    async def test_priority_follows_the_context_into_threads(self):
+        with llm_priority(Priority.BACKGROUND):
+            self.assertEqual(await asyncio.to_thread(current_priority), Priority.BACKGROUND)
+        self.assertEqual(current_priority(), Priority.INTERACTIVE)
+
+
+class TestPriorityDispatcherThreads(unittest.TestCase):
+    def test_blocking_callers_share_the_slots(self):
+        dispatcher = make_dispatcher(max_concurrent=2)
+        active, peak = [0], [0]
+        lock = threading.Lock()
+
+        def call():
+            with dispatcher.slot(Priority.INTERACTIVE):
+                with lock:
+                    active[0] += 1
+                    peak[0] = max(peak[0], active[0])
+                time.sleep(0.02)
+                with lock:
+                    active[0] -= 1
+
+        threads = [threading.Thread(target=call) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(peak[0], 2)
+        self.assertEqual(dispatcher.get_stats()["classes"]["interactive"]["admitted"], 6)
+
+
+if __name__ == "__main__":
+    unittest.main()
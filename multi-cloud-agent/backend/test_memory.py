@@ -0,0 +1,190 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from core.embedding_store import EmbeddingStore
+from memory import Memory
+
+
+def make_memory(dim=8, seed=0):
+    """A Memory whose embeddings are random but fixed per text, without any embedding service."""
+    memory = Memory(embedding_dim=dim)
+    rng = np.random.default_rng(seed)
+    vectors = {}
+
+    def embed(text):
+        if text not in vectors:
+            vectors[text] = rng.standard_normal(dim).astype(np.float32)
+        return vectors[text]
+
+    memory._get_embedding = embed
+    memory._get_embeddings = lambda texts: [embed(t) for t in texts]
+    return memory, embed
+
+
+class TestMemorySearch(unittest.TestCase):
+    def test_matches_brute_force_cosine_ranking(self):
+        memory, embed = make_memory()
+        for i in range(600):
+            memory.add_document({"i": i})
+        query = "what about seven"
+        results = memory.search(query, k=5)
+
+        docs = np.stack([embed(d) for d in memory.documents])
+        similarities = docs @ embed(query) / (np.linalg.norm(docs, axis=1) * np.linalg.norm(embed(query)))
+        expected = [json.loads(memory.documents[i]) for i in np.argsort(-similarities)[:5]]
+        self.assertEqual([doc for _, doc in results], expected)
+        distances = [d for d, _ in results]
+        self.assertEqual(distances, sorted(distances))
+        self.assertAlmostEqual(distances[0], 1 - similarities.max(), places=5)
+
+    def test_deleted_documents_leave_search_results(self):
+        memory, _ = make_memory()
+        ids = [memory.add_document({"i": i}) for i in range(300)]
+        query = json.dumps({"i": 123})
+        self.assertEqual(memory.search(query, k=1)[0][1], {"i": 123})
+
+        self.assertTrue(memory.delete_document(ids[123]))
+        self.assertFalse(memory.delete_document(ids[123]))
+        self.assertNotIn({"i": 123}, [doc for _, doc in memory.search(query, k=300)])
+        self.assertEqual(len(memory.documents), 299)
+        self.assertEqual(memory.get_stats()["index"]["size"], 299)
+
+    def test_batch_search_answers_each_query(self):
+        memory, _ = make_memory()
+        for i in range(50):
+            memory.add_document({"i": i})
+        queries = [json.dumps({"i": 3}), json.dumps({"i": 40})]
+        batched = memory.search_batch(queries, k=3)
+        for query, results in zip(queries, batched):
+            single = memory.search(query, k=3)
+            self.assertEqual([doc for _, doc in results], [doc for _, doc in single])
+            np.testing.assert_allclose([d for d, _ in results], [d for d, _ in single], atol=1e-5)
+
+    def test_mismatched_embedding_dimension_does_not_break_search(self):
+        memory = Memory(embedding_dim=8)
+        memory._get_embedding = lambda text: np.ones(4, dtype=np.float32)
+        memory._get_embeddings = lambda texts: [np.ones(4, dtype=np.float32) for _ in texts]
+        memory.add_document({"a": 1})
+        self.assertEqual(memory.dimension_mismatches, 1)
+        # The query cannot be compared either, so the most recent documents come back
+        self.assertEqual(memory.search("anything", k=2), [(0.0, {"a": 1})])
+
+    def test_empty_memory(self):
+        memory, _ = make_memory()
+        self.assertEqual(memory.search("q"), [])
+        self.assertEqual(memory.search_batch(["a", "b"]), [[], []])
+
+
+class TestMemoryBatching(unittest.TestCase):
+    def test_add_documents_embeds_in_one_batch(self):
+        memory, embed = make_memory()
+        batches = []
+        memory._get_embeddings = lambda texts: batches.append(len(texts)) or [embed(t) for t in texts]
+        ids = memory.add_documents([{"i": i} for i in range(40)])
+        self.assertEqual((len(ids), batches), (40, [40]))
+        self.assertEqual(memory.search(json.dumps({"i": 5}), k=1)[0][1], {"i": 5})
+
+    def test_concurrent_single_adds_share_batches(self):
+        memory, embed = make_memory()
+        batches = []
+        memory._get_embeddings = lambda texts: batches.append(len(texts)) or [embed(t) for t in texts]
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            list(pool.map(lambda i: memory.add_document({"i": i}), range(64)))
+        self.assertEqual(sum(batches), 64)
+        self.assertLess(len(batches), 64)
+        self.assertEqual(len(memory.documents), 64)
+
+
+class TestMemoryIngestion(unittest.TestCase):
+    def test_enqueued_documents_become_searchable(self):
+        memory, embed = make_memory()
+        release = threading.Event()
+        memory._get_embeddings = lambda texts: release.wait(2) and [embed(t) for t in texts]
+        doc_id = memory.enqueue_document({"type": "user_goal", "content": "deploy the staging cluster"})
+        other = memory.enqueue_document({"type": "chat", "message": "hello there"})
+
+        # Not embedded yet: saved and lexically searchable, but not in the index
+        self.assertEqual(len(memory.document_data()), 2)
+        self.assertEqual(memory.search("deploy staging", k=1), [])
+        self.assertEqual(memory.search("deploy staging", k=1, include_pending=True)[0],
+                         (0.0, {"type": "user_goal", "content": "deploy the staging cluster"}))
+        self.assertEqual(memory.get_stats()["ingestion"]["in_flight"] + memory.get_stats()["ingestion"]["depth"], 2)
+
+        release.set()
+        self.assertTrue(memory.wait_for_ingestion(timeout=2))
+        query = json.dumps({"type": "user_goal", "content": "deploy the staging cluster"})
+        self.assertEqual(memory.search(query, k=1)[0][1]["content"], "deploy the staging cluster")
+        self.assertEqual(memory.get_stats()["index"]["size"], 2)
+        self.assertTrue(memory.delete_document(doc_id))
+        self.assertTrue(memory.delete_document(other))
+        self.assertEqual(memory.document_data(), [])
+
+    def test_document_deleted_before_embedding_is_dropped(self):
+        memory, embed = make_memory()
+        release = threading.Event()
+        memory._get_embeddings = lambda texts: release.wait(2) and [embed(t) for t in texts]
+        doc_id = memory.enqueue_document({"i": 1})
+        self.assertTrue(memory.delete_document(doc_id))
+        release.set()
+        self.assertTrue(memory.wait_for_ingestion(timeout=2))
+        self.assertEqual((memory.document_data(), memory.get_stats()["index"]["size"]), ([], 0))
+
+
+class TestMemoryIngestionBackpressure(unittest.IsolatedAsyncioTestCase):
+    async def test_full_queue_is_relieved_off_the_event_loop(self):
+        memory, embed = make_memory()
+        memory._ingest_queue.max_pending = 1
+        release = threading.Event()
+        loop_thread = threading.get_ident()
+        threads = []
+
+        def embed_batch(texts):
+            threads.append(threading.get_ident())
+            if len(threads) == 1:
+                release.wait(2)
+            return [embed(t) for t in texts]
+
+        memory._get_embeddings = embed_batch
+        # The first document occupies the worker, the second fills the queue
+        memory.enqueue_document({"i": 0})
+        while not threads:
+            await asyncio.sleep(0.001)
+        memory.enqueue_document({"i": 1})
+        doc_id = await memory.enqueue_document_async({"i": 2})
+        self.assertEqual(memory._ingest_queue.get_stats()["rejected"], 1)
+        release.set()
+        self.assertNotIn(loop_thread, threads)
+        self.assertTrue(memory.wait_for_ingestion(timeout=2))
+        self.assertEqual(len(memory.documents), 3)
+        self.assertTrue(memory.delete_document(doc_id))
+
+
+class TestMemoryPersistence(unittest.TestCase):
+    def test_restart_reuses_stored_embeddings(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            prefix = os.path.join(tmp, "memory.embeddings")
+            memory, _ = make_memory()
+            for i in range(20):
+                memory.add_document({"i": i})
+            memory.persist_embeddings(EmbeddingStore(prefix, 8))
+            saved = memory.document_data()
+
+            restarted = Memory(embedding_dim=8)
+            embedded = []
+            restarted._get_embedding = lambda text: np.ones(8, dtype=np.float32)
+            restarted._get_embeddings = lambda texts: [embedded.append(t) or np.ones(8, dtype=np.float32) for t in texts]
+            counts = restarted.load_documents(saved + [{"i": "new"}], EmbeddingStore(prefix, 8))
+            self.assertEqual(counts, {"reused": 20, "embedded": 1})
+            self.assertEqual(embedded, [json.dumps({"i": "new"})])
+            np.testing.assert_allclose(restarted.index.export()[1][:20], memory.index.export()[1], rtol=1e-6)
+            self.assertEqual(restarted.search(json.dumps({"i": "new"}), k=1)[0][1], {"i": "new"})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from core.micro_batcher import MicroBatcher
+
+
+class TestMicroBatcher(unittest.TestCase):
+    def test_full_batches_go_out_without_waiting(self):
+        batches = []
+        batcher = MicroBatcher(lambda items: batches.append(list(items)) or [i * 2 for i in items],
+                               max_size=4, max_latency=5.0)
+        futures = [batcher.submit(i) for i in range(8)]
+        started = time.monotonic()
+        self.assertEqual([f.result(timeout=2) for f in futures], [i * 2 for i in range(8)])
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual(sorted(len(b) for b in batches), [4, 4])
+
+    def test_partial_batch_leaves_after_max_latency(self):
+        batcher = MicroBatcher(lambda items: [i + 1 for i in items], max_size=100, max_latency=0.05)
+        started = time.monotonic()
+        self.assertEqual(batcher.call(1), 2)
+        self.assertGreaterEqual(time.monotonic() - started, 0.04)
+        self.assertEqual(batcher.get_stats()["batches"], 1)
+
+    def test_concurrent_callers_are_grouped(self):
+        sizes = []
+        lock = threading.Lock()
+
+        def double(items):
+            with lock:
+                sizes.append(len(items))
+            return [i * 2 for i in items]
+
+        batcher = MicroBatcher(double, max_size=16, max_latency=0.05)
+        with ThreadPoolExecutor(max_workers=32) as pool:
+            results = list(pool.map(batcher.call, range(64)))
+        self.assertEqual(results, [i * 2 for i in range(64)])
+        self.assertLess(len(sizes), 64)
+        self.assertLessEqual(max(sizes), 16)
+
+    def test_batch_failure_reaches_every_caller(self):
+        def broken(items):
+            raise ValueError("upstream down")
+
+        batcher = MicroBatcher(broken, max_size=2, max_latency=0.01)
+        futures = [batcher.submit(i) for i in range(2)]
+        for future in futures:
+            with self.assertRaises(ValueError):
+                future.result(timeout=2)
+        self.assertEqual(batcher.get_stats()["failed_batches"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
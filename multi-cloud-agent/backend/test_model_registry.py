@@ -0,0 +1,52 @@
+import time
+import unittest
+
+from google.api_core.exceptions import NotFound
+
+from core.model_registry import ModelAvailabilityRegistry
+
+CANDIDATES = ["gemini-2.5-pro", "gemini-1.5-flash", "gemini-1.5-pro"]
+
+
+class TestModelAvailabilityRegistry(unittest.TestCase):
+    def setUp(self):
+        self.registry = ModelAvailabilityRegistry(negative_ttl=60, refresh_interval=300)
+
+    def test_unknown_models_keep_preference_order(self):
+        self.assertEqual(self.registry.candidates_for("key-a", CANDIDATES), CANDIDATES)
+
+    def test_skips_unavailable_and_keeps_configured_order(self):
+        self.registry.record_unavailable("key-a", "gemini-2.5-pro", NotFound("model not found"))
+        self.registry.record_success("key-a", "gemini-1.5-pro")
+        # A known-good model is not promoted over a preferred one that is merely untried
+        self.assertEqual(self.registry.candidates_for("key-a", CANDIDATES), ["gemini-1.5-flash", "gemini-1.5-pro"])
+        # Outcomes are per key
+        self.assertEqual(self.registry.candidates_for("key-b", CANDIDATES), CANDIDATES)
+        self.assertEqual(self.registry.get_status()["skipped_unavailable"], 1)
+
+    def test_negative_results_expire(self):
+        self.registry.record_unavailable("key-a", "gemini-2.5-pro", "unsupported")
+        self.registry._status[("key-a", "gemini-2.5-pro")].checked_at = time.time() - 61
+        self.assertEqual(self.registry.candidates_for("key-a", CANDIDATES), CANDIDATES)
+        self.assertEqual(self.registry.get_status()["models"]["key-a"]["gemini-2.5-pro"]["state"], "expired")
+
+    def test_refresh_probes_each_key_and_model(self):
+        def probe(key, model_name):
+            if model_name == "gemini-2.5-pro":
+                raise NotFound("not found")
+            if model_name == "gemini-1.5-pro" and key == "key-b":
+                raise ConnectionError("network down")
+            return model_name != "gemini-1.5-flash"
+
+        registry = ModelAvailabilityRegistry(negative_ttl=60, refresh_interval=300, probe=probe)
+        registry.refresh(["key-a", "key-b"], CANDIDATES)
+        self.assertEqual(registry.candidates_for("key-a", CANDIDATES), ["gemini-1.5-pro"])
+        # A failed probe leaves the model unknown rather than marking it unavailable
+        self.assertEqual(registry.candidates_for("key-b", CANDIDATES), ["gemini-1.5-pro"])
+        status = registry.get_status()
+        self.assertEqual((status["refreshes"], status["probe_errors"]), (1, 1))
+        self.assertEqual(status["models"]["key-a"]["gemini-2.5-pro"]["source"], "probe")
+
+
+if __name__ == "__main__":
+    unittest.main()
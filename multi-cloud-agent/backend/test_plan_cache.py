@@ -0,0 +1,118 @@
+import unittest
+import zlib
+
+import numpy as np
+
+from core.plan_cache import PlanCache, adapt_plan, extract_entities, intent_signature
+
+
+def _embed(text):
+    """Bag-of-words embedding: prompts that share words are similar."""
+    vector = np.zeros(64, dtype=np.float32)
+    for word in text.lower().split():
+        vector[zlib.crc32(word.strip(".,'\"").encode()) % 64] += 1.0
+    return vector
+
+
+PLAN = [
+    {"step": 1, "action": "open_browser", "params": {"url": "https://example.com/newsletter"}},
+    {"step": 2, "action": "fill_form", "params": {"browser_id": "browser_0", "selector": "input[name='email']", "value": "test@example.com"}},
+    {"step": 3, "action": "close_browser", "params": {"browser_id": "browser_0"}},
+]
+PROMPT = "Go to https://example.com/newsletter and sign up with my email test@example.com"
+
+
+class TestPlanAdaptation(unittest.TestCase):
+    def test_extracts_urls_emails_quotes_and_numbers(self):
+        self.assertEqual(
+            extract_entities('Open https://a.io/x, email bob@a.io about "Q3 report" in 2 days'),
+            ["https://a.io/x", "bob@a.io", "Q3 report", "2"]
+        )
+
+    def test_substitutes_new_values_into_params(self):
+        plan = adapt_plan(PLAN, PROMPT, "Go to https://other.org/news and sign up with my email me@other.org")
+        self.assertEqual(plan[0]["params"]["url"], "https://other.org/news")
+        self.assertEqual(plan[1]["params"]["value"], "me@other.org")
+        # The cached plan itself is untouched
+        self.assertEqual(PLAN[0]["params"]["url"], "https://example.com/newsletter")
+
+    def test_mismatched_values_cannot_be_adapted(self):
+        self.assertIsNone(adapt_plan(PLAN, PROMPT, "Go to https://other.org/news and sign up"))
+
+    def test_only_whole_param_values_are_substituted(self):
+        plan = [{"step": 1, "action": "create_vm", "params": {"instance_type": "t2.micro", "count": 2, "name": "2"}}]
+        adapted = adapt_plan(plan, "Launch 2 instances", "Launch 3 instances")
+        self.assertEqual(adapted[0]["params"], {"instance_type": "t2.micro", "count": 3, "name": "3"})
+
+    def test_value_inside_another_param_is_a_miss(self):
+        plan = [{"step": 1, "action": "create_vm", "params": {"count": 1, "region": "us-east-1"}}]
+        # "1" also occurs in the region, which the new prompt changes as well
+        self.assertIsNone(adapt_plan(plan, "Launch 1 instance in us-east-1", "Launch 4 instances in us-west-2"))
+        # A changed number that is not a param value anywhere cannot be honoured
+        plan = [{"step": 1, "action": "create_vm", "params": {"instance_type": "t2.micro"}}]
+        self.assertIsNone(adapt_plan(plan, "Launch 2 instances", "Launch 3 instances"))
+
+
+class TestIntentSignature(unittest.TestCase):
+    def test_synonyms_share_a_signature(self):
+        self.assertEqual(intent_signature("Create a VM on GCP"), intent_signature("spin up a virtual machine in Google Cloud"))
+        self.assertEqual(intent_signature("Create a VM on GCP"), ({"create"}, {"vm", "gcp"}))
+
+    def test_opposite_actions_and_other_targets_differ(self):
+        self.assertNotEqual(intent_signature("create a VM on gcp"), intent_signature("delete a VM on gcp"))
+        self.assertNotEqual(intent_signature("create a VM on gcp"), intent_signature("create a VM on aws"))
+        self.assertNotEqual(intent_signature("create a VM on gcp"), intent_signature("create a bucket on gcp"))
+
+    def test_literal_values_are_not_read_as_targets(self):
+        self.assertEqual(intent_signature("Open https://cloud.google.com/aws"), intent_signature("Open https://example.com"))
+
+
+class TestPlanCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = PlanCache(embed=_embed, threshold=0.7, enabled=True)
+        self.cache.load(1, [(7, PROMPT, PLAN)])
+
+    def test_similar_prompt_reuses_adapted_plan(self):
+        match = self.cache.lookup(1, "Go to https://other.org/news and sign up with my email me@other.org")
+        self.assertIsNotNone(match)
+        self.assertEqual(match.plan_id, 7)
+        self.assertGreaterEqual(match.similarity, 0.7)
+        self.assertEqual(match.plan[1]["params"]["value"], "me@other.org")
+        self.assertEqual(self.cache.get_stats()["hits"], 1)
+
+    def test_unrelated_prompt_and_other_users_miss(self):
+        self.assertIsNone(self.cache.lookup(1, "Summarize today's cloud costs per provider"))
+        self.assertIsNone(self.cache.lookup(2, PROMPT))
+        self.assertEqual(self.cache.get_stats()["misses"], 2)
+
+    def test_exact_repeat_is_served_without_embedding(self):
+        cache = PlanCache(embed=lambda text: np.zeros(8), threshold=0.8, enabled=True)
+        cache.load(1, [(7, PROMPT, PLAN)])
+        match = cache.lookup(1, "  " + PROMPT.upper() + "\n")
+        self.assertEqual((match.plan_id, match.similarity, match.plan), (7, 1.0, PLAN))
+        self.assertIsNone(cache.lookup(1, "Go to https://example.com and sign up"))
+
+    def test_similar_prompt_with_a_different_intent_misses(self):
+        # Every prompt embeds identically, so only the intent check tells them apart
+        cache = PlanCache(embed=lambda text: np.ones(8), threshold=0.9, enabled=True)
+        plan = [{"step": 1, "action": "create_vm", "params": {"provider": "gcp"}}]
+        cache.load(1, [(7, "create a VM on gcp", plan)])
+        self.assertIsNone(cache.lookup(1, "delete a VM on gcp"))
+        self.assertIsNone(cache.lookup(1, "create a VM on aws"))
+        self.assertEqual(cache.get_stats()["intent_mismatches"], 2)
+        self.assertEqual(cache.lookup(1, "launch a VM on gcp").plan_id, 7)
+
+    def test_add_and_remove_follow_feedback(self):
+        prompt = "Create a VM in AWS and install nginx"
+        plan = [{"step": 1, "action": "create_vm", "params": {"provider": "aws"}}]
+        self.cache.add(1, 8, prompt, plan)
+        self.assertEqual(self.cache.lookup(1, prompt).plan_id, 8)
+        self.cache.remove(1, 8)
+        self.assertIsNone(self.cache.lookup(1, prompt))
+        # Users whose plans were never loaded are indexed on first lookup instead
+        self.cache.add(3, 9, prompt, plan)
+        self.assertFalse(self.cache.is_loaded(3))
+
+
+if __name__ == "__main__":
+    unittest.main()
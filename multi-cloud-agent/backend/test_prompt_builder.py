@@ -0,0 +1,93 @@
+import asyncio
+import unittest
+
+from core.history_compactor import HistoryCompactor
+from core.prompt_builder import AgentPromptBuilder, NO_HISTORY, condense_result
+
+TEMPLATE = "GOAL: {goal}\nHISTORY: {history}\nTOOLS: {tools}"
+PAGE = "<html><head><script>var x = 1;</script></head><body><div>Sign up here</div></body></html>"
+
+
+def _step(n, name="get_page_content", result=PAGE):
+    return {"step": n, "thought": "", "action": {"name": name, "params": {}}, "result": result}
+
+
+class TestAgentPromptBuilder(unittest.TestCase):
+    def test_empty_history(self):
+        builder = AgentPromptBuilder(TEMPLATE, "{}", token_budget=1000)
+        self.assertIn(NO_HISTORY, builder.build("goal"))
+
+    def test_html_results_are_reduced_to_text(self):
+        text = condense_result(PAGE, 200)
+        self.assertIn("Sign up here", text)
+        self.assertNotIn("<div>", text)
+        self.assertNotIn("var x", text)
+
+    def test_old_steps_are_compacted(self):
+        builder = AgentPromptBuilder(TEMPLATE, "{}", token_budget=100000, recent_steps=2,
+                                     recent_result_chars=1000, old_result_chars=20)
+        builder.extend(_step(n, result="r" * 500) for n in range(1, 6))
+        lines = builder.render_history().splitlines()
+        self.assertEqual(len(lines), 5)
+        self.assertLess(len(lines[0]), 100)
+        self.assertGreater(len(lines[-1]), 500)
+
+    def test_prompt_size_stays_bounded(self):
+        builder = AgentPromptBuilder(TEMPLATE, "{}", token_budget=2000)
+        sizes = []
+        for n in range(1, 300):
+            builder.add_step(_step(n, result=PAGE * 500))
+            sizes.append(len(builder.build("goal")))
+        self.assertLessEqual(max(sizes), 2000 * 4 + 1000)
+        self.assertIn("Steps 1-", builder.render_history())
+
+    def test_summary_replaces_covered_steps(self):
+        builder = AgentPromptBuilder(TEMPLATE, "{}", token_budget=100000, recent_steps=2)
+        builder.extend(_step(n, result="ok") for n in range(1, 7))
+        lines, through = builder.summary_batch()
+        self.assertEqual((len(lines), through), (4, 4))
+        builder.apply_summary("Opened the signup page.", through)
+        history = builder.render_history()
+        self.assertIn("Summary of steps 1-4: Opened the signup page.", history)
+        self.assertNotIn("Step 3:", history)
+        self.assertIn("Step 5:", history)
+        # Steps already covered by a stored summary are skipped on resume
+        builder.add_step(_step(2))
+        self.assertEqual(builder.get_stats()["steps_in_prompt"], 2)
+
+
+class TestHistoryCompactor(unittest.IsolatedAsyncioTestCase):
+    async def test_background_summary_is_applied(self):
+        prompts = []
+
+        async def generate(prompt):
+            prompts.append(prompt)
+            return "Summary so far."
+
+        builder = AgentPromptBuilder(TEMPLATE, "{}", token_budget=100000, recent_steps=1)
+        compactor = HistoryCompactor(builder, "goal", generate, trigger_tokens=1)
+        builder.extend(_step(n, result="ok") for n in range(1, 4))
+        self.assertTrue(compactor.maybe_start())
+        self.assertFalse(compactor.maybe_start())
+        await asyncio.sleep(0)
+        self.assertEqual(compactor.collect(), ("Summary so far.", 2))
+        self.assertIn("Step 2:", prompts[0])
+        self.assertIn("Summary of steps 1-2", builder.render_history())
+        await compactor.close()
+
+    async def test_failed_summary_keeps_history(self):
+        async def generate(prompt):
+            raise RuntimeError("quota")
+
+        builder = AgentPromptBuilder(TEMPLATE, "{}", token_budget=100000, recent_steps=1)
+        compactor = HistoryCompactor(builder, "goal", generate, trigger_tokens=1)
+        builder.extend(_step(n, result="ok") for n in range(1, 4))
+        compactor.maybe_start()
+        await asyncio.sleep(0)
+        self.assertIsNone(compactor.collect())
+        self.assertIsNone(builder.summary)
+        self.assertFalse(compactor.maybe_start())
+
+
+if __name__ == '__main__':
+    unittest.main()
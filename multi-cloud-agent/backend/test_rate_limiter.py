@@ -0,0 +1,47 @@
+import threading
+import time
+import unittest
+
+from rate_limiter import RateLimiter
+
+
+class TestRateLimiter(unittest.TestCase):
+    def setUp(self):
+        self.limiter = RateLimiter()
+
+    def test_allows_a_full_burst_then_blocks(self):
+        allowed = [self.limiter.is_allowed("k", max_requests=5, window_seconds=60) for _ in range(6)]
+        self.assertEqual(allowed, [True] * 5 + [False])
+        self.assertEqual(self.limiter.get_remaining_requests("k", max_requests=5, window_seconds=60), 0)
+        self.assertEqual(self.limiter.get_remaining_requests("other", max_requests=5, window_seconds=60), 5)
+
+    def test_acquire_returns_queued_waits_without_sleeping(self):
+        start = time.monotonic()
+        waits = [self.limiter.acquire("k", max_requests=2, window_seconds=10) for _ in range(4)]
+        self.assertLess(time.monotonic() - start, 0.1)
+        self.assertEqual(waits[:2], [0.0, 0.0])
+        self.assertAlmostEqual(waits[2], 5.0, delta=0.05)
+        self.assertAlmostEqual(waits[3], 10.0, delta=0.05)
+
+    def test_throttled_key_does_not_stall_other_keys(self):
+        self.limiter.acquire("slow", max_requests=1, window_seconds=1)
+        sleeper = threading.Thread(target=self.limiter.wait_if_needed, args=("slow", 1, 1))
+        sleeper.start()
+        time.sleep(0.05)
+        start = time.monotonic()
+        for _ in range(100):
+            self.limiter.acquire("fast", max_requests=1000, window_seconds=1)
+        self.assertLess(time.monotonic() - start, 0.2)
+        sleeper.join(2)
+
+    def test_429_backoff_and_retry_after(self):
+        self.limiter.handle_429_error("k", retry_after=30)
+        self.assertAlmostEqual(self.limiter.acquire("k", max_requests=60, window_seconds=60), 30.0, delta=0.1)
+        status = self.limiter.get_circuit_breaker_status("k")
+        self.assertEqual(status["backoff_multiplier"], 1.5)
+        self.limiter.reset_circuit_breaker("k")
+        self.assertEqual(self.limiter.acquire("k", max_requests=60, window_seconds=60), 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import os
+import tempfile
+import time
+import unittest
+
+from core.response_cache import ResponseCache, make_cache_key
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmpdir.name, "cache.db")
+        self.cache = ResponseCache(db_path=self.db_path, ttl_seconds=60, enabled=True)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_key_normalizes_whitespace_but_not_content(self):
+        config = {"temperature": 0.7}
+        key = make_cache_key("Plan this\n\n\n\ntask  \n", ["gemini-1.5-flash"], config)
+        self.assertEqual(key, make_cache_key("  Plan this\n\ntask\n", ["gemini-1.5-flash"], config))
+        self.assertNotEqual(key, make_cache_key("Plan that\n\ntask", ["gemini-1.5-flash"], config))
+        self.assertNotEqual(key, make_cache_key("Plan this\n\ntask", ["gemini-1.5-pro"], config))
+        self.assertNotEqual(key, make_cache_key("Plan this\n\ntask", ["gemini-1.5-flash"], {"temperature": 0.2}))
+
+    def test_memory_then_disk_tiers(self):
+        self.assertIsNone(self.cache.get("k"))
+        self.cache.put("k", "answer")
+        self.assertEqual(self.cache.get("k"), "answer")
+
+        # A new instance (e.g. after restart) is served from sqlite
+        restarted = ResponseCache(db_path=self.db_path, ttl_seconds=60, enabled=True)
+        self.assertEqual(restarted.get("k"), "answer")
+        self.assertEqual(restarted.get("k"), "answer")
+        stats = restarted.get_stats()
+        self.assertEqual((stats["disk_hits"], stats["memory_hits"]), (1, 1))
+        self.assertEqual(self.cache.get_stats()["misses"], 1)
+
+    def test_expired_entries_are_not_served(self):
+        cache = ResponseCache(db_path=self.db_path, ttl_seconds=1, enabled=True)
+        cache.put("k", "answer")
+        time.sleep(1.1)
+        self.assertIsNone(cache.get("k"))
+
+    def test_disabled_cache(self):
+        cache = ResponseCache(db_path=self.db_path, enabled=False)
+        cache.put("k", "answer")
+        self.assertIsNone(cache.get("k"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,201 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+from core.circuit_breaker import CircuitBreakerConfig, CircuitBreakerManager, CircuitBreakerOpenError
+from core.key_scheduler import KeyScheduler
+from core.shared_state import RedisStateBackend, SqliteStateBackend
+from rate_limiter import RateLimiter
+
+
+class WatchError(Exception):
+    pass
+
+
+class FakeRedis:
+    """Just enough of redis-py (GET/SET/DELETE, WATCH/MULTI/EXEC pipelines) to stand in for a server."""
+
+    def __init__(self):
+        self.data = {}
+        self.versions = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+            self.versions[key] = self.versions.get(key, 0) + 1
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, server):
+        self.server = server
+        self.watched = {}
+        self.queued = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def watch(self, key):
+        self.watched[key] = self.server.versions.get(key, 0)
+
+    def get(self, key):
+        return self.server.get(key)
+
+    def multi(self):
+        pass
+
+    def set(self, key, value):
+        self.queued.append((key, value))
+
+    def execute(self):
+        with self.server.lock:
+            if any(self.server.versions.get(k, 0) != v for k, v in self.watched.items()):
+                raise WatchError()
+            for key, value in self.queued:
+                self.server.data[key] = value.encode()
+                self.server.versions[key] = self.server.versions.get(key, 0) + 1
+
+
+class SharedStateBackendContract:
+    def make_backend(self):
+        raise NotImplementedError
+
+    def test_update_is_atomic_across_threads(self):
+        backend = self.make_backend()
+
+        def increment():
+            for _ in range(50):
+                backend.update("counter", lambda value: {"n": (value or {"n": 0})["n"] + 1})
+
+        threads = [threading.Thread(target=increment) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        self.assertEqual(backend.get("counter"), {"n": 200})
+        backend.delete("counter")
+        self.assertIsNone(backend.get("counter"))
+
+    def test_two_limiters_share_one_budget(self):
+        backend = self.make_backend()
+        worker_a, worker_b = RateLimiter(backend), RateLimiter(backend)
+        allowed = [worker.is_allowed("gemini", 4, 60) for worker in (worker_a, worker_b) * 3]
+        self.assertEqual(allowed.count(True), 4)
+        self.assertEqual(worker_b.get_remaining_requests("gemini", 4, 60), 0)
+
+        for _ in range(5):
+            worker_a.handle_429_error("gemini")
+        status = worker_b.get_circuit_breaker_status("gemini")
+        self.assertEqual((status["state"], status["failure_count"]), ("OPEN", 5))
+        worker_b.reset_circuit_breaker("gemini")
+        self.assertEqual(worker_a.get_circuit_breaker_status("gemini")["state"], "CLOSED")
+
+    def test_breaker_tripped_in_one_worker_opens_in_the_other(self):
+        backend = self.make_backend()
+        config = CircuitBreakerConfig(failure_threshold=2, recovery_timeout=60)
+        worker_a = CircuitBreakerManager(backend).get_breaker("gemini", config)
+        worker_b = CircuitBreakerManager(backend).get_breaker(
+            "gemini", CircuitBreakerConfig(failure_threshold=2, recovery_timeout=60))
+
+        def fail():
+            raise ValueError("upstream down")
+
+        for _ in range(2):
+            with self.assertRaises(ValueError):
+                worker_a.call(fail)
+        with self.assertRaises(CircuitBreakerOpenError):
+            worker_b.call(lambda: "ok")
+
+        worker_b.reset()
+        self.assertEqual(worker_a.call(lambda: "ok"), "ok")
+
+    def test_breaker_only_writes_when_a_success_clears_something(self):
+        backend = self.make_backend()
+        breaker = CircuitBreakerManager(backend).get_breaker("gemini", CircuitBreakerConfig(failure_threshold=3))
+        updated = []
+        update = backend.update
+        backend.update = lambda key, fn: updated.append(key) or update(key, fn)
+
+        for _ in range(3):
+            breaker.call(lambda: "ok")
+        self.assertEqual(updated, [])
+        breaker.record_failure()
+        breaker.call(lambda: "ok")
+        self.assertEqual(len(updated), 2)
+        self.assertEqual(backend.get("breaker:gemini")["failure_count"], 0)
+
+    def test_key_budgets_are_split_between_workers(self):
+        backend = self.make_backend()
+        keys = ["key-one-0000000", "key-two-0000000"]
+        worker_a = KeyScheduler(keys, rpm=2, tpm=1000, daily_requests=100, max_wait=0, backend=backend)
+        worker_b = KeyScheduler(keys, rpm=2, tpm=1000, daily_requests=100, max_wait=0, backend=backend)
+        picked = [worker.acquire(keys)[0] for worker in (worker_a, worker_b, worker_a, worker_b)]
+        self.assertEqual(sorted(picked), sorted(keys * 2))
+        # Both keys are spent; neither worker may go past the shared budget
+        self.assertEqual(worker_a.acquire(keys)[0], None)
+        self.assertEqual(worker_b.acquire(keys)[0], None)
+
+        worker_a.record_rate_limited(keys[0], retry_after=30)
+        self.assertGreater(worker_b.get_status()[keys[0][:10]]["blocked_for_seconds"], 25)
+
+    def test_key_probes_only_read_and_reservations_touch_one_key(self):
+        backend = self.make_backend()
+        keys = ["key-one-0000000", "key-two-0000000"]
+        scheduler = KeyScheduler(keys, rpm=5, tpm=1000, daily_requests=100, max_wait=0, backend=backend)
+        updated = []
+        update = backend.update
+        backend.update = lambda key, fn: updated.append(key) or update(key, fn)
+
+        self.assertIn(scheduler.acquire(keys, reserve=False)[0], keys)
+        scheduler.get_status()
+        self.assertEqual(updated, [])
+
+        key, _ = scheduler.acquire(keys)
+        scheduler.record_success(key, 10, 5)
+        # One record per key, and only the chosen key's record is written
+        self.assertEqual(len(set(updated)), 1)
+        self.assertEqual(len(updated), 2)
+        other = next(k for k in keys if k != key)
+        self.assertEqual(scheduler.get_status()[other[:10]]["requests"], 0)
+        self.assertEqual(scheduler.get_status()[key[:10]]["requests"], 1)
+
+
+class TestSqliteStateBackend(SharedStateBackendContract, unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def make_backend(self):
+        return SqliteStateBackend(os.path.join(self.tmp.name, "shared_state.db"))
+
+    def test_state_survives_a_new_connection(self):
+        self.make_backend().update("breaker:x", lambda value: {"state": "open"})
+        self.assertEqual(self.make_backend().get("breaker:x"), {"state": "open"})
+
+
+class TestRedisStateBackend(SharedStateBackendContract, unittest.TestCase):
+    def make_backend(self):
+        if not hasattr(self, "server"):
+            self.server = FakeRedis()
+        return RedisStateBackend(self.server)
+
+    def test_keys_are_prefixed_and_json_encoded(self):
+        self.make_backend().update("limit:gemini", lambda value: {"tat": 1.5})
+        self.assertEqual(json.loads(self.server.data["mca:limit:gemini"]), {"tat": 1.5})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from core.single_flight import SingleFlight
+
+
+class TestSingleFlightThreads(unittest.TestCase):
+    def _run_concurrently(self, flights, fn, n=5):
+        results, errors = [], []
+
+        def call():
+            try:
+                results.append(flights.do("k", fn))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(n)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        return results, errors
+
+    def test_identical_calls_share_one_upstream_call(self):
+        flights = SingleFlight("test")
+        calls = []
+
+        def upstream():
+            calls.append(1)
+            time.sleep(0.2)
+            return "answer"
+
+        results, errors = self._run_concurrently(flights, upstream)
+        self.assertEqual((results, errors, len(calls)), (["answer"] * 5, [], 1))
+        stats = flights.get_stats()
+        self.assertEqual((stats["calls"], stats["coalesced"], stats["in_flight"]), (5, 4, 0))
+
+    def test_failure_reaches_every_waiter(self):
+        flights = SingleFlight("test")
+
+        def upstream():
+            time.sleep(0.2)
+            raise ValueError("quota")
+
+        results, errors = self._run_concurrently(flights, upstream)
+        self.assertEqual(results, [])
+        self.assertEqual([str(e) for e in errors], ["quota"] * 5)
+        # A finished flight is forgotten, so the next call goes upstream again
+        self.assertEqual(flights.do("k", lambda: "fresh"), "fresh")
+
+
+class TestSingleFlightAsync(unittest.IsolatedAsyncioTestCase):
+    async def test_identical_coroutines_share_one_call_and_its_error(self):
+        flights = SingleFlight("test")
+        calls = []
+
+        async def upstream(value):
+            calls.append(value)
+            await asyncio.sleep(0.05)
+            if value == "bad":
+                raise RuntimeError("upstream failed")
+            return value
+
+        results = await asyncio.gather(*(flights.do_async("a", upstream, "ok") for _ in range(4)))
+        self.assertEqual(results, ["ok"] * 4)
+        errors = await asyncio.gather(*(flights.do_async("b", upstream, "bad") for _ in range(3)), return_exceptions=True)
+        self.assertTrue(all(isinstance(e, RuntimeError) for e in errors))
+        self.assertEqual(calls, ["ok", "bad"])
+
+    async def test_cancelled_waiter_does_not_cancel_the_others(self):
+        flights = SingleFlight("test")
+        started = asyncio.Event()
+        cancelled = []
+
+        async def upstream():
+            started.set()
+            try:
+                await asyncio.sleep(0.1)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+            return "done"
+
+        leader = asyncio.create_task(flights.do_async("k", upstream))
+        follower = asyncio.create_task(flights.do_async("k", upstream))
+        await started.wait()
+        leader.cancel()
+        self.assertEqual(await follower, "done")
+        self.assertEqual(cancelled, [])
+
+        # Once every waiter is gone the upstream call is cancelled too
+        started.clear()
+        only = asyncio.create_task(flights.do_async("k", upstream))
+        await started.wait()
+        only.cancel()
+        await asyncio.sleep(0.01)
+        self.assertEqual(cancelled, [True])
+        self.assertEqual(flights.in_flight(), 0)
+
+    async def test_caller_arriving_as_the_last_waiter_leaves_starts_a_new_flight(self):
+        flights = SingleFlight("test")
+        started = asyncio.Event()
+
+        async def upstream():
+            started.set()
+            await asyncio.sleep(0.05)
+            return "done"
+
+        only = asyncio.create_task(flights.do_async("k", upstream))
+        await started.wait()
+        only.cancel()
+        # Runs right after the abandoned flight is cancelled, before its upstream task has wound down
+        again = asyncio.create_task(flights.do_async("k", upstream))
+        with self.assertRaises(asyncio.CancelledError):
+            await only
+        self.assertEqual(await again, "done")
+
+    async def test_sync_callers_do_not_wait_on_coroutine_flights(self):
+        flights = SingleFlight("test")
+        release = asyncio.Event()
+
+        async def upstream():
+            await release.wait()
+            return "async"
+
+        task = asyncio.create_task(flights.do_async("k", upstream))
+        await asyncio.sleep(0)
+        # Blocking here on the loop's own flight would deadlock; the sync call runs on its own
+        self.assertEqual(flights.do("k", lambda: "sync"), "sync")
+        release.set()
+        self.assertEqual(await task, "async")
+
+
+if __name__ == "__main__":
+    unittest.main()
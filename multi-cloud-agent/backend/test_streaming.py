@@ -0,0 +1,62 @@
+import unittest
+
+from core.streaming import JsonObjectScanner, read_json_object
+
+
+class TestJsonObjectScanner(unittest.TestCase):
+    def test_object_completes_on_its_closing_brace(self):
+        scanner = JsonObjectScanner()
+        self.assertEqual(scanner.feed('Sure! {"thought": "a {b}", '), [])
+        self.assertEqual(scanner.feed('"action": {"name": "x"}'), [])
+        self.assertEqual(scanner.feed('}\nHope this helps {'),
+                         ['{"thought": "a {b}", "action": {"name": "x"}}'])
+
+    def test_escaped_quotes_do_not_end_strings(self):
+        scanner = JsonObjectScanner()
+        self.assertEqual(scanner.feed('{"q": "say \\"}\\" now"'), [])
+        self.assertEqual(scanner.feed('}'), ['{"q": "say \\"}\\" now"}'])
+
+
+class TestReadJsonObject(unittest.IsolatedAsyncioTestCase):
+    async def test_stops_the_stream_once_the_object_parses(self):
+        produced = []
+        closed = []
+
+        async def stream():
+            try:
+                for chunk in ['```json\n{"thought": "go", ', '"action": {"name": "done"}}', '\n```', " trailing"]:
+                    produced.append(chunk)
+                    yield chunk
+            finally:
+                closed.append(True)
+
+        seen = []
+
+        async def on_chunk(chunk):
+            seen.append(chunk)
+
+        decision, text = await read_json_object(stream(), on_chunk)
+        self.assertEqual(decision, {"thought": "go", "action": {"name": "done"}})
+        self.assertEqual(len(produced), 2)
+        self.assertEqual(seen, produced)
+        self.assertEqual(closed, [True])
+        self.assertTrue(text.endswith("}}"))
+
+    async def test_prose_braces_are_skipped(self):
+        async def stream():
+            yield "Plan {step one} then "
+            yield '{"thought": "ok"}'
+
+        decision, _ = await read_json_object(stream())
+        self.assertEqual(decision, {"thought": "ok"})
+
+    async def test_no_object_raises_value_error(self):
+        async def stream():
+            yield "no json here"
+
+        with self.assertRaises(ValueError):
+            await read_json_object(stream())
+
+
+if __name__ == "__main__":
+    unittest.main()
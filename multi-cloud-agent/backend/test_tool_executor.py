@@ -0,0 +1,117 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest.mock import Mock
+
+import browsing
+from core.tool_executor import (
+    ToolExecutor, ToolQueueTimeoutError, ToolTimeoutError,
+    RECENT_RECYCLED_BROWSERS, RESOURCE_BROWSER, RESOURCE_CPU, RESOURCE_NETWORK,
+)
+from tools import Tool
+
+
+class TestToolExecutor(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.executor = ToolExecutor({RESOURCE_BROWSER: 1, RESOURCE_NETWORK: 2, RESOURCE_CPU: 1})
+
+    async def asyncTearDown(self):
+        self.executor.shutdown()
+
+    async def test_run_tool_returns_result(self):
+        tool = Tool("echo", "Echo", lambda text: text.upper(), resource=RESOURCE_CPU)
+        self.assertEqual(await self.executor.run_tool(tool, {"text": "hi"}), "HI")
+        self.assertEqual(self.executor.get_stats()["pools"][RESOURCE_CPU]["completed"], 1)
+
+    async def test_tool_timeout_param_is_passed_to_the_tool(self):
+        def wait_for(selector, timeout=10):
+            return (selector, timeout)
+        tool = Tool("wait_for", "Wait", wait_for, resource=RESOURCE_CPU)
+        result = await self.executor.run_tool(tool, {"selector": "#go", "timeout": 3}, timeout=1)
+        self.assertEqual(result, ("#go", 3))
+
+    async def test_resource_is_inferred_from_signature(self):
+        def get_title(browser_id: str) -> str:
+            return browser_id
+        self.assertEqual(Tool("get_title", "Title", get_title).resource, RESOURCE_BROWSER)
+        self.assertEqual(Tool("lookup", "Lookup", lambda query: query).resource, RESOURCE_NETWORK)
+
+    async def test_timeout_frees_caller_and_recycles_browser(self):
+        release = threading.Event()
+        driver = Mock()
+        driver.quit.side_effect = release.set
+        browsing.browsers["browser_test"] = driver
+
+        def stuck(browser_id):
+            release.wait(5)
+            return "late"
+
+        tool = Tool("stuck", "Stuck", stuck)
+        started = time.monotonic()
+        with self.assertRaises(ToolTimeoutError):
+            await self.executor.run_tool(tool, {"browser_id": "browser_test"}, timeout=0.1)
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertNotIn("browser_test", browsing.browsers)
+        self.assertIn("browser_test", self.executor.get_stats()["recycled_browsers"])
+        # Quitting the driver is what unblocks the stuck call
+        self.assertTrue(await asyncio.to_thread(release.wait, 2))
+
+    async def test_concurrency_cap_queues_extra_calls(self):
+        release = threading.Event()
+        tool = Tool("slow", "Slow", lambda: release.wait(5), resource=RESOURCE_NETWORK)
+        tasks = [asyncio.create_task(self.executor.run_tool(tool, {})) for _ in range(3)]
+        await asyncio.sleep(0.1)
+        pool = self.executor.get_stats()["pools"][RESOURCE_NETWORK]
+        self.assertEqual((pool["active"], pool["queued"]), (2, 1))
+        release.set()
+        await asyncio.gather(*tasks)
+        self.assertEqual(self.executor.get_stats()["pools"][RESOURCE_NETWORK]["queued"], 0)
+
+    async def test_timeout_starts_when_the_call_starts(self):
+        release = threading.Event()
+        blocker = asyncio.create_task(self.executor.run_in_pool(RESOURCE_CPU, release.wait, 5))
+        await asyncio.sleep(0.05)
+        queued = asyncio.create_task(self.executor.run_in_pool(RESOURCE_CPU, lambda: time.sleep(0.2) or "done", timeout=0.3))
+        # Queued for 0.2s, then runs for 0.2s: over the timeout in total but not once started
+        await asyncio.sleep(0.2)
+        release.set()
+        self.assertEqual(await queued, "done")
+        await blocker
+
+    async def test_queue_wait_timeout_drops_the_call_without_recycling(self):
+        release = threading.Event()
+        driver = Mock()
+        browsing.browsers["browser_queued"] = driver
+        calls = []
+
+        def wait_for_release(browser_id):
+            calls.append(browser_id)
+            release.wait(5)
+
+        tool = Tool("wait", "Wait", wait_for_release)
+        blocker = asyncio.create_task(self.executor.run_tool(tool, {"browser_id": "browser_busy"}))
+        await asyncio.sleep(0.05)
+        with self.assertRaises(ToolQueueTimeoutError):
+            await self.executor.run_tool(tool, {"browser_id": "browser_queued"}, timeout=0.1)
+        release.set()
+        await blocker
+        self.assertIs(browsing.browsers.pop("browser_queued"), driver)
+        driver.quit.assert_not_called()
+        self.assertEqual(calls, ["browser_busy"])
+        stats = self.executor.get_stats()
+        self.assertEqual(stats["pools"][RESOURCE_BROWSER]["queue_timed_out"], 1)
+        self.assertEqual(stats["pools"][RESOURCE_BROWSER]["queued"], 0)
+        self.assertEqual(stats["browsers_recycled"], 0)
+
+    async def test_recycled_browser_history_is_bounded(self):
+        for i in range(RECENT_RECYCLED_BROWSERS + 10):
+            self.executor.recycle_browser(f"browser_gone_{i}")
+        stats = self.executor.get_stats()
+        self.assertEqual(stats["browsers_recycled"], RECENT_RECYCLED_BROWSERS + 10)
+        self.assertEqual(len(stats["recycled_browsers"]), RECENT_RECYCLED_BROWSERS)
+        self.assertEqual(stats["recycled_browsers"][-1], f"browser_gone_{RECENT_RECYCLED_BROWSERS + 9}")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+
+import numpy as np
+
+from core.vector_index import AutoIndex, ExactIndex, IVFIndex, create_vector_index
+
+
+def normalized(rng, n, dim):
+    vectors = rng.standard_normal((n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def clustered(rng, n, dim, clusters=50):
+    """Rows around a few directions, closer to real embeddings than uniform noise."""
+    centers = normalized(rng, clusters, dim)
+    vectors = centers[rng.integers(0, clusters, n)] + 0.3 * normalized(rng, n, dim)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+class TestExactIndex(unittest.TestCase):
+    def test_insert_delete_and_search(self):
+        rng = np.random.default_rng(0)
+        vectors = normalized(rng, 100, 16)
+        index = ExactIndex(16)
+        index.add(range(100), vectors)
+        scores, ids = index.search(vectors[[7]], 3)[0]
+        self.assertEqual(ids[0], 7)
+        self.assertAlmostEqual(float(scores[0]), 1.0, places=5)
+
+        self.assertEqual(index.remove([7, 7, 1000]), 1)
+        _, ids = index.search(vectors[[7]], 100)[0]
+        self.assertNotIn(7, ids.tolist())
+        self.assertEqual(len(ids), 99)
+        # The row moved into the gap is still found under its own id
+        _, ids = index.search(vectors[[99]], 1)[0]
+        self.assertEqual(ids.tolist(), [99])
+
+
+class TestIVFIndex(unittest.TestCase):
+    def test_recall_against_exact_search(self):
+        rng = np.random.default_rng(1)
+        vectors = clustered(rng, 5000, 32)
+        queries = clustered(rng, 50, 32)
+        exact, ivf = ExactIndex(32), IVFIndex(32, nprobe=8)
+        exact.add(range(5000), vectors)
+        ivf.add(range(5000), vectors)
+
+        hits = 0
+        for (_, expected), (_, found) in zip(exact.search(queries, 10), ivf.search(queries, 10)):
+            hits += len(set(expected.tolist()) & set(found.tolist()))
+        self.assertGreaterEqual(hits / 500, 0.9)
+        self.assertEqual(ivf.get_stats()["nlist"], int(np.sqrt(5000)))
+
+    def test_incremental_inserts_and_deletes(self):
+        rng = np.random.default_rng(2)
+        vectors = normalized(rng, 400, 16)
+        ivf = IVFIndex(16, nprobe=1000)
+        for start in range(0, 400, 50):
+            ivf.add(range(start, start + 50), vectors[start:start + 50])
+        self.assertEqual(len(ivf), 400)
+        self.assertGreater(ivf.get_stats()["trainings"], 1)
+
+        ivf.remove(range(0, 400, 2))
+        _, ids = ivf.search(vectors[[3]], 1)[0]
+        self.assertEqual(ids.tolist(), [3])
+        _, ids = ivf.search(vectors[[4]], 400)[0]
+        self.assertNotIn(4, ids.tolist())
+        self.assertEqual(len(ids), 200)
+
+        ivf.remove(range(1, 400, 2))
+        self.assertEqual(len(ivf), 0)
+        self.assertEqual(len(ivf.search(vectors[[3]], 5)[0][1]), 0)
+        ivf.add([1000], vectors[[5]])
+        self.assertEqual(ivf.search(vectors[[5]], 5)[0][1].tolist(), [1000])
+
+
+class TestAutoIndex(unittest.TestCase):
+    def test_switches_to_ivf_at_threshold_and_back(self):
+        rng = np.random.default_rng(3)
+        vectors = normalized(rng, 300, 16)
+        index = AutoIndex(16, threshold=200, nprobe=1000)
+        index.add(range(150), vectors[:150])
+        self.assertEqual(index.kind, "exact")
+        index.add(range(150, 300), vectors[150:])
+        self.assertEqual(index.kind, "ivf")
+        self.assertEqual(index.search(vectors[[250]], 1)[0][1].tolist(), [250])
+
+        index.remove(range(220))
+        self.assertEqual(index.kind, "exact")
+        self.assertEqual(len(index), 80)
+        self.assertEqual(index.get_stats()["switches"], 2)
+
+    def test_factory(self):
+        self.assertIsInstance(create_vector_index(8, "exact"), ExactIndex)
+        self.assertIsInstance(create_vector_index(8, "ivf"), IVFIndex)
+        self.assertIsInstance(create_vector_index(8, "annoy"), AutoIndex)
+
+
+if __name__ == "__main__":
+    unittest.main()
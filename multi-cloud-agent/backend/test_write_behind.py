@@ -0,0 +1,56 @@
+import threading
+import time
+import unittest
+
+from core.write_behind import WriteBehindQueue
+
+
+class TestWriteBehindQueue(unittest.TestCase):
+    def test_items_are_flushed_in_order_in_batches(self):
+        flushed = []
+        queue = WriteBehindQueue(flushed.append, max_batch=3)
+        for i in range(10):
+            self.assertTrue(queue.put(i))
+        self.assertTrue(queue.drain(timeout=2))
+        self.assertEqual([i for batch in flushed for i in batch], list(range(10)))
+        self.assertLessEqual(max(len(batch) for batch in flushed), 3)
+        stats = queue.get_stats()
+        self.assertEqual((stats["flushed"], stats["depth"], stats["in_flight"], stats["lag_ms"]), (10, 0, 0, 0.0))
+
+    def test_lag_and_depth_while_flush_is_blocked(self):
+        release = threading.Event()
+        queue = WriteBehindQueue(lambda items: release.wait(2), max_batch=1, max_pending=2)
+        self.assertTrue(queue.put(0))
+        while queue.get_stats()["in_flight"] == 0:
+            time.sleep(0.001)
+        self.assertTrue(queue.put(1))
+        self.assertTrue(queue.put(2))
+        self.assertFalse(queue.drain(timeout=0.05))
+        stats = queue.get_stats()
+        self.assertEqual((stats["in_flight"], stats["depth"]), (1, 2))
+        self.assertGreater(stats["lag_ms"], 0)
+        # Past max_pending queued items, put refuses
+        self.assertFalse(queue.put(3))
+        self.assertEqual(queue.get_stats()["rejected"], 1)
+        release.set()
+        self.assertTrue(queue.drain(timeout=2))
+        self.assertEqual(len(queue), 0)
+
+    def test_failed_batch_does_not_stop_the_worker(self):
+        flushed = []
+
+        def flush(items):
+            if items == [0]:
+                raise ValueError("boom")
+            flushed.extend(items)
+
+        queue = WriteBehindQueue(flush, max_batch=1)
+        queue.put(0)
+        queue.put(1)
+        self.assertTrue(queue.drain(timeout=2))
+        self.assertEqual(flushed, [1])
+        self.assertEqual(queue.get_stats()["failed_items"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
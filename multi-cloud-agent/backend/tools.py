@@ -1,5 +1,6 @@
 import re
-from typing import Dict, Any, Callable, List
+import inspect
+from typing import Dict, Any, Callable, List, Optional
 from cloud_handlers import handle_clouds
 import requests
 import os
@@ -658,24 +659,51 @@ def refactor_code(file_path: str, refactor_type: str, target: str = None) -> str
         return f"Failed to refactor code: {e}"
 
 # --- Tool Registry ---
+# Local, compute-bound tools; everything else is treated as network I/O unless it drives a browser
+CPU_BOUND_TOOLS = {
+    "read_file", "write_file", "analyze_repository_structure", "analyze_code_file", "search_code_patterns",
+    "apply_code_changes", "run_tests", "create_new_file", "refactor_code", "finish_task"
+}
+
 class Tool:
-    def __init__(self, name: str, description: str, func: Callable):
+    def __init__(self, name: str, description: str, func: Callable, resource: Optional[str] = None):
         self.name = name
         self.description = description
         self.func = func
+        # Pool used by core.tool_executor: "browser", "network" or "cpu"
+        self.resource = resource or self._infer_resource()
+    
+    def _infer_resource(self) -> str:
+        try:
+            params = inspect.signature(self.func).parameters
+        except (TypeError, ValueError):
+            params = {}
+        if self.name == "open_browser" or "browser_id" in params:
+            return "browser"
+        if self.name in CPU_BOUND_TOOLS:
+            return "cpu"
+        return "network"
 
 class ToolRegistry:
     def __init__(self):
         self.tools = {}
+        self._tools_json: Optional[str] = None
     
     def register(self, tool: Tool):
         self.tools[tool.name] = tool
+        self._tools_json = None
     
     def get_tool(self, name: str) -> Tool:
         return self.tools.get(name)
     
     def get_all_tools_dict(self) -> Dict[str, str]:
         return {name: tool.description for name, tool in self.tools.items()}
+    
+    def get_tools_json(self) -> str:
+        """Tool descriptions rendered for prompts; cached until the next register()."""
+        if self._tools_json is None:
+            self._tools_json = json.dumps(self.get_all_tools_dict(), indent=2)
+        return self._tools_json
 
 # Initialize tool registry
 tool_registry = ToolRegistry()
@@ -1,4 +1,5 @@
-import React, { useState } from 'react';
+import React, { useEffect, useState } from 'react';
+import websocketService from '../services/websocket';
 import './AIContentChat.css';
 
 const AIContentChat = ({ taskId, onClose }) => {
@@ -7,6 +8,26 @@ const AIContentChat = ({ taskId, onClose }) => {
   const [isLoading, setIsLoading] = useState(false);
   const [error, setError] = useState(null);
 
+  useEffect(() => {
+    // The answer streams in over the WebSocket while the request is still running
+    const unsubscribe = websocketService.subscribe('chat', (data) => {
+      if (!data.stream || data.task_id !== taskId) return;
+      setMessages(prev => {
+        const existing = prev.find(m => m.id === data.stream_id);
+        if (existing) {
+          return prev.map(m => m.id === data.stream_id ? { ...m, message: m.message + data.stream } : m);
+        }
+        return [...prev, {
+          id: data.stream_id,
+          sender: 'ai',
+          message: data.stream,
+          timestamp: new Date().toLocaleTimeString()
+        }];
+      });
+    });
+    return () => unsubscribe();
+  }, [taskId]);
+
   const sendMessage = async () => {
     if (!inputMessage.trim()) return;
 
@@ -40,14 +61,15 @@ const AIContentChat = ({ taskId, onClose }) => {
       const data = await response.json();
       
       const aiMessage = {
-        id: Date.now() + 1,
+        id: data.stream_id || Date.now() + 1,
         sender: 'ai',
         message: data.response,
         timestamp: new Date().toLocaleTimeString(),
         context: data.context
       };
 
-      setMessages(prev => [...prev, aiMessage]);
+      // Replace the streamed copy (if any) with the complete answer
+      setMessages(prev => [...prev.filter(m => m.id !== aiMessage.id), aiMessage]);
     } catch (err) {
       console.error('Error sending message:', err);
       setError('Failed to send message. Please try again.');
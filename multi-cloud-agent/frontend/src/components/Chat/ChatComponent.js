@@ -15,7 +15,7 @@ import {
 } from '@mui/material';
 import { Send, SmartToy, Person, Pause, PlayArrow } from '@mui/icons-material';
 import api from '../../services/api';
-import websocketService from '../../services/websocket';
+import websocketService, { mergeAgentStream } from '../../services/websocket';
 
 const ChatComponent = ({ currentAgentRunId, onAgentControl }) => {
   const [messages, setMessages] = useState([]);
@@ -50,6 +50,8 @@ const ChatComponent = ({ currentAgentRunId, onAgentControl }) => {
 
     // Subscribe to WebSocket chat messages
     const unsubscribeChat = websocketService.subscribe('chat', (data) => {
+      // Streamed task-chat answers are rendered by AIContentChat
+      if (data.stream !== undefined) return;
       const newMsg = {
         id: genId(),
         sender: data.sender,
@@ -66,6 +68,17 @@ const ChatComponent = ({ currentAgentRunId, onAgentControl }) => {
       if (data.status) {
         setAgentStatus(data.status);
       }
+      if (data.stream !== undefined) {
+        // The agent's plan for the step, as it is generated
+        setMessages(prev => mergeAgentStream(prev, data, (id, text) => ({
+          id,
+          sender: 'agent',
+          message: text,
+          message_type: 'thinking',
+          agent_run_id: data.run_id,
+          timestamp: new Date().toISOString()
+        })));
+      }
       if (data.log) {
         // Add agent log as a message
         const logMsg = {
@@ -126,13 +139,13 @@ const ChatComponent = ({ currentAgentRunId, onAgentControl }) => {
 
   const getMessageIcon = (sender, messageType) => {
     if (sender === 'user') return <Person color="primary" />;
-    if (messageType === 'log') return <SmartToy color="secondary" />;
+    if (messageType === 'log' || messageType === 'thinking') return <SmartToy color="secondary" />;
     return <SmartToy color="action" />;
   };
 
   const getMessageColor = (sender, messageType) => {
     if (sender === 'user') return 'primary.light';
-    if (messageType === 'log') return 'grey.100';
+    if (messageType === 'log' || messageType === 'thinking') return 'grey.100';
     return 'secondary.light';
   };
 
@@ -48,7 +48,7 @@ import {
 } from '@mui/icons-material';
 import { format } from 'date-fns';
 import api from '../../services/api';
-import websocketService from '../../services/websocket';
+import websocketService, { mergeAgentStream } from '../../services/websocket';
 
 const quickActions = [
   {
@@ -119,6 +119,14 @@ function ChatInterface({ onToolCall, websocketConnected, currentRunId }) {
       if (data.status) {
         setAgentStatus(data.status);
       }
+      if (data.stream !== undefined) {
+        setAgentLogs(prev => mergeAgentStream(prev, data, (id, text) => ({
+          id,
+          message: text,
+          step: data.step,
+          timestamp: new Date().toISOString()
+        })));
+      }
       if (data.log) {
         setAgentLogs(prev => [...prev, {
           id: Date.now() + Math.random(),
@@ -129,6 +137,8 @@ function ChatInterface({ onToolCall, websocketConnected, currentRunId }) {
     });
 
     const unsubscribeChat = websocketService.subscribe('chat', (data) => {
+      // Streamed task-chat answers are rendered by AIContentChat
+      if (data.stream !== undefined) return;
       let content = data.message;
       let additionalMetadata = {};
       if (typeof data.message === 'object' && data.message !== null) {
@@ -531,19 +541,22 @@ function ChatInterface({ onToolCall, websocketConnected, currentRunId }) {
         
         {messages.map(renderMessage)}
         
-        {isLoading && (
+        {/* Queued agent runs keep reporting (and streaming their plans) after the request returns */}
+        {(isLoading || agentLogs.length > 0) && (
           <Box sx={{ display: 'flex', justifyContent: 'flex-start', mb: 2 }}>
             <Box sx={{ display: 'flex', alignItems: 'flex-start' }}>
               <Avatar sx={{ bgcolor: 'secondary.main', mx: 1, width: 32, height: 32 }}>
                 <BotIcon />
               </Avatar>
               <Paper elevation={1} sx={{ p: 2, borderRadius: 2, maxWidth: '70%' }}>
-                <Box sx={{ display: 'flex', alignItems: 'center', mb: agentLogs.length > 0 ? 1 : 0 }}>
-                  <CircularProgress size={16} sx={{ mr: 1 }} />
-                  <Typography variant="body2">
-                    {agentStatus === 'processing' ? 'Processing your request...' : 'Thinking...'}
-                  </Typography>
-                </Box>
+                {isLoading && (
+                  <Box sx={{ display: 'flex', alignItems: 'center', mb: agentLogs.length > 0 ? 1 : 0 }}>
+                    <CircularProgress size={16} sx={{ mr: 1 }} />
+                    <Typography variant="body2">
+                      {agentStatus === 'processing' ? 'Processing your request...' : 'Thinking...'}
+                    </Typography>
+                  </Box>
+                )}
                 {agentLogs.length > 0 && (
                   <Box sx={{ maxHeight: 200, overflow: 'auto', bgcolor: 'grey.50', p: 1, borderRadius: 1 }}>
                     {agentLogs.slice(-5).map((log) => (
@@ -556,10 +569,11 @@ function ChatInterface({ onToolCall, websocketConnected, currentRunId }) {
                           fontSize: '0.75rem',
                           color: 'text.secondary',
                           mb: 0.5,
-                          wordBreak: 'break-word'
+                          wordBreak: 'break-word',
+                          whiteSpace: 'pre-wrap'
                         }}
                       >
-                        {log.message}
+                        {log.step !== undefined ? `Step ${log.step}: ${log.message}` : log.message}
                       </Typography>
                     ))}
                   </Box>
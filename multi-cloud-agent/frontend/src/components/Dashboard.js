@@ -1,7 +1,7 @@
 import React, { useState, useEffect } from 'react';
 import { useAuth } from '../contexts/AuthContext';
 import api from '../services/api';
-import websocketService from '../services/websocket';
+import websocketService, { mergeAgentStream } from '../services/websocket';
 import {
   AppBar,
   Toolbar,
@@ -50,10 +50,13 @@ function Dashboard({ navigate }) {
     websocketService.connect(null, token);
 
     const unsubscribe = websocketService.subscribe('agent_updates', (update) => {
+      if (update.stream !== undefined) {
+        setLogs(prevLogs => mergeAgentStream(prevLogs, update, (id, text) => ({ id, step: update.step, message: text })));
+      }
       if (update.log) {
-        setLogs(prevLogs => [...prevLogs, update.log]);
+        setLogs(prevLogs => [...prevLogs, { id: `log-${Date.now()}-${Math.random()}`, message: update.log }]);
       }
-      if (update.status === 'complete' || update.status === 'error') {
+      if (update.status === 'complete' || update.status === 'error' || update.status === 'cancelled') {
         setResponse(update.data);
         setLoading(false);
       }
@@ -117,7 +120,7 @@ function Dashboard({ navigate }) {
   const handleToolCall = (toolCall) => {
     // Handle tool calls from chat interface
     console.log('Tool call received:', toolCall);
-    setLogs(prev => [...prev, `Tool called: ${toolCall.name}`]);
+    setLogs(prev => [...prev, { id: `tool-${Date.now()}-${Math.random()}`, message: `Tool called: ${toolCall.name}` }]);
   };
 
   const toggleSidebar = () => {
@@ -226,9 +229,9 @@ function Dashboard({ navigate }) {
                     Logs:
                   </Typography>
                   <Box sx={{ maxHeight: 300, overflow: 'auto' }}>
-                    {logs.map((log, index) => (
-                      <Typography key={index} variant="body2" sx={{ fontFamily: 'monospace', mb: 0.5 }}>
-                        {log}
+                    {logs.map((log) => (
+                      <Typography key={log.id} variant="body2" sx={{ fontFamily: 'monospace', mb: 0.5, whiteSpace: 'pre-wrap' }}>
+                        {log.step !== undefined ? `Step ${log.step} (planning): ${log.message}` : log.message}
                       </Typography>
                     ))}
                   </Box>
@@ -195,6 +195,17 @@ class WebSocketService {
   }
 }
 
+// Agent decisions stream in on 'agent_updates' as { stream, run_id, step } chunks while the
+// step is being planned. Folds one chunk into the entry for its (run_id, step), creating that
+// entry with makeEntry(id, text) on the first chunk; entries keep their text in `message`.
+export function mergeAgentStream(entries, update, makeEntry) {
+  const id = `stream-${update.run_id}-${update.step}`;
+  if (entries.some(entry => entry.id === id)) {
+    return entries.map(entry => (entry.id === id ? { ...entry, message: entry.message + update.stream } : entry));
+  }
+  return [...entries, makeEntry(id, update.stream)];
+}
+
 // Create a singleton instance
 const websocketService = new WebSocketService();
 